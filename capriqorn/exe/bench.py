@@ -0,0 +1,99 @@
+#!/usr/bin/env python2.7
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""
+Capriqorn benchmark suite.
+
+Runs the benchmarks on synthetic data, writes the timings to a JSON baseline
+file and optionally compares them with a previous baseline.
+"""
+
+
+from __future__ import print_function
+import sys
+import copy
+from cadishi import util
+from ..lib import benchmark
+from .. import version
+
+
+def configure_cli(subparsers):
+    """Attach a parser (specifying command name and flags) to the argparse subparsers object."""
+    parser = subparsers.add_parser('bench', help='run benchmarks on synthetic data')
+    parser.add_argument('--quick', action='store_true',
+                        help='use small workloads, e.g. for a quick check')
+    parser.add_argument('--list', action='store_true',
+                        help='list the available benchmarks and exit')
+    parser.add_argument('--select', nargs='+', metavar='PATTERN',
+                        help='run the benchmarks matching the shell-style patterns, e.g. "postproc.*"')
+    parser.add_argument('--n-frames', type=int, help='number of synthetic frames')
+    parser.add_argument('--n-atoms', type=int, help='number of particles per species and frame')
+    parser.add_argument('--n-bins', type=int, help='number of histogram bins')
+    parser.add_argument('--n-workers', type=int, nargs='+', metavar='N',
+                        help='numbers of workers of the parallel pipeline benchmarks')
+    parser.add_argument('--repeat', type=int, help='number of timings per benchmark, the best is reported')
+    parser.add_argument('--output', default='capriqorn_bench.json', metavar='FILE',
+                        help='baseline file the results are written to (default: capriqorn_bench.json)')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare the results with a baseline file, exit with status 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown flagged as a regression (default: 0.1)')
+    parser.set_defaults(func=main)
+
+
+def main(argparse_args):
+    print(util.SEP)
+    if argparse_args.quick:
+        config = copy.deepcopy(benchmark.quick)
+    else:
+        config = copy.deepcopy(benchmark.defaults)
+    for key in ['n_frames', 'n_atoms', 'n_bins', 'n_workers', 'repeat']:
+        value = getattr(argparse_args, key)
+        if value is not None:
+            config[key] = value
+
+    if argparse_args.list:
+        for name in benchmark.select(benchmark.get_benchmarks(config).keys(), argparse_args.select):
+            print(" " + name)
+        print(util.SEP)
+        return
+
+    baseline = None
+    if argparse_args.compare:
+        try:
+            baseline = benchmark.load(argparse_args.compare)
+        except (IOError, ValueError):
+            print(" Error: Could not read baseline file <" + argparse_args.compare + ">.")
+            sys.exit(1)
+
+    print(version.get_printable_version_string())
+    print(util.SEP)
+    print(" Running benchmarks, configuration: " + str(config))
+    print(util.SEP)
+    result = benchmark.run(config, argparse_args.select)
+    benchmark.save(result, argparse_args.output)
+    print(util.SEP)
+    print(" Results were written to <" + argparse_args.output + ">.")
+
+    if baseline is not None:
+        print(util.SEP)
+        print(" Comparison with <" + argparse_args.compare + ">, threshold " + str(argparse_args.threshold) + ":")
+        rows = benchmark.compare(result, baseline, argparse_args.threshold)
+        benchmark.print_comparison(rows)
+        n_regressions = len([row for row in rows if row[-1] == 'regression'])
+        print(util.SEP)
+        if (n_regressions > 0):
+            print(" " + str(n_regressions) + " regression(s) detected.")
+            print(util.SEP)
+            sys.exit(1)
+        print(" No regressions detected.")
+    print(util.SEP)
@@ -20,6 +20,7 @@ from . import preprocessor
 from . import postprocessor
 from . import example
 from . import compare
+from . import bench
 from cadishi.exe import histograms
 from cadishi.exe import merge
 from cadishi.exe import unpack
@@ -39,6 +40,7 @@ def setup_cli():
     example.configure_cli(subparsers)
     merge.configure_cli(subparsers)
     unpack.configure_cli(subparsers)
+    bench.configure_cli(subparsers)
     # "secret" command
     if ('compare' in '\t'.join(sys.argv)):
         compare.configure_cli(subparsers)
@@ -24,6 +24,9 @@ import json
 import argparse
 from cadishi import util
 from ..lib import pipeutil
+from ..lib import checkpoint
+from ..lib import parpipe
+from ..lib import incremental
 from .. import postproc
 from .. import version
 
@@ -31,6 +34,36 @@ from .. import version
 def configure_cli(subparsers):
     """Attach a parser (specifying command name and flags) to the argparse subparsers object."""
     parser = subparsers.add_parser('postproc', help='run postprocessor')
+    parser.add_argument('--append', action='store_true',
+                        help='only process new frames and add them to the result of a previous run (requires n_avg: all)')
+    parser.add_argument('--profile', action='store_true',
+                        help='record the timings of the pipeline elements, written to ./pipeline_log/')
+    parser.add_argument('--memory', action='store_true',
+                        help='record the memory usage of the pipeline elements and processes, written to ./pipeline_log/')
+    parser.add_argument('--memory-budget', type=float, metavar='MB',
+                        help='warn if the peak memory usage of a process exceeds the budget (implies --memory)')
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='additionally trace the Python/NumPy allocations (slow, implies --memory)')
+    parser.add_argument('--status', action='store_true',
+                        help='write the live progress and throughput periodically to ./pipeline_log/status.json')
+    parser.add_argument('--progress', action='store_true',
+                        help='print the live progress as a single updating line (implies --status)')
+    parser.add_argument('--status-interval', type=float, default=5.0, metavar='SECONDS',
+                        help='seconds between the progress updates (default: 5)')
+    parser.add_argument('--cache', metavar='DIR',
+                        help='serve unchanged pipeline stages from a cache directory, and store the others')
+    parser.add_argument('--cache-size', type=float, default=1024., metavar='MB',
+                        help='size limit of the cache directory (default: 1024 MB)')
+    parser.add_argument('--supervise', action='store_true',
+                        help='restart failed or hung workers of the parallel region and re-queue their frames')
+    parser.add_argument('--max-retries', type=int, default=2, metavar='N',
+                        help='re-queue a frame at most N times before putting it into quarantine (default: 2)')
+    parser.add_argument('--worker-timeout', type=float, default=parpipe.QUEUE_TIMEOUT, metavar='SECONDS',
+                        help='seconds without progress after which a supervised worker is considered hung (default: 300)')
+    parser.add_argument('--checkpoint', type=int, metavar='N',
+                        help='write a checkpoint every N frames next to the output file of the H5Writer')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue an interrupted run from its last checkpoint')
     parser.add_argument('input', nargs=argparse.REMAINDER,
                         help='postprocessor parameter file (optional)', metavar='postprocessor.yaml')
     parser.set_defaults(func=main)
@@ -67,7 +100,40 @@ def main(argparse_args):
 
     pipeline_module = "capriqorn.postproc"
 
-    pipeutil.run_pipeline(pipeline_meta, pipeline_module)
+    if argparse_args.append:
+        if not incremental.setup_append(pipeline_meta):
+            print(util.SEP)
+            return
+
+    if argparse_args.checkpoint or argparse_args.resume:
+        if argparse_args.append:
+            print(" Error: --checkpoint and --resume cannot be combined with --append.")
+            print(util.SEP)
+            sys.exit(1)
+        checkpoint.setup(pipeline_meta, pipeline_module, interval=argparse_args.checkpoint,
+                         resume=argparse_args.resume)
+
+    memory = None
+    if argparse_args.memory or (argparse_args.memory_budget is not None) or argparse_args.tracemalloc:
+        memory = {'budget': argparse_args.memory_budget, 'tracemalloc': argparse_args.tracemalloc}
+
+    progress = None
+    if argparse_args.status or argparse_args.progress:
+        progress = {'interval': argparse_args.status_interval, 'show': argparse_args.progress}
+
+    cache = None
+    if argparse_args.cache:
+        if argparse_args.append:
+            print(" Note: The stage cache is not used in append mode.")
+        else:
+            cache = {'directory': argparse_args.cache, 'size': argparse_args.cache_size}
+
+    supervise = None
+    if argparse_args.supervise:
+        supervise = {'retries': argparse_args.max_retries, 'timeout': argparse_args.worker_timeout}
+
+    pipeutil.run_pipeline(pipeline_meta, pipeline_module, profile=argparse_args.profile, memory=memory,
+                          progress=progress, cache=cache, supervise=supervise)
 
     print(" ... done.")
     print(util.SEP)
@@ -24,6 +24,8 @@ import json
 import argparse
 from cadishi import util
 from ..lib import pipeutil
+from ..lib import checkpoint
+from ..lib import parpipe
 from .. import postproc
 from .. import version
 
@@ -31,6 +33,30 @@ from .. import version
 def configure_cli(subparsers):
     """Attach a parser (specifying command name and flags) to the argparse subparsers object."""
     parser = subparsers.add_parser('preproc', help='run preprocessor')
+    parser.add_argument('--profile', action='store_true',
+                        help='record the timings of the pipeline elements, written to ./pipeline_log/')
+    parser.add_argument('--memory', action='store_true',
+                        help='record the memory usage of the pipeline elements and processes, written to ./pipeline_log/')
+    parser.add_argument('--memory-budget', type=float, metavar='MB',
+                        help='warn if the peak memory usage of a process exceeds the budget (implies --memory)')
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='additionally trace the Python/NumPy allocations (slow, implies --memory)')
+    parser.add_argument('--status', action='store_true',
+                        help='write the live progress and throughput periodically to ./pipeline_log/status.json')
+    parser.add_argument('--progress', action='store_true',
+                        help='print the live progress as a single updating line (implies --status)')
+    parser.add_argument('--status-interval', type=float, default=5.0, metavar='SECONDS',
+                        help='seconds between the progress updates (default: 5)')
+    parser.add_argument('--supervise', action='store_true',
+                        help='restart failed or hung workers of the parallel region and re-queue their frames')
+    parser.add_argument('--max-retries', type=int, default=2, metavar='N',
+                        help='re-queue a frame at most N times before putting it into quarantine (default: 2)')
+    parser.add_argument('--worker-timeout', type=float, default=parpipe.QUEUE_TIMEOUT, metavar='SECONDS',
+                        help='seconds without progress after which a supervised worker is considered hung (default: 300)')
+    parser.add_argument('--checkpoint', type=int, metavar='N',
+                        help='write a checkpoint every N frames next to the output file of the H5Writer')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue an interrupted run from its last checkpoint')
     parser.add_argument('input', nargs=argparse.REMAINDER,
                         help='preprocessor parameter file (optional)', metavar='preprocessor.yaml')
     parser.set_defaults(func=main)
@@ -67,7 +93,24 @@ def main(argparse_args):
 
     pipeline_module = "capriqorn.preproc"
 
-    pipeutil.run_pipeline(pipeline_meta, pipeline_module)
+    if argparse_args.checkpoint or argparse_args.resume:
+        checkpoint.setup(pipeline_meta, pipeline_module, interval=argparse_args.checkpoint,
+                         resume=argparse_args.resume)
+
+    memory = None
+    if argparse_args.memory or (argparse_args.memory_budget is not None) or argparse_args.tracemalloc:
+        memory = {'budget': argparse_args.memory_budget, 'tracemalloc': argparse_args.tracemalloc}
+
+    progress = None
+    if argparse_args.status or argparse_args.progress:
+        progress = {'interval': argparse_args.status_interval, 'show': argparse_args.progress}
+
+    supervise = None
+    if argparse_args.supervise:
+        supervise = {'retries': argparse_args.max_retries, 'timeout': argparse_args.worker_timeout}
+
+    pipeutil.run_pipeline(pipeline_meta, pipeline_module, profile=argparse_args.profile, memory=memory,
+                          progress=progress, supervise=supervise)
 
     print(" ... done.")
     print(util.SEP)
@@ -27,15 +27,28 @@ ITYPE = np.int
 ctypedef np.int_t ITYPE_t
 
 
+# coordinates are processed in the precision they are given in (float32 or
+# float64), distances are always accumulated in double precision
+ctypedef fused COORD_t:
+    np.float32_t
+    np.float64_t
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def queryDistance(np.ndarray[DTYPE_t, ndim=2] xyz, np.ndarray[DTYPE_t, ndim=2] ref, double R):
+def queryDistance(np.ndarray[COORD_t, ndim=2] xyz, np.ndarray[COORD_t, ndim=2] ref, double R):
     """Check which atoms in xyz lie within a radius R of any reference
     atom.
 
     Reimplementation of the queryDistance() function from preproc_filter_refstruct.py.
     Much faster. Use <perf_preproc_filter_refstruct.py> to measure the performance.
 
+    Single (float32) and double (float64) precision input is supported, xyz
+    and ref must have the same data type.  The squared distances are computed
+    in double precision in both cases, i.e. for float32 input the result is
+    identical to the one obtained from the same coordinates converted to
+    float64.
+
     Parameters
     ----------
     xyz : array_like (n_atoms, n_dim)
@@ -66,10 +79,63 @@ def queryDistance(np.ndarray[DTYPE_t, ndim=2] xyz, np.ndarray[DTYPE_t, ndim=2] r
         for j in range(n_ref):
             d = 0.0
             for k in range(3):
-                dx = xyz[i,k] - ref[j,k]
+                dx = <DTYPE_t>xyz[i,k] - <DTYPE_t>ref[j,k]
                 d = d + dx*dx
             #if (sqrt(d) < R):
             if (d < Rsq):
                 mask[i] = True
                 break
     return mask
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def classifyDistance(np.ndarray[COORD_t, ndim=2] xyz, np.ndarray[COORD_t, ndim=2] ref,
+                     double R_core, double R_body):
+    """Classify the atoms in xyz by their distance to the nearest reference
+    atom in a single pass, fusing the core and body selections.
+
+    Parameters
+    ----------
+    xyz : array_like (n_atoms, n_dim)
+        atoms positions, float32 or float64
+    ref : array_like (n_atoms, n_dim)
+        Reference atoms positions, same data type as xyz
+    R_core : float
+        core radius, R_core <= R_body
+    R_body : float
+        body radius
+
+    Returns
+    -------
+    labels : ndarray (n_atoms), dtype uint8
+        0 outside the body, 1 within the shell (distance between R_core and
+        R_body), 2 within the core, equivalent to two calls of queryDistance()
+    """
+    cdef np.ndarray[np.uint8_t, ndim=1] labels = np.zeros(xyz.shape[0], dtype=np.uint8)
+    cdef ITYPE_t n_xyz = xyz.shape[0]
+    cdef ITYPE_t n_ref = ref.shape[0]
+    cdef ITYPE_t i
+    cdef ITYPE_t j
+    cdef ITYPE_t k
+    cdef DTYPE_t d
+    cdef DTYPE_t dx
+    cdef DTYPE_t Rsq_core
+    cdef DTYPE_t Rsq_body
+
+    Rsq_core = R_core*R_core
+    Rsq_body = R_body*R_body
+
+    for i in range(n_xyz):
+        for j in range(n_ref):
+            d = 0.0
+            for k in range(3):
+                dx = <DTYPE_t>xyz[i,k] - <DTYPE_t>ref[j,k]
+                d = d + dx*dx
+            if (d < Rsq_body):
+                # the atom is within the body, continue to search for a core hit
+                labels[i] = 1
+                if (d < Rsq_core):
+                    labels[i] = 2
+                    break
+    return labels
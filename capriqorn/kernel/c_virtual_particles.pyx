@@ -26,11 +26,22 @@ ITYPE = np.int
 ctypedef np.int_t ITYPE_t
 
 
+# the lattice may be generated in single or double precision, the arithmetic
+# is always carried out in double precision
+ctypedef fused COORD_t:
+    np.float32_t
+    np.float64_t
+
+
 #@cython.boundscheck(False)
-def genLattice(gridLength, latticeConstant, noise=False):
+def genLattice(gridLength, latticeConstant, noise=False, dtype=FTYPE):
     """
     Generate a 3D lattice, optionally with random displacement.
     Serves as a helper function for <preproc_filter_virtual_particles.py>.
+
+    The lattice is returned with the data type dtype (np.float64 or
+    np.float32).  The random numbers drawn do not depend on dtype, a single
+    precision lattice is the double precision lattice rounded to float32.
     """
 
     cdef np.ndarray[FTYPE_t, ndim=2] base = np.zeros((3, 3))
@@ -44,14 +55,9 @@ def genLattice(gridLength, latticeConstant, noise=False):
 
     cdef np.ndarray[FTYPE_t, ndim=2] baseNew = rot.rotate(base, alpha, beta, gamma)
 
-    cdef np.ndarray[FTYPE_t, ndim=2] lattice = np.zeros((gridLength ** 3, 3))
+    lattice = np.zeros((gridLength ** 3, 3), dtype=dtype)
 
     cdef FTYPE_t l_half = gridLength / 2
-    cdef ITYPE_t idx = 0
-
-    cdef ITYPE_t i
-    cdef ITYPE_t j
-    cdef ITYPE_t k
 
     # --- original Python code
 #     for i in range(gridLength):
@@ -75,22 +81,44 @@ def genLattice(gridLength, latticeConstant, noise=False):
     if noise is True:
         # create randomness in a vectorized way
         noize = np.random.uniform(-0.5, 0.5, (gridLength ** 3, 3))
-        for i in range(gridLength):
-            for j in range(gridLength):
-                for k in range(gridLength):
-                    lattice[idx] = (FTYPE(i) - l_half + noize[idx,0]) * baseNew[0] \
-                                 + (FTYPE(j) - l_half + noize[idx,1]) * baseNew[1] \
-                                 + (FTYPE(k) - l_half + noize[idx,2]) * baseNew[2] \
-                                 + offset
-                    idx += 1
+        _fillLattice(lattice, baseNew, offset, noize, True, gridLength, l_half)
     else:
-        for i in range(gridLength):
-            for j in range(gridLength):
-                for k in range(gridLength):
-                    lattice[idx] = (FTYPE(i) - l_half) * baseNew[0] \
-                                 + (FTYPE(j) - l_half) * baseNew[1] \
-                                 + (FTYPE(k) - l_half) * baseNew[2] \
-                                 + offset
-                    idx += 1
+        noize = np.zeros((1, 3))
+        _fillLattice(lattice, baseNew, offset, noize, False, gridLength, l_half)
 
     return lattice
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _fillLattice(np.ndarray[COORD_t, ndim=2] lattice,
+                 np.ndarray[FTYPE_t, ndim=2] baseNew,
+                 np.ndarray[FTYPE_t, ndim=1] offset,
+                 np.ndarray[FTYPE_t, ndim=2] noize,
+                 bint use_noise,
+                 ITYPE_t gridLength,
+                 FTYPE_t l_half):
+    """Fill the lattice points into the preallocated array lattice."""
+    cdef ITYPE_t idx = 0
+    cdef ITYPE_t i
+    cdef ITYPE_t j
+    cdef ITYPE_t k
+    cdef ITYPE_t m
+    cdef FTYPE_t vi
+    cdef FTYPE_t vj
+    cdef FTYPE_t vk
+
+    for i in range(gridLength):
+        for j in range(gridLength):
+            for k in range(gridLength):
+                vi = <FTYPE_t>i - l_half
+                vj = <FTYPE_t>j - l_half
+                vk = <FTYPE_t>k - l_half
+                if use_noise:
+                    vi = vi + noize[idx, 0]
+                    vj = vj + noize[idx, 1]
+                    vk = vk + noize[idx, 2]
+                for m in range(3):
+                    lattice[idx, m] = <COORD_t>(vi * baseNew[0, m] + vj * baseNew[1, m] \
+                                                + vk * baseNew[2, m] + offset[m])
+                idx += 1
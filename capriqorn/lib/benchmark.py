@@ -0,0 +1,331 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""Capriqorn benchmark library, used by `capriq bench`.
+
+The benchmarks run the performance critical parts of Capriqorn on synthetic
+data generated by the preprocessor and postprocessor DummyReaders: the
+reference structure kernels, the geometry filters, the VirtualParticles
+filter, the postprocessor filters Average, Solvent, DeltaH, and PDDF, and the
+parallel preprocessor pipeline for a varying number of workers.  The size of
+the workloads is set by a configuration dictionary, see `defaults`.
+
+Each benchmark is a function taking the configuration and returning a
+function without arguments to be timed.  It is called before each timing,
+such that the preparation of the (fresh copies of the) input data is not part
+of the timing.  The best of `repeat` timings is reported.
+The results are stored as a JSON baseline file, compare() flags the
+benchmarks which became slower than the baseline by more than a threshold.
+"""
+from __future__ import print_function
+
+
+import sys
+import copy
+import json
+import time
+import fnmatch
+import platform
+import timeit
+import numpy as np
+from collections import OrderedDict
+from . import refstruct
+from . import rdf
+from . import pipeutil
+from .. import version
+from .. import testing
+
+
+# size of the synthetic workloads
+defaults = {'n_frames': 4,
+            'n_atoms': 200000,
+            'n_ref': 5000,
+            'n_bins': 4000,
+            'n_workers': [1, 2, 4],
+            'repeat': 3}
+
+# reduced sizes, e.g. for a quick check or the test suite
+quick = {'n_frames': 2,
+         'n_atoms': 20000,
+         'n_ref': 500,
+         'n_bins': 1000,
+         'n_workers': [1, 2],
+         'repeat': 1}
+
+# edge length of the box the preprocessor coordinates are distributed in,
+# and the radius of the spherical observation volume
+box_length = 80.0
+radius = 30.0
+shell_width = 3.0
+# solvent species of the reference rdf file shipped with the test data
+solvent_elements = ['Cl-1', 'H', 'Na+1', 'O']
+dr = 0.01
+
+
+def _drain(pipeline_element):
+    """Pull all objects through a pipeline element, return the last one."""
+    obj = None
+    for obj in next(pipeline_element):
+        pass
+    return obj
+
+
+def _data_file(name):
+    return testing.get_test_data_file_path(name)
+
+
+def coordinate_frames(config):
+    """Return synthetic preprocessor frames with uniformly distributed coordinates."""
+    from ..preproc import io as preproc_io
+    reader = preproc_io.DummyReader(n_frames=config['n_frames'], n_atoms=config['n_atoms'],
+                                    box_length=box_length, table=False)
+    return list(next(reader))
+
+
+def histogram_frames(config):
+    """Return synthetic histogram sets including the shell and the virtual
+    particle histograms and the pipeline log information required by the
+    Solvent, DeltaH, and PDDF filters."""
+    from ..postproc import io as postproc_io
+    elements = []
+    for element in solvent_elements + ['X']:
+        elements.extend([element, element + '.s'])
+    reader = postproc_io.DummyReader(n_histogram_sets=config['n_frames'], n_bins=config['n_bins'],
+                                     elements=elements, scalars=True)
+    frames = list(next(reader))
+    r_max = dr * config['n_bins']
+    for frm in frames:
+        frm.put_meta({'histograms': {'histogram': {'dr': dr, 'sum': 1}}})
+        frm.put_meta({'Sphere': {'radius': radius, 'shell_width': shell_width,
+                                 'volume': rdf.VSphere(radius),
+                                 'shell_volume': rdf.VShell(radius - shell_width, radius),
+                                 'r_max': r_max}})
+        frm.put_meta({'VirtualParticles': {'method': 'lattice', 'x_density': 0.1}})
+    return frames
+
+
+def _cached(config, key, function):
+    """Compute input data once per configuration."""
+    cache = config.setdefault('_cache', {})
+    if key not in cache:
+        cache[key] = function(config)
+    return cache[key]
+
+
+# --- benchmark definitions below, each returns the function to be timed ---
+
+
+def bench_refstruct_query(config):
+    xyz = box_length * (np.random.rand(config['n_atoms'], 3) - 0.5)
+    ref = 0.5 * box_length * (np.random.rand(config['n_ref'], 3) - 0.5)
+    return lambda: refstruct.queryDistance(xyz, ref, 3.0)
+
+
+def bench_refstruct_classify(config):
+    xyz = box_length * (np.random.rand(config['n_atoms'], 3) - 0.5)
+    ref = 0.5 * box_length * (np.random.rand(config['n_ref'], 3) - 0.5)
+    return lambda: refstruct.classifyDistance(xyz, ref, 3.0, 6.0)
+
+
+def bench_refstruct_cell_lists(config):
+    xyz = box_length * (np.random.rand(config['n_atoms'], 3) - 0.5)
+    ref = 0.5 * box_length * (np.random.rand(config['n_ref'], 3) - 0.5)
+    return lambda: refstruct.cutout_using_cell_lists(xyz, ref, 3.0, return_mask=True)
+
+
+def _geometry(label, parameters):
+    def setup(config):
+        from ..preproc import filter as preproc_filter
+        frames = _cached(config, 'coordinate_frames', coordinate_frames)
+        element = getattr(preproc_filter, label)(source=testing.FrameSource(copy.deepcopy(frames)),
+                                                 **parameters)
+        return lambda: _drain(element)
+    return setup
+
+
+def bench_virtual_particles(config):
+    from ..preproc import filter as preproc_filter
+    frames = _cached(config, 'coordinate_frames', coordinate_frames)
+    element = preproc_filter.VirtualParticles(source=testing.FrameSource(copy.deepcopy(frames)),
+                                              x_box_length=box_length, x_density=0.1)
+    return lambda: _drain(element)
+
+
+def _postproc_input(config, label):
+    """Return the input frames of the postprocessor filter label, i.e. the
+    output of the upstream filters."""
+    from ..postproc import filter as postproc_filter
+    if (label == 'Average'):
+        return _cached(config, 'histogram_frames', histogram_frames)
+
+    def upstream(config):
+        if (label == 'Solvent'):
+            frames = _postproc_input(config, 'Average')
+            element = postproc_filter.Average(source=testing.FrameSource(copy.deepcopy(frames)), n_avg=1)
+        elif (label == 'DeltaH'):
+            frames = _postproc_input(config, 'Solvent')
+            element = postproc_filter.Solvent(source=testing.FrameSource(copy.deepcopy(frames)),
+                                              g_ascii_file=_data_file('rdf.extended.dat'))
+        elif (label == 'PDDF'):
+            frames = _postproc_input(config, 'DeltaH')
+            element = postproc_filter.DeltaH(source=testing.FrameSource(copy.deepcopy(frames)),
+                                             form_factor_file=_data_file('atomsf.dat'))
+        return [frm for frm in next(element) if frm is not None]
+    return _cached(config, 'input_' + label, upstream)
+
+
+def _postproc(label):
+    def setup(config):
+        from ..postproc import filter as postproc_filter
+        source = testing.FrameSource(copy.deepcopy(_postproc_input(config, label)))
+        if (label == 'Average'):
+            element = postproc_filter.Average(source=source, n_avg='all')
+        elif (label == 'Solvent'):
+            element = postproc_filter.Solvent(source=source, g_ascii_file=_data_file('rdf.extended.dat'))
+        elif (label == 'DeltaH'):
+            element = postproc_filter.DeltaH(source=source, form_factor_file=_data_file('atomsf.dat'))
+        elif (label == 'PDDF'):
+            element = postproc_filter.PDDF(source=source, form_factor_file=_data_file('atomsf.dat'))
+        return lambda: _drain(element)
+    return setup
+
+
+def _parallel(n_workers):
+    def setup(config):
+        pipeline_meta = [{'DummyReader': {'n_frames': 4 * config['n_frames'], 'n_atoms': config['n_atoms'],
+                                          'box_length': box_length, 'table': False}},
+                         {'ParallelFork': {'n_workers': n_workers}},
+                         {'Sphere': {'radius': radius, 'shell_width': shell_width}},
+                         {'ParallelJoin': {}},
+                         {'DummyWriter': {}}]
+        return lambda: pipeutil.run_pipeline(copy.deepcopy(pipeline_meta), "capriqorn.preproc")
+    return setup
+
+
+def get_benchmarks(config):
+    """Return the ordered dictionary of the benchmarks for the configuration."""
+    benchmarks = OrderedDict()
+    benchmarks['refstruct.queryDistance'] = bench_refstruct_query
+    benchmarks['refstruct.classifyDistance'] = bench_refstruct_classify
+    benchmarks['refstruct.cell_lists'] = bench_refstruct_cell_lists
+    benchmarks['preproc.Sphere'] = _geometry('Sphere', {'radius': radius, 'shell_width': shell_width})
+    benchmarks['preproc.Ellipsoid'] = _geometry('Ellipsoid', {'semi_principal_axes': [20., 25., 30.],
+                                                              'shell_width': shell_width})
+    benchmarks['preproc.Cuboid'] = _geometry('Cuboid', {'half_lengths': [20., 25., 30.],
+                                                        'shell_width': shell_width})
+    benchmarks['preproc.VirtualParticles'] = bench_virtual_particles
+    for label in ['Average', 'Solvent', 'DeltaH', 'PDDF']:
+        benchmarks['postproc.' + label] = _postproc(label)
+    for n_workers in config['n_workers']:
+        benchmarks['pipeline.n_workers=' + str(n_workers)] = _parallel(n_workers)
+    return benchmarks
+
+
+def select(names, patterns):
+    """Return the names matching any of the shell-style patterns."""
+    if not patterns:
+        return list(names)
+    return [name for name in names if any([fnmatch.fnmatch(name, pattern) for pattern in patterns])]
+
+
+def measure(benchmark, config):
+    """Return the list of the wall clock times of the repeated runs of a benchmark."""
+    times = []
+    for _i in range(config['repeat']):
+        function = benchmark(config)
+        t0 = timeit.default_timer()
+        function()
+        times.append(timeit.default_timer() - t0)
+    return times
+
+
+def run(config=None, patterns=None, verbose=True):
+    """Run the benchmarks, return the result dictionary ready to be saved as a baseline.
+
+    Parameters
+    ----------
+    config : dict
+        Workload configuration, missing entries are taken from `defaults`.
+    patterns : list
+        Optional shell-style patterns selecting the benchmarks by name.
+    """
+    cfg = copy.deepcopy(defaults)
+    if config is not None:
+        cfg.update(config)
+    benchmarks = get_benchmarks(cfg)
+    results = OrderedDict()
+    for name in select(benchmarks.keys(), patterns):
+        times = measure(benchmarks[name], cfg)
+        results[name] = {'best': min(times), 'mean': sum(times) / float(len(times)), 'times': times}
+        if verbose:
+            print(" {:32s} {:10.4f} s".format(name, results[name]['best']))
+            sys.stdout.flush()
+    cfg.pop('_cache', None)
+    return {'version': version.get_version_string(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'config': cfg,
+            'results': results}
+
+
+def save(result, file_name):
+    with open(file_name, 'w') as fp:
+        json.dump(result, fp, indent=1)
+
+
+def load(file_name):
+    with open(file_name, 'r') as fp:
+        return json.load(fp)
+
+
+def compare(result, baseline, threshold=0.1):
+    """Compare the best timings of a result with a baseline.
+
+    Returns
+    -------
+    list
+        List of tuples (name, baseline time, time, ratio, status), the status
+        being one of 'ok', 'regression', 'improvement', 'new', and 'missing'.
+        A benchmark is a regression (improvement) if its time exceeds (falls
+        below) the baseline time by more than the relative threshold.
+    """
+    rows = []
+    base_results = baseline['results']
+    for (name, entry) in result['results'].items():
+        if name not in base_results:
+            rows.append((name, None, entry['best'], None, 'new'))
+            continue
+        t_base = base_results[name]['best']
+        ratio = entry['best'] / t_base if (t_base > 0.0) else float('inf')
+        if (ratio > 1.0 + threshold):
+            status = 'regression'
+        elif (ratio < 1.0 / (1.0 + threshold)):
+            status = 'improvement'
+        else:
+            status = 'ok'
+        rows.append((name, t_base, entry['best'], ratio, status))
+    for name in base_results:
+        if name not in result['results']:
+            rows.append((name, base_results[name]['best'], None, None, 'missing'))
+    return rows
+
+
+def print_comparison(rows):
+    print(" {:32s} {:>10s} {:>10s} {:>7s}  {}".format('benchmark', 'base [s]', 'time [s]', 'ratio', 'status'))
+    for (name, t_base, t, ratio, status) in rows:
+        print(" {:32s} {:>10s} {:>10s} {:>7s}  {}".format(
+            name,
+            '-' if t_base is None else '{:.4f}'.format(t_base),
+            '-' if t is None else '{:.4f}'.format(t),
+            '-' if ratio is None else '{:.2f}'.format(ratio),
+            status.upper() if status == 'regression' else status))
@@ -0,0 +1,133 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""Capriqorn block averaging library, used to estimate statistical errors.
+
+The Average filter optionally splits the frames it averages into blocks of
+consecutive frames for one or more block sizes and accumulates the mean and
+the variance of the block means in a single pass (Welford's algorithm).  The
+standard errors are stored next to the averaged histograms at
+
+    histograms_stderr/<block size>/<species pair>
+
+As usual in a blocking analysis, the standard error increases with the block
+size until the blocks are uncorrelated, the plateau value is the estimate.
+
+The block means of the first block size are moreover stored at
+
+    error_blocks/<block index>/<location>
+
+such that the DeltaH and PDDF filters are able to evaluate dI and pddf_tot for
+each block mean and derive the standard errors of these quantities as well.
+The solvent matching parameters of the averaged frame are used for all blocks.
+The PDDF filter removes the block means afterwards, i.e. they are part of the
+output only in case the pipeline does not contain the PDDF filter.
+
+The error estimates are not supported for an Average filter inside a parallel
+region.
+"""
+
+
+import numpy as np
+from cadishi import base
+
+
+loc_histograms_stderr = 'histograms_stderr'
+loc_error_blocks = 'error_blocks'
+
+
+class RunningVariance(object):
+    """Running mean and variance of dictionaries of arrays, updated one sample
+    at a time using Welford's algorithm."""
+
+    def __init__(self, skip_keys=['radii']):
+        self.skip_keys = skip_keys
+        self.n = 0
+        self.mean = {}
+        self.m2 = {}
+
+    def add(self, values):
+        """Add a sample, given as a dictionary of arrays."""
+        self.n += 1
+        for (key, x) in values.items():
+            if key in self.skip_keys:
+                continue
+            x = np.asarray(x, dtype=np.float64)
+            if key not in self.mean:
+                self.mean[key] = x.copy()
+                self.m2[key] = np.zeros_like(self.mean[key])
+            else:
+                delta = x - self.mean[key]
+                self.mean[key] += delta / self.n
+                self.m2[key] += delta * (x - self.mean[key])
+
+    def variance(self):
+        """Return the dictionary of the (unbiased) sample variances, NaN in
+        case less than two samples were added."""
+        var = {}
+        for (key, m2) in self.m2.items():
+            if (self.n > 1):
+                var[key] = m2 / float(self.n - 1)
+            else:
+                var[key] = np.full_like(m2, np.nan)
+        return var
+
+    def stderr(self):
+        """Return the dictionary of the standard errors of the mean."""
+        return {key: np.sqrt(var / float(max(self.n, 1))) for (key, var) in self.variance().items()}
+
+
+def get_block_sizes(block_sizes):
+    """Return the sorted list of the block sizes given in the parameter file,
+    which may be None, an integer, or a list of integers."""
+    if block_sizes is None:
+        return []
+    if isinstance(block_sizes, int):
+        block_sizes = [block_sizes]
+    block_sizes = [int(b) for b in block_sizes]
+    if any([b < 1 for b in block_sizes]):
+        raise ValueError("block sizes for the error estimates must be positive integers")
+    return sorted(set(block_sizes))
+
+
+def get_error_blocks(frm):
+    """Return the list of the block data stored by the Average filter in frm,
+    sorted by the block index."""
+    if not frm.contains_key(loc_error_blocks):
+        return []
+    blocks = frm.get_data(loc_error_blocks)
+    return [blocks[key] for key in sorted(blocks.keys(), key=int)]
+
+
+def get_replica(frm, block, drop_locations=[]):
+    """Return a container sharing the data of frm, except for the locations
+    stored in the block data which are replaced by the block values.
+
+    The top-level locations listed in drop_locations are not shared, i.e.
+    data a filter writes there does not alter frm.  The replica is used to
+    evaluate a filter for the block means of a frame.
+    """
+    replica = base.Container()
+    replica.i = frm.i
+    replica.data = dict(frm.data)
+    for location in [loc_error_blocks, loc_histograms_stderr] + drop_locations:
+        replica.data.pop(location, None)
+    replica.data.update(block)
+    replica.data['log'] = list(frm.data['log'])
+    return replica
+
+
+def columns_stderr(running, key):
+    """Return a two-column array of the first column of the running mean
+    (the abscissa) and the standard error of the second column."""
+    mean = running.mean[key]
+    err = running.stderr()[key]
+    return np.column_stack((mean[:, 0], err[:, 1]))
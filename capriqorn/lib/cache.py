@@ -0,0 +1,239 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""Capriqorn content-addressed stage cache, enabled by `capriq postproc --cache`.
+
+The output stream of each filter of a (sequential) pipeline is stored in a
+cache entry, keyed by a hash of
+
+* the fingerprint of the input data, i.e. the paths, sizes and modification
+  times of the files and directories given to the reader and to the filters
+  (e.g. RDF and form factor files),
+* the parameters (as returned by get_meta()) of the reader and of all the
+  filters up to and including the filter,
+* the Capriqorn version.
+
+When a pipeline is run again, the longest prefix of the pipeline with a
+complete cache entry is replaced by a CacheReader serving the stored frames,
+such that e.g. changing the parameters of the PDDF filter does not recompute
+the Average, Solvent and DeltaH stages.  The cache directory is limited in
+size, the least recently used entries are removed first.
+"""
+from __future__ import print_function
+
+
+import os
+import glob
+import json
+import shutil
+import hashlib
+import pickle
+from cadishi import base
+from cadishi import util
+from .. import version
+
+
+MB = 1024. * 1024.
+stream_file = 'stream.pkl'
+entry_file = 'entry.json'
+
+
+def _stat_path(path):
+    """Return a list with the fingerprints of a file or of the files of a directory."""
+    stats = []
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                stats.extend(_stat_path(os.path.join(root, name)))
+    elif os.path.isfile(path):
+        stat = os.stat(path)
+        stats.append([os.path.abspath(path), stat.st_size, stat.st_mtime])
+    return stats
+
+
+def fingerprint(parameters):
+    """Return the fingerprints of the files and directories referenced by the
+    (nested) parameters of a pipeline element."""
+    stats = []
+    if isinstance(parameters, dict):
+        for key in sorted(parameters.keys()):
+            stats.extend(fingerprint(parameters[key]))
+    elif isinstance(parameters, (list, tuple)):
+        for value in parameters:
+            stats.extend(fingerprint(value))
+    elif isinstance(parameters, str) and os.path.exists(parameters):
+        stats.extend(_stat_path(parameters))
+    return stats
+
+
+def get_stage_keys(pipeline):
+    """Return the cache keys of the output streams of the elements of an
+    instantiated pipeline, the key of an element covers all upstream elements."""
+    keys = []
+    digest = hashlib.sha1()
+    digest.update(version.get_version_string().encode('utf-8'))
+    for element in pipeline:
+        meta = element.get_meta()
+        # the data files of the filters (e.g. form factors, RDFs) are covered as well
+        digest.update(json.dumps(fingerprint(meta), sort_keys=True).encode('utf-8'))
+        digest.update(json.dumps(meta, sort_keys=True, default=str).encode('utf-8'))
+        keys.append(digest.hexdigest())
+    return keys
+
+
+class CacheReader(base.Reader):
+    """Reader serving the frames of a cache entry."""
+    _depends = []
+    _conflicts = []
+
+    def __init__(self, entry, verbose=False):
+        self.entry = entry
+        self.verb = verbose
+        # ---
+        self._depends.extend(super(base.Reader, self)._depends)
+        self._conflicts.extend(super(base.Reader, self)._conflicts)
+
+    def get_meta(self):
+        """Return information on the present reader, ready to be added to a
+        frame object's list of pipeline meta information.
+        """
+        meta = {}
+        label = 'CacheReader'
+        param = {'entry': self.entry}
+        meta[label] = param
+        return meta
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # mark the entry as recently used
+        os.utime(os.path.join(self.entry, entry_file), None)
+        with open(os.path.join(self.entry, stream_file), 'rb') as fp:
+            while True:
+                try:
+                    frm = pickle.load(fp)
+                except EOFError:
+                    break
+                if self.verb:
+                    print("CacheReader.next() :", frm.i)
+                yield frm
+
+
+class _CachingSource(object):
+    """Stand-in for a pipeline element as the source of the next element,
+    storing the output stream of the element into a new cache entry."""
+
+    def __init__(self, element, entry, label, size_limit):
+        self.element = element
+        self.entry = entry
+        self.label = label
+        self.size_limit = size_limit
+
+    def __getattr__(self, name):
+        return getattr(self.element, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        tmp_entry = self.entry + '.tmp.' + str(os.getpid())
+        util.rmrf(tmp_entry)
+        util.md(tmp_entry + '/')
+        fp = open(os.path.join(tmp_entry, stream_file), 'wb')
+        n_items = 0
+        try:
+            for obj in next(self.element):
+                if (fp is not None) and isinstance(obj, base.Container):
+                    pickle.dump(obj, fp, protocol=pickle.HIGHEST_PROTOCOL)
+                    n_items += 1
+                    if (fp.tell() > self.size_limit):
+                        # the entry would not fit into the cache
+                        fp.close()
+                        fp = None
+                        util.rmrf(tmp_entry)
+                yield obj
+            if fp is not None:
+                size = fp.tell()
+                fp.close()
+                fp = None
+                with open(os.path.join(tmp_entry, entry_file), 'w') as fp_entry:
+                    json.dump({'label': self.label, 'n_items': n_items, 'size': size}, fp_entry)
+                if not os.path.exists(self.entry):
+                    os.rename(tmp_entry, self.entry)
+        finally:
+            if fp is not None:
+                fp.close()
+            util.rmrf(tmp_entry)
+
+    next = __next__
+
+
+def is_complete(entry):
+    """Check if a cache entry exists and has been completed."""
+    return os.path.isfile(os.path.join(entry, entry_file))
+
+
+def apply(pipeline, directory, size=1024.):
+    """Serve the longest cached prefix of an instantiated (sequential) pipeline
+    from the cache and store the output streams of the remaining filters.
+
+    Parameters
+    ----------
+    pipeline : list
+        List of instantiated classes forming the pipeline.
+    directory : string
+        Cache directory.
+    size : float
+        Size limit of the cache directory in MB.
+
+    Returns
+    -------
+    Tuple with (the modified pipeline, the number of elements served from the cache).
+    """
+    util.md(os.path.join(directory, ''))
+    keys = get_stage_keys(pipeline)
+    entries = [os.path.join(directory, key) for key in keys]
+    # the writer is never cached
+    n_cached = 0
+    for position in range(len(pipeline) - 2, 0, -1):
+        if is_complete(entries[position]):
+            n_cached = position + 1
+            break
+    if (n_cached > 0):
+        reader = CacheReader(entries[n_cached - 1])
+        pipeline = [reader] + pipeline[n_cached:]
+        pipeline[1].src = reader
+        entries = [entries[n_cached - 1]] + entries[n_cached:]
+    for position in range(1, len(pipeline) - 1):
+        if not is_complete(entries[position]):
+            element = pipeline[position]
+            pipeline[position + 1].src = _CachingSource(pipeline[position + 1].src, entries[position],
+                                                        element.__class__.__name__, size * MB)
+    return (pipeline, n_cached)
+
+
+def evict(directory, size=1024.):
+    """Remove the least recently used cache entries until the size of the
+    cache directory is within the limit (MB)."""
+    entries = []
+    for filename in glob.glob(os.path.join(directory, '*', entry_file)):
+        with open(filename) as fp:
+            entry = json.load(fp)
+        entries.append((os.path.getmtime(filename), entry['size'], os.path.dirname(filename)))
+    total = sum([entry[1] for entry in entries])
+    for (_mtime, entry_size, entry) in sorted(entries):
+        if (total <= size * MB):
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= entry_size
+    return total
@@ -0,0 +1,235 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""Capriqorn checkpoint and resume, enabled by `--checkpoint N` and `--resume`.
+
+Every N frames a checkpoint file `<output file>.checkpoint` is written next
+to the output file of the H5Writer, recording
+
+* the number of the last frame of a contiguous sequence of frames processed,
+* the parameters of the reader (as logged in the frame),
+* the parameters needed to restore the state of the stateful pipeline
+  elements, as returned by their method get_checkpoint(), e.g. the random
+  number generator state of VirtualParticles or the running sums of Average.
+
+The checkpoints are written by the H5Writer after it has written (and
+flushed) N frames, and by the Average filter averaging over all frames after
+it has added N frames to its running sums, as the H5Writer does not receive
+any frame before the end of the run in that case.  The latter is not
+supported for Average in a parallel region.  Only the elements running in the
+process of the H5Writer or Average, respectively, contribute their state.  The checkpoint file is removed when the run has completed.
+
+Running the pre- or postprocessor with `--resume` then reopens the output
+in append mode, removes the frames written after the checkpoint, restores
+the state of the elements, and lets the reader continue after the last
+checkpointed frame.
+"""
+from __future__ import print_function
+
+
+import os
+import pickle
+import h5py
+from . import incremental
+from . import pipeutil
+
+
+checkpoint_suffix = '.checkpoint'
+# readers supporting resuming: 'original' readers number the frames relative
+# to the original trajectory, 'sequential' readers number the frames read
+# consecutively, starting after number_offset
+resumable_readers = {'CRDBoxReader': 'original', 'MDReader': 'original',
+                     'H5Reader': 'sequential'}
+
+
+def get_checkpoint_file(output_file):
+    """Return the name of the checkpoint file belonging to an output file."""
+    return output_file + checkpoint_suffix
+
+
+def write(file_name, checkpoint):
+    """Write a checkpoint atomically."""
+    with open(file_name + '.tmp', 'wb') as fp:
+        pickle.dump(checkpoint, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(file_name + '.tmp', file_name)
+
+
+def read(file_name):
+    """Read a checkpoint, return None if it does not exist."""
+    if not os.path.isfile(file_name):
+        return None
+    with open(file_name, 'rb') as fp:
+        return pickle.load(fp)
+
+
+def remove(file_name):
+    """Remove a checkpoint after the run has completed."""
+    if os.path.isfile(file_name):
+        os.remove(file_name)
+
+
+def get_reader_meta(frm):
+    """Return the label and the parameters of the (last) resumable reader in
+    the pipeline log of the frame frm, or None."""
+    for entry in reversed(frm.get_meta()):
+        for (label, parameters) in entry.items():
+            if label in resumable_readers:
+                return (label, parameters)
+    return None
+
+
+def collect_states(element):
+    """Return the checkpoint parameters of element and of its upstream
+    elements running in the present process, keyed by their labels.  The
+    labels are taken from get_meta(), such that the stand-ins installed by
+    the instrumentation (e.g. <profiling.py>) are transparent."""
+    states = {}
+    while (element is not None):
+        if hasattr(element, 'get_checkpoint'):
+            label = list(element.get_meta().keys())[0]
+            if label in states:
+                raise RuntimeError("checkpointing supports a single stateful element `" + label + "'")
+            states[label] = element.get_checkpoint()
+        element = getattr(element, 'src', None)
+        if not hasattr(element, 'src'):
+            break
+    return states
+
+
+def make_checkpoint(frm, interval, source, states):
+    """Return a checkpoint for the frames up to frm."""
+    return {'frame': frm.i, 'interval': interval, 'source': source,
+            'reader': get_reader_meta(frm), 'parameters': states}
+
+
+def _in_parallel_region(pipeline_meta, label):
+    """Check if the first active element with the given label is placed
+    inside an (active) parallel region."""
+    in_region = False
+    for filter_meta in pipeline_meta:
+        for (key, parameters) in filter_meta.items():
+            if parameters is None:
+                parameters = {}
+            if (parameters.get('active', True) == False):
+                continue
+            if (key == 'ParallelFork') and (parameters.get('n_workers', 0) > 0):
+                in_region = True
+            elif (key == 'ParallelJoin'):
+                in_region = False
+            elif (key == label):
+                return in_region
+    return False
+
+
+def setup_checkpoint(pipeline_meta, interval):
+    """Modify a pipeline specification in place to write checkpoints every
+    interval frames.
+
+    Raises
+    ------
+    RuntimeError
+        In case there is no H5Writer, in case the Average filter averaging
+        over all frames runs inside a parallel region, where its partial sums
+        are only merged at the end of the run, or in case VirtualParticles runs
+        inside a parallel region, where its random number generator state lives
+        on the workers and cannot be restored.
+    """
+    writer_param = incremental.get_parameters(pipeline_meta, 'H5Writer')
+    if writer_param is None:
+        raise RuntimeError("checkpointing requires an H5Writer")
+    writer_param['checkpoint'] = interval
+    if _in_parallel_region(pipeline_meta, 'VirtualParticles'):
+        raise RuntimeError("checkpointing is not supported for VirtualParticles in a parallel region, "
+                           "disable the ParallelFork filter")
+    average_param = incremental.get_parameters(pipeline_meta, 'Average')
+    if (average_param is not None) and (average_param.get('n_avg') == 'all'):
+        if _in_parallel_region(pipeline_meta, 'Average'):
+            raise RuntimeError("checkpointing with n_avg: all is not supported for Average in a parallel region, "
+                               "disable the ParallelFork filter")
+        average_param['checkpoint'] = interval
+        average_param['checkpoint_file'] = get_checkpoint_file(writer_param.get('file', 'default.hdf5'))
+
+
+def trim_output(file_name, frame):
+    """Remove the frames beyond frame from an HDF5 output file."""
+    with h5py.File(file_name, 'a') as h5fp:
+        for key in list(h5fp.keys()):
+            if key.isdigit() and (int(key) > frame):
+                del h5fp[key]
+
+
+def setup_resume(pipeline_meta, pipeline_module):
+    """Modify a pipeline specification in place to continue from the checkpoint
+    of the output file of the H5Writer.
+
+    Returns
+    -------
+    int
+        The checkpoint interval of the previous run, or None in case no
+        checkpoint was found.
+    """
+    writer_param = incremental.get_parameters(pipeline_meta, 'H5Writer')
+    if writer_param is None:
+        raise RuntimeError("resuming requires an H5Writer")
+    if writer_param.get('append', False):
+        raise RuntimeError("resuming is not supported in append mode")
+    output_file = writer_param.get('file', 'default.hdf5')
+    checkpoint = read(get_checkpoint_file(output_file))
+    if checkpoint is None:
+        print(" No checkpoint found for <" + output_file + ">, processing all frames.")
+        return None
+    if checkpoint['reader'] is None:
+        raise RuntimeError("the checkpoint does not contain the reader information")
+    (label, previous) = checkpoint['reader']
+    reader_param = incremental.get_parameters(pipeline_meta, label)
+    if reader_param is None:
+        raise RuntimeError("the pipeline does not contain the reader `" + label + "' of the checkpoint")
+    # the frame selection must be entirely done by the reader
+    (element_meta, _settings) = pipeutil.get_pipeline_settings(pipeline_meta)
+    (plan, _notes) = pipeutil.plan_pipeline(element_meta, pipeline_module)
+    for filter_meta in plan:
+        if 'Step' in filter_meta:
+            raise RuntimeError("resuming requires Step to directly follow the reader, use its `step' parameter")
+    if reader_param.get('shuffle', False):
+        raise RuntimeError("resuming is not supported for shuffled input")
+    frame = checkpoint['frame']
+    step = previous.get('step', 1) or 1
+    if (resumable_readers[label] == 'original'):
+        reader_param['first'] = frame + step
+    else:
+        first = previous.get('first', 1) or 1
+        reader_param['first'] = first + (frame - previous.get('number_offset', 0)) * step
+        reader_param['number_offset'] = frame
+    for (element_label, parameters) in checkpoint['parameters'].items():
+        element_param = incremental.get_parameters(pipeline_meta, element_label)
+        if element_param is None:
+            raise RuntimeError("the pipeline does not contain the element `" + element_label +
+                               "' whose state is stored in the checkpoint")
+        element_param.update(parameters)
+    if (checkpoint['source'] == 'H5Writer') and os.path.isfile(output_file):
+        trim_output(output_file, frame)
+        writer_param['mode'] = 'a'
+    print(" Resuming from the checkpoint of <" + output_file + "> after frame " + str(frame) + ".")
+    return checkpoint['interval']
+
+
+def setup(pipeline_meta, pipeline_module, interval=None, resume=False):
+    """Set up checkpointing and resuming for the command line flags
+    `--checkpoint interval` and `--resume`, by default a resumed run continues
+    with the checkpoint interval of the previous run."""
+    if resume:
+        previous_interval = setup_resume(pipeline_meta, pipeline_module)
+        if interval is None:
+            interval = previous_interval
+    if interval:
+        setup_checkpoint(pipeline_meta, interval)
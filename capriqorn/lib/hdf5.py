@@ -0,0 +1,157 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+"""Capriqorn HDF5 reader and writer, extending the Cadishi H5Reader by sharded
+and incremental reading, and the Cadishi H5Writer by an append mode and by
+checkpoints.
+
+The module is imported by the pre- and postprocessor IO modules after the
+Cadishi HDF5 module, i.e. the H5Reader and H5Writer below replace the Cadishi
+ones.
+"""
+from __future__ import print_function
+
+
+import os
+from cadishi.io import hdf5 as cadishi_hdf5
+from . import checkpoint as checkpoint_lib
+
+
+class H5Reader(cadishi_hdf5.H5Reader):
+    """HDF5 reader returning base.Container instances, with support for
+    sharded reading in parallel pipelines."""
+    _depends = []
+    _conflicts = []
+
+    def __init__(self, file=["default.h5"], first=1, last=None, step=1,
+                 shuffle=False, shuffle_reproducible=False, number_offset=0, verbose=False):
+        """
+        Parameters
+        ----------
+        number_offset : int
+            Offset added to the frame numbers, used when frames are appended
+            to the result of a previous run, see <lib/incremental.py>.
+        """
+        super(H5Reader, self).__init__(file=file, first=first, last=last, step=step,
+                                       shuffle=shuffle, shuffle_reproducible=shuffle_reproducible,
+                                       verbose=verbose)
+        self.number_offset = number_offset
+        self.shard_index = 0
+        self.n_shards = 1
+
+    def shard(self, shard_index, n_shards):
+        """Restrict the reader to every n_shards-th frame of the frame pool,
+        starting at shard_index.  Frame numbers are kept identical to the ones
+        of an unsharded reader."""
+        self.shard_index = shard_index
+        self.n_shards = n_shards
+
+    def get_frame_count(self):
+        """Return the number of frames delivered by the reader (shard)."""
+        return len(self.frame_pool[self.shard_index::self.n_shards])
+
+    def get_meta(self):
+        """Return information on the HDF5 reader, ready to be added to a frame
+        object's list of pipeline meta information.
+        """
+        meta = super(H5Reader, self).get_meta()
+        if (self.number_offset != 0):
+            meta['H5Reader']['number_offset'] = self.number_offset
+        return meta
+
+    def __next__(self):
+        """Generator yielding frame by frame (re-numbering frames from one)."""
+        c = 1 + self.number_offset + self.shard_index
+        for idx_tuple in self.frame_pool[self.shard_index::self.n_shards]:
+            frm = self.get_frame(idx_tuple)
+            frm.i = c  # re-introduce numbering
+            frm.put_meta(self.get_meta())
+            if self.verb:
+                print("H5Reader.next() : ", frm.i)
+            yield frm
+            c += self.n_shards
+
+
+class H5Writer(cadishi_hdf5.H5Writer):
+    """HDF5 writer for base.Container instances.  In append mode, the output
+    file is only replaced once the pipeline has completed, such that the
+    previous result is kept in case of a failure.  With checkpoints enabled,
+    the output file is flushed and a checkpoint is written every `checkpoint`
+    frames, see <lib/checkpoint.py>."""
+    _depends = []
+    _conflicts = []
+    # all container locations are written, unless restricted by the parameter `fields`
+    _consumes = None
+    _produces = []
+
+    def __init__(self, file="default.hdf5", source=-1,
+                 compression=None, mode="w", append=False, fields=None, checkpoint=0, verbose=False):
+        """
+        Parameters
+        ----------
+        fields : list
+            Optional list of the top-level container locations to be written,
+            e.g. ['coordinates', 'dimensions'].  By default all locations are written.
+        checkpoint : int
+            Number of frames between checkpoints, 0 disables checkpoints.
+        """
+        self.target_file = file
+        self.append = append
+        self.fields = fields
+        self.checkpoint = checkpoint
+        self.checkpoint_file = checkpoint_lib.get_checkpoint_file(file)
+        self.n_written = 0
+        if self.append:
+            file = file + '.part'
+        super(H5Writer, self).__init__(file=file, source=source, compression=compression,
+                                       mode=mode, verbose=verbose)
+
+    def get_meta(self):
+        """Return information on the HDF5 writer,
+        ready to be added to a frame object's list of
+        pipeline meta information.
+        """
+        meta = {}
+        label = 'H5Writer'
+        param = {'file': self.target_file,
+                 'compression': self.comp,
+                 'append': self.append}
+        if self.fields is not None:
+            param['fields'] = self.fields
+        meta[label] = param
+        return meta
+
+    def put_frame(self, frm):
+        """Save a single frame, restricted to the requested fields."""
+        if self.fields is not None:
+            for location in list(frm.data.keys()):
+                if (location != 'log') and (location not in self.fields):
+                    del frm.data[location]
+        self.n_written += 1
+        due = (self.checkpoint > 0) and (self.n_written % self.checkpoint == 0)
+        if due:
+            # the pipeline log is serialized by the parent class
+            checkpoint = checkpoint_lib.make_checkpoint(frm, self.checkpoint, 'H5Writer',
+                                                        checkpoint_lib.collect_states(self.src))
+        super(H5Writer, self).put_frame(frm)
+        if due:
+            self.flush()
+            checkpoint_lib.write(self.checkpoint_file, checkpoint)
+
+    def dump(self):
+        """Save a series of frames, in append mode replace the output file
+        afterwards."""
+        super(H5Writer, self).dump()
+        if (self.checkpoint > 0):
+            self.flush()
+            checkpoint_lib.remove(self.checkpoint_file)
+        if self.append:
+            self.close_file_safely()
+            os.replace(self.file, self.target_file)
@@ -0,0 +1,120 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""Capriqorn incremental postprocessing.
+
+When averaging over all frames (`n_avg: all`), the Average filter stores its
+running sums, the per-frame scalars, and the number of frames in the output
+frame at the location `average_state`.  Running the postprocessor with
+`--append` then continues from that state: The H5Reader only reads the frames
+beyond the ones processed before, the Average filter adds them to the stored
+sums, and the downstream filters (Solvent, DeltaH, PDDF) are evaluated once on
+the updated average.  The output file is replaced when the run has completed.
+
+Requirements: The pipeline starts with an H5Reader, contains an Average filter
+with `n_avg: all`, and ends with an H5Writer.  The input files are the ones of
+the previous run, optionally extended by additional frames or additional files
+appended to the list.
+"""
+from __future__ import print_function
+
+
+import os
+import six
+from . import hdf5
+
+
+loc_average_state = 'average_state'
+
+
+def get_parameters(pipeline_meta, label):
+    """Return the parameter dictionary of the first active pipeline element
+    with the given label, or None."""
+    for filter_meta in pipeline_meta:
+        for (key, parameters) in filter_meta.items():
+            if (key == label) and (parameters.get('active', True) != False):
+                return parameters
+    return None
+
+
+def _file_list(files):
+    if isinstance(files, six.string_types):
+        return [files]
+    else:
+        return list(files)
+
+
+def read_state(file_name):
+    """Return the last frame of the HDF5 file carrying an Average state, or None."""
+    reader = hdf5.H5Reader(file=file_name)
+    for idx_tuple in reversed(reader.frame_pool):
+        frm = reader.get_frame(idx_tuple)
+        if frm.contains_key(loc_average_state):
+            return frm
+    return None
+
+
+def setup_append(pipeline_meta):
+    """Modify a postprocessor pipeline specification in place to continue the
+    result stored in the output file of the H5Writer.
+
+    Returns
+    -------
+    bool
+        False in case there are no new frames to be processed.
+    """
+    reader_param = get_parameters(pipeline_meta, 'H5Reader')
+    average_param = get_parameters(pipeline_meta, 'Average')
+    writer_param = get_parameters(pipeline_meta, 'H5Writer')
+    if (reader_param is None) or (average_param is None) or (writer_param is None):
+        raise RuntimeError("appending requires an H5Reader, an Average filter, and an H5Writer")
+    if (average_param.get('n_avg') != 'all'):
+        raise RuntimeError("appending requires the Average filter to use n_avg: all")
+    if average_param.get('error_block_sizes') is not None:
+        raise RuntimeError("appending does not support the error estimates of the Average filter")
+    if reader_param.get('shuffle', False):
+        raise RuntimeError("appending does not support shuffled reading")
+    output_file = writer_param.get('file', 'default.hdf5')
+    if not os.path.isfile(output_file):
+        print(" No previous result found at <" + output_file + ">, processing all frames.")
+        return True
+    frm = read_state(output_file)
+    if frm is None:
+        raise RuntimeError("no running sums found in <" + output_file + ">, rerun without appending")
+    state = frm.get_data(loc_average_state)
+    # --- determine the frames read by the previous run(s)
+    previous = frm.query_meta('H5Reader')
+    step = reader_param.get('step', 1)
+    if (step is None):
+        step = 1
+    previous_step = previous.get('step', 1)
+    if (previous_step is None):
+        previous_step = 1
+    if (_file_list(previous['file']) != _file_list(reader_param['file'])[:len(_file_list(previous['file']))]) \
+       or (previous_step != step):
+        raise RuntimeError("the H5Reader input does not continue the one of the previous run")
+    previous_first = previous.get('first', 1)
+    if (previous_first is None):
+        previous_first = 1
+    first = previous_first + int(state['n_appended'][0]) * step
+    reader = hdf5.H5Reader(file=reader_param['file'], first=first,
+                           last=reader_param.get('last', None), step=step)
+    n_new = len(reader.frame_pool)
+    if (n_new == 0):
+        print(" No new frames found, the result in <" + output_file + "> is up to date.")
+        return False
+    print(" Appending " + str(n_new) + " frames to the " + str(int(state['n_frames'][0])) +
+          " frames averaged in <" + output_file + ">.")
+    reader_param['first'] = first
+    reader_param['number_offset'] = int(state['n_frames'][0])
+    average_param['append_state'] = state
+    writer_param['append'] = True
+    return True
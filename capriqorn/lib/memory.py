@@ -0,0 +1,205 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""Capriqorn pipeline memory accounting, enabled by `--memory`.
+
+The MemoryProfiler is attached to the pipeline elements of each process via
+profiling.instrument().  After each step of a pipeline element it records
+
+* the payload size, i.e. the size of the NumPy arrays of the container
+  passed on by the element,
+* the resident set size (RSS) of the process, and the growth of the RSS
+  during the step, excluding the upstream elements,
+* optionally (tracemalloc), the growth of the memory allocated by Python
+  and NumPy during the step, excluding the upstream elements.
+
+Each process writes its records and its peak RSS to the file
+`memory.<worker id>.json` in the directory `./pipeline_log/`.  When the
+pipeline has completed, the master process merges these files into
+`memory_summary.json` and prints a warning if the peak RSS of a process
+exceeds the memory budget.
+"""
+from __future__ import print_function
+
+
+import os
+import sys
+import glob
+import json
+from cadishi import base
+from cadishi import util
+from . import profiling
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+summary_file = 'memory_summary.json'
+# number of source lines reported by tracemalloc
+n_top_allocations = 10
+MB = 1024. * 1024.
+
+
+def get_rss():
+    """Return the current resident set size of the process in bytes, or None."""
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+def get_peak_rss():
+    """Return the peak resident set size of the process in bytes, or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    if (sys.platform != 'darwin'):
+        peak *= 1024
+    return peak
+
+
+class MemoryProfiler(object):
+    """Collects the memory usage of the pipeline elements of the present process."""
+
+    def __init__(self, worker_id='main', trace_malloc=False):
+        self.worker_id = worker_id
+        self.elements = []
+        self.trace_malloc = trace_malloc and (tracemalloc is not None)
+        if self.trace_malloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # rss and traced memory growth of the nested (upstream) generator steps
+        self._stack = []
+
+    def add_element(self, position, label):
+        """Register a pipeline element, return its record."""
+        record = {'worker': self.worker_id, 'position': position, 'label': label,
+                  'n_items': 0, 'payload_max': 0, 'payload_sum': 0,
+                  'rss_max': 0, 'rss_growth': 0, 'traced_growth': 0}
+        self.elements.append(record)
+        return record
+
+    def _traced(self):
+        if self.trace_malloc:
+            return tracemalloc.get_traced_memory()[0]
+        return 0
+
+    def enter(self):
+        self._stack.append([0, 0])
+        return (get_rss() or 0, self._traced())
+
+    def leave(self, record, start, obj=None):
+        """Account the step of a generator started at start (as returned by
+        enter()) which yielded obj."""
+        rss = get_rss() or 0
+        rss_growth = rss - start[0]
+        traced_growth = self._traced() - start[1]
+        child = self._stack.pop()
+        if (len(self._stack) > 0):
+            self._stack[-1][0] += rss_growth
+            self._stack[-1][1] += traced_growth
+        record['rss_growth'] += rss_growth - child[0]
+        record['traced_growth'] += traced_growth - child[1]
+        record['rss_max'] = max(record['rss_max'], rss)
+        if isinstance(obj, base.Container):
+            size = profiling.nbytes(obj)
+            record['n_items'] += 1
+            record['payload_max'] = max(record['payload_max'], size)
+            record['payload_sum'] += size
+
+    def write(self, directory=profiling.profile_directory):
+        """Write the records of the present process to the profile directory."""
+        util.md(directory)
+        top = []
+        if self.trace_malloc:
+            snapshot = tracemalloc.take_snapshot()
+            for stat in snapshot.statistics('lineno')[:n_top_allocations]:
+                frame = stat.traceback[0]
+                top.append({'line': frame.filename + ':' + str(frame.lineno),
+                            'size': stat.size, 'count': stat.count})
+        process = {'worker': self.worker_id, 'pid': os.getpid(),
+                   'peak_rss': get_peak_rss(), 'top_allocations': top}
+        filename = os.path.join(directory, 'memory.' + self.worker_id + '.json')
+        with open(filename, 'w') as fp:
+            json.dump({'process': process, 'elements': self.elements}, fp)
+
+
+def clear(directory=profiling.profile_directory):
+    """Remove the memory files of a previous run."""
+    for filename in glob.glob(os.path.join(directory, 'memory*.json')):
+        os.remove(filename)
+
+
+def merge(directory=profiling.profile_directory, budget=None):
+    """Merge the files written by the processes of a pipeline into the summary.
+
+    Parameters
+    ----------
+    budget : float
+        Optional memory budget per process in MB.
+
+    Returns
+    -------
+    dict
+        The summary.
+    """
+    processes = []
+    elements = []
+    for filename in sorted(glob.glob(os.path.join(directory, 'memory.*.json'))):
+        with open(filename) as fp:
+            memory = json.load(fp)
+        processes.append(memory['process'])
+        elements.extend(memory['elements'])
+    filters = {}
+    for record in elements:
+        total = filters.setdefault(record['label'], {'n_items': 0, 'payload_max': 0, 'payload_sum': 0,
+                                                     'rss_max': 0, 'rss_growth': 0, 'traced_growth': 0})
+        for key in ['n_items', 'payload_sum', 'rss_growth', 'traced_growth']:
+            total[key] += record[key]
+        for key in ['payload_max', 'rss_max']:
+            total[key] = max(total[key], record[key])
+    for total in filters.values():
+        total['payload_mean'] = total['payload_sum'] / float(max(total['n_items'], 1))
+    exceeded = []
+    if budget is not None:
+        exceeded = [process['worker'] for process in processes
+                    if (process['peak_rss'] is not None) and (process['peak_rss'] > budget * MB)]
+    summary = {'processes': processes, 'elements': elements, 'filters': filters,
+               'budget': budget, 'budget_exceeded': exceeded}
+    with open(os.path.join(directory, summary_file), 'w') as fp:
+        json.dump(summary, fp, indent=1, sort_keys=True)
+    return summary
+
+
+def print_summary(summary):
+    """Print the peak RSS per process and the payload and RSS growth per filter class."""
+    print(" Memory (peak RSS per process):")
+    for process in summary['processes']:
+        peak = process['peak_rss']
+        print("   {:32s} {:>10s} MB".format(process['worker'], '-' if peak is None else '{:.1f}'.format(peak / MB)))
+    print(" Memory (per filter, totals over all processes):")
+    print("   {:24s} {:>12s} {:>12s} {:>14s}".format('filter', 'payload [MB]', 'max RSS [MB]', 'RSS growth [MB]'))
+    filters = summary['filters']
+    for label in sorted(filters, key=lambda x: -filters[x]['rss_growth']):
+        total = filters[label]
+        print("   {:24s} {:12.1f} {:12.1f} {:14.1f}".format(
+            label, total['payload_max'] / MB, total['rss_max'] / MB, total['rss_growth'] / MB))
+    for worker in summary['budget_exceeded']:
+        print(" Warning: the peak RSS of `" + worker + "' exceeds the memory budget of " +
+              str(summary['budget']) + " MB.")
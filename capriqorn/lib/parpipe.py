@@ -35,6 +35,41 @@ this as follows e.g. using five processes:
          w        writer
 
 Status: OK, including order preservation, see also <pipeutil.py>.
+
+Sharded reading: When the reader directly precedes the first ParallelFork, the
+option `sharding: true` of the ParallelFork filter moves the reader into the
+workers of the parallel region.  Each worker then opens its own reader which
+delivers a disjoint subset (every n_workers-th frame) of the selected frames,
+i.e. process 0 and the queue transport between the reader and the workers are
+eliminated:
+
+    r    r    r   reader (shard 0,1,2)   process 0,1,2
+    o    o    o   parallel fork
+    f    f    f
+    f    f    f
+    o    o    o   parallel join
+------------------------------------------------------------
+         o        parallel join         process 3
+         f        filter
+         w        writer
+
+The readers need to implement the method `shard(shard_index, n_shards)`.
+
+Reductions: Instead of shipping every container to the master, a filter
+directly preceding ParallelJoin (e.g. the Average filter of the postprocessor)
+may reduce the frames on the worker and ship partial results, stored as an
+object at the location `base.loc_parallel + '/partial'` of an otherwise empty
+container.  The object needs to provide the attribute `key` (a consecutive
+integer starting at 0, e.g. the index of an averaging block) and the methods
+`merge(other)`, `complete()`, and `finalize()`.  ParallelJoin merges the
+partials of the same key received from the workers, and yields the container
+returned by `finalize()` in the order of the keys as soon as a partial is
+complete.  Incomplete partials are finalized when all workers are done.
+
+Supervision: With a supervisor (see <supervisor.py>), the filters report the
+frames in flight on the workers of the parallel region to the master, which
+restarts failed workers and re-queues their frames instead of shutting down
+the pipeline.
 """
 from __future__ import print_function
 
@@ -50,17 +85,21 @@ SIDE_UPSTREAM = 1
 SIDE_DOWNSTREAM = 2
 # max. elements before the queue.put() function blocks, see <pipeutil.py>
 QUEUE_MAXSIZE = 32
-# seconds before the queue.get() function raises QueueEmpty(), see <pipeutil.py>
-#QUEUE_TIMEOUT = 300.0
+# seconds without a heartbeat before a supervised worker is considered hung, see <supervisor.py>
+QUEUE_TIMEOUT = 300.0
 
 
 class ParallelFork(base.Filter):
     """Filter to indicate the start of a parallel region of a pipeline."""
     _depends = []
     _conflicts = []
+    # container locations, see <lib/prune.py>
+    _consumes = []
+    _produces = []
 
     def __init__(self, source=-1, verbose=False,
-                 queue=None, side=SIDE_UNDEFINED, n_workers=0, worker_id=''):
+                 queue=None, side=SIDE_UNDEFINED, n_workers=0, worker_id='',
+                 sharding=False, shard_index=0, supervisor=None):
         """
         Parameters
         ----------
@@ -73,6 +112,12 @@ class ParallelFork(base.Filter):
             Number of workers used for the parallel region.
         worker_id : string
             String to identify the present worker.
+        sharding : bool
+            Run a reader on each worker, reading a disjoint subset of the frames.
+        shard_index : int
+            Index of the shard read by the present worker, set by <pipeutil.py>.
+        supervisor : supervisor.Supervisor
+            Supervisor the frames taken from the queue are reported to, set by <pipeutil.py>.
         """
         self.src = source
         self.verb = verbose
@@ -80,6 +125,14 @@ class ParallelFork(base.Filter):
         self.side = side
         self.n_workers = n_workers
         self.worker_id = worker_id
+        self.sharding = sharding
+        self.shard_index = shard_index
+        self.supervisor = supervisor
+        if self.sharding and (self.side == SIDE_DOWNSTREAM):
+            if not hasattr(self.src, 'shard'):
+                raise RuntimeError("sharded reading is not supported by " +
+                                   self.src.__class__.__name__)
+            self.src.shard(self.shard_index, self.n_workers)
 
     def get_meta(self):
         """ Return information on the present filter, ready to be added to a
@@ -89,23 +142,52 @@ class ParallelFork(base.Filter):
         label = 'ParallelFork'
         param = {'side': self.side,
                  'n_workers': self.n_workers,
-                 'worker_id': self.worker_id}
+                 'worker_id': self.worker_id,
+                 'sharding': self.sharding}
         meta[label] = param
         return meta
 
-    def next(self):
+    def __next__(self):
         """Generator-style method which pulls objects from the queue and
         yields them. To be used downstream-wise."""
         if self.verb:
             print(self.__class__.__name__ + '.next() : ' + self.worker_id)
+        if self.sharding:
+            for obj in self._next_shard():
+                yield obj
+            return
+        retry = []
+        if self.supervisor is not None:
+            retry = list(self.supervisor.retry)
         while True:
-            obj = self.queue.get()
+            if (len(retry) > 0):
+                # objects of a failed worker, see <supervisor.py>
+                obj = retry.pop(0)
+            else:
+                obj = self.queue.get()
+            if self.supervisor is not None:
+                self.supervisor.take(obj)
             if isinstance(obj, base.Container):
                 obj.put_meta(self.get_meta())
             yield obj
             if obj is None:
                 break
 
+    def _next_shard(self):
+        """Generator yielding the frames of the local reader shard.
+
+        The container objects are numbered as if they had passed a single
+        upstream ParallelFork, such that ParallelJoin restores the ordering.
+        """
+        counter = self.shard_index
+        for obj in next(self.src):
+            if isinstance(obj, base.Container):
+                obj.put_data(base.loc_parallel + '/number', counter)
+                counter += self.n_workers
+                obj.put_meta(self.get_meta())
+            yield obj
+        yield None
+
     def dump(self):
         """Generator-style method which gets objects by calling the previous
         class'es next() function and puts the objects into the queue. To be used
@@ -117,7 +199,7 @@ class ParallelFork(base.Filter):
         counter = 0
         if self.verb:
             print(self.__class__.__name__ + '.dump() : ' + self.worker_id)
-        for obj in self.src.next():
+        for obj in next(self.src):
             # on the upstream side of ParallelFork, we count and mark each container object
             if isinstance(obj, base.Container):
                 obj.put_data(base.loc_parallel + '/number', counter)
@@ -133,9 +215,12 @@ class ParallelJoin(base.Filter):
     """Filter to indicate the stop of a parallel region of a pipeline."""
     _depends = []
     _conflicts = []
+    # container locations, see <lib/prune.py>
+    _consumes = []
+    _produces = []
 
     def __init__(self, source=-1, verbose=False,
-                 queue=None, side=SIDE_UNDEFINED, n_workers=0, worker_id=''):
+                 queue=None, side=SIDE_UNDEFINED, n_workers=0, worker_id='', supervisor=None):
         """
         Parameters
         ----------
@@ -147,6 +232,8 @@ class ParallelJoin(base.Filter):
         n_workers : int
         worker_id : string
             String to identify the present worker.
+        supervisor : supervisor.Supervisor
+            Supervisor of the workers of the parallel region, set by <pipeutil.py>.
         """
         self.src = source
         self.verb = verbose
@@ -154,6 +241,7 @@ class ParallelJoin(base.Filter):
         self.side = side
         self.n_workers = n_workers
         self.worker_id = worker_id
+        self.supervisor = supervisor
 
     def get_meta(self):
         """ Return information on the present filter, ready to be added to a
@@ -167,26 +255,49 @@ class ParallelJoin(base.Filter):
         meta[label] = param
         return meta
 
-    def next(self):
+    def __next__(self):
         """Generator-style method which pulls objects from the queue and
         yields them. To be used downstream-wise.
 
         Preserves the initial ordering of the container objects thanks to the
-        numbering added by the ParallelFork filter.
+        numbering added by the ParallelFork filter.  With a supervisor, failed
+        workers are recovered, duplicates of re-queued frames are dropped, and
+        the frames put into quarantine are skipped.
         """
         if self.verb:
             print(self.__class__.__name__ + '.next() : ' + self.worker_id)
         buf = {}
+        partials = {}
         finished = False
         none_counter = 0
         yield_counter = 0
+        partial_counter = 0
         valid_counter = 0
+        skipped = {}
+        reduction = False
         while True:
+            if self.supervisor is not None:
+                for number in self.supervisor.check():
+                    skipped[number] = True
             if not finished:
                 try:
                     obj = self.queue.get(False, 0.5)
-                    if isinstance(obj, base.Container):
+                    if isinstance(obj, base.Container) and obj.contains_key(base.loc_parallel + '/partial'):
+                        reduction = True
+                        partial = obj.get_data(base.loc_parallel + '/partial')
+                        if partial.key in partials:
+                            partials[partial.key].merge(partial)
+                        else:
+                            partials[partial.key] = partial
+                        if self.verb:
+                            print("  merged: " + str(partial.key))
+                    elif isinstance(obj, base.Container):
                         number = obj.get_data(base.loc_parallel + '/number')
+                        if self.supervisor is not None:
+                            # drop late duplicates of re-queued frames and frames in quarantine
+                            if (not self.supervisor.complete(number)) or (number < yield_counter) or \
+                               (number in buf):
+                                continue
                         obj.del_data(base.loc_parallel)
                         obj.put_meta(self.get_meta())
                         buf[number] = obj
@@ -197,6 +308,8 @@ class ParallelJoin(base.Filter):
                         none_counter += 1
                 except Exception as e:
                     pass
+                if reduction and (self.supervisor is not None):
+                    raise RuntimeError("ParallelJoin: reductions are not supported in supervised mode")
             else:
                 break
             # yield all pending objects
@@ -207,8 +320,14 @@ class ParallelJoin(base.Filter):
                     if self.verb:
                         print("  yield'd: " + str(yield_counter))
                     yield_counter += 1
+                elif yield_counter in skipped:
+                    yield_counter += 1
                 else:
                     break
+            # yield all completed partials
+            while (partial_counter in partials) and partials[partial_counter].complete():
+                yield self.finalize_partial(partials.pop(partial_counter))
+                partial_counter += 1
             if (none_counter == self.n_workers):
                 finished = True
         # The following remainder branch should never be entered:
@@ -217,17 +336,35 @@ class ParallelJoin(base.Filter):
                 yield buf[key]
                 if self.verb:
                     print("  yield'r: " + str(key))
+        # finalize the incomplete partials, e.g. a remainder block
+        for key in sorted(partials.keys()):
+            yield self.finalize_partial(partials[key])
         yield None
 
+    def finalize_partial(self, partial):
+        """Return the container holding the final result of a merged partial."""
+        obj = partial.finalize()
+        obj.put_meta(self.get_meta())
+        if self.verb:
+            print("  yield'd: partial " + str(partial.key))
+        return obj
+
     def dump(self):
         """Generator-style method which gets objects by calling the previous
         class'es next() function and puts the objects into the queue. To be used
         upstream-wise."""
         if self.verb:
             print(self.__class__.__name__ + '.dump() : ' + self.worker_id)
-        for obj in self.src.next():
+        for obj in next(self.src):
             if isinstance(obj, base.Container):
                 obj.put_meta(self.get_meta())
-            self.queue.put(obj)
+            if self.supervisor is None:
+                self.queue.put(obj)
+            else:
+                self.supervisor.put(self.queue, obj)
+                if obj is None:
+                    self.supervisor.finish()
+                else:
+                    self.supervisor.beat()
         # for i in range(self.n_workers):
         #     self.queue.put(None)
@@ -19,6 +19,7 @@ import sys
 import math
 import numpy as np
 from . import rdf
+from . import rebin
 from . import formFactor as ff
 import cadishi.util
 # --- use fast Cython functions for time critical parts, if available
@@ -52,20 +53,18 @@ def binning(data, n, dr, distQ=False):
     """
     tmp = data[0, :].copy()
     data[0, :] = 0
-    new = np.zeros((old_div(len(data), n) + 1, len(data[0])))
+    n_new = old_div(len(data), n)
+    new = np.zeros((n_new + 1, len(data[0])))
     if distQ:
         fac = 1. / float(n)
         iadd = 1
     else:
         fac = 1.
         iadd = 0
-    for i in range(old_div(len(data), n)):
-        total = np.zeros(len(data[0]))
-        for j in range(n):
-            total[:] += data[i * n + j + iadd, :]
-        # average/=float(n) #DANGER
-        new[i + 1, 1:] = total[1:] * fac
-        new[i + 1, 0] = total[0] / float(n)
+    total = rebin.coarsen(data[iadd:iadd + n_new * n, :], n, remainder=False)
+    # average/=float(n) #DANGER
+    new[1:, 1:] = total[:, 1:] * fac
+    new[1:, 0] = total[:, 0] / float(n)
     new[0, :] = tmp[:]
     new[0, 0] = 0
     return new, dr * n
@@ -78,43 +77,19 @@ def coarsen_histogram(data, n, dr, distQ=False):
     data_new = {}
     if distQ:
         fac = 1. / float(n)
-        iadd = 1
     else:
         fac = 1.
-        iadd = 0
-    # --- coarsen data
-    radii = data['radii']
-    radii_new = []  # Python list, to be converted to NumPy below
-    count = 0
-    r_avg = 0.0
-    for rad in radii:
-        count += 1
-        r_avg += rad
-        if (count % n == 0):
-            radii_new.append(r_avg / float(n))
-            r_avg = 0.0
-    if (count % n > 0):
-        # remainder
-        radii_new.append(r_avg / float(count % n))
-    data_new['radii'] = np.array(radii_new)
-    # --- coarsen data
-    for key in data:
-        if (key == 'radii'):
-            continue
-        histo_new = []  # Python list, to be converted to NumPy below
-        count = 0
-        bin_new = 0
-        for bin_old in data[key]:
-            count += 1
-            bin_new += bin_old
-            if (count % n == 0):
-                histo_new.append(fac * bin_new)
-                bin_new = 0
-        if (count % n > 0):
-            histo_new.append(fac * bin_new)
-        data_new[key] = np.array(histo_new)
-        # --- first line special entry
-        (data_new[key])[0] = (data[key])[0]
+    # --- coarsen radii
+    data_new['radii'] = rebin.coarsen_mean(data['radii'], n)
+    # --- coarsen data, all species pairs at once
+    keys = [key for key in data if (key != 'radii')]
+    if (len(keys) > 0):
+        table = rebin.coarsen(np.column_stack([data[key] for key in keys]), n)
+        table *= fac
+        for j, key in enumerate(keys):
+            data_new[key] = table[:, j].copy()
+            # --- first line special entry
+            (data_new[key])[0] = (data[key])[0]
     # ---  first line special entry
     (data_new['radii'])[0] = 0.0
     return data_new, dr * n
@@ -19,12 +19,260 @@ import sys
 import time
 import signal
 import copy
+import json
+import inspect
+import traceback
 import multiprocessing as mp
 import numpy as np
 from cadishi import base
 from cadishi import util
 from cadishi import dict_util
 from . import parpipe
+from . import profiling
+from . import memory as memory_lib
+from . import progress as progress_lib
+from . import cache as cache_lib
+from . import supervisor as supervisor_lib
+
+
+# Pipeline-level settings and their default values.  The settings are given by
+# an optional `Pipeline` entry of the pipeline specification, e.g.
+#   - Pipeline:
+#       precision: single
+# and are passed to all pipeline elements accepting a parameter of the same name,
+# unless the parameter is set explicitly for the element.  The setting
+# `optimize` enables the planning pass, see plan_pipeline(), the setting
+# `share_state` the pre-fork initialization, see share_state().
+PIPELINE_SETTINGS = {'precision': 'double', 'optimize': True, 'share_state': True}
+
+
+def get_pipeline_settings(pipeline_meta):
+    """Separate the pipeline-level settings from a pipeline specification.
+
+    Parameters
+    ----------
+    pipeline_meta : list
+        List with pipeline element specifications, optionally including `Pipeline` entries.
+
+    Raises
+    ------
+    ValueError
+
+    Returns
+    -------
+    Tuple with (the list of pipeline element specifications without the
+    `Pipeline` entries, the dictionary of pipeline-level settings).
+    """
+    settings = copy.deepcopy(PIPELINE_SETTINGS)
+    element_meta = []
+    for filter_meta in pipeline_meta:
+        assert (len(filter_meta) == 1)
+        if 'Pipeline' in filter_meta:
+            parameters = filter_meta['Pipeline']
+            if parameters is None:
+                parameters = {}
+            for key in parameters:
+                if key not in PIPELINE_SETTINGS:
+                    raise ValueError("unknown pipeline setting `" + str(key) + "'")
+            settings.update(parameters)
+        else:
+            element_meta.append(filter_meta)
+    return (element_meta, settings)
+
+
+def _accepts_parameter(pipeline_class, name):
+    """Check if the constructor of a pipeline class accepts the parameter `name`."""
+    try:
+        args = inspect.getfullargspec(pipeline_class.__init__).args
+    except AttributeError:
+        args = inspect.getargspec(pipeline_class.__init__).args
+    return (name in args)
+
+
+def apply_pipeline_settings(pipeline_meta, pipeline_module, settings):
+    """Pass the pipeline-level settings to the elements of a pipeline
+    specification, modifying it in place.  Parameters set explicitly for an
+    element take precedence.
+
+    Parameters
+    ----------
+    pipeline_meta : list
+        List with pipeline element specifications.
+    pipeline_module : string
+        Python module from which to load the pipeline elements (classes) from.
+    settings : dict
+        Pipeline-level settings, as returned by get_pipeline_settings().
+    """
+    for filter_meta in pipeline_meta:
+        for (label, parameters) in filter_meta.items():
+            if parameters.get('active', True) == False:
+                continue
+            pipeline_class = util.load_class(pipeline_module, label)
+            for (key, value) in settings.items():
+                if (key not in parameters) and _accepts_parameter(pipeline_class, key):
+                    parameters[key] = value
+
+
+def _get_label(filter_meta):
+    """Return the label and the parameters of a pipeline element specification."""
+    assert (len(filter_meta) == 1)
+    for (label, parameters) in filter_meta.items():
+        if parameters is None:
+            parameters = {}
+        return (label, parameters)
+
+
+def _get_class_flag(pipeline_module, label, flag):
+    """Return a planning flag (class attribute) of a pipeline class, False if unset."""
+    return getattr(util.load_class(pipeline_module, label), flag, False)
+
+
+def _get_locations(pipeline_module, label, parameters, attribute):
+    """Return the set of top-level container locations declared by the class
+    attribute `_consumes` or `_produces` of a pipeline class, or None if
+    unknown.  Writers accepting a parameter `fields` consume only these."""
+    pipeline_class = util.load_class(pipeline_module, label)
+    if (attribute == '_consumes') and (parameters.get('fields', None) is not None) and \
+            _accepts_parameter(pipeline_class, 'fields'):
+        return set(parameters['fields'])
+    locations = getattr(pipeline_class, attribute, None)
+    if locations is None:
+        return None
+    return set(locations)
+
+
+def prune_pipeline(plan, pipeline_module):
+    """Insert Prune filters into a pipeline specification, such that container
+    locations are dropped as soon as they are not consumed downstream, see
+    <prune.py>.
+
+    Returns
+    -------
+    Tuple with (the list of pipeline element specifications, the list of
+    messages describing the Prune filters inserted).
+    """
+    n = len(plan)
+    labels = [_get_label(x) for x in plan]
+    # backward pass: locations live after each element, None meaning all
+    live_out = [None] * n
+    live = set()
+    for k in range(n - 1, -1, -1):
+        live_out[k] = live
+        consumes = _get_locations(pipeline_module, labels[k][0], labels[k][1], '_consumes')
+        if (consumes is None) or (live is None):
+            live = None
+        else:
+            live = live | consumes
+    # forward pass: insert Prune filters where dead locations may be present
+    pruned = []
+    notes = []
+    present = None
+    for k in range(n):
+        pruned.append(plan[k])
+        (label, parameters) = labels[k]
+        if (present is not None):
+            produces = _get_locations(pipeline_module, label, parameters, '_produces')
+            present = None if (produces is None) else (present | produces)
+        if (k == n - 1) or (live_out[k] is None):
+            continue
+        if (present is not None) and present.issubset(live_out[k]):
+            continue
+        (next_label, next_parameters) = labels[k + 1]
+        if (next_label == 'ParallelFork') and next_parameters.get('sharding', False):
+            # the reader has to precede a sharded ParallelFork directly
+            continue
+        if (label == 'Average') and (next_label == 'ParallelJoin'):
+            # Average has to precede ParallelJoin directly, see get_parallel_configuration()
+            continue
+        keep = sorted(live_out[k])
+        pruned.append({'Prune': {'keep': keep}})
+        notes.append("pruning after " + label + ", keeping " + str(keep))
+        present = set(keep)
+    return (pruned, notes)
+
+
+def plan_pipeline(pipeline_meta, pipeline_module):
+    """Optimize a pipeline specification before instantiation.
+
+    The planning is driven by class attributes of the pipeline elements:
+
+    * `_stride`: the filter keeps every n-th frame, given by its parameter
+      `step` (i.e. Step).  Filters with a stride of one are dropped.
+    * `_pure`: the filter processes each frame independently of the other
+      frames, passes on every frame, and has no side effects.  Stride filters
+      are moved upstream of pure filters such that the dropped frames are not
+      processed, ParallelFork and ParallelJoin are never crossed.
+    * `_fold_stride`: the reader numbers the frames relative to the original
+      dataset and selects the frames via its parameters `first`, `last`, and
+      `step`.  A stride filter directly following such a reader is folded into
+      its `step` parameter, such that the dropped frames are not even read.
+
+    Inactive elements are removed.  Finally, Prune filters are inserted which
+    drop the container locations not consumed downstream, see prune_pipeline().
+
+    Parameters
+    ----------
+    pipeline_meta : list
+        List with pipeline element specifications, without `Pipeline` entries.
+    pipeline_module : string
+        Python module from which to load the pipeline elements (classes) from.
+
+    Returns
+    -------
+    Tuple with (the optimized list of pipeline element specifications, the
+    list of messages describing the optimizations applied).
+    """
+    plan = []
+    notes = []
+    for filter_meta in pipeline_meta:
+        (label, parameters) = _get_label(filter_meta)
+        if (parameters.get('active', True) == False):
+            if (label != 'ParallelJoin'):
+                notes.append("removed inactive " + label)
+                continue
+        elif _get_class_flag(pipeline_module, label, '_stride') and (parameters.get('step', 1) == 1):
+            notes.append("removed " + label + " with step 1")
+            continue
+        plan.append(copy.deepcopy({label: parameters}))
+    # move stride filters upstream of pure filters
+    for i in range(len(plan)):
+        (label, parameters) = _get_label(plan[i])
+        if not _get_class_flag(pipeline_module, label, '_stride'):
+            continue
+        j = i
+        while (j > 0) and _get_class_flag(pipeline_module, _get_label(plan[j - 1])[0], '_pure'):
+            j -= 1
+        if (j < i):
+            notes.append("moved " + label + " ahead of " +
+                         ", ".join([_get_label(x)[0] for x in plan[j:i]]))
+            plan.insert(j, plan.pop(i))
+    # fold stride filters into the reader
+    while (len(plan) > 1):
+        (reader_label, reader_parameters) = _get_label(plan[0])
+        (label, parameters) = _get_label(plan[1])
+        if not (_get_class_flag(pipeline_module, reader_label, '_fold_stride') and
+                _get_class_flag(pipeline_module, label, '_stride')):
+            break
+        step = reader_parameters.get('step', 1)
+        if step is None:
+            step = 1
+        reader_parameters['step'] = step * parameters.get('step', 1)
+        notes.append("folded " + label + " into " + reader_label + ", step " + str(reader_parameters['step']))
+        del plan[1]
+    (plan, prune_notes) = prune_pipeline(plan, pipeline_module)
+    notes.extend(prune_notes)
+    return (plan, notes)
+
+
+def print_plan(plan, notes):
+    """Print the optimizations applied by plan_pipeline() and the resulting plan."""
+    print(util.SEP)
+    print(" Pipeline plan:")
+    for note in notes:
+        print("   - " + note)
+    if (len(notes) == 0):
+        print("   - no optimizations applicable")
+    print("   " + " -> ".join([_get_label(x)[0] for x in plan]))
 
 
 def instantiate_pipeline(pipeline_meta, pipeline_module, worker_id=None):
@@ -143,6 +391,9 @@ def get_parallel_configuration(pipeline_meta):
         ParallelFork filter
     followed by a closing
         ParallelJoin filter.
+    An Average filter inside a parallel region ships partial sums to the
+    ParallelJoin filter and therefore has to directly precede it, the error
+    estimates of the Average filter are not supported in that case.
 
     Parameters
     ----------
@@ -162,6 +413,8 @@ def get_parallel_configuration(pipeline_meta):
     n_workers = 0
     n_workers_per_segment = []
     n_workers_per_segment.append(1)
+    n_upstream = 0
+    previous = ""
     for filter_meta in pipeline_meta:
         assert (len(filter_meta) == 1)
         label = ""
@@ -175,6 +428,11 @@ def get_parallel_configuration(pipeline_meta):
             if (parameters['active'] == False):
                 continue
             del parameters['active']
+        if (previous == 'Average') and (n_fork > n_join) and (label != 'ParallelJoin'):
+            raise RuntimeError("the Average filter has to directly precede ParallelJoin in a parallel region")
+        if (label == 'Average') and (n_fork > n_join) and parameters.get('error_block_sizes'):
+            raise RuntimeError("the error estimates (error_block_sizes) of the Average filter are not supported in a parallel region")
+        previous = label
         if (label == 'ParallelFork'):
             n_fork += 1
             n_workers = parameters['n_workers']
@@ -182,13 +440,18 @@ def get_parallel_configuration(pipeline_meta):
             if (n_workers <= 0):
                 n_workers = 1
                 parameters['n_workers'] = n_workers
+            if parameters.get('sharding', False):
+                if (n_fork > 1) or (n_upstream != 1):
+                    raise RuntimeError("sharded reading requires the reader to directly precede the first ParallelFork")
+                # the reader runs on the workers of the parallel region
+                n_workers_per_segment.pop(0)
             n_workers_per_segment.append(n_workers)
         elif (label == 'ParallelJoin'):
             n_join += 1
             n_workers_per_segment.append(1)
             n_workers = 0  # reset n_workers flag
-        else:
-            pass
+        elif (n_fork == 0):
+            n_upstream += 1
         if (n_fork - n_join > 1):
             raise RuntimeError("nesting of pipeline parallelism is not allowed")
     if (n_fork != n_join):
@@ -196,7 +459,8 @@ def get_parallel_configuration(pipeline_meta):
     return (n_fork, n_workers_per_segment)
 
 
-def pipeline_segment_worker(pipeline_segment, pipeline_module, worker_id):
+def pipeline_segment_worker(pipeline_segment, pipeline_module, worker_id, profile=False, memory=None,
+                            progress=None, supervisor=None, worker_index=0, attempt=0):
     """Function launched in multiprocessing child processes ("workers") in order
     to run a pipeline segment.
 
@@ -208,21 +472,48 @@ def pipeline_segment_worker(pipeline_segment, pipeline_module, worker_id):
         Python module from which to load the pipeline elements (classes) from.
     worker_id : string
         Optional string identifying a parallel worker.  For debug/log purposes.
+    profile : bool
+        Record the timings of the pipeline elements, see <profiling.py>.
+    memory : dict
+        Options of the memory accounting, see run_pipeline().
+    progress : progress.Progress
+        Shared frame counters of the live progress reporting, see <progress.py>.
+    supervisor : supervisor.Supervisor
+        Supervisor of the parallel region the worker belongs to, see <supervisor.py>.
+    worker_index : int
+        Index of the worker within the parallel region.
+    attempt : int
+        Number of the restart of a supervised worker, 0 for the initial start.
 
     Returns
     -------
     Nothing, quits process with exit status "0" on success.
     """
-    output_file = "./pipeline_log/" + pipeline_module + '_' + worker_id + '.log'
+    output_file = "./pipeline_log/" + pipeline_module + '_' + worker_id
+    if (attempt > 0):
+        output_file += '_restart_' + str(attempt)
+    output_file += '.log'
     util.md(output_file)
     util.redirectOutput(output_file)
+    if supervisor is not None:
+        supervisor.slot = worker_index
     pipeline = instantiate_pipeline(pipeline_segment, pipeline_module, worker_id)
     check_filter_dependencies(pipeline, pipeline_module)
     check_filter_conflicts(pipeline, pipeline_module)
+    profilers = instrument_pipeline(pipeline, worker_id, profile, memory, progress)
     try:
         pipeline[-1].dump()
+        for profiler in profilers:
+            profiler.write()
     except:
         print(" Exception detected in `" + worker_id + "'.")
+        if supervisor is not None:
+            # the master recovers the worker, see <supervisor.py>
+            traceback.print_exc()
+            print(" Exiting, the frames in flight are re-queued by the master.")
+            print(util.SEP)
+            sys.stdout.flush()
+            sys.exit(1)
         print(" Sending shutdown signal to master process. Goodbye.")
         print(util.SEP)
         os.kill(os.getppid(), signal.SIGUSR1)
@@ -283,6 +574,13 @@ def get_pipeline_meta_segments(pipeline_meta):
                 # we use the zero value as a flag to indicate a disabled configuration
                 n_workers = 0
                 continue
+        if (label == 'ParallelFork') and parameters.get('sharding', False):
+            # sharded reading: the reader and the downstream side of the fork
+            # share a segment, no queue is necessary
+            segment.append(copy.deepcopy(filter_meta))
+            segment[-1][label]['queue'] = None
+            segment[-1][label]['side'] = parpipe.SIDE_DOWNSTREAM
+            continue
         segment.append(copy.deepcopy(filter_meta))
         if (label == 'ParallelJoin'):
             # the downstream side of join needs to know the number of workers
@@ -301,6 +599,104 @@ def get_pipeline_meta_segments(pipeline_meta):
     return meta_segments
 
 
+def get_shard_segment(segment, shard_index):
+    """Return a copy of a pipeline segment specification with the shard index
+    set for a sharded ParallelFork filter, if any.
+
+    Parameters
+    ----------
+    segment : list
+        Pipeline segment specification, as returned by get_pipeline_meta_segments().
+    shard_index : int
+        Index of the worker within the parallel region.
+
+    Returns
+    -------
+    list
+        Pipeline segment specification.
+    """
+    shard_segment = []
+    for filter_meta in segment:
+        if ('ParallelFork' in filter_meta) and filter_meta['ParallelFork'].get('sharding', False):
+            parameters = dict(filter_meta['ParallelFork'])
+            parameters['shard_index'] = shard_index
+            filter_meta = {'ParallelFork': parameters}
+        shard_segment.append(filter_meta)
+    return shard_segment
+
+
+def share_state(meta_segments, pipeline_module):
+    """Build the shareable state of the pipeline elements running on child
+    processes once in the master process, before the workers are forked.
+
+    Pipeline classes declare state which does not change during the run
+    (e.g. parsed reference structures, form factor tables) by a class method
+    get_shared_state(**parameters), and accept it by the constructor parameter
+    `shared_state`.  The state is added to the element specifications, such
+    that the workers inherit it copy-on-write instead of each worker reading
+    the same files at startup.
+
+    Parameters
+    ----------
+    meta_segments : list
+        Pipeline segment specifications run on child processes, modified in place.
+    pipeline_module : string
+        Python module from which to load the pipeline elements (classes) from.
+
+    Returns
+    -------
+    int
+        Number of distinct states built.
+    """
+    states = {}
+    for segment in meta_segments:
+        for filter_meta in segment:
+            (label, parameters) = _get_label(filter_meta)
+            pipeline_class = util.load_class(pipeline_module, label)
+            if not hasattr(pipeline_class, 'get_shared_state') or ('shared_state' in parameters) or \
+               not _accepts_parameter(pipeline_class, 'shared_state'):
+                continue
+            key = label + json.dumps(parameters, sort_keys=True, default=str)
+            if key not in states:
+                states[key] = pipeline_class.get_shared_state(**parameters)
+            parameters['shared_state'] = states[key]
+            filter_meta[label] = parameters
+    return len(states)
+
+
+def get_supervisor(meta_segments, n_parallel, supervise):
+    """Return the supervisor of the parallel region of a segmented pipeline
+    specification, see <supervisor.py>.
+
+    Raises
+    ------
+    RuntimeError
+        In case the pipeline has more than one parallel region or uses sharded reading.
+    """
+    if (n_parallel != 1) or (len(meta_segments) != 3):
+        raise RuntimeError("supervision requires a single parallel region without sharded reading")
+    parameters = meta_segments[1][0]['ParallelFork']
+    return supervisor_lib.Supervisor(parameters['n_workers'],
+                                     max_retries=supervise.get('retries', 2),
+                                     timeout=supervise.get('timeout', parpipe.QUEUE_TIMEOUT))
+
+
+def get_supervised_segment(segment, supervisor):
+    """Return a copy of a pipeline segment specification with the supervisor
+    set for the ParallelFork filters on the downstream side and for the
+    ParallelJoin filters."""
+    supervised_segment = []
+    for filter_meta in segment:
+        for (label, parameters) in filter_meta.items():
+            if ((label == 'ParallelFork') and (parameters['side'] == parpipe.SIDE_DOWNSTREAM)) or \
+               (label == 'ParallelJoin'):
+                parameters = dict(parameters)
+                parameters['supervisor'] = supervisor
+                filter_meta = {label: parameters}
+        supervised_segment.append(filter_meta)
+    return supervised_segment
+
+
 # List containing the multiprocessing workers.
 mp_pool = []
 # flag to avoid the signal handler act multiple times
@@ -325,7 +721,47 @@ def pipeline_master_unexpectedShutdownHandler(signum, frame):
         os.kill(os.getpid(), signal.SIGTERM)
         os.kill(os.getpid(), signal.SIGKILL)
 
-def run_pipeline(pipeline_meta, pipeline_module):
+def instrument_pipeline(pipeline, worker_id, profile=False, memory=None, progress=None):
+    """Attach the requested profilers to an instantiated pipeline (segment),
+    return the list of the profilers."""
+    profilers = []
+    if progress is not None:
+        profilers.append(progress.instrument(pipeline, worker_id))
+    if profile:
+        profilers.append(profiling.instrument(pipeline, worker_id))
+    if memory is not None:
+        profiler = memory_lib.MemoryProfiler(worker_id, memory.get('tracemalloc', False))
+        profilers.append(profiling.instrument(pipeline, worker_id, profiler))
+    return profilers
+
+
+def report_instrumentation(profile=False, memory=None):
+    """Merge and print the records written by the profilers of all processes."""
+    if profile:
+        print()
+        profiling.print_summary(profiling.merge())
+        print(" Profile written to <" + os.path.join(profiling.profile_directory, profiling.trace_file) + ">.")
+    if memory is not None:
+        print()
+        memory_lib.print_summary(memory_lib.merge(budget=memory.get('budget', None)))
+        print(" Memory summary written to <" + os.path.join(profiling.profile_directory,
+                                                            memory_lib.summary_file) + ">.")
+
+
+def get_queue_handles(meta_segments):
+    """Return the multiprocessing queues of a segmented pipeline specification."""
+    queues = []
+    for segment in meta_segments:
+        for filter_meta in segment:
+            for parameters in filter_meta.values():
+                queue = parameters.get('queue', None)
+                if (queue is not None) and all([queue is not q for q in queues]):
+                    queues.append(queue)
+    return queues
+
+
+def run_pipeline(pipeline_meta, pipeline_module, profile=False, memory=None, progress=None, cache=None,
+                 supervise=None):
     """Run pipeline by dividing the pipeline into segments, setting up the
     actual pipeline segments and running them on multiprocessing workers.
 
@@ -335,33 +771,116 @@ def run_pipeline(pipeline_meta, pipeline_module):
         List with pipeline element specifications.
     pipeline_module : string
         Python module from which to load the pipeline elements (classes) from.
+    profile : bool
+        Record the timings of the pipeline elements of all processes and write
+        a summary and a trace file to './pipeline_log/', see <profiling.py>.
+    memory : dict
+        Record the memory usage of the pipeline elements and the peak RSS of
+        all processes, and write a summary to './pipeline_log/', see
+        <memory.py>.  Options: 'budget' (peak RSS per process in MB above
+        which a warning is issued), 'tracemalloc' (bool).  None disables the
+        memory accounting.
+    progress : dict
+        Report the number of frames read and joined, the throughput, the
+        queue depths and the estimated remaining time periodically to
+        './pipeline_log/status.json', see <progress.py>.  Options: 'interval'
+        (seconds between updates), 'show' (bool, print a single updating
+        status line).  None disables the progress reporting.
+    cache : dict
+        Serve the unchanged leading stages of a sequential pipeline from the
+        stage cache and store the output of the other stages, see <cache.py>.
+        Options: 'directory', 'size' (size limit in MB).  None disables the
+        stage cache.
+    supervise : dict
+        Restart failed and hung workers of the parallel region and re-queue
+        their frames instead of shutting down the pipeline, see
+        <supervisor.py>.  Options: 'retries' (number of times a frame is
+        re-queued before it is put into quarantine), 'timeout' (seconds
+        without a heartbeat after which a worker is considered hung).  None
+        disables the supervision.
 
     Returns
     -------
     Nothing on success.
     """
+    (pipeline_meta, settings) = get_pipeline_settings(pipeline_meta)
+    apply_pipeline_settings(pipeline_meta, pipeline_module, settings)
+    if settings['optimize']:
+        (pipeline_meta, notes) = plan_pipeline(pipeline_meta, pipeline_module)
+        print_plan(pipeline_meta, notes)
     (n_parallel, n_workers_per_segment) = get_parallel_configuration(pipeline_meta)
     # print(" DBG: parallel configuration:" + str((n_parallel, n_workers_per_segment)))
+    if profile:
+        profiling.clear()
+    if memory is not None:
+        memory_lib.clear()
     if (n_parallel <= 0):
+        if supervise is not None:
+            print(" Note: Supervision is only available for parallel pipelines.")
         # sanitize the pipeline meta information
         meta_segments = get_pipeline_meta_segments(pipeline_meta)
         pipeline = instantiate_pipeline(meta_segments[0], pipeline_module)
         # print(" DBG: pipeline:" + str(pipeline))
         check_filter_dependencies(pipeline, pipeline_module)
         check_filter_conflicts(pipeline, pipeline_module)
+        if cache is not None:
+            (pipeline, n_cached) = cache_lib.apply(pipeline, cache['directory'], cache.get('size', 1024.))
+            if (n_cached > 0):
+                print(" Stage cache: serving the first " + str(n_cached) + " pipeline elements from <" +
+                      cache['directory'] + ">.")
+        monitor = None
+        if progress is not None:
+            monitor = progress_lib.Progress(['main'], interval=progress.get('interval', 5.0),
+                                            show=progress.get('show', False))
+        profilers = instrument_pipeline(pipeline, 'main', profile, memory, monitor)
         print(" Running sequential pipeline ...", end='')
         sys.stdout.flush()
-        pipeline[-1].dump()
+        if monitor is not None:
+            print()
+            monitor.start()
+        try:
+            pipeline[-1].dump()
+        except:
+            if monitor is not None:
+                monitor.stop('failed')
+            raise
     else:
         # counting: reader, writer, parallel workers, workers between parallel regions
         n_workers = sum(n_workers_per_segment)
         print(" Running parallel pipeline with " + str(n_workers) + " worker processes in total ...")
+        if cache is not None:
+            print(" Note: The stage cache is not available for parallel pipelines.")
+            cache = None
+        # reset the worker list, in case a pipeline has been run before
+        del mp_pool[:]
         # split pipeline description into per-process parts, obtain queue handles
         meta_segments = get_pipeline_meta_segments(pipeline_meta)
+        supervisor = None
+        if supervise is not None:
+            supervisor = get_supervisor(meta_segments, n_parallel, supervise)
+            meta_segments = meta_segments[:1] + [get_supervised_segment(segment, supervisor)
+                                                 for segment in meta_segments[1:]]
+        if settings['share_state']:
+            # only the segments replicated on several workers benefit
+            n_shared = share_state([segment for (i, segment) in enumerate(meta_segments[:-1])
+                                    if (n_workers_per_segment[i] > 1)], pipeline_module)
+            if (n_shared > 0):
+                print(" Built the shared state of " + str(n_shared) +
+                      " pipeline element(s) before starting the workers.")
         # print(" DBG: meta_segments:" + str(meta_segments))
         # launch child processes to work on the segmented pipeline
         enumerated_segments = [pair for pair in enumerate(meta_segments)]
         last, segment = enumerated_segments[-1]
+        monitor = None
+        if progress is not None:
+            worker_ids = []
+            for i, segment in enumerated_segments[:-1]:
+                worker_ids.extend(['segment_' + str(i) + '_worker_' + str(j) for j in range(n_workers_per_segment[i])])
+            worker_ids.append('segment_' + str(last) + '_worker_main')
+            monitor = progress_lib.Progress(worker_ids, get_queue_handles(meta_segments),
+                                            interval=progress.get('interval', 5.0),
+                                            show=progress.get('show', False))
+        region_workers = []
         for i, segment in enumerated_segments:
             if (i == last):
                 # run the last pipeline segment on the present process
@@ -371,11 +890,28 @@ def run_pipeline(pipeline_meta, pipeline_module):
                 # run any previous pipeline egments on child processes
                 for j in range(n_workers_per_segment[i]):
                     worker_id = 'segment_' + str(i) + '_worker_' + str(j)
+                    region_supervisor = supervisor if (i == 1) else None
                     mp_worker = mp.Process(target=pipeline_segment_worker,
-                                           args=(segment, pipeline_module, worker_id))
+                                           args=(get_shard_segment(segment, j), pipeline_module, worker_id,
+                                                 profile, memory, monitor, region_supervisor, j))
                     mp_pool.append(mp_worker)
+                    if (i == 1):
+                        region_workers.append(mp_worker)
+        profilers = instrument_pipeline(pipeline, worker_id, profile, memory, monitor)
+        if supervisor is not None:
+            def spawn(slot, attempt):
+                """Start a new worker of the parallel region in place of a failed one."""
+                mp_worker = mp.Process(target=pipeline_segment_worker,
+                                       args=(meta_segments[1], pipeline_module, 'segment_1_worker_' + str(slot),
+                                             profile, memory, monitor, supervisor, slot, attempt))
+                mp_pool.append(mp_worker)
+                mp_worker.start()
+                return mp_worker
+            supervisor.attach(region_workers, spawn)
         for mp_worker in mp_pool:
             mp_worker.start()
+        if monitor is not None:
+            monitor.start()
         sys.stdout.flush()
         # install the shutdown handler for SIGUSR1 events received from child processes
         signal.signal(signal.SIGUSR1, pipeline_master_unexpectedShutdownHandler)
@@ -387,9 +923,23 @@ def run_pipeline(pipeline_meta, pipeline_module):
             print(" Master: Sending shutdown signal to all processes. Goodbye.")
             for mp_worker in mp_pool:
                 mp_worker.terminate()
+            if monitor is not None:
+                monitor.stop('failed')
             print(util.SEP)
             raise
         else:
             # all the child processes should be finished until now, nevertheless we join() them
             for mp_worker in mp_pool:
                 mp_worker.join()
+            if supervisor is not None:
+                supervisor.report()
+    if monitor is not None:
+        status = monitor.stop()
+        print(" Processed " + str(status['frames_read']) + " frames at " +
+              "{:.2f}".format(status['throughput']) + " frames/s, status written to <" +
+              os.path.join(monitor.directory, progress_lib.status_file) + ">.")
+    for profiler in profilers:
+        profiler.write()
+    if cache is not None:
+        cache_lib.evict(cache['directory'], cache.get('size', 1024.))
+    report_instrumentation(profile, memory)
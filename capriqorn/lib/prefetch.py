@@ -0,0 +1,81 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""Capriqorn prefetching library.
+
+Readers use prefetch() to load the next few items (e.g. histogram files) in a
+background thread while the pipeline processes the current one, hiding the
+latency of opening and reading files on network filesystems.  File I/O and
+NumPy release the GIL, such that the loading overlaps with the computation.
+"""
+
+
+import threading
+from six.moves import queue
+
+
+# marker put into the queue after the last item
+_END = object()
+
+
+class _Failure(object):
+    """Wrapper to pass an exception raised in the background thread."""
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def prefetch(items, load, depth=2):
+    """Yield load(item) for each item, loading up to depth items ahead in a
+    background thread.  In case depth is not positive, the items are loaded
+    sequentially in the calling thread.
+    """
+    if (depth is None) or (depth <= 0):
+        for item in items:
+            yield load(item)
+        return
+    buf = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def _put(obj):
+        while not stop.is_set():
+            try:
+                buf.put(obj, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _worker():
+        try:
+            for item in items:
+                if not _put(load(item)):
+                    return
+        except Exception as e:
+            _put(_Failure(e))
+            return
+        _put(_END)
+
+    thread = threading.Thread(target=_worker)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            obj = buf.get()
+            if obj is _END:
+                break
+            if isinstance(obj, _Failure):
+                raise obj.exception
+            yield obj
+    finally:
+        # also reached when the consumer closes the generator early
+        stop.set()
+        thread.join()
@@ -0,0 +1,247 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""Capriqorn pipeline profiling library, enabled by `--profile`.
+
+instrument() wraps the generators of the instantiated pipeline elements of a
+process.  Each step of a generator (i.e. each object yielded by a filter) is
+timed (wall and CPU time), and the sizes of the NumPy arrays of the containers
+passed between the elements are counted.  The times are exclusive, i.e. the
+time spent in the upstream elements is subtracted.  For the ParallelFork and
+ParallelJoin filters the exclusive time is the time spent waiting on the
+multiprocessing queues.
+
+Each process writes its records to the file `profile.<worker id>.json` in the
+directory `./pipeline_log/`.  When the pipeline has completed, the master
+process merges these files into
+
+    profile_summary.json   totals per pipeline element and per filter class
+    profile_trace.json     per-frame spans in the Chrome trace event format,
+                           to be viewed with chrome://tracing or Perfetto
+"""
+from __future__ import print_function
+
+
+import os
+import glob
+import json
+import time
+import numpy as np
+from cadishi import base
+from cadishi import util
+
+
+profile_directory = './pipeline_log/'
+summary_file = 'profile_summary.json'
+trace_file = 'profile_trace.json'
+queue_labels = ['ParallelFork', 'ParallelJoin']
+
+_cpu_time = time.process_time
+
+
+def nbytes(obj):
+    """Return the total size in bytes of the NumPy arrays contained in a
+    container or a (nested) dictionary."""
+    if isinstance(obj, base.Container):
+        obj = obj.data
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    elif isinstance(obj, dict):
+        return sum([nbytes(value) for value in obj.values()])
+    else:
+        return 0
+
+
+class Profiler(object):
+    """Collects the timings of the pipeline elements of the present process."""
+
+    def __init__(self, worker_id='main'):
+        self.worker_id = worker_id
+        self.pid = os.getpid()
+        self.events = []
+        self.elements = []
+        # wall and cpu time spent in the nested (upstream) generator steps
+        self._stack = []
+
+    def add_element(self, position, label):
+        """Register a pipeline element, return its record."""
+        record = {'worker': self.worker_id, 'position': position, 'label': label,
+                  'n_items': 0, 'wall': 0.0, 'cpu': 0.0, 'bytes_in': 0, 'bytes_out': 0,
+                  'queue_wait': 0.0}
+        self.elements.append(record)
+        return record
+
+    def enter(self):
+        self._stack.append([0.0, 0.0])
+        return (time.time(), _cpu_time())
+
+    def leave(self, record, start, obj=None):
+        """Account the step of a generator started at start (as returned by
+        enter()) which yielded obj."""
+        wall = time.time() - start[0]
+        cpu = _cpu_time() - start[1]
+        child = self._stack.pop()
+        if (len(self._stack) > 0):
+            self._stack[-1][0] += wall
+            self._stack[-1][1] += cpu
+        record['wall'] += wall - child[0]
+        record['cpu'] += cpu - child[1]
+        if record['label'] in queue_labels:
+            record['queue_wait'] += wall - child[0]
+        args = {}
+        if isinstance(obj, base.Container):
+            size = nbytes(obj)
+            record['n_items'] += 1
+            record['bytes_out'] += size
+            args = {'frame': obj.i, 'bytes': size}
+        self.events.append({'name': record['label'], 'cat': 'filter', 'ph': 'X',
+                            'ts': start[0] * 1.e6, 'dur': wall * 1.e6,
+                            'pid': self.pid, 'tid': 0, 'args': args})
+
+    def write(self, directory=profile_directory):
+        """Write the records of the present process to the profile directory."""
+        util.md(directory)
+        filename = os.path.join(directory, 'profile.' + self.worker_id + '.json')
+        for (upstream, record) in zip(self.elements[:-1], self.elements[1:]):
+            record['bytes_in'] = upstream['bytes_out']
+        if (len(self.elements) > 1):
+            # the last element (writer) consumes the items of its source
+            self.elements[-1]['n_items'] = self.elements[-2]['n_items']
+        process = {'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'tid': 0,
+                   'args': {'name': self.worker_id}}
+        with open(filename, 'w') as fp:
+            json.dump({'elements': self.elements, 'events': [process] + self.events}, fp)
+
+
+class _ProfiledSource(object):
+    """Stand-in for a pipeline element as the source of the next element,
+    timing the steps of the element's generator."""
+
+    def __init__(self, element, profiler, record):
+        self.element = element
+        self.profiler = profiler
+        self.record = record
+
+    def __getattr__(self, name):
+        return getattr(self.element, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        generator = next(self.element)
+        while True:
+            start = self.profiler.enter()
+            try:
+                obj = next(generator)
+            except StopIteration:
+                self.profiler.leave(self.record, start)
+                return
+            self.profiler.leave(self.record, start, obj)
+            yield obj
+
+    next = __next__
+
+
+def instrument(pipeline, worker_id='main', profiler=None):
+    """Wrap the elements of an instantiated pipeline (segment) for profiling.
+
+    Parameters
+    ----------
+    pipeline : list
+        List of instantiated classes forming the pipeline.
+    worker_id : string
+        String identifying the present process.
+    profiler : object
+        Optional profiler (e.g. memory.MemoryProfiler) providing the methods
+        add_element(), enter(), and leave() of the Profiler, which is used by
+        default.  A pipeline may be instrumented by several profilers.
+
+    Returns
+    -------
+    Profiler
+        The profiler collecting the records of the pipeline.
+    """
+    if profiler is None:
+        profiler = Profiler(worker_id)
+    records = [profiler.add_element(position, element.__class__.__name__)
+               for (position, element) in enumerate(pipeline)]
+    for position in range(1, len(pipeline)):
+        source = _ProfiledSource(pipeline[position].src, profiler, records[position - 1])
+        pipeline[position].src = source
+    # the last element is driven by its dump() method
+    element = pipeline[-1]
+    dump = element.dump
+
+    def _dump():
+        start = profiler.enter()
+        try:
+            return dump()
+        finally:
+            profiler.leave(records[-1], start)
+            # restore the method, which breaks the reference cycle via the closure
+            element.__dict__.pop('dump', None)
+
+    element.dump = _dump
+    return profiler
+
+
+def clear(directory=profile_directory):
+    """Remove the profile files of a previous run."""
+    for filename in glob.glob(os.path.join(directory, 'profile*.json')):
+        os.remove(filename)
+
+
+def merge(directory=profile_directory):
+    """Merge the files written by the processes of a pipeline into the summary
+    and the trace file.
+
+    Returns
+    -------
+    dict
+        The summary.
+    """
+    elements = []
+    events = []
+    for filename in sorted(glob.glob(os.path.join(directory, 'profile.*.json'))):
+        with open(filename) as fp:
+            profile = json.load(fp)
+        elements.extend(profile['elements'])
+        events.extend(profile['events'])
+    filters = {}
+    for record in elements:
+        total = filters.setdefault(record['label'], {'n_items': 0, 'wall': 0.0, 'cpu': 0.0,
+                                                     'bytes_in': 0, 'bytes_out': 0,
+                                                     'queue_wait': 0.0})
+        for key in total:
+            total[key] += record[key]
+    for total in filters.values():
+        total['wall_per_item'] = total['wall'] / float(max(total['n_items'], 1))
+        total['cpu_per_item'] = total['cpu'] / float(max(total['n_items'], 1))
+    summary = {'elements': elements, 'filters': filters}
+    with open(os.path.join(directory, summary_file), 'w') as fp:
+        json.dump(summary, fp, indent=1, sort_keys=True)
+    with open(os.path.join(directory, trace_file), 'w') as fp:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp)
+    return summary
+
+
+def print_summary(summary):
+    """Print the totals per filter class, ordered by the wall time."""
+    print(" Profile (totals over all processes):")
+    print("   {:24s} {:>8s} {:>10s} {:>10s} {:>10s} {:>10s}".format(
+        'filter', 'items', 'wall [s]', 'cpu [s]', 'in [MB]', 'out [MB]'))
+    filters = summary['filters']
+    for label in sorted(filters, key=lambda x: -filters[x]['wall']):
+        total = filters[label]
+        print("   {:24s} {:8d} {:10.3f} {:10.3f} {:10.1f} {:10.1f}".format(
+            label, total['n_items'], total['wall'], total['cpu'],
+            total['bytes_in'] / 1.e6, total['bytes_out'] / 1.e6))
@@ -0,0 +1,204 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""Capriqorn live progress reporting, enabled by `--status` and `--progress`.
+
+Each process of a pipeline counts the frames yielded by the first element of
+its pipeline segment, i.e. the frames read by a reader, the frames received
+by a parallel worker (downstream side of ParallelFork), or the frames joined
+by the master (downstream side of ParallelJoin).  The counters are kept in
+shared memory.  A thread of the master process periodically writes the
+counters, the throughput (overall and per worker), the depths of the
+multiprocessing queues, and an estimate of the remaining time to the status
+file `./pipeline_log/status.json`, and optionally prints them as a single
+updating line.
+
+The expected number of frames is obtained from the readers implementing the
+method `get_frame_count()`.
+"""
+from __future__ import print_function
+
+
+import os
+import sys
+import json
+import time
+import threading
+import multiprocessing as mp
+from cadishi import base
+from cadishi import util
+from . import profiling
+
+
+status_file = 'status.json'
+# roles of the processes, determined by the first element of their pipeline segment
+ROLE_UNDEFINED = 0
+ROLE_READER = 1
+ROLE_WORKER = 2
+ROLE_JOIN = 3
+
+
+def get_frame_count(reader):
+    """Return the number of frames a reader is going to deliver, or None."""
+    if hasattr(reader, 'get_frame_count'):
+        try:
+            return reader.get_frame_count()
+        except Exception:
+            return None
+    return None
+
+
+class ProgressCounter(object):
+    """Counts the frames yielded by the first element of a pipeline segment,
+    attached to the pipeline via profiling.instrument()."""
+
+    def __init__(self, counts, slot):
+        self.counts = counts
+        self.slot = slot
+
+    def add_element(self, position, label):
+        return position
+
+    def enter(self):
+        return None
+
+    def leave(self, record, start, obj=None):
+        if (record == 0) and isinstance(obj, base.Container):
+            self.counts[self.slot] += 1
+
+    def write(self, directory=None):
+        pass
+
+
+class Progress(object):
+    """Shared frame counters of the processes of a pipeline, and the monitor
+    thread of the master process writing the status file."""
+
+    def __init__(self, worker_ids, queues=[], interval=5.0, show=False,
+                 directory=profiling.profile_directory):
+        self.worker_ids = list(worker_ids)
+        n = len(self.worker_ids)
+        self.counts = mp.Array('l', n, lock=False)
+        self.expected = mp.Array('l', [-1] * n, lock=False)
+        self.roles = mp.Array('i', n, lock=False)
+        self.queues = queues
+        self.interval = interval
+        self.show = show
+        self.directory = directory
+        self.t0 = None
+        self._thread = None
+        self._stop = None
+        self._last = None
+
+    def instrument(self, pipeline, worker_id):
+        """Attach a frame counter to the first element of a pipeline segment."""
+        slot = self.worker_ids.index(worker_id)
+        source = pipeline[0]
+        if isinstance(source, base.Reader):
+            self.roles[slot] = ROLE_READER
+            count = get_frame_count(source)
+            if count is not None:
+                self.expected[slot] = count
+        elif (source.__class__.__name__ == 'ParallelFork'):
+            self.roles[slot] = ROLE_WORKER
+        elif (source.__class__.__name__ == 'ParallelJoin'):
+            self.roles[slot] = ROLE_JOIN
+        return profiling.instrument(pipeline, worker_id, ProgressCounter(self.counts, slot))
+
+    def get_status(self, state='running'):
+        """Return the status dictionary."""
+        now = time.time()
+        elapsed = max(now - self.t0, 1.e-9)
+        counts = list(self.counts)
+        roles = list(self.roles)
+        frames_read = sum([c for (c, r) in zip(counts, roles) if (r == ROLE_READER)])
+        # the master process runs the last segment, starting with the final ParallelJoin
+        frames_joined = counts[-1] if (roles[-1] == ROLE_JOIN) else None
+        expected = [e for (e, r) in zip(self.expected, roles) if (r == ROLE_READER)]
+        if (len(expected) > 0) and all([e >= 0 for e in expected]):
+            frames_total = sum(expected)
+        else:
+            frames_total = None
+        # throughput over the last interval
+        if self._last is None:
+            recent = frames_read / elapsed
+        else:
+            recent = (frames_read - self._last[1]) / max(now - self._last[0], 1.e-9)
+        self._last = (now, frames_read)
+        throughput = frames_read / elapsed
+        eta = None
+        if (frames_total is not None) and (throughput > 0.0):
+            eta = max(frames_total - frames_read, 0) / throughput
+        workers = {}
+        for (worker_id, c, r) in zip(self.worker_ids, counts, roles):
+            workers[worker_id] = {'frames': c, 'throughput': c / elapsed,
+                                  'role': {ROLE_READER: 'reader', ROLE_WORKER: 'worker',
+                                           ROLE_JOIN: 'join'}.get(r, 'undefined')}
+        queue_depths = {}
+        for (i, queue) in enumerate(self.queues):
+            try:
+                queue_depths['queue_' + str(i)] = queue.qsize()
+            except NotImplementedError:
+                # e.g. on macOS
+                queue_depths['queue_' + str(i)] = None
+        return {'state': state,
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'elapsed': elapsed,
+                'frames_total': frames_total,
+                'frames_read': frames_read,
+                'frames_joined': frames_joined,
+                'throughput': throughput,
+                'throughput_recent': recent,
+                'eta': eta,
+                'workers': workers,
+                'queues': queue_depths}
+
+    def write_status(self, state='running'):
+        """Write the status file (atomically) and optionally print the status line."""
+        status = self.get_status(state)
+        util.md(self.directory)
+        filename = os.path.join(self.directory, status_file)
+        with open(filename + '.tmp', 'w') as fp:
+            json.dump(status, fp, indent=1, sort_keys=True)
+        os.rename(filename + '.tmp', filename)
+        if self.show:
+            line = " Progress: {} frames read".format(status['frames_read'])
+            if status['frames_total'] is not None:
+                line += " of {}".format(status['frames_total'])
+            if status['frames_joined'] is not None:
+                line += ", {} joined".format(status['frames_joined'])
+            line += ", {:.2f} frames/s".format(status['throughput_recent'])
+            if status['eta'] is not None:
+                line += ", ETA {:.0f} s".format(status['eta'])
+            end = '\n' if (state != 'running') else ''
+            sys.stdout.write('\r' + line + ' ' * 8 + end)
+            sys.stdout.flush()
+        return status
+
+    def _monitor(self):
+        while not self._stop.wait(self.interval):
+            self.write_status()
+
+    def start(self):
+        """Start the monitor thread, to be called after the worker processes were started."""
+        self.t0 = time.time()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._monitor)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, state='done'):
+        """Stop the monitor thread and write the final status."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self.write_status(state)
@@ -0,0 +1,71 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+"""Capriqorn Prune() filter, dropping container fields not needed downstream.
+
+The pipeline elements declare the top-level container locations they consume
+and produce via the class attributes `_consumes` and `_produces` (lists of
+locations, None or unset meaning all/unknown).  The planning pass in
+<pipeutil.py> computes the locations that are live after each element and
+inserts Prune() filters where dead locations may be present, in particular in
+front of ParallelFork, ParallelJoin and the writers, which cuts the
+serialization volume of the queues and the memory footprint.
+"""
+from __future__ import print_function
+
+
+from cadishi import base
+
+
+# locations which are never pruned: the pipeline log and the parallel bookkeeping
+KEEP_ALWAYS = ['log', base.loc_parallel]
+
+
+class Prune(base.Filter):
+    """Filter that deletes all top-level container locations except the ones
+    given by keep.  The filter does not add an entry to the pipeline log,
+    such that the pipeline output does not depend on the planning pass."""
+    _depends = []
+    _conflicts = []
+    _consumes = []
+    _produces = []
+    _pure = True
+
+    def __init__(self, keep=[], source=-1, verbose=False):
+        self.src = source
+        self.keep = list(keep)
+        self.verb = verbose
+        self._keep = set(self.keep + KEEP_ALWAYS)
+        # ---
+        self._depends.extend(super(base.Filter, self)._depends)
+        self._conflicts.extend(super(base.Filter, self)._conflicts)
+
+    def get_meta(self):
+        """Return information on the present filter, ready to be added to a
+        frame object's list of pipeline meta information.
+        """
+        meta = {}
+        label = 'Prune'
+        param = {'keep': self.keep}
+        meta[label] = param
+        return meta
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        for frm in next(self.src):
+            if isinstance(frm, base.Container):
+                for location in list(frm.data.keys()):
+                    if location not in self._keep:
+                        del frm.data[location]
+                if self.verb:
+                    print("Prune.next() :", frm.i)
+            yield frm
@@ -10,6 +10,11 @@
 
 
 """RDF calculation.
+
+The functions operating on rdf tables (first column: radii, further columns:
+species pairs) are available as element-wise reference implementations and
+as vectorized implementations (suffix 'Fast') working on whole arrays, which
+are used by smooth().
 """
 from __future__ import division
 from __future__ import print_function
@@ -242,6 +247,50 @@ def PSh(R1, R2, r):
     """
     return old_div(MSh(R1, R2, r), VShell(R1, R2) ** 2)
 
+
+def mFast(R, rvec):
+    """
+    Vectorized implementation of m(R, r).
+    """
+    mask = np.logical_and(rvec >= 0, rvec <= 2 * R)
+    return np.where(mask, 1. / 3. * math.pi * math.pi * rvec * rvec * (rvec - 2. * R) ** 2 * (rvec + 4. * R), 0.)
+
+
+def m1Fast(R1, R2, rvec):
+    """
+    Vectorized implementation of m1(R1, R2, r).
+    """
+    mask = np.logical_and(rvec >= 0, rvec < R2 - R1)
+    return np.where(mask, 4. / 3. * math.pi * rvec * rvec * R1 * R1 * R1, 0.)
+
+
+def m2Fast(R1, R2, rvec):
+    """
+    Vectorized implementation of m2(R1, R2, r).
+    """
+    mask = np.logical_and(rvec >= R2 - R1, rvec <= R1 + R2)
+    return np.where(mask, 1. / 12. * math.pi * rvec * (R1 + R2 - rvec) ** 2 *
+                    (rvec * rvec - 3 * (R1 - R2) ** 2 + 2 * rvec * (R1 + R2)), 0.)
+
+
+def MShFast(R1, R2, rvec):
+    """
+    Pair distance distribution function of spherical shell with inner radius R1 an outer radius R2.
+    Vectorized implementation.
+    """
+    rvec = np.asarray(rvec, dtype=np.float64)
+    mask = np.logical_and(rvec >= 0, rvec <= 2. * R2)
+    val = mFast(R2, rvec) + mFast(R1, rvec) - 8. * math.pi * (m1Fast(R1, R2, rvec) + m2Fast(R1, R2, rvec))
+    return np.where(mask, val, 0.)
+
+
+def PShFast(R1, R2, rvec):
+    """
+    Normalized pair-distance distribution function of spherical shell with inner radius R1 an outer radius R2.
+    Vectorized implementation.
+    """
+    return MShFast(R1, R2, rvec) / VShell(R1, R2) ** 2
+
 # def getRDFInhom(distData, lenData, R, col, delta, lenCol):
 #    norm=np.sum(distData[:,col])-distData[0,col]
 #    nr=distData[0,col]
@@ -423,6 +472,57 @@ def setGinfty(histo, ginfty):
     return histo
 
 
+def getRDFCumuFast(histo, delta):
+    """
+    Vectorized implementation of getRDFCumu().
+
+    Returns
+    -------
+    histoCumu: array_like
+        Integrated rdfs from large to small distances.
+    """
+    histoCumu = histo[:-2, :].copy()
+    # same summation order as getRDFCumu(): from the last row to the third one
+    histoCumu[:1:-1, 1:] *= delta
+    np.cumsum(histoCumu[:1:-1, 1:], axis=0, out=histoCumu[:1:-1, 1:])
+    histoCumu[0, 1:] = 0.
+    return histoCumu
+
+
+def getPlateauValueFast(histoCumu, index):
+    """
+    Vectorized implementation of getPlateauValue(), fitting all columns at once.
+    """
+    par = np.polyfit(histoCumu[index:-1, 0], histoCumu[index:-1, 1:], 1)
+    return -par[0]
+
+
+def taperNoiseFast(histo, index, ginfty, noiseFraction=0.01, verb=False):
+    """
+    Vectorized implementation of taperNoise().
+    """
+    histo_out = histo.copy()
+    if 0 < noiseFraction and noiseFraction < 1:
+        dR = histo[-1, 0] - histo[index, 0]
+        l = math.sqrt(old_div(-dR**2, math.log(noiseFraction)))
+        rStart = histo[index, 0]
+        if verb == True:
+            print(" Smoothening rdfs from bin", index, "at distance r =", rStart, "to bin", len(histo), "at distance r =", histo[-1, 0], ".\n")
+        ginfty = np.asarray(ginfty)
+        temp = (np.abs(histo[index:, 0]) - rStart) / l
+        temp *= temp
+        histo_out[index:, 1:] = ginfty + (histo[index:, 1:] - ginfty) * np.exp(-temp)[:, np.newaxis]
+    return histo_out
+
+
+def setGinftyFast(histo, ginfty):
+    """
+    Vectorized implementation of setGinfty().
+    """
+    histo[-1, 1:] = ginfty
+    return histo
+
+
 def smooth(histo, delta, fitFraction,  noiseFraction, verb=False):
     """
     Tapering noise in rdfs.
@@ -432,10 +532,9 @@ def smooth(histo, delta, fitFraction,  noiseFraction, verb=False):
     The parameter 'fitFraction' is the fraction of the rdf distance range at its end, where the rdf shows a plateau.
     'fitFraction' should not be larger than the shortest plateau of the partial rdfs.
     """
-    histoCumu = getRDFCumu(histo, delta)
-    index = getStartingBin(histo, fitFraction)
-    ginfty = getPlateauValue(histoCumu, index)
+    histoCumu = getRDFCumuFast(histo, delta)
     index = getStartingBin(histo, fitFraction)
-    histo_smooth = taperNoise(histo, index, ginfty, noiseFraction, verb=verb)
-    histo_smooth = setGinfty(histo_smooth, ginfty)
+    ginfty = getPlateauValueFast(histoCumu, index)
+    histo_smooth = taperNoiseFast(histo, index, ginfty, noiseFraction, verb=verb)
+    histo_smooth = setGinftyFast(histo_smooth, ginfty)
     return histo_smooth
@@ -0,0 +1,133 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""Capriqorn histogram rebinning library.
+
+The routines operate along the first axis of an array, i.e. on all columns
+(species pairs) of a (n_bins, n_columns) table at once:
+
+* coarsen() sums groups of n adjacent bins (integer factor) via reshape-sum,
+* rebin() maps histogram counts from arbitrary bin edges onto other bin edges
+  via cumulative sums, assuming the counts to be uniformly distributed within
+  the input bins,
+* regrid() interpolates bin averages (densities, e.g. rdfs) conservatively
+  onto another grid, i.e. the integral over the bins is preserved.
+
+The rdf tables read by the Solvent filter (first column: radii, first row:
+particle densities) are mapped onto the bins of the histograms by
+regrid_rdf_table() and regrid_rdf_dict().
+"""
+
+
+import numpy as np
+
+
+def coarsen(values, n, remainder=True):
+    """Sum groups of n adjacent bins along the first axis.
+
+    Parameters
+    ----------
+    values : array_like
+        Histogram(s), bins along the first axis.
+    n : int
+        Number of bins combined into a single bin.
+    remainder : bool
+        Sum the trailing bins (less than n) into an additional bin.
+    """
+    values = np.asarray(values)
+    n = int(n)
+    m = values.shape[0] // n
+    out = values[:m * n].reshape((m, n) + values.shape[1:]).sum(axis=1)
+    if remainder and (values.shape[0] % n > 0):
+        out = np.concatenate((out, values[m * n:].sum(axis=0)[np.newaxis]))
+    return out
+
+
+def coarsen_mean(values, n, remainder=True):
+    """Average groups of n adjacent bins along the first axis, e.g. the radii,
+    the trailing bins are averaged over their actual number."""
+    values = np.asarray(values)
+    out = coarsen(values, n, remainder) / float(n)
+    if remainder and (values.shape[0] % n > 0):
+        out[-1] *= float(n) / float(values.shape[0] % n)
+    return out
+
+
+def edges_from_centers(centers):
+    """Return the bin edges of bins given by their centers, the inner edges
+    are the midpoints of adjacent centers."""
+    centers = np.asarray(centers, dtype=np.float64)
+    edges = np.empty(centers.shape[0] + 1)
+    edges[1:-1] = 0.5 * (centers[1:] + centers[:-1])
+    edges[0] = centers[0] - (edges[1] - centers[0])
+    edges[-1] = centers[-1] + (centers[-1] - edges[-2])
+    return edges
+
+
+def rebin(values, edges_in, edges_out):
+    """Rebin histogram counts along the first axis from the bins defined by
+    edges_in onto the bins defined by edges_out.  The total count within the
+    range covered by both sets of edges is preserved.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    edges_in = np.asarray(edges_in, dtype=np.float64)
+    edges_out = np.asarray(edges_out, dtype=np.float64)
+    assert (edges_in.shape[0] == values.shape[0] + 1)
+    cumulative = np.zeros((values.shape[0] + 1,) + values.shape[1:])
+    np.cumsum(values, axis=0, out=cumulative[1:])
+    # linear interpolation of the cumulative counts at edges_out, all columns at once
+    x = np.clip(edges_out, edges_in[0], edges_in[-1])
+    idx = np.clip(np.searchsorted(edges_in, x, side='right') - 1, 0, edges_in.shape[0] - 2)
+    weight = (x - edges_in[idx]) / (edges_in[idx + 1] - edges_in[idx])
+    weight = weight.reshape(weight.shape + (1,) * (values.ndim - 1))
+    cumulative_out = cumulative[idx] + weight * (cumulative[idx + 1] - cumulative[idx])
+    return np.diff(cumulative_out, axis=0)
+
+
+def regrid(values, edges_in, edges_out):
+    """Conservatively interpolate bin averages (densities) along the first
+    axis from the bins defined by edges_in onto the bins defined by edges_out."""
+    values = np.asarray(values, dtype=np.float64)
+    width_in = np.diff(edges_in).reshape((-1,) + (1,) * (values.ndim - 1))
+    width_out = np.diff(edges_out).reshape((-1,) + (1,) * (values.ndim - 1))
+    return rebin(values * width_in, edges_in, edges_out) / width_out
+
+
+def regrid_rdf_table(table, radii, dr):
+    """Map an rdf table onto the bins of width dr centered at radii.
+
+    The first column of the table holds the radii, the first row holds the
+    densities and is kept.  The further rows are interpolated conservatively
+    onto radii[1:], as far as the bins are covered by the table.  The rows of
+    the result correspond to radii[0:len(result)].
+    """
+    radii = np.asarray(radii, dtype=np.float64)
+    edges_in = edges_from_centers(table[1:, 0])
+    edges_out = np.append(radii[1:] - 0.5 * dr, radii[-1] + 0.5 * dr)
+    n_out = int(np.count_nonzero(edges_out[1:] <= edges_in[-1] + 1.e-9 * dr))
+    out = np.zeros((n_out + 1, table.shape[1]))
+    out[0, 0] = radii[0]
+    out[0, 1:] = table[0, 1:]
+    out[1:, 0] = radii[1:n_out + 1]
+    out[1:, 1:] = regrid(table[1:, 1:], edges_in, edges_out[:n_out + 1])
+    return out
+
+
+def regrid_rdf_dict(g_dict, radii, dr):
+    """Map a dictionary of rdfs (including the key 'radii') onto the bins of
+    width dr centered at radii, see regrid_rdf_table()."""
+    keys = sorted([key for key in g_dict if (key != 'radii')])
+    table = np.column_stack([g_dict['radii']] + [g_dict[key] for key in keys])
+    table = regrid_rdf_table(table, radii, dr)
+    out = {'radii': table[:, 0].copy()}
+    for j, key in enumerate(keys):
+        out[key] = table[:, j + 1].copy()
+    return out
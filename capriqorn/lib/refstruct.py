@@ -63,18 +63,56 @@ def get_selection(xyz, ref, R):
         return queryDistance(xyz, ref, R)
 
 
+def get_classification(xyz, ref, R_core, R_body):
+    """Uppermost entry point to the fused core/shell selection, returns an
+    uint8 array with the labels 0 (outside), 1 (shell), and 2 (core).
+    """
+    if q_cell_lists:
+        labels = np.asarray(cutout_using_cell_lists(xyz, ref, R_body, return_mask=True), dtype=np.uint8)
+        labels[np.asarray(cutout_using_cell_lists(xyz, ref, R_core, return_mask=True), dtype=bool)] = 2
+        return labels
+    else:
+        return classifyDistance(xyz, ref, R_core, R_body)
+
+
+def _common_coordinate_type(xyz, ref):
+    """Return the data type the selection kernels are run with: single
+    precision if both inputs are single precision, double precision otherwise.
+    """
+    if (np.asarray(xyz).dtype == np.float32) and (np.asarray(ref).dtype == np.float32):
+        return np.float32
+    else:
+        return np.float64
+
+
 def queryDistance(xyz, ref, R):
     """Lightweight wrapper of the simple queryDistance functions.
     """
-    # the cython kernel needs double precision input
-    xyz = np.asanyarray(xyz, dtype=np.float64)
-    ref = np.asanyarray(ref, dtype=np.float64)
+    # the cython kernel supports float32 and float64 input of the same type,
+    # single precision coordinates are passed without conversion
+    dtype = _common_coordinate_type(xyz, ref)
+    xyz = np.asanyarray(xyz, dtype=dtype)
+    ref = np.asanyarray(ref, dtype=dtype)
     if have_c_refstruct:
         return c_refstruct.queryDistance(xyz, ref, R)
     else:
         return queryDistance_opt(xyz, ref, R)
 
 
+def classifyDistance(xyz, ref, R_core, R_body):
+    """Lightweight wrapper of the fused core/shell selection functions.
+    """
+    dtype = _common_coordinate_type(xyz, ref)
+    xyz = np.asanyarray(xyz, dtype=dtype)
+    ref = np.asanyarray(ref, dtype=dtype)
+    if have_c_refstruct:
+        return c_refstruct.classifyDistance(xyz, ref, R_core, R_body)
+    else:
+        labels = queryDistance_opt(xyz, ref, R_body).astype(np.uint8)
+        labels[queryDistance_opt(xyz, ref, R_core)] = 2
+        return labels
+
+
 def queryDistance_opt(xyz, ref, R):
     """Check which atoms in xyz lie within a radius R of any reference
     atom.
@@ -95,8 +133,8 @@ def queryDistance_opt(xyz, ref, R):
     query : ndarray (n_atoms)
         boolean array showing which particle are close to ref
     """
-    xyz = np.asanyarray(xyz)
-    ref = np.asanyarray(ref)
+    xyz = np.asanyarray(xyz, dtype=np.float64)
+    ref = np.asanyarray(ref, dtype=np.float64)
     mask = np.zeros(xyz.shape[0], dtype=bool)
     for i, a in enumerate(xyz):
         for b in ref:
@@ -373,7 +411,7 @@ def get_observation_volume_particle_indices(ref_positions, positions, ref_partic
     for k in ref_particle_indices:
         ref = ref_positions[ref_particle_indices[k]]
         xyz = positions[particle_indices_within_neighbours[k]]
-        tmp = queryDistance(np.asanyarray(xyz, dtype=np.float64), np.asanyarray(ref, dtype=np.float64), distance)
+        tmp = queryDistance(xyz, ref, distance)
         num_distances_calc += len(ref) * len(xyz)
         dummy_indices = np.asanyarray(particle_indices_within_neighbours[k])[np.where(tmp)[0]]
         if len(dummy_indices) > 0:
@@ -13,6 +13,12 @@
 
 The core, shell, full selection routines are implemented here, as
 well as the the functionality to merge virtual particles.
+
+Since the set of keys (species pairs) is constant across the frames, the
+mapping of the keys of the input frame to the keys of a selection, including
+the removal of the shell identifiers and the merging of the virtual particle
+species X1 and X2, is compiled once into a KeyPlan per key set.  The plan is
+then applied to every frame by a single gather and segmented sum.
 """
 
 
@@ -20,78 +26,190 @@ import numpy as np
 
 from cadishi import base
 from cadishi import util
-from cadishi import dict_util
 from ..postproc.filter.strip_virtual_particles import blacklist
+from . import species
+
+
+# regions of the species pairs
+CORE = 'core'
+SHELL = 'shell'
+CROSS = 'cross'
+FULL = 'full'
+# no selection, merging the virtual particles only
+MERGE = 'merge'
+# keys which are copied instead of summed
+passthrough_keys = ['radii', 'frame']
+
+
+class KeyPlan(object):
+    """Index map from the keys of a dictionary of arrays (source) to the keys
+    of a selection (target), where several source arrays may be summed into
+    one target array."""
+
+    def __init__(self, mapping, passthrough=[]):
+        """
+        Parameters
+        ----------
+        mapping : list
+            List of tuples (source key, target key).
+        passthrough : list
+            Keys copied from the source to the target if present.
+        """
+        self.passthrough = list(passthrough)
+        self.target_keys = sorted(set([target for (_, target) in mapping]))
+        rank = {key: j for (j, key) in enumerate(self.target_keys)}
+        # order the sources by target (stable), such that the sources of each
+        # target form a contiguous segment
+        mapping = sorted(mapping, key=lambda pair: rank[pair[1]])
+        self.source_keys = [source for (source, _) in mapping]
+        targets = np.array([rank[target] for (_, target) in mapping], dtype=np.int64)
+        self.starts = np.flatnonzero(np.diff(targets, prepend=-1))
+        self.identity = all([source == target for (source, target) in mapping])
+
+    def apply(self, values):
+        """Return a new dictionary holding the selection of the dictionary values."""
+        out = {}
+        for key in self.passthrough:
+            if key in values:
+                out[key] = np.copy(values[key])
+        if (len(self.source_keys) == 0):
+            return out
+        arrays = [np.asarray(values[key]) for key in self.source_keys]
+        if all([arr.shape == arrays[0].shape for arr in arrays]):
+            sums = np.add.reduceat(np.stack(arrays), self.starts, axis=0)
+            for (j, key) in enumerate(self.target_keys):
+                out[key] = sums[j]
+        else:
+            stops = list(self.starts[1:]) + [len(arrays)]
+            for (j, key) in enumerate(self.target_keys):
+                out[key] = np.copy(arrays[self.starts[j]])
+                for arr in arrays[self.starts[j] + 1:stops[j]]:
+                    out[key] += arr
+        return out
 
 
-def get_core(frm_in):
-    """
-    Selects the core parts of a base.Container() instance,
-    and returns them inside a new base.Container() instance.
-    """
+def _strip_shell(key):
+    """Remove the trailing shell identifiers from a species (pair) key."""
+    return ','.join([x[:-2] if x.endswith('.s') else x for x in key.split(',')])
+
+
+def _pair_region(key):
+    pair = key.split(',')
+    n_shell = int(pair[0].endswith('.s')) + int(pair[1].endswith('.s'))
+    return [CORE, CROSS, SHELL][n_shell]
+
+
+def _merge_x(keys, pairs=True):
+    """Return the renaming of the keys merging the virtual particle species
+    X1 and X2 (in case both are present) into X."""
+    if ('X1' in util.get_elements(keys)) and ('X2' in util.get_elements(keys)):
+        if pairs:
+            return {key: key.replace('X1', 'X').replace('X2', 'X') for key in keys}
+        else:
+            return {key: ('X' if key in ['X1', 'X2'] else key) for key in keys}
+    else:
+        return {key: key for key in keys}
+
+
+def _histogram_mapping(keys, region):
+    """Return the list of (source key, target key) of the histograms of region."""
+    if (region == FULL):
+        mapping = []
+        for sub_region in [CORE, SHELL, CROSS]:
+            mapping += [(source, _strip_shell(target)) for (source, target) in
+                        _histogram_mapping(keys, sub_region)]
+        return mapping
+    selected = [key for key in keys if (key not in passthrough_keys) and (_pair_region(key) == region)]
+    if (region == SHELL):
+        renamed = {key: _strip_shell(key) for key in selected}
+    else:
+        renamed = {key: key for key in selected}
+    # Use StripVirtualParticles() earlier in the pipeline!
+    for key in renamed.values():
+        assert (key not in blacklist)
+    merged = _merge_x(list(renamed.values()))
+    return [(key, merged[renamed[key]]) for key in selected]
+
+
+def _particle_number_mapping(keys, region):
+    """Return the list of (source key, target key) of the particle numbers of region."""
+    if (region == FULL):
+        return _particle_number_mapping(keys, CORE) + _particle_number_mapping(keys, SHELL)
+    elif (region == CROSS):
+        return []
+    selected = [key for key in keys if (key not in passthrough_keys) and
+                (key.endswith('.s') == (region == SHELL))]
+    renamed = {key: _strip_shell(key) for key in selected}
+    merged = _merge_x(list(renamed.values()), pairs=False)
+    return [(key, merged[renamed[key]]) for key in selected]
+
+
+# compiled plans, indexed by (location, region, source keys)
+_plans = {}
+
+
+def get_plan(location, region, keys):
+    """Return the (cached) plan selecting region from the keys at location."""
+    keys = tuple(sorted(keys))
+    plan_id = (location, region, keys)
+    if plan_id not in _plans:
+        if (region == MERGE):
+            keys = [key for key in keys if key not in passthrough_keys]
+            if (location == base.loc_histograms):
+                # Use StripVirtualParticles() earlier in the pipeline!
+                for key in keys:
+                    assert (key not in blacklist)
+            merged = _merge_x(keys, pairs=(location == base.loc_histograms))
+            mapping = list(merged.items())
+            passthrough = passthrough_keys
+        elif (location == base.loc_histograms):
+            mapping = _histogram_mapping(keys, region)
+            passthrough = ['radii']
+        elif (region == SHELL):
+            mapping = _particle_number_mapping(keys, region)
+            passthrough = ['frame']
+        else:
+            mapping = _particle_number_mapping(keys, region)
+            passthrough = passthrough_keys
+        _plans[plan_id] = KeyPlan(mapping, passthrough)
+    return _plans[plan_id]
+
+
+def _select(frm_in, region):
+    """Return a new container holding the selection region of frm_in."""
     frm_out = base.Container()
     # ---
     frm_out.i = frm_in.i
     # --- extend pipeline_log
     frm_out.put_data('log', frm_in.get_data('log'))
-    log_entry = {'get_core': True}
+    log_entry = {'get_' + region: True}
     frm_out.put_meta(log_entry)
-    # --- filter particle numbers
-    for key in sorted(frm_in.get_keys(base.loc_nr_particles)):
-        if key.endswith('.s'):
-            continue
-        frm_out.put_data(base.loc_nr_particles + '/' + key,
-                         frm_in.get_data(base.loc_nr_particles + '/' + key))
-    # --- filter histogram data
-    for key in sorted(frm_in.get_keys(base.loc_histograms)):
-        if (key != 'radii'):
-            pair = key.split(',')
-            if (pair[0].endswith('.s') or pair[1].endswith('.s')):
-                continue
-        frm_out.put_data(base.loc_histograms + '/' + key,
-                         frm_in.get_data(base.loc_histograms + '/' + key))
-    # ---
-    merge_virtual_particles(frm_out)
     # ---
+    for location in [base.loc_nr_particles, base.loc_histograms]:
+        if (location == base.loc_nr_particles) and (region == CROSS):
+            # Note: particle numbers do not make sense for cross
+            continue
+        if frm_in.contains_key(location):
+            values = frm_in.get_data(location)
+            plan = get_plan(location, region, values.keys())
+            species.put_view(frm_out, location, plan.apply(values))
     return frm_out
 
 
+def get_core(frm_in):
+    """
+    Selects the core parts of a base.Container() instance,
+    and returns them inside a new base.Container() instance.
+    """
+    return _select(frm_in, CORE)
+
+
 def get_shell(frm_in):
     """
     Selects the shell parts of a base.Container() instance,
     and returns them inside a new base.Container() instance.
     """
-    frm_out = base.Container()
-    # ---
-    frm_out.i = frm_in.i
-    # --- extend pipeline_log
-    frm_out.put_data('log', frm_in.get_data('log'))
-    log_entry = {'get_shell': True}
-    frm_out.put_meta(log_entry)
-    # --- filter particle numbers
-    for key in sorted(frm_in.get_keys(base.loc_nr_particles)):
-        if key.endswith('.s'):
-            # strip off the trailing shell identifier
-            frm_out.put_data(base.loc_nr_particles + '/' + key[:-2],
-                             frm_in.get_data(base.loc_nr_particles + '/' + key))
-        elif (key == 'frame'):
-            frm_out.put_data(base.loc_nr_particles + '/' + key,
-                             frm_in.get_data(base.loc_nr_particles + '/' + key))
-    # --- filter histogram data
-    for key in sorted(frm_in.get_keys(base.loc_histograms)):
-        pair = key.split(',')
-        if (pair[0].endswith('.s') and pair[1].endswith('.s')):
-            # strip off the trailing shell identifiers
-            key_new = (pair[0])[:-2] + ',' + (pair[1])[:-2]
-            frm_out.put_data(base.loc_histograms + '/' + key_new,
-                             frm_in.get_data(base.loc_histograms + '/' + key))
-        elif (key == 'radii'):
-            frm_out.put_data(base.loc_histograms + '/' + key,
-                             frm_in.get_data(base.loc_histograms + '/' + key))
-    # ---
-    merge_virtual_particles(frm_out)
-    # ---
-    return frm_out
+    return _select(frm_in, SHELL)
 
 
 def get_cross(frm_in):
@@ -99,26 +217,7 @@ def get_cross(frm_in):
     Selects the cross parts of a base.Container() instance,
     and returns them inside a new base.Container() instance.
     """
-    frm_out = base.Container()
-    # ---
-    frm_out.i = frm_in.i
-    # --- extend pipeline_log
-    frm_out.put_data('log', frm_in.get_data('log'))
-    log_entry = {'get_cross': True}
-    frm_out.put_meta(log_entry)
-    # Note: particle numbers do not make sense for cross
-    for key in sorted(frm_in.get_keys(base.loc_histograms)):
-        if (key != 'radii'):
-            pair = key.split(',')
-            if (pair[0].endswith('.s') and pair[1].endswith('.s')) or \
-               (not pair[0].endswith('.s') and not pair[1].endswith('.s')):
-                continue
-        frm_out.put_data(base.loc_histograms + '/' + key,
-                         frm_in.get_data(base.loc_histograms + '/' + key))
-    # ---
-    merge_virtual_particles(frm_out)
-    # ---
-    return frm_out
+    return _select(frm_in, CROSS)
 
 
 def get_full(frm_in):
@@ -133,45 +232,7 @@ def get_full(frm_in):
     if meta['shell_width'] < 0:
         return frm_in
     #######################
-    frm_out = base.Container()
-    # ---
-    frm_out.i = frm_in.i
-    # --- extend pipeline_log
-    frm_out.put_data('log', frm_in.get_data('log'))
-    log_entry = {'get_full': True}
-    frm_out.put_meta(log_entry)
-    # --- construct the full set from the divided sets
-    frm_out_core = get_core(frm_in)
-    frm_out_shell = get_shell(frm_in)
-    frm_out_cross = get_cross(frm_in)
-    # --- sum up particle numbers
-    frm_out.put_data(base.loc_nr_particles,  # include radii
-                     frm_out_core.get_data(base.loc_nr_particles))
-    X = frm_out.get_data(base.loc_nr_particles)
-    Y = frm_out_shell.get_data(base.loc_nr_particles)
-    dict_util.sum_values(X, Y)  # semantics: X += Y
-    # --- sum up histogram vectors
-    frm_out.put_data(base.loc_histograms,  # include radii
-                     frm_out_core.get_data(base.loc_histograms))
-    X = frm_out.get_data(base.loc_histograms)
-    Y = frm_out_shell.get_data(base.loc_histograms)
-    dict_util.sum_values(X, Y)  # semantics: X += Y
-    # --- sum up cross histograms explicitly due to key handling
-    for (key, Y) in list((frm_out_cross.get_data(base.loc_histograms)).items()):
-        if (key == 'radii'):
-            continue
-        else:
-            pair = key.split(',')
-            for idx in [0, 1]:
-                if pair[idx].endswith('.s'):
-                    pair[idx] = (pair[idx])[:-2]
-            key_new = pair[0] + ',' + pair[1]
-            X = frm_out.get_data(base.loc_histograms + '/' + key_new)
-            X += Y
-    # ---
-    merge_virtual_particles(frm_out)
-    # ---
-    return frm_out
+    return _select(frm_in, FULL)
 
 
 def merge_virtual_particles(frm):
@@ -180,50 +241,11 @@ def merge_virtual_particles(frm):
     Modifies the base.Container() instance in-place.
     """
     assert isinstance(frm, base.Container)
-    # --- sum up the distance histograms
-    if frm.contains_key(base.loc_histograms):
-        histgrms = frm.get_data(base.loc_histograms)
-        for key in list(histgrms.keys()):
-            # Use StripVirtualParticles() earlier in the pipeline!
-            assert (key not in blacklist)
-        elements = util.get_elements(list(histgrms.keys()))
-        if ('X1' in elements) and ('X2' in elements):
-            all_X1 = []
-            all_X2 = []
-            for key in list(histgrms.keys()):
-                if 'X1' in key:
-                    all_X1.append(key)
-                elif 'X2' in key:
-                    all_X2.append(key)
-            all_X1X2 = sorted(set(all_X1 + all_X2))
-            for key in all_X1X2:
-                key_new = key.replace('X1', 'X').replace('X2', 'X')
-                # print "###", key, key_new
-                if key_new not in list(histgrms.keys()):
-                    histgrms[key_new] = np.zeros_like(histgrms[key])
-                histgrms[key_new] += histgrms[key]
-                del histgrms[key]
-    # --- sum up the particle number arrays
-    if frm.contains_key(base.loc_nr_particles):
-        partnums = frm.get_data(base.loc_nr_particles)
-        elements = util.get_elements(list(partnums.keys()))
-        if ('X1' in elements) and ('X2' in elements):
-            X1 = partnums['X1']
-            X2 = partnums['X2']
-            X = X1 + X2
-            partnums['X'] = X.copy()
-            del X
-            del partnums['X1']
-            del partnums['X2']
-    # --- sum up the length histogram arrays
-    if frm.contains_key(base.loc_len_histograms):
-        lenhists = frm.get_data(base.loc_len_histograms)
-        elements = util.get_elements(list(lenhists.keys()))
-        if ('X1' in elements) and ('X2' in elements):
-            X1 = lenhists['X1']
-            X2 = lenhists['X2']
-            X = X1 + X2
-            lenhists['X'] = X.copy()
-            del X
-            del lenhists['X1']
-            del lenhists['X2']
+    for location in [base.loc_histograms, base.loc_nr_particles, base.loc_len_histograms]:
+        if frm.contains_key(location):
+            values = frm.get_data(location)
+            plan = get_plan(location, MERGE, values.keys())
+            if not plan.identity:
+                merged = plan.apply(values)
+                values.clear()
+                values.update(merged)
@@ -0,0 +1,263 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""Capriqorn species partition library.
+
+The coordinates of a frame are stored per species in the container.  Since the
+topology does not change during a trajectory, the readers compute a partition
+table (a permutation of the atoms ordered by species plus the offsets of the
+species blocks) once at startup.  A frame is then split by a single `take`
+operation into one contiguous buffer.  The per-species arrays put into the
+container are views of that buffer.  Downstream, the geometry filters detect
+such frames via `get_blocks()` and process all species at once, again producing
+views of a single buffer.
+
+The geometry filters label each particle with a region (outside, shell, core)
+and compact the coordinates per region via `select_regions()`, optionally in
+chunks of a limited number of particles to bound the size of the temporary
+arrays for very large frames.
+"""
+
+
+from collections import OrderedDict
+import copy
+import numpy as np
+from cadishi import base
+from cadishi import util
+
+
+def read_alias_file(alias_file):
+    """Read an alias file, mapping atom names (first column) to element names
+    (second column), and return an ordered dictionary.
+    """
+    alias_dict = OrderedDict()
+    with open(alias_file, 'r') as fp:
+        for line in fp:
+            pair = tuple(line.strip().split())
+            if len(pair) == 2:
+                alias_dict[pair[0]] = pair[1]
+    return alias_dict
+
+
+class SpeciesPartition(object):
+    """Permutation/offset table to split the coordinates of a frame by species."""
+
+    def __init__(self, element_list, atom_indices=None):
+        """
+        Parameters
+        ----------
+        element_list : list of strings
+            Element names of the (selected) atoms.
+        atom_indices : array_like, optional
+            Indices of the (selected) atoms into the coordinate arrays to be
+            split.  Default is None, i.e. range(len(element_list)).
+        """
+        element_array = np.array(element_list)
+        self.elements = sorted(set(element_list))
+        codes = np.searchsorted(np.array(self.elements), element_array)
+        order = np.argsort(codes, kind='stable')
+        if atom_indices is None:
+            self.permutation = order
+        else:
+            self.permutation = np.asarray(atom_indices)[order]
+        counts = np.bincount(codes, minlength=len(self.elements))
+        self.offsets = np.zeros(len(self.elements) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(counts)
+
+    @classmethod
+    def from_alias(cls, atom_names, alias_dict, atom_indices=None):
+        """Create a partition from atom names and an alias dictionary."""
+        return cls([alias_dict[name] for name in atom_names], atom_indices)
+
+    @property
+    def n_atoms(self):
+        return int(self.offsets[-1])
+
+    def split(self, coords, dtype=None):
+        """Return a contiguous buffer holding the coordinates sorted by species.
+
+        Parameters
+        ----------
+        coords : numpy.ndarray
+            Coordinates of shape (n, 3) indexed by the atom indices of the partition.
+        dtype : numpy.dtype, optional
+            Data type of the buffer, default is the data type of coords.
+        """
+        buf = np.take(coords, self.permutation, axis=0)
+        if (dtype is not None) and (buf.dtype != dtype):
+            buf = buf.astype(dtype)
+        return buf
+
+    def put(self, frm, coords, dtype=None, location=base.loc_coordinates):
+        """Split coords by species and put views of a single buffer into the
+        container frm."""
+        buf = self.split(coords, dtype)
+        put_blocks(frm, self.elements, buf, self.offsets, location)
+        return buf
+
+
+def put_view(frm, location, data):
+    """Store data at location in the container without copying it, in contrast
+    to Container.put_data() which stores a deep copy."""
+    subnodes = util.tokenize(location)
+    node = frm.data
+    for name in subnodes[:-1]:
+        node = node.setdefault(name, {})
+    node[subnodes[-1]] = data
+
+
+def put_blocks(frm, labels, buf, offsets, location=base.loc_coordinates, suffix=''):
+    """Put the species blocks of buf as views into the container."""
+    for k, label in enumerate(labels):
+        put_view(frm, location + '/' + label + suffix, buf[offsets[k]:offsets[k + 1]])
+
+
+def _data_pointer(arr):
+    return arr.__array_interface__['data'][0]
+
+
+def get_blocks(frm, location=base.loc_coordinates, skip_keys='radii'):
+    """Return the per-species arrays of a container as a tuple (labels, buf,
+    offsets) of a single buffer and the offsets of the blocks.
+
+    In case the arrays are consecutive views of a single buffer, e.g. as
+    created by SpeciesPartition.put(), no data is copied.  Otherwise, the arrays
+    are concatenated.
+    """
+    labels = frm.get_keys(location, skip_keys=skip_keys)
+    arrays = [frm.get_data(location + '/' + label) for label in labels]
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([arr.shape[0] for arr in arrays])
+    if (len(arrays) == 0):
+        return labels, np.zeros((0, 3)), offsets
+    buf = arrays[0].base
+    is_view = isinstance(buf, np.ndarray) and buf.flags['C_CONTIGUOUS'] and \
+        (buf.ndim == 2) and (buf.shape[0] == offsets[-1]) and \
+        (_data_pointer(buf) == _data_pointer(arrays[0]))
+    if is_view:
+        row_bytes = buf.strides[0]
+        for k, arr in enumerate(arrays):
+            if (arr.base is not buf) or (arr.dtype != buf.dtype) or (arr.shape[1:] != buf.shape[1:]) or \
+               (_data_pointer(arr) != _data_pointer(buf) + offsets[k] * row_bytes):
+                is_view = False
+                break
+    if not is_view:
+        buf = np.concatenate(arrays)
+    return labels, buf, offsets
+
+
+def compress_blocks(buf, offsets, mask):
+    """Select the rows of buf where mask is True, return the compacted buffer
+    and the new block offsets."""
+    counts = np.zeros(mask.shape[0] + 1, dtype=np.int64)
+    np.cumsum(mask, out=counts[1:])
+    return buf[mask], counts[offsets]
+
+
+# labels used by the geometry filters to classify particles, the core region
+# is identical to the body in case no shell is used
+REGION_OUTSIDE = 0
+REGION_SHELL = 1
+REGION_CORE = 2
+# key suffixes of the coordinates of the regions in the output frames
+REGION_SUFFIXES = {REGION_CORE: '', REGION_SHELL: '.s'}
+
+
+def get_regions(shell_width):
+    """Return the region labels to be selected by a geometry filter."""
+    if (shell_width > 0.0):
+        return [REGION_CORE, REGION_SHELL]
+    else:
+        return [REGION_CORE]
+
+
+def region_labels(q_body, q_core=None):
+    """Return uint8 region labels from the boolean body and (optional) core
+    masks, the core region must be a subset of the body."""
+    if q_core is None:
+        return np.left_shift(q_body, 1, dtype=np.uint8)
+    else:
+        return np.add(q_body, q_core, dtype=np.uint8)
+
+
+def iter_chunks(offsets, chunk_size=None):
+    """Yield tuples (block index, start, stop) of row ranges of at most
+    chunk_size rows, not crossing the block boundaries given by offsets.
+    In case chunk_size is None or not positive, complete blocks are yielded."""
+    for k in range(len(offsets) - 1):
+        start = int(offsets[k])
+        stop = int(offsets[k + 1])
+        if (chunk_size is None) or (chunk_size <= 0):
+            step = max(stop - start, 1)
+        else:
+            step = int(chunk_size)
+        for chunk_start in range(start, stop, step):
+            yield k, chunk_start, min(chunk_start + step, stop)
+
+
+def select_regions(buf, offsets, classify, regions, chunk_size=None):
+    """Classify the rows of buf and compact them per region, chunk by chunk.
+
+    Parameters
+    ----------
+    buf : numpy.ndarray
+        Coordinates of all species, as returned by get_blocks().
+    offsets : numpy.ndarray
+        Offsets of the species blocks in buf.
+    classify : callable
+        classify(chunk, k) returns the uint8 region labels of the rows of
+        chunk, a part of the block k of buf.
+    regions : list of int
+        Region labels to be selected.
+    chunk_size : int, optional
+        Maximum number of rows processed at once.  The temporaries of the
+        classification are bounded by the chunk size, the output arrays are
+        allocated once.  Default is None, i.e. a species block at once.
+
+    Returns
+    -------
+    list
+        List of tuples (compacted buffer, block offsets), one per region.
+    """
+    n_blocks = len(offsets) - 1
+    n_labels = max(regions) + 1
+    labels = np.empty(buf.shape[0], dtype=np.uint8)
+    counts = np.zeros((n_blocks, n_labels), dtype=np.int64)
+    for (k, start, stop) in iter_chunks(offsets, chunk_size):
+        labels[start:stop] = classify(buf[start:stop], k)
+        counts[k] += np.bincount(labels[start:stop], minlength=n_labels)[:n_labels]
+    selection = []
+    for region in regions:
+        offsets_out = np.zeros(n_blocks + 1, dtype=np.int64)
+        np.cumsum(counts[:, region], out=offsets_out[1:])
+        buf_out = np.empty((offsets_out[-1],) + buf.shape[1:], dtype=buf.dtype)
+        pos = 0
+        for (k, start, stop) in iter_chunks(offsets, chunk_size):
+            mask = (labels[start:stop] == region)
+            n_sel = np.count_nonzero(mask)
+            np.compress(mask, buf[start:stop], axis=0, out=buf_out[pos:pos + n_sel])
+            pos += n_sel
+        selection.append((buf_out, offsets_out))
+    return selection
+
+
+def copy_container(frm, skip_locations):
+    """Return a deep copy of the container frm, except for the data stored at
+    the top-level locations listed in skip_locations, which is not copied."""
+    detached = {}
+    for location in skip_locations:
+        if location in frm.data:
+            detached[location] = frm.data.pop(location)
+    try:
+        frm_out = copy.deepcopy(frm)
+    finally:
+        frm.data.update(detached)
+    return frm_out
@@ -0,0 +1,241 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""Capriqorn supervision of the workers of a parallel region, enabled by `--supervise`.
+
+By default, an exception on any worker shuts down the complete pipeline, see
+<pipeutil.py>.  In supervised mode the master process instead keeps track of
+the frames each worker of the parallel region has in flight:
+
+* The ParallelFork filter on a worker reports each frame taken from the queue,
+  together with a copy of the frame, via a control pipe to the master, and
+  updates the heartbeat (time stamp) of the worker.  The ParallelJoin filter
+  on the worker updates the heartbeat for each frame passed on, also while it
+  is blocked on a full queue, and reports when the worker is done.
+* The ParallelJoin filter on the master marks the frames received as complete
+  and periodically checks the workers.  A worker is considered dead when its
+  process has terminated without being done, and hung when it has frames in
+  flight but did not update its heartbeat within the timeout.  Hung workers
+  are terminated.
+* A new worker is started in place of a dead worker, which first processes
+  the frames that were in flight on the dead worker (and the final None in
+  case the dead worker had already taken it) before it continues with the
+  queue of the ParallelFork filter.  The frames are handed over directly as
+  the queue may already hold the final Nones.  A frame which has been
+  re-queued more than max_retries times is put into quarantine, i.e. it is
+  skipped, and listed at the end of the run and in
+  './pipeline_log/quarantine.json'.
+
+The copies of the frames double the volume of the input transferred to the
+workers.  Supervision is supported for a single parallel region without
+sharded reading, and for filters passing on each frame individually, i.e. not
+for reductions (partial results) shipped to the ParallelJoin filter.
+"""
+from __future__ import print_function
+
+
+import os
+import json
+import time
+import multiprocessing as mp
+from six.moves import queue as queue_module
+from cadishi import base
+from cadishi import util
+from . import parpipe
+
+
+quarantine_file = 'quarantine.json'
+# seconds between two checks of the worker processes
+CHECK_INTERVAL = 0.5
+
+
+class Supervisor(object):
+    """Bookkeeping of the frames in flight on the workers of a parallel region,
+    shared by the master and the worker processes."""
+
+    def __init__(self, n_workers, max_retries=2, timeout=parpipe.QUEUE_TIMEOUT,
+                 directory="./pipeline_log"):
+        """
+        Parameters
+        ----------
+        n_workers : int
+            Number of workers of the parallel region.
+        max_retries : int
+            Number of times a frame is re-queued before it is put into quarantine.
+        timeout : float
+            Seconds without a heartbeat after which a worker having frames in
+            flight is considered hung.
+        directory : string
+            Directory the quarantine list is written to.
+        """
+        self.n_workers = n_workers
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.directory = directory
+        # shared between the processes
+        self.control = mp.SimpleQueue()
+        self.heartbeats = mp.Array('d', n_workers, lock=False)
+        # set on the worker processes: the slot of the worker, and the objects
+        # re-queued to the worker before it takes objects from the queue
+        self.slot = None
+        self.retry = []
+        # master state
+        self.processes = [None] * n_workers
+        self.spawn = None
+        self.in_flight = [{} for _ in range(n_workers)]
+        self.took_none = [False] * n_workers
+        self.done = [False] * n_workers
+        self.retries = {}
+        self.quarantine = {}
+        self.n_restarts = 0
+        self.n_idle_failures = 0
+        self.last_check = 0.0
+
+    # --- worker side
+
+    def beat(self):
+        """Update the heartbeat of the present worker."""
+        self.heartbeats[self.slot] = time.time()
+
+    def take(self, obj):
+        """Report an object taken from the queue by the present worker."""
+        self.beat()
+        if isinstance(obj, base.Container):
+            self.control.put(('take', self.slot, obj.get_data(base.loc_parallel + '/number'), obj))
+        elif obj is None:
+            self.control.put(('take', self.slot, None, None))
+
+    def put(self, queue, obj):
+        """Put obj into the output queue of the present worker.  While the
+        queue is full, e.g. due to a slow master, the heartbeat is updated,
+        such that a blocked worker is not considered hung."""
+        interval = min(CHECK_INTERVAL, 0.25 * self.timeout)
+        while True:
+            try:
+                queue.put(obj, True, interval)
+                break
+            except queue_module.Full:
+                self.beat()
+
+    def finish(self):
+        """Report that the present worker has passed on its final None."""
+        self.control.put(('done', self.slot, None, None))
+
+    # --- master side
+
+    def attach(self, processes, spawn):
+        """Register the worker processes and a function spawn(slot, attempt)
+        starting a new worker in place of the one at slot."""
+        self.processes = list(processes)
+        self.spawn = spawn
+        now = time.time()
+        for slot in range(self.n_workers):
+            self.heartbeats[slot] = now
+
+    def poll(self):
+        """Process the pending reports of the workers."""
+        while not self.control.empty():
+            (kind, slot, number, obj) = self.control.get()
+            if (kind == 'take'):
+                if number is None:
+                    self.took_none[slot] = True
+                else:
+                    self.in_flight[slot][number] = obj
+            elif (kind == 'done'):
+                self.done[slot] = True
+
+    def complete(self, number):
+        """Mark the frame number as complete, return False in case the frame
+        is in quarantine and is to be dropped."""
+        self.poll()
+        for frames in self.in_flight:
+            if number in frames:
+                del frames[number]
+                break
+        return (number not in self.quarantine)
+
+    def check(self):
+        """Check the workers at most every CHECK_INTERVAL seconds, recover dead
+        and hung workers.  Return the list of frame numbers put into quarantine."""
+        now = time.time()
+        if (now - self.last_check < CHECK_INTERVAL):
+            return []
+        self.last_check = now
+        self.poll()
+        quarantined = []
+        for slot in range(self.n_workers):
+            process = self.processes[slot]
+            if (process is None) or self.done[slot]:
+                continue
+            if process.is_alive():
+                busy = (len(self.in_flight[slot]) > 0) or self.took_none[slot]
+                if busy and (now - self.heartbeats[slot] > self.timeout):
+                    print(" Supervisor: worker " + str(slot) + " is hung, terminating it.")
+                    process.terminate()
+                    process.join()
+                else:
+                    continue
+            else:
+                process.join()
+            # collect the final reports of the worker
+            self.poll()
+            if not self.done[slot]:
+                quarantined.extend(self.recover(slot))
+        return quarantined
+
+    def recover(self, slot):
+        """Start a new worker in place of the dead worker at slot, re-queueing
+        the frames in flight to it, return the frame numbers put into quarantine."""
+        frames = self.in_flight[slot]
+        print(" Supervisor: worker " + str(slot) + " failed with " + str(len(frames)) + " frame(s) in flight.")
+        if (len(frames) == 0):
+            # e.g. a failure during the setup, the worker is restarted only a limited number of times
+            self.n_idle_failures += 1
+            if (self.n_idle_failures > self.max_retries):
+                raise RuntimeError("Supervisor: workers failed repeatedly without processing frames")
+        quarantined = []
+        retry = []
+        for number in sorted(frames.keys()):
+            frm = frames[number]
+            self.retries[number] = self.retries.get(number, 0) + 1
+            if (self.retries[number] > self.max_retries):
+                print(" Supervisor: frame " + str(frm.i) + " failed " + str(self.retries[number]) +
+                      " times, putting it into quarantine.")
+                self.quarantine[number] = frm.i
+                quarantined.append(number)
+            else:
+                retry.append(frm)
+        if self.took_none[slot]:
+            retry.append(None)
+        self.in_flight[slot] = {}
+        self.took_none[slot] = False
+        self.n_restarts += 1
+        self.heartbeats[slot] = time.time()
+        # the new worker process inherits the objects to be re-queued
+        self.retry = retry
+        self.processes[slot] = self.spawn(slot, self.n_restarts)
+        self.retry = []
+        return quarantined
+
+    def report(self):
+        """Print the restarts and the frames put into quarantine, and write the
+        quarantine list to the log directory."""
+        if (self.n_restarts == 0) and (len(self.quarantine) == 0):
+            return
+        print(" Supervisor: " + str(self.n_restarts) + " worker restart(s), " +
+              str(len(self.quarantine)) + " frame(s) in quarantine.")
+        if (len(self.quarantine) > 0):
+            file_name = os.path.join(self.directory, quarantine_file)
+            util.md(file_name)
+            frames = sorted(self.quarantine.values())
+            with open(file_name, 'w') as fp:
+                json.dump({'frames': frames, 'max_retries': self.max_retries}, fp, indent=2)
+            print(" Supervisor: frames in quarantine " + str(frames) + ", written to <" + file_name + ">.")
@@ -12,3 +12,4 @@ from cadishi.base import *
 from .io import *
 from .filter import *
 from ..lib.parpipe import *
+from ..lib.prune import *
@@ -23,6 +23,10 @@ import numpy as np
 from cadishi import base
 from cadishi import util
 from cadishi import dict_util
+from ...lib import species
+from ...lib import blocking
+from ...lib import incremental
+from ...lib import checkpoint as checkpoint_lib
 
 
 def scaleFactorXX(nx, xrho):
@@ -129,12 +133,301 @@ def scaleVirtualHistograms(frm):
     return frm
 
 
+class GrowingArray(object):
+    """One-dimensional array supporting appends at amortized constant cost,
+    used to collect per-frame scalars such as particle numbers and volumes."""
+
+    def __init__(self, capacity=16):
+        self._data = None
+        self._capacity = capacity
+        self.size = 0
+
+    def append(self, values):
+        """Append the (flattened) values to the array."""
+        values = np.ravel(values)
+        size = self.size + values.shape[0]
+        if self._data is None:
+            self._data = np.empty(max(self._capacity, size), dtype=values.dtype)
+        elif (size > self._data.shape[0]) or (np.result_type(self._data, values) != self._data.dtype):
+            # grow geometrically, such that n appends cost O(n) in total
+            data = np.empty(max(2 * self._data.shape[0], size), dtype=np.result_type(self._data, values))
+            data[:self.size] = self._data[:self.size]
+            self._data = data
+        self._data[self.size:size] = values
+        self.size = size
+
+    def get(self):
+        """Return the array of the values appended so far."""
+        if self._data is None:
+            return np.empty(0)
+        return self._data[:self.size]
+
+
+class AverageAccumulator(object):
+    """Running sums of the histograms of a block of frames, moreover the
+    particle numbers and volumes of the frames are collected.  The incoming
+    frames are not copied, the sums are updated in place."""
+
+    # locations of the data that is summed, and of the data that is appended
+    sum_locations = [base.loc_histograms, base.loc_shell_Hxx, base.loc_len_histograms]
+    append_locations = [base.loc_nr_particles, base.loc_volumes]
+
+    def __init__(self):
+        self.n_frames = 0
+        self.sums = {}
+        self.scalars = {}
+        # frame numbers, only collected in parallel pipelines to be able to
+        # restore the order of the per-frame scalars after merging
+        self.numbers = GrowingArray()
+
+    def add(self, frm, with_shell_Hxx=False, number=None):
+        """Add the data of the frame frm to the running sums."""
+        for location in self.sum_locations:
+            if (location == base.loc_shell_Hxx) and not with_shell_Hxx:
+                continue
+            if not frm.contains_key(location):
+                continue
+            Y = frm.get_data(location)
+            X = self.sums.setdefault(location, {})
+            if ('radii' in Y) and ('radii' not in X):
+                X['radii'] = Y['radii']
+            dict_util.sum_values(X, Y)
+        for location in self.append_locations:
+            if not frm.contains_key(location):
+                continue
+            buffers = self.scalars.setdefault(location, {})
+            for (key, value) in frm.get_data(location).items():
+                if (key == 'radii'):
+                    continue
+                if key not in buffers:
+                    buffers[key] = GrowingArray()
+                buffers[key].append(value)
+        if number is not None:
+            self.numbers.append(number)
+        self.n_frames += 1
+
+    def merge(self, other):
+        """Add the sums and the per-frame scalars of the accumulator other."""
+        for (location, Y) in other.sums.items():
+            X = self.sums.setdefault(location, {})
+            if ('radii' in Y) and ('radii' not in X):
+                X['radii'] = Y['radii']
+            dict_util.sum_values(X, Y)
+        for (location, other_buffers) in other.scalars.items():
+            buffers = self.scalars.setdefault(location, {})
+            for (key, buf) in other_buffers.items():
+                if key not in buffers:
+                    buffers[key] = GrowingArray()
+                buffers[key].append(buf.get())
+        self.numbers.append(other.numbers.get())
+        self.n_frames += other.n_frames
+
+    def get_state(self):
+        """Return a copy of the running sums and the per-frame scalars as a
+        dictionary, to be stored in the output and to continue later on."""
+        state = {'n_frames': np.array([self.n_frames]),
+                 'sums': copy.deepcopy(self.sums),
+                 'scalars': {}}
+        for (location, buffers) in self.scalars.items():
+            state['scalars'][location] = {key: buf.get().copy() for (key, buf) in buffers.items()}
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        """Create an accumulator continuing from a state returned by get_state()."""
+        accumulator = cls()
+        accumulator.n_frames = int(state['n_frames'][0])
+        accumulator.sums = copy.deepcopy(state['sums'])
+        for (location, values) in state['scalars'].items():
+            buffers = accumulator.scalars.setdefault(location, {})
+            for (key, value) in values.items():
+                buffers[key] = GrowingArray()
+                buffers[key].append(value)
+        return accumulator
+
+    def _frame_order(self, size):
+        """Return the permutation sorting size per-frame values by frame
+        number, or None in case they are already sorted."""
+        numbers = self.numbers.get()
+        if (numbers.shape[0] != self.n_frames) or (size % self.n_frames != 0) or \
+           np.all(numbers[1:] > numbers[:-1]):
+            return None
+        return np.argsort(np.repeat(numbers, size // self.n_frames), kind='stable')
+
+    def put(self, frm_out):
+        """Put the sums and the collected per-frame scalars into the
+        container frm_out, without copying."""
+        for (location, X) in self.sums.items():
+            species.put_view(frm_out, location, X)
+        for (location, buffers) in self.scalars.items():
+            values = {}
+            for (key, buf) in buffers.items():
+                values[key] = buf.get()
+                order = self._frame_order(values[key].shape[0])
+                if order is not None:
+                    values[key] = values[key][order]
+            species.put_view(frm_out, location, values)
+
+
+def rescale_average(frm_out, val, multiref=False):
+    """Scale the summed histograms of frm_out by val."""
+    # --- rescale distance histograms
+    if frm_out.contains_key(base.loc_histograms):
+        X = frm_out.get_data(base.loc_histograms)
+        dict_util.scale_values(X, val)
+    # --- multiref: rescale shell XX histogram
+    if multiref:
+        if frm_out.contains_key(base.loc_shell_Hxx):
+            X = frm_out.get_data(base.loc_shell_Hxx)
+            dict_util.scale_values(X, val)
+    # --- rescale length histograms
+    if frm_out.contains_key(base.loc_len_histograms):
+        X = frm_out.get_data(base.loc_len_histograms)
+        dict_util.scale_values(X, val)
+
+
+class AveragePartial(object):
+    """Partial sums of the frames of a single averaging block, accumulated by
+    an Average filter running on a worker of a parallel region.
+
+    The partials are shipped to the ParallelJoin filter which merges the
+    partials of the same block received from the workers and finalizes the
+    block as soon as all of its frames are accounted for, see <lib/parpipe.py>.
+    """
+
+    def __init__(self, key, size, factor, multiref, meta):
+        """
+        Parameters
+        ----------
+        key : int
+            Index of the averaging block.
+        size : int
+            Number of frames of a complete block, 0 in case all frames are averaged.
+        factor : float
+            Factor applied when averaging.
+        multiref : bool
+            Sum and rescale the shell H_xx histograms (MultiReferenceStructure).
+        meta : dict
+            Meta information of the Average filter.
+        """
+        self.key = key
+        self.size = size
+        self.factor = factor
+        self.multiref = multiref
+        self.meta = meta
+        self.accumulator = AverageAccumulator()
+        # frame number, frame index and pipeline log of the last frame of the block
+        self.last_number = -1
+        self.i = -1
+        self.log = []
+
+    def add(self, frm, number):
+        """Add the frame frm carrying the global frame number number."""
+        self.accumulator.add(frm, with_shell_Hxx=self.multiref, number=number)
+        if (number > self.last_number):
+            self.last_number = number
+            self.i = frm.i
+            self.log = frm.get_meta()
+
+    def merge(self, other):
+        """Merge the partial sums of another worker for the same block."""
+        assert (other.key == self.key)
+        self.accumulator.merge(other.accumulator)
+        if (other.last_number > self.last_number):
+            self.last_number = other.last_number
+            self.i = other.i
+            self.log = other.log
+
+    def complete(self):
+        """Return True in case all frames of the block were merged."""
+        return (self.size > 0) and (self.accumulator.n_frames >= self.size)
+
+    def finalize(self):
+        """Return a container holding the average over the frames of the block."""
+        n_avg = self.accumulator.n_frames
+        if (self.size > 0) and (n_avg < self.size):
+            print("Average.next(): averaged over " + str(n_avg) + " remainder histograms")
+        frm_out = base.Container()
+        self.accumulator.put(frm_out)
+        rescale_average(frm_out, old_div(np.float_(self.factor), np.float_(n_avg)), self.multiref)
+        frm_out.i = self.i
+        frm_out.put_data('log', self.log)
+        meta = copy.deepcopy(self.meta)
+        meta['Average']['n_avg'] = n_avg
+        frm_out.put_meta(meta)
+        return frm_out
+
+
+class BlockErrorAccumulator(object):
+    """Block means of the histograms for several block sizes and the running
+    variances of these block means, see <lib/blocking.py>.  The block means of
+    the first (smallest) block size are kept for the downstream filters."""
+
+    def __init__(self, block_sizes):
+        self.block_sizes = block_sizes
+        self.current = [AverageAccumulator() for b in block_sizes]
+        self.running = [blocking.RunningVariance() for b in block_sizes]
+        self.blocks = []
+        self.radii = None
+
+    def add(self, frm, factor, multiref=False):
+        """Add the frame frm, and complete the blocks which are full."""
+        for (k, b) in enumerate(self.block_sizes):
+            self.current[k].add(frm, with_shell_Hxx=multiref)
+            if (self.current[k].n_frames == b):
+                block = base.Container()
+                self.current[k].put(block)
+                rescale_average(block, old_div(np.float_(factor), np.float_(b)), multiref)
+                histograms = block.get_data(base.loc_histograms)
+                self.running[k].add(histograms)
+                if self.radii is None:
+                    self.radii = histograms['radii']
+                if (k == 0):
+                    del block.data['log']
+                    self.blocks.append(block.data)
+                self.current[k] = AverageAccumulator()
+
+    def put(self, frm_out):
+        """Put the standard errors and the block means into the container
+        frm_out, incomplete blocks at the end are discarded."""
+        for (k, b) in enumerate(self.block_sizes):
+            if (self.running[k].n == 0):
+                continue
+            stderr = self.running[k].stderr()
+            stderr['radii'] = self.radii
+            species.put_view(frm_out, blocking.loc_histograms_stderr + '/' + str(b), stderr)
+        if (len(self.blocks) > 0):
+            species.put_view(frm_out, blocking.loc_error_blocks,
+                             {str(j): block for (j, block) in enumerate(self.blocks)})
+
+
 class Average(base.Filter):
-    """a filter that averages over histograms"""
+    """a filter that averages over histograms
+
+    Inside a parallel region, i.e. placed directly before the ParallelJoin
+    filter, the Average filter accumulates partial sums per block of n_avg
+    frames which are merged by the ParallelJoin filter.  The blocks are
+    determined from the frame numbers assigned by the ParallelFork filter,
+    such that the result is identical to the one of a sequential pipeline.
+
+    With error_block_sizes, the frames of each averaged frame are moreover
+    split into blocks of consecutive frames to estimate the standard errors of
+    the averaged histograms in the same pass, see <lib/blocking.py>.
+
+    When averaging over all frames, the running sums are stored in the output
+    frame, such that frames can be appended later on, see <lib/incremental.py>.
+    With checkpoints enabled, the running sums are moreover written to a
+    checkpoint file every `checkpoint` frames, see <lib/checkpoint.py>.
+    """
     _depends = []
     _conflicts = []
+    # container locations, see <lib/prune.py>
+    _consumes = AverageAccumulator.sum_locations + AverageAccumulator.append_locations
+    _produces = AverageAccumulator.sum_locations + AverageAccumulator.append_locations + \
+        [blocking.loc_histograms_stderr, blocking.loc_error_blocks, incremental.loc_average_state]
 
-    def __init__(self, n_avg=1, factor=1.0, source=-1, verbose=False):
+    def __init__(self, n_avg=1, factor=1.0, error_block_sizes=None, append_state=None,
+                 checkpoint=0, checkpoint_file=None, source=-1, verbose=False):
         if isinstance(n_avg, basestring) and ("all" in n_avg):
             self.n_avg = 0
             self.all = True
@@ -145,6 +438,17 @@ class Average(base.Filter):
             raise ValueError("n_avg must be an integer or the string 'all'")
         # custom factor applied when averaging
         self.factor = factor
+        # block sizes used to estimate the standard errors
+        self.error_block_sizes = blocking.get_block_sizes(error_block_sizes)
+        # running sums of a previous run to be continued, set by <lib/incremental.py>
+        self.append_state = append_state
+        if (self.append_state is not None) and not self.all:
+            raise ValueError("appending frames requires n_avg: all")
+        # checkpoints of the running sums, set by <lib/checkpoint.py>
+        self.checkpoint = checkpoint
+        self.checkpoint_file = checkpoint_file
+        if (self.checkpoint > 0) and (len(self.error_block_sizes) > 0):
+            raise ValueError("checkpoints are not supported in combination with error_block_sizes")
         self.src = source
         self.verb = verbose
         self.count = 0
@@ -156,19 +460,8 @@ class Average(base.Filter):
         frm_out.i = frm_in.i
         # --- perform averaging on histograms
         val = old_div(np.float_(self.factor), np.float_(n_avg))
-        # --- rescale distance histograms
-        if frm_out.contains_key(base.loc_histograms):
-            X = frm_out.get_data(base.loc_histograms)
-            dict_util.scale_values(X, val)
-        # --- multiref: rescale shell XX histogram
-        if (virtual_param is not None and self.geometry == 'MultiReferenceStructure'):
-            if frm_out.contains_key(base.loc_shell_Hxx):
-                X = frm_out.get_data(base.loc_shell_Hxx)
-                dict_util.scale_values(X, val)
-        # --- rescale length histograms
-        if frm_out.contains_key(base.loc_len_histograms):
-            X = frm_out.get_data(base.loc_len_histograms)
-            dict_util.scale_values(X, val)
+        multiref = (virtual_param is not None and self.geometry == 'MultiReferenceStructure')
+        rescale_average(frm_out, val, multiref)
         # ---
         frm_out.put_data('log', frm_in.get_data('log'))
         frm_out.put_meta(self.get_meta(n_avg=n_avg))
@@ -185,79 +478,126 @@ class Average(base.Filter):
         label = 'Average'
         param = {'n_avg': n_avg,
                  'all': self.all,
-                 'factor': self.factor}
+                 'factor': self.factor,
+                 'error_block_sizes': self.error_block_sizes}
         meta[label] = param
         return meta
 
     def __iter__(self):
         return self
 
-    def __next__(self):
+    def wrap_partial(self, partial):
+        """Return a container carrying the partial sums to the ParallelJoin filter."""
         frm_out = base.Container()
+        species.put_view(frm_out, base.loc_parallel + '/partial', partial)
+        if self.verb:
+            print("Average.next() : partial block", partial.key)
+        return frm_out
+
+    def write_checkpoint(self, frm_in, accumulator):
+        """Write the running sums over all frames up to frm_in to the checkpoint file."""
+        state = accumulator.get_state()
+        state['n_appended'] = np.array([self.count])
+        states = checkpoint_lib.collect_states(self.src)
+        states['Average'] = {'append_state': state}
+        checkpoint_lib.write(self.checkpoint_file,
+                             checkpoint_lib.make_checkpoint(frm_in, self.checkpoint, 'Average', states))
+
+    def new_error_accumulator(self):
+        """Return an accumulator for the error estimates, or None."""
+        if (len(self.error_block_sizes) > 0):
+            return BlockErrorAccumulator(self.error_block_sizes)
+        else:
+            return None
+
+    def __next__(self):
+        if self.append_state is not None:
+            accumulator = AverageAccumulator.from_state(self.append_state)
+        else:
+            accumulator = AverageAccumulator()
+        n_previous = accumulator.n_frames
+        errors = self.new_error_accumulator()
+        partial = None
+        frm_in = None
+        virtual_param = None
         for frm_tmp in next(self.src):
             # handle None correctly (used as a sign to abandon ship in parallel pipelines)
             # in combination with the remainder treatment below (which needs the last frm_in)
             if frm_tmp is not None:
-                frm_in = copy.deepcopy(frm_tmp)
+                frm_in = frm_tmp
                 self.geometry = frm_in.get_geometry()
                 # --- multiref: scale histograms containing virtual particles
                 virtual_param = frm_in.query_meta('VirtualParticles')
-                if (virtual_param is not None and self.geometry == 'MultiReferenceStructure'):
-                    frm_in = scaleVirtualHistograms(frm_in)
+                multiref = (virtual_param is not None and self.geometry == 'MultiReferenceStructure')
+                if multiref:
+                    # the scaling operates in place, the input frame is left untouched
+                    frm_in = scaleVirtualHistograms(copy.deepcopy(frm_in))
                 # --- take into account the histogram sample parameter when averaging
                 if (self.count == 0):
                     histo_par = util.search_pipeline('histograms', frm_in.get_meta())
                     if (histo_par is not None) and (len(histo_par) > 0):
                         histo_sample = histo_par['histogram']['sum']
                         self.factor = self.factor / float(histo_sample)
-                # --- sum distance histograms
-                if not frm_out.contains_key(base.loc_histograms + '/radii'):
-                    frm_out.put_data(base.loc_histograms + '/radii',
-                                     frm_in.get_data(base.loc_histograms + '/radii'))
-                X = frm_out.get_data(base.loc_histograms)
-                Y = frm_in.get_data(base.loc_histograms)
-                dict_util.sum_values(X, Y)
-                # --- sum shell H_xx(r)
-                if (virtual_param is not None and self.geometry == 'MultiReferenceStructure'):
-                    if not frm_out.contains_key(base.loc_shell_Hxx):
-                        frm_out.put_data(base.loc_shell_Hxx, frm_in.get_data(base.loc_shell_Hxx))
-                    X = frm_out.get_data(base.loc_shell_Hxx)
-                    Y = frm_in.get_data(base.loc_shell_Hxx)
-                    dict_util.sum_values(X, Y)
-                # --- sum length histograms (only present with Sphere geometry)
-                if frm_in.contains_key(base.loc_len_histograms):
-                    if not frm_out.contains_key(base.loc_len_histograms + '/radii'):
-                        frm_out.put_data(base.loc_len_histograms + '/radii',
-                                         frm_in.get_data(base.loc_len_histograms + '/radii'))
-                    X = frm_out.get_data(base.loc_len_histograms)
-                    Y = frm_in.get_data(base.loc_len_histograms)
-                    dict_util.sum_values(X, Y)
-                # --- append particle numbers
-                if frm_in.contains_key(base.loc_nr_particles):
-                    frm_out.append_data(frm_in, base.loc_nr_particles)
-                # --- append periodic box volumes
-                if frm_in.contains_key(base.loc_volumes):
-                    frm_out.append_data(frm_in, base.loc_volumes)
-                # ---
+                # --- parallel region: accumulate partial sums per block
+                if frm_in.contains_key(base.loc_parallel + '/number'):
+                    if (errors is not None) or (n_previous > 0):
+                        raise RuntimeError("Average: error estimates and appending are not supported in parallel regions")
+                    number = frm_in.get_data(base.loc_parallel + '/number')
+                    if self.all:
+                        key = 0
+                    else:
+                        key = number // self.n_avg
+                    # the frames arrive in ascending order, a block is done
+                    # on the present worker as soon as the next one starts
+                    if (partial is not None) and (partial.key != key):
+                        yield self.wrap_partial(partial)
+                        partial = None
+                    if partial is None:
+                        partial = AveragePartial(key, self.n_avg, self.factor, multiref, self.get_meta())
+                    partial.add(frm_in, number)
+                    self.count += 1
+                    continue
+                # --- sum distance, shell H_xx (multiref only), and length histograms,
+                # collect particle numbers and periodic box volumes
+                accumulator.add(frm_in, with_shell_Hxx=multiref)
+                if errors is not None:
+                    errors.add(frm_in, self.factor, multiref)
                 self.count += 1
+                if self.all and (self.checkpoint > 0) and (self.count % self.checkpoint == 0):
+                    self.write_checkpoint(frm_in, accumulator)
                 # deliver a frame averaged over n_avg frames
                 if (not self.all) and (self.count % self.n_avg == 0):
+                    frm_out = base.Container()
+                    accumulator.put(frm_out)
+                    if errors is not None:
+                        errors.put(frm_out)
                     self.apply_rescaling(frm_in, frm_out, self.n_avg, virtual_param)
                     if self.verb:
                         print("Average.next() :", frm_in.i)
                     yield frm_out
                     del frm_out
-                    frm_out = base.Container()
+                    accumulator = AverageAccumulator()
+                    errors = self.new_error_accumulator()
         # rescale and deliver a single frame if averaging over all frames is desired
         # OR
         # treat a remainder properly
         remainder_avg = -1
-        if self.all:
-            remainder_avg = self.count
+        if partial is not None:
+            yield self.wrap_partial(partial)
+        elif self.all:
+            remainder_avg = n_previous + self.count
         elif (self.count % self.n_avg > 0):
             remainder_avg = self.count % self.n_avg
             print("Average.next(): averaged over " + str(remainder_avg) + " remainder histograms")
         if (remainder_avg > 0):
+            frm_out = base.Container()
+            if self.all:
+                state = accumulator.get_state()
+                state['n_appended'] = np.array([self.count])
+                species.put_view(frm_out, incremental.loc_average_state, state)
+            accumulator.put(frm_out)
+            if errors is not None:
+                errors.put(frm_out)
             self.apply_rescaling(frm_in, frm_out, remainder_avg, virtual_param)
             if self.verb:
                 print("Average.next() :", frm_in.i)
@@ -22,9 +22,11 @@ from cadishi import base
 from cadishi import util
 
 from ...lib import rdf
+from ...lib import rebin
 from ...lib import selection
 from ...lib import formFactor as ff
 from ...lib import pyntensities as pynt
+from ...lib import blocking
 
 
 def _make_2d(dict_in):
@@ -74,6 +76,10 @@ class DeltaH(base.Filter):
     """A filter that computes the intensity."""
     _depends = ["Solvent"]
     _conflicts = []
+    # container locations, see <lib/prune.py>
+    _consumes = [base.loc_solv_match, base.loc_histograms, base.loc_len_histograms,
+                 base.loc_nr_particles, blocking.loc_error_blocks]
+    _produces = [base.loc_intensity, base.loc_delta_h]
 
     def __init__(self,
                  form_factor_file='atomsf.dat',
@@ -107,6 +113,7 @@ class DeltaH(base.Filter):
         param = {'form_factor_file': self.form_factor_file,
                  'nq': self.nq,
                  'dq': self.dq,
+                 'debug': self.debug,
                  # --- we keep the following two entries for log purposes
                  'geometry': self.geometry,
                  'x_particle_method': self.x_particle_method}
@@ -116,308 +123,328 @@ class DeltaH(base.Filter):
     def __iter__(self):
         return self
 
-    def __next__(self):
-        for hs in next(self.src):
-            # hs was chosen to mean 'histogram set' ...
-            if hs is not None:
-                assert isinstance(hs, base.Container)
+    def compute(self, hs):
+        """Compute the difference histograms dH, the particle number differences
+        dN, and the intensities, and store them in the container hs."""
+        assert isinstance(hs, base.Container)
 
-                # --- obtain information from the pipeline log
-                dr = hs.query_meta('histograms/histogram/dr')
-                assert (dr is not None)
-                # ---
-                self.geometry = hs.get_geometry()
-                assert (self.geometry is not None)
-                geometry_param = hs.query_meta(self.geometry)
-                assert (geometry_param is not None)
-                if (self.geometry == 'Sphere' or self.geometry == 'Cuboid' or self.geometry == 'Ellipsoid'):
-                    V = geometry_param['volume']
-                    assert (V is not None)
-                    # VAvg is neede below for MultiReference, where V=1 for histograms
-                    # but VAvg is used for densities
-                    VAvg = V
+        # --- obtain information from the pipeline log
+        dr = hs.query_meta('histograms/histogram/dr')
+        assert (dr is not None)
+        # ---
+        self.geometry = hs.get_geometry()
+        assert (self.geometry is not None)
+        geometry_param = hs.query_meta(self.geometry)
+        assert (geometry_param is not None)
+        if (self.geometry == 'Sphere' or self.geometry == 'Cuboid' or self.geometry == 'Ellipsoid'):
+            V = geometry_param['volume']
+            assert (V is not None)
+            # VAvg is neede below for MultiReference, where V=1 for histograms
+            # but VAvg is used for densities
+            VAvg = V
+        else:
+            # --- for non-sphere geometries, we calculate V using x particles below
+            V = None
+        # ---
+        virtual_param = hs.query_meta('VirtualParticles')
+        if (virtual_param is not None):
+            self.x_particle_method = virtual_param['method']
+            xrho = virtual_param['x_density']
+        # ---
+        rdf_header = list((hs.get_data(base.loc_solv_match + '/g_scaled')).keys())
+        rdf_header.remove('radii')
+        rdf_elements = util.get_elements(rdf_header)
+        n_solv = len(rdf_elements)
+        hs_full = selection.get_full(hs)
+        n_part_elements = util.get_elements(list(hs_full.get_data(base.loc_nr_particles).keys()))
+        histo_elements = util.get_elements(list(hs_full.get_data(base.loc_histograms).keys()))
+        # --- print '###', n_part_elements, histo_elements
+        assert (n_part_elements == histo_elements)
+        n_prot = len(histo_elements)
+        if (self.debug):
+            print(" rdf_header", rdf_header)
+            print(" rdf_elements", rdf_elements)
+            print(" n_solv =", n_solv)
+            print(" n_prot=", n_prot)
+
+        histo = copy.deepcopy(hs_full.get_data(base.loc_histograms))
+        nr = len(hs_full.get_data(base.loc_histograms + '/radii'))
+        for key in list(histo.keys()):
+            if (key == 'radii'):
+                continue
+            histo[key] *= 2.0
+
+        # --- NOTE : in the following, we're sorting out the virtual particles
+        H, Hx = _separate_ghosts_from_histogram(histo)
+
+        # --- consistency checks of the radii
+        g_scaled = hs.get_data(base.loc_solv_match + '/g_scaled')
+        radii_2 = hs_full.get_data(base.loc_histograms + '/radii')[0:nr]
+        eps = 1.e-9
+        if (len(g_scaled['radii']) < nr) or np.any(np.fabs(g_scaled['radii'][0:nr] - radii_2) >= eps):
+            # e.g. g_scaled read from a file obtained with a different bin size
+            g_scaled = rebin.regrid_rdf_dict(g_scaled, radii_2, dr)
+        assert (len(g_scaled['radii']) >= nr)
+        radii_1 = g_scaled['radii'][0:nr]
+        assert np.all(np.fabs(radii_1 - radii_2) < eps)
+        #
+        rdf_expanded = {}
+        for key in list(g_scaled.keys()):
+            # Note: g_scaled dictionary includes the radii array
+            rdf_expanded[key] = np.zeros(nr)
+            (rdf_expanded[key])[0:nr] = (g_scaled[key])[0:nr]
+        rdf_org = copy.deepcopy(rdf_expanded)
+        # ---
+        if (self.debug):
+            hs.put_data(base.loc_delta_h + '/debug/rdf_org', rdf_org)
+        rho = hs.get_data(base.loc_solv_match + '/rho')
+        # ---
+        for key in list(rdf_expanded.keys()):
+            # zero densities as done in the reference code <deltaH.py>
+            if (key == 'radii'):
+                continue
+            (rdf_expanded[key])[0] = 0.0
+
+        if (self.geometry == 'Sphere') and (self.x_particle_method is None):
+            # print "### delta_H :: SPHERE BRANCH ###"
+            R = geometry_param['radius']
+            dHs = copy.deepcopy(H)
+            for key in list(dHs.keys()):
+                if (key == 'radii'):
+                    continue
+                (dHs[key])[:] = 0.0
+            dHp = copy.deepcopy(dHs)
+            dH = copy.deepcopy(dHs)
+            # ---
+            assert hs.contains_key(base.loc_len_histograms)
+            # --- construct h matrix
+            x_list = hs.get_data(base.loc_len_histograms + '/radii')
+            r_list = H['radii']
+            # --- implement h using a dictionary
+            h_dict = {}
+            for key in hs.get_keys(base.loc_len_histograms):
+                h_dict[key] = np.zeros(len(r_list))
+            h_dict['radii'][:] = r_list[:]
+            # ---
+            pSphere = np.zeros((r_list.shape[0], 2))
+            pSphere[:, 0] = r_list[:]
+            # ---
+            for j, rv in enumerate(r_list):
+                pSphere[j, 1] = rdf.P(rv, R)
+            if (self.debug):
+                hs.put_data(base.loc_delta_h + '/debug/pSphere', pSphere)
+            # ---
+            dx = dr  # DANGER! However, these two should be the same anyway!
+            # ---
+            getSr = rdf.SrFast
+            print()
+            for j, rv in enumerate(r_list):
+                if self.verb and (j % 1000 == 0):
+                    print(" DeltaH:bin ", j)
+                Sr = getSr(x_list, R, rv)
+                for key in hs.get_keys(base.loc_len_histograms, skip_keys=['radii']):
+                    (h_dict[key])[j] += (hs.get_data(base.loc_len_histograms + '/' + key)[:] * Sr[:]).sum(axis=0)
+
+            for key in hs.get_keys(base.loc_len_histograms, skip_keys=['radii']):
+                h_dict[key] *= 2.0 * dx / V
+                # --- patch rho[] such that it can be used in the block below
+                if key not in rho:
+                    rho[key] = 0.0
+
+            for key in sorted(H.keys()):
+                if (key == 'radii'):
+                    continue
+                # --- patch rdf_expanded such that it can be used below
+                if key not in rdf_expanded:
+                    rdf_expanded[key] = np.zeros(nr)
+                    # ---
+                (el1, el2) = key.split(',')
+                if (el1 == el2):
+                    fac = 1.0
                 else:
-                    # --- for non-sphere geometries, we calculate V using x particles below
-                    V = None
+                    fac = 2.0
                 # ---
-                virtual_param = hs.query_meta('VirtualParticles')
-                if (virtual_param is not None):
-                    self.x_particle_method = virtual_param['method']
-                    xrho = virtual_param['x_density']
+                (dHs[key])[:] = fac * ((rdf_expanded[key])[:] - 2.0) \
+                    * rho[el1] * rho[el2] * V * V * pSphere[:, 1] * dr  # Hx[:,ixx]
                 # ---
-                rdf_header = list((hs.get_data(base.loc_solv_match + '/g_scaled')).keys())
-                rdf_header.remove('radii')
-                rdf_elements = util.get_elements(rdf_header)
-                n_solv = len(rdf_elements)
-                hs_full = selection.get_full(hs)
-                n_part_elements = util.get_elements(list(hs_full.get_data(base.loc_nr_particles).keys()))
-                histo_elements = util.get_elements(list(hs_full.get_data(base.loc_histograms).keys()))
-                # --- print '###', n_part_elements, histo_elements
-                assert (n_part_elements == histo_elements)
-                n_prot = len(histo_elements)
-                if (self.debug):
-                    print(" rdf_header", rdf_header)
-                    print(" rdf_elements", rdf_elements)
-                    print(" n_solv =", n_solv)
-                    print(" n_prot=", n_prot)
-
-                histo = copy.deepcopy(hs_full.get_data(base.loc_histograms))
-                nr = len(hs_full.get_data(base.loc_histograms + '/radii'))
-                for key in list(histo.keys()):
-                    if (key == 'radii'):
+                if (fac == 1):
+                    (dHp[key])[:] = (H[key])[:] - V * rho[el1] * (h_dict[el1])[:]  # *Hx[:,ix1]
+                else:
+                    (dHp[key])[:] = (H[key])[:] - V * (rho[el2] * (h_dict[el1])[:] +
+                                                       rho[el1] * (h_dict[el2])[:])
+                # ---
+                (dH[key])[:] = (dHp[key])[:] - (dHs[key])[:]
+        else:
+            # --- virtual particle method branch
+            # print "delta_h "
+            nx = np.mean(hs_full.get_data(base.loc_nr_particles + '/X'), dtype=np.float64)
+            if not (self.geometry == 'Sphere' or self.geometry == 'Cuboid' or self.geometry == 'Ellipsoid'):
+                V = old_div(nx, xrho)
+            VAvg = V
+            if (self.geometry == 'MultiReferenceStructure'):
+                V = 1.
+                # print " V =", V, "VAvg =", VAvg
+            else:
+                for key in Hx:
+                    if key in 'radii':
                         continue
-                    histo[key] *= 2.0
-
-                # --- NOTE : in the following, we're sorting out the virtual particles
-                H, Hx = _separate_ghosts_from_histogram(histo)
-
-                # --- consistency checks of the radii
-                assert (len(hs.get_data(base.loc_solv_match + '/g_scaled/radii')) >= nr)
-                radii_1 = hs.get_data(base.loc_solv_match + '/g_scaled/radii')[0:nr]
-                radii_2 = hs_full.get_data(base.loc_histograms + '/radii')[0:nr]
-                eps = 1.e-9
-                assert np.all(np.fabs(radii_1 - radii_2) < eps)
-                #
-                rdf_expanded = {}
-                for key in list((hs.get_data(base.loc_solv_match + '/g_scaled')).keys()):
-                    # Note: g_scaled dictionary includes the radii array
+                    pair = key.split(',')
+                    assert (len(pair) == 2)
+                    if (pair[0] == 'X') and (pair[1] == 'X'):
+                        Hx[key] /= (Hx[key]).sum()
+                    else:
+                        Hx[key] /= nx
+            # ---
+            dHs = copy.deepcopy(H)
+            for key in list(dHs.keys()):
+                if (key == 'radii'):
+                    continue
+                (dHs[key])[:] = 0.0
+            dHp = copy.deepcopy(dHs)
+            dH = copy.deepcopy(dHs)
+            # ---
+            for key in sorted(H.keys()):
+                if (key == 'radii'):
+                    continue
+                # --- patch rdf_expanded such that it can be used below
+                if key not in rdf_expanded:
                     rdf_expanded[key] = np.zeros(nr)
-                    (rdf_expanded[key])[0:nr] = (hs.get_data(base.loc_solv_match + '/g_scaled/' + key))[0:nr]
-                rdf_org = copy.deepcopy(rdf_expanded)
                 # ---
-                if (self.debug):
-                    hs.put_data(base.loc_delta_h + '/debug/rdf_org', rdf_org)
-                rho = hs.get_data(base.loc_solv_match + '/rho')
+                (el1, el2) = key.split(',')
+                # --- patch rho such that it can be used below
+                for el in [el1, el2]:
+                    if el not in rho:
+                        rho[el] = 0.0
                 # ---
-                for key in list(rdf_expanded.keys()):
-                    # zero densities as done in the reference code <deltaH.py>
-                    if (key == 'radii'):
-                        continue
-                    (rdf_expanded[key])[0] = 0.0
-
-                if (self.geometry == 'Sphere') and (self.x_particle_method is None):
-                    # print "### delta_H :: SPHERE BRANCH ###"
-                    R = geometry_param['radius']
-                    dHs = copy.deepcopy(H)
-                    for key in list(dHs.keys()):
-                        if (key == 'radii'):
-                            continue
-                        (dHs[key])[:] = 0.0
-                    dHp = copy.deepcopy(dHs)
-                    dH = copy.deepcopy(dHs)
-                    # ---
-                    assert hs.contains_key(base.loc_len_histograms)
-                    # --- construct h matrix
-                    x_list = hs.get_data(base.loc_len_histograms + '/radii')
-                    r_list = H['radii']
-                    # --- implement h using a dictionary
-                    h_dict = {}
-                    for key in hs.get_keys(base.loc_len_histograms):
-                        h_dict[key] = np.zeros(len(r_list))
-                    h_dict['radii'][:] = r_list[:]
-                    # ---
-                    pSphere = np.zeros((r_list.shape[0], 2))
-                    pSphere[:, 0] = r_list[:]
-                    # ---
-                    for j, rv in enumerate(r_list):
-                        pSphere[j, 1] = rdf.P(rv, R)
-                    if (self.debug):
-                        hs.put_data(base.loc_delta_h + '/debug/pSphere', pSphere)
-                    # ---
-                    dx = dr  # DANGER! However, these two should be the same anyway!
-                    # ---
-                    getSr = rdf.SrFast
-                    print()
-                    for j, rv in enumerate(r_list):
-                        if self.verb and (j % 1000 == 0):
-                            print(" DeltaH:bin ", j)
-                        Sr = getSr(x_list, R, rv)
-                        for key in hs.get_keys(base.loc_len_histograms, skip_keys=['radii']):
-                            (h_dict[key])[j] += (hs.get_data(base.loc_len_histograms + '/' + key)[:] * Sr[:]).sum(axis=0)
-
-                    for key in hs.get_keys(base.loc_len_histograms, skip_keys=['radii']):
-                        h_dict[key] *= 2.0 * dx / V
-                        # --- patch rho[] such that it can be used in the block below
-                        if key not in rho:
-                            rho[key] = 0.0
-
-                    for key in sorted(H.keys()):
-                        if (key == 'radii'):
-                            continue
-                        # --- patch rdf_expanded such that it can be used below
-                        if key not in rdf_expanded:
-                            rdf_expanded[key] = np.zeros(nr)
-                            # ---
-                        (el1, el2) = key.split(',')
-                        if (el1 == el2):
-                            fac = 1.0
-                        else:
-                            fac = 2.0
-                        # ---
-                        (dHs[key])[:] = fac * ((rdf_expanded[key])[:] - 2.0) \
-                            * rho[el1] * rho[el2] * V * V * pSphere[:, 1] * dr  # Hx[:,ixx]
-                        # ---
-                        if (fac == 1):
-                            (dHp[key])[:] = (H[key])[:] - V * rho[el1] * (h_dict[el1])[:]  # *Hx[:,ix1]
-                        else:
-                            (dHp[key])[:] = (H[key])[:] - V * (rho[el2] * (h_dict[el1])[:] +
-                                                               rho[el1] * (h_dict[el2])[:])
-                        # ---
-                        (dH[key])[:] = (dHp[key])[:] - (dHs[key])[:]
+                if (el1 == el2):
+                    fac = 1.0
                 else:
-                    # --- virtual particle method branch
-                    # print "delta_h "
-                    nx = np.mean(hs_full.get_data(base.loc_nr_particles + '/X'), dtype=np.float64)
-                    if not (self.geometry == 'Sphere' or self.geometry == 'Cuboid' or self.geometry == 'Ellipsoid'):
-                        V = old_div(nx, xrho)
-                    VAvg = V
-                    if (self.geometry == 'MultiReferenceStructure'):
-                        V = 1.
-                        # print " V =", V, "VAvg =", VAvg
-                    else:
-                        for key in Hx:
-                            if key in 'radii':
-                                continue
-                            pair = key.split(',')
-                            assert (len(pair) == 2)
-                            if (pair[0] == 'X') and (pair[1] == 'X'):
-                                Hx[key] /= (Hx[key]).sum()
-                            else:
-                                Hx[key] /= nx
-                    # ---
-                    dHs = copy.deepcopy(H)
-                    for key in list(dHs.keys()):
-                        if (key == 'radii'):
-                            continue
-                        (dHs[key])[:] = 0.0
-                    dHp = copy.deepcopy(dHs)
-                    dH = copy.deepcopy(dHs)
-                    # ---
-                    for key in sorted(H.keys()):
-                        if (key == 'radii'):
-                            continue
-                        # --- patch rdf_expanded such that it can be used below
-                        if key not in rdf_expanded:
-                            rdf_expanded[key] = np.zeros(nr)
-                        # ---
-                        (el1, el2) = key.split(',')
-                        # --- patch rho such that it can be used below
-                        for el in [el1, el2]:
-                            if el not in rho:
-                                rho[el] = 0.0
-                        # ---
-                        if (el1 == el2):
-                            fac = 1.0
-                        else:
-                            fac = 2.0
-                        # ---
-                        (dHs[key])[:] = fac * ((rdf_expanded[key])[:] - 2.0) \
-                            * rho[el1] * rho[el2] * V * V * Hx['X,X']
-                        # ---
-                        if (fac == 1):
-                            (dHp[key])[:] = (H[key])[:] - V * rho[el1] * (Hx[el1 + ',X'])[:]
-                        else:
-                            (dHp[key])[:] = (H[key])[:] - V * (rho[el2] * (Hx[el1 + ',X'])[:] +
-                                                               rho[el1] * (Hx[el2 + ',X'])[:])
-                        # ---
-                        (dH[key])[:] = (dHp[key])[:] - (dHs[key])[:]
+                    fac = 2.0
                 # ---
-                if (self.debug):
-                    hs.put_data(base.loc_delta_h + '/debug/rdf_expanded', rdf_expanded)
-                    hs.put_data(base.loc_delta_h + '/debug/dHs', dHs)
-                    hs.put_data(base.loc_delta_h + '/debug/dHp', dHp)
-                    hs.put_data(base.loc_delta_h + '/debug/dH', dH)
-                    hs.put_data(base.loc_delta_h + '/debug/H', H)
-                    hs.put_data(base.loc_delta_h + '/debug/rho', rho)
-                    hs.put_data(base.loc_delta_h + '/debug/h_dict', h_dict)
-
+                (dHs[key])[:] = fac * ((rdf_expanded[key])[:] - 2.0) \
+                    * rho[el1] * rho[el2] * V * V * Hx['X,X']
                 # ---
-                hs.put_data(base.loc_intensity + '/dH', dH)
-
-                # --- calculate average particle numbers
-                nr_part_avg = {}
-                for key in hs_full.get_keys(base.loc_nr_particles):
-                    nr_part = hs_full.get_data(base.loc_nr_particles + '/' + key)
-                    nr_part_avg[key] = nr_part.sum(axis=0) / float(nr_part.shape[0])
-                # --- calculate difference
-                nr_part_diff = {}
-                for key in nr_part_avg:
-                    if key in rho:
-                        nr_part_diff[key] = nr_part_avg[key] - rho[key] * VAvg
-                    else:
-                        nr_part_diff[key] = nr_part_avg[key]
+                if (fac == 1):
+                    (dHp[key])[:] = (H[key])[:] - V * rho[el1] * (Hx[el1 + ',X'])[:]
+                else:
+                    (dHp[key])[:] = (H[key])[:] - V * (rho[el2] * (Hx[el1 + ',X'])[:] +
+                                                       rho[el1] * (Hx[el2 + ',X'])[:])
+                # ---
+                (dH[key])[:] = (dHp[key])[:] - (dHs[key])[:]
+        # ---
+        if (self.debug):
+            hs.put_data(base.loc_delta_h + '/debug/rdf_expanded', rdf_expanded)
+            hs.put_data(base.loc_delta_h + '/debug/dHs', dHs)
+            hs.put_data(base.loc_delta_h + '/debug/dHp', dHp)
+            hs.put_data(base.loc_delta_h + '/debug/dH', dH)
+            hs.put_data(base.loc_delta_h + '/debug/H', H)
+            hs.put_data(base.loc_delta_h + '/debug/rho', rho)
+            hs.put_data(base.loc_delta_h + '/debug/h_dict', h_dict)
 
-                hs.put_data(base.loc_intensity + '/dN', nr_part_diff)
+        # ---
+        hs.put_data(base.loc_intensity + '/dH', dH)
+
+        # --- calculate average particle numbers
+        nr_part_avg = {}
+        for key in hs_full.get_keys(base.loc_nr_particles):
+            nr_part = hs_full.get_data(base.loc_nr_particles + '/' + key)
+            nr_part_avg[key] = nr_part.sum(axis=0) / float(nr_part.shape[0])
+        # --- calculate difference
+        nr_part_diff = {}
+        for key in nr_part_avg:
+            if key in rho:
+                nr_part_diff[key] = nr_part_avg[key] - rho[key] * VAvg
+            else:
+                nr_part_diff[key] = nr_part_avg[key]
 
-                # --- INTENSITY CALCULATION ---
+        hs.put_data(base.loc_intensity + '/dN', nr_part_diff)
 
-                # --- read atom form factors from file
-                ff_dict = ff.readAtomSFParam(self.form_factor_file)
+        # --- INTENSITY CALCULATION ---
 
-                # --- prepare 2D input array for library routine
-                (dH_2d, dH_2d_keys) = _make_2d(dH)
-                if (self.debug):
-                    hs.put_data(base.loc_delta_h + '/debug/dH_2d', dH_2d)
-                # ---
-                _pIntInter, dInter = pynt.intensitiesFFFaster(self.nq, self.dq,
-                                                              dH_2d, dH_2d_keys, ff_dict, 1)
-                # # --- prepare input
-                # nr_part_keys = sorted(nr_part_diff.keys())
-                # nr_part_vals = []
-                # for key in nr_part_keys:
-                #     nr_part_vals.append(nr_part_diff[key])
-                # # ---
-                # _pIntIntra, dIntra = pynt.intensitiesFFIntraAtom(self.nq, self.dq, \
-                #                             nr_part_vals, nr_part_keys, ff_dict)
-                # # ---
-                # hs.put_data(base.loc_intensity+'/dI_inter', dInter)
-                # hs.put_data(base.loc_intensity+'/dI_intra', dIntra)
-                dI = dInter.copy()
-                # TODO: check, the following line was commented out in <deltaH.py>
-                # dI[:,1] += dIntra[:,1]
-                hs.put_data(base.loc_intensity + '/dI', dI)
-
-                # --- prepare 2D input array for library routine
-                #     (cannot use _make_2d() routine here)
-                n_row = len(rdf_org['radii'])
-                n_col = len(list(dH.keys()))
-                rdf_org_2d = np.zeros((n_row, n_col))
-                rdf_org_2d[:, 0] = (rdf_org['radii'])[:]
-                rdf_org_2d_keys = sorted(rdf_org.keys())
-                rdf_org_2d_keys.remove('radii')
-                for key in rdf_org_2d_keys:
-                    if key in dH_2d_keys:
-                        idx = dH_2d_keys.index(key) + 1
-                        rdf_org_2d[:, idx] = (rdf_org[key])[:]
-                # ---
-                rho_list = []
-                rho_keys = sorted(rho.keys())
-                for key in ['X', 'X1', 'X2']:
-                    if key in rho_keys:
-                        rho_keys.remove(key)
-                for key in rho_keys:
-                    rho_list.append(rho[key])
-                # ---
-                if (self.debug):
-                    hs.put_data(base.loc_delta_h + '/debug/rdf_org_2d', rdf_org_2d)
-                # ---
-                bulkH = pynt.getBulkIntegrand(rdf_org_2d, rho_list)
-                bulkH_keys = dH_2d_keys
-                # print "bulkH_keys", bulkH_keys
-                _pIntInter, dIntensityInter = pynt.intensitiesFFFaster(self.nq,
-                                                                       self.dq, bulkH, bulkH_keys, ff_dict, dr)
-                _pIntIntra, dIntensityIntra = pynt.intensitiesFFIntraAtom(self.nq,
-                                                                          self.dq, rho_list, rho_keys, ff_dict)
-                dIntensity = dIntensityInter.copy()
-                dIntensity[:, 1] += dIntensityIntra[:, 1]
-                # ---
-                hs.put_data(base.loc_intensity + '/I_solv_inter', dIntensityInter)
-                hs.put_data(base.loc_intensity + '/I_solv_intra', dIntensityIntra)
-                hs.put_data(base.loc_intensity + '/I_solv', dIntensity)
+        # --- read atom form factors from file
+        ff_dict = ff.readAtomSFParam(self.form_factor_file)
+
+        # --- prepare 2D input array for library routine
+        (dH_2d, dH_2d_keys) = _make_2d(dH)
+        if (self.debug):
+            hs.put_data(base.loc_delta_h + '/debug/dH_2d', dH_2d)
+        # ---
+        _pIntInter, dInter = pynt.intensitiesFFFaster(self.nq, self.dq,
+                                                      dH_2d, dH_2d_keys, ff_dict, 1)
+        # # --- prepare input
+        # nr_part_keys = sorted(nr_part_diff.keys())
+        # nr_part_vals = []
+        # for key in nr_part_keys:
+        #     nr_part_vals.append(nr_part_diff[key])
+        # # ---
+        # _pIntIntra, dIntra = pynt.intensitiesFFIntraAtom(self.nq, self.dq, \
+        #                             nr_part_vals, nr_part_keys, ff_dict)
+        # # ---
+        # hs.put_data(base.loc_intensity+'/dI_inter', dInter)
+        # hs.put_data(base.loc_intensity+'/dI_intra', dIntra)
+        dI = dInter.copy()
+        # TODO: check, the following line was commented out in <deltaH.py>
+        # dI[:,1] += dIntra[:,1]
+        hs.put_data(base.loc_intensity + '/dI', dI)
+
+        # --- prepare 2D input array for library routine
+        #     (cannot use _make_2d() routine here)
+        n_row = len(rdf_org['radii'])
+        n_col = len(list(dH.keys()))
+        rdf_org_2d = np.zeros((n_row, n_col))
+        rdf_org_2d[:, 0] = (rdf_org['radii'])[:]
+        rdf_org_2d_keys = sorted(rdf_org.keys())
+        rdf_org_2d_keys.remove('radii')
+        for key in rdf_org_2d_keys:
+            if key in dH_2d_keys:
+                idx = dH_2d_keys.index(key) + 1
+                rdf_org_2d[:, idx] = (rdf_org[key])[:]
+        # ---
+        rho_list = []
+        rho_keys = sorted(rho.keys())
+        for key in ['X', 'X1', 'X2']:
+            if key in rho_keys:
+                rho_keys.remove(key)
+        for key in rho_keys:
+            rho_list.append(rho[key])
+        # ---
+        if (self.debug):
+            hs.put_data(base.loc_delta_h + '/debug/rdf_org_2d', rdf_org_2d)
+        # ---
+        bulkH = pynt.getBulkIntegrand(rdf_org_2d, rho_list)
+        bulkH_keys = dH_2d_keys
+        # print "bulkH_keys", bulkH_keys
+        _pIntInter, dIntensityInter = pynt.intensitiesFFFaster(self.nq,
+                                                               self.dq, bulkH, bulkH_keys, ff_dict, dr)
+        _pIntIntra, dIntensityIntra = pynt.intensitiesFFIntraAtom(self.nq,
+                                                                  self.dq, rho_list, rho_keys, ff_dict)
+        dIntensity = dIntensityInter.copy()
+        dIntensity[:, 1] += dIntensityIntra[:, 1]
+        # ---
+        hs.put_data(base.loc_intensity + '/I_solv_inter', dIntensityInter)
+        hs.put_data(base.loc_intensity + '/I_solv_intra', dIntensityIntra)
+        hs.put_data(base.loc_intensity + '/I_solv', dIntensity)
 
-                # TODO: Think about stripping unnecessary information
-                # (histograms, length histograms) from hs at this point.
+        # the histograms and length histograms are dropped by a Prune filter
+        # in case they are not written, see <lib/prune.py>
 
+    def __next__(self):
+        for hs in next(self.src):
+            # hs was chosen to mean 'histogram set' ...
+            if hs is not None:
+                self.compute(hs)
+                # --- standard errors of dI from the block means of the Average filter
+                blocks = blocking.get_error_blocks(hs)
+                if (len(blocks) > 0):
+                    running = blocking.RunningVariance()
+                    for block in blocks:
+                        replica = blocking.get_replica(hs, block, [base.loc_intensity, base.loc_delta_h])
+                        self.compute(replica)
+                        running.add({'dI': replica.get_data(base.loc_intensity + '/dI')})
+                        # dH and dN of the block are used by the PDDF filter
+                        block[base.loc_intensity] = {'dH': replica.get_data(base.loc_intensity + '/dH'),
+                                                     'dN': replica.get_data(base.loc_intensity + '/dN')}
+                    hs.put_data(base.loc_intensity + '/dI_stderr', blocking.columns_stderr(running, 'dI'))
                 hs.put_meta(self.get_meta())
                 if self.verb:
                     print("DeltaH.next() :", hs.i)
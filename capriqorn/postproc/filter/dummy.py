@@ -19,6 +19,9 @@ class Dummy(base.Filter):
     """a filter that does nothing"""
     _depends = []
     _conflicts = []
+    # container locations, see <lib/prune.py>
+    _consumes = []
+    _produces = []
 
     def __init__(self, source=-1, verbose=False):
         self.src = source
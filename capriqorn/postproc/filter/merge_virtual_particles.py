@@ -27,6 +27,9 @@ class MergeVirtualParticles(base.Filter):
     in base.Container() instances."""
     _depends = []
     _conflicts = []
+    # container locations, see <lib/prune.py>
+    _consumes = [base.loc_histograms, base.loc_nr_particles, base.loc_len_histograms]
+    _produces = []
 
     def __init__(self, source=-1, verbose=False):
         self.src = source
@@ -14,7 +14,6 @@
 
 # TODO: catch runtime assertions, use meaningful error messages
 
-from six.moves import range
 import numpy as np
 
 from cadishi import base
@@ -25,6 +24,9 @@ class RDF(base.Filter):
     """RDF computation filter."""
     _depends = []
     _conflicts = []
+    # container locations, see <lib/prune.py>
+    _consumes = [base.loc_volumes, base.loc_nr_particles, base.loc_histograms]
+    _produces = [base.loc_rdf]
 
     def __init__(self, source=-1, verbose=False):
         self.src = source
@@ -76,32 +78,39 @@ class RDF(base.Filter):
         vol_inv = np.sum(np.reciprocal(box_volumes))
         vol_inv /= n_samples  # QUESTION: 'norm' in the original code, is this just the number of samples?
 
-        # coefficients repeatedly used by the nested loop below
+        # coefficients of the bins, common to all species pairs
         coeff = 4.0 * np.pi * dr * vol_inv * np.multiply(radii, radii)
 
+        # normalization factors of the species pairs, the histograms are
+        # normalized at once as columns of a (n_bins, n_pairs) array below
         rdf = {}
+        keys = []
+        norms = []
         for key in histogram_keys:
             species_1, species_2 = tuple(key.split(','))
             nr_1 = np.sum(nr_particles[species_1]) / float(n_samples)
             nr_2 = np.sum(nr_particles[species_2]) / float(n_samples)
-            # the particle number in the box is constant, therefor densities are calculated as
-            rho_1 = nr_1 * vol_inv
-            rho_2 = nr_2 * vol_inv
             if (nr_1 * nr_2 > 0):
                 if (species_1 == species_2):
                     fac = 1.0
                 else:
                     fac = 2.0
-                histo = np.copy(histograms[key])
-                for i in range(len(radii)):
-                    histo[i] /= fac * nr_1 * nr_2 * coeff[i]
-                # Factor 2 because distances are only counted once in histograms (r_{ij} and r_{ji} are counted as a single distance)
-                rdf[key] = 2 * histo
-                if (species_1 == species_2):
-                    rdf[key][0] = rho_1
+                keys.append(key)
+                norms.append(fac * nr_1 * nr_2)
             else:
                 if self.verb:
                     print(" RDF: skipping " + key)
+        if (len(keys) > 0):
+            histos = np.column_stack([histograms[key] for key in keys])
+            histos /= np.outer(coeff, norms)
+            # Factor 2 because distances are only counted once in histograms (r_{ij} and r_{ji} are counted as a single distance)
+            histos *= 2
+            for j, key in enumerate(keys):
+                species_1, species_2 = tuple(key.split(','))
+                rdf[key] = histos[:, j].copy()
+                if (species_1 == species_2):
+                    # the particle number in the box is constant, therefore the density is calculated as
+                    rdf[key][0] = np.sum(nr_particles[species_1]) / float(n_samples) * vol_inv
         rdf['radii'] = radii
         # ---
         if self.verb:
@@ -24,12 +24,16 @@ from cadishi.io import hdf5
 
 from ...lib import selection
 from ...lib import rdf
+from ...lib import rebin
 
 
 class Solvent(base.Filter):
     """A filter that performs self-consistent solvent matching."""
     _depends = []
     _conflicts = []
+    # container locations, see <lib/prune.py>
+    _consumes = [base.loc_histograms, base.loc_shell_Hxx, base.loc_nr_particles]
+    _produces = [base.loc_solv_match]
 
     def __init__(self, source=-1,
                  g_ascii_file="rdf.extended.dat",
@@ -49,6 +53,9 @@ class Solvent(base.Filter):
         # --- Note: The following two parameters are obtained from the pipeline log!
         self.geometry = None
         self.x_particle_method = None
+        # --- frame-invariant data, computed on the first frame
+        self._g_tables = None
+        self._g_scaled = None
         # ---
         self.debug = debug
         self.verb = verbose
@@ -69,12 +76,80 @@ class Solvent(base.Filter):
                  'g_scaled_file': self.g_scaled_file,
                  'g_plateau_fraction': self.g_plateau_fraction,
                  'g_noise_fraction': self.g_noise_fraction,
+                 'debug': self.debug,
                  # --- we keep the following two entries for log purposes
                  'geometry': self.geometry,
                  'x_particle_method': self.x_particle_method}
         meta[label] = param
         return meta
 
+    def get_g_tables(self, radii, dr):
+        """Return the dictionary of the reference g-functions (tapered noise,
+        extended to the radii of the histograms) and the interpolator of the
+        matching g-function.  The tables depend only on the parameters of the
+        filter and the radii (bin size dr), they are computed once and reused
+        as long as the radii do not change.
+        """
+        if (self._g_tables is not None) and np.array_equal(self._g_tables['radii'], radii):
+            return self._g_tables
+        if (self._g_tables is not None) and self.verb:
+            print("Solvent.get_g_tables() : radii changed, recomputing the g-functions")
+        debug = {}
+        g_header = (rdf.readHeader(self.g_ascii_file)).rstrip('\n').split()
+        assert (self.g_match in g_header)
+        _g_el_set = set([])
+        for item in g_header:
+            if (item == '#'):
+                continue
+            pair = item.split(',')
+            _g_el_set.add(pair[0])
+            _g_el_set.add(pair[1])  # obsolete
+        g_elements = sorted(list(_g_el_set))
+        # ---
+        g_table_0 = np.loadtxt(self.g_ascii_file)
+
+        g_dr = (g_table_0[1:, 0] - g_table_0[:-1, 0]).mean()
+        # Tapers noise for self.g_noise_fraction<1. Determines and set ginfty in last bins.
+        g_table_0_smooth = rdf.smooth(g_table_0, g_dr, self.g_plateau_fraction,
+                                      self.g_noise_fraction, verb=False)
+        debug['g_table_0_smooth'] = g_table_0_smooth
+        g_table_0 = g_table_0_smooth
+
+        # In case the bin sizes of the histograms and the rdfs differ, interpolate the rdfs
+        # conservatively onto the bins of the histograms.
+        if not np.isclose(g_dr, dr, rtol=1.e-6, atol=0.):
+            if self.verb:
+                print("Solvent.get_g_tables() : rebinning the rdfs from dr =", g_dr, "to dr =", dr)
+            g_table_0 = rebin.regrid_rdf_table(g_table_0, radii, dr)
+            debug['g_table_0_smooth_rebinned'] = g_table_0
+
+        # Extend rdf in distance AFTER noise tapering, where rdf values at largest distance are set to ginfty.
+        if radii.shape[0] > g_table_0.shape[0]:
+            new_g_table = np.zeros((radii.shape[0], g_table_0.shape[1]))
+            new_g_table[:g_table_0.shape[0], :] = g_table_0
+            new_g_table[:, 0] = radii
+            tmp = g_table_0[-1, 1:]
+            new_g_table[g_table_0.shape[0]:, 1:] = tmp[np.newaxis, :]
+            g_table_0 = new_g_table
+            debug['g_table_0_smooth_extended'] = new_g_table
+        g_table = g_table_0
+        # ---
+        assert (len(g_header) == g_table.shape[1])
+        g_idx = g_header.index(self.g_match)
+        g_org = g_table[:, [0, g_idx]]
+        debug['g_org'] = g_org
+        # Use SciPy interpolator object to operate on the
+        # reference g function.  Warning: Linear interpolation!
+        g_int = sint.interp1d(g_org[:, 0], g_org[:, 1])
+        self._g_tables = {'radii': radii.copy(),
+                          'g_header': g_header,
+                          'g_elements': g_elements,
+                          'g_table': g_table,
+                          'g_org': g_org,
+                          'g_int': g_int,
+                          'debug': debug}
+        return self._g_tables
+
     def __iter__(self):
         return self
 
@@ -87,14 +162,16 @@ class Solvent(base.Filter):
                 assert isinstance(obj, base.Container)
 
                 if self.g_scaled_file is not None:
-                    # --- read g_scaled and rho from previous calculation ---
-                    reader = hdf5.H5Reader(filename=self.g_scaled_file)
-                    for frm in reader.next():
-                        obj_g_scaled = frm
-                        break
-                    del reader
-                    g_dict = obj_g_scaled.get_data(base.loc_solv_match + '/g_scaled')
-                    rho_dict = obj_g_scaled.get_data(base.loc_solv_match + '/rho')
+                    # --- read g_scaled and rho from previous calculation (once) ---
+                    if self._g_scaled is None:
+                        reader = hdf5.H5Reader(filename=self.g_scaled_file)
+                        for frm in reader.next():
+                            obj_g_scaled = frm
+                            break
+                        del reader
+                        self._g_scaled = (obj_g_scaled.get_data(base.loc_solv_match + '/g_scaled'),
+                                          obj_g_scaled.get_data(base.loc_solv_match + '/rho'))
+                    g_dict, rho_dict = self._g_scaled
 
                 else:
                     # --- compute g_scaled and rho ---
@@ -124,67 +201,18 @@ class Solvent(base.Filter):
                         raise NotImplementedError('Geometry ' + self.geometry +
                                                   'not implemented for self-consistent solvent matching')
 
-                    # --- read and prepare g-function for matching
-                    g_header = (rdf.readHeader(self.g_ascii_file)).rstrip('\n').split()
-                    assert (self.g_match in g_header)
-                    _g_el_set = set([])
-                    for item in g_header:
-                        if (item == '#'):
-                            continue
-                        pair = item.split(',')
-                        _g_el_set.add(pair[0])
-                        _g_el_set.add(pair[1])  # obsolete
-                    g_elements = sorted(list(_g_el_set))
-                    # ---
-                    g_table_0 = np.loadtxt(self.g_ascii_file)
-
-                    # TODO: Assert that histograms and rdfs have same bin size. Else, generate new rdf by interpolation.
-                    g_dr = (g_table_0[1:, 0] - g_table_0[:-1, 0]).mean()
-                    # print g_dr
-                    # Tapers noise for self.g_noise_fraction<1. Determines and set ginfty in last bins.
-                    g_table_0_smooth = rdf.smooth(g_table_0, g_dr, self.g_plateau_fraction,
-                                                  self.g_noise_fraction, verb=False)
-
-    #                 np.savetxt("g_table_0_smooth.dat", g_table_0_smooth)
-                    if (self.debug):
-                        obj.put_data(base.loc_solv_match + '/g_table_0_smooth', g_table_0_smooth)
-
-                    g_table_0 = g_table_0_smooth
-
+                    # --- read and prepare g-function for matching, cached across frames
                     _radii = obj.get_data(base.loc_histograms + '/radii')
-                    # Extend rdf in distance AFTER noise tapering, where rdf values at largest distance are set to ginfty.
-                    if _radii.shape[0] > g_table_0.shape[0]:
-                        new_g_table = np.zeros((_radii.shape[0], g_table_0.shape[1]))
-                        new_g_table[:g_table_0.shape[0], :] = g_table_0
-                        new_g_table[:, 0] = _radii
-                        tmp = g_table_0[-1, 1:]
-                        new_g_table[g_table_0.shape[0]:, 1:] = tmp[np.newaxis, :]
-                        g_table_0 = new_g_table
-                        # np.savetxt("g_table_0_smooth_extended.dat", new_g_table)
-                        if (self.debug):
-                            obj.put_data(base.loc_solv_match + '/g_table_0_smooth_extended', new_g_table)
-
-                    # if do_g_extension:
-                    #     g_dr_0 = g_table_0[-1, 0] - g_table_0[-2, 0]
-                    #     g_nr_0 = g_table_0.shape[0]
-                    #     g_nrow = g_extension_factor * g_nr_0
-                    #     g_ncol = g_table_0.shape[1]
-                    #     g_table = np.zeros((g_nrow, g_ncol))
-                    #     g_table[0:g_nr_0, :] = g_table_0[0:g_nr_0, :]
-                    #     for idx in range(g_nr_0, g_nrow):
-                    #         g_table[idx, 0] = g_table[idx - 1, 0] + g_dr_0
-                    #         g_table[idx, 1:] = g_table[idx - 1, 1:]
-                    # else:
-                    #     g_table = g_table_0
-                    g_table = g_table_0
-                    # ---
-                    assert (len(g_header) == g_table.shape[1])
-                    g_idx = g_header.index(self.g_match)
-                    g_org = g_table[:, [0, g_idx]]
+                    tables = self.get_g_tables(_radii, dr)
                     if (self.debug):
-                        obj.put_data(base.loc_solv_match + '/g_org', g_org)
+                        for (key, val) in tables['debug'].items():
+                            obj.put_data(base.loc_solv_match + '/' + key, val)
+                    g_header = tables['g_header']
+                    g_elements = tables['g_elements']
+                    g_org = tables['g_org']
                     rho_g_org = g_org[0, 1]  # rho value stored at [0,1] (code by JK)
-                    # --- split g_table into a dict holding individual arrays
+                    # --- split a copy of g_table into a dict holding individual arrays
+                    g_table = tables['g_table'].copy()
                     g_dict = {}
                     g_dict['radii'] = g_table[:, 0]
                     for i in range(1, len(g_header)):
@@ -218,12 +246,7 @@ class Solvent(base.Filter):
                     rho_match = old_div(n_match_avg, V_shell)
                     # JK: Should we instead use <n_i/V_i> averaged over frames for multiref??
 
-                    # Use SciPy interpolator object to operate on the
-                    # reference g function.  Warning: Linear interpolation!
-                    g_int = sint.interp1d(g_org[:, 0], g_org[:, 1])
-
                     # --- solvent-matching calculation
-                    _radii = obj.get_data(base.loc_histograms + '/radii')
                     pShell = np.zeros_like(_radii)
                     H = np.zeros_like(_radii)
                     gAct = np.zeros_like(_radii)
@@ -231,23 +254,16 @@ class Solvent(base.Filter):
                     if (self.geometry == 'Sphere') and (self.x_particle_method is None):
                         R = geometry_param['radius']
                         sw = geometry_param['shell_width']
-                        for i, r in enumerate(_radii):
-                            pShell[i] = rdf.PSh(R - sw, R, r)
-                            H[i] = pShell[i] * g_int(_radii[i])
+                        pShell = rdf.PShFast(R - sw, R, _radii)
+                        H = pShell * tables['g_int'](_radii)
                     else:
                         histgrms = shell.get_data(base.loc_histograms)
                         pShell = histgrms['X,X'].copy()
                         pShell /= pShell.sum()
                         pShell /= dr
-                        for i, r in enumerate(_radii):
-                            if (pShell[i] > 0.0):
-                                gAct[i] /= pShell[i]
-                            else:
-                                gAct[i] = 0.0
-                            if (_radii[i] < g_dict['radii'][0]) or (_radii[i] >= g_dict['radii'][-1]):
-                                H[i] = 0.0
-                            else:
-                                H[i] = pShell[i] * g_int(_radii[i])
+                        # Note: gAct remains zero
+                        mask = (_radii >= g_dict['radii'][0]) & (_radii < g_dict['radii'][-1])
+                        H[mask] = pShell[mask] * tables['g_int'](_radii[mask])
                     # ---
                     pre_factor = rho_match ** 2 * VSqr_shell * dr / 2.
                     # print "### pre_factor =", pre_factor
@@ -28,6 +28,9 @@ class StripVirtualParticles(base.Filter):
     """
     _depends = []
     _conflicts = []
+    # container locations, see <lib/prune.py>
+    _consumes = [base.loc_histograms]
+    _produces = []
 
     def __init__(self, source=-1, verbose=False):
         self.src = source
@@ -10,5 +10,6 @@
 
 from cadishi.io.hdf5 import *
 from cadishi.io.pickel import *
+from ...lib.hdf5 import *
 from .dummy import *
 from .distHisto import *
@@ -10,9 +10,23 @@
 
 
 """Capriqorn reader for legacy distHisto files.
+
+For large histograms_output directories, the distHistoReader can load the
+.npy files memory-mapped (mmap_mode, always copy-on-write), such that the
+histograms put into the pipeline are views of the file data instead of
+copies which downstream filters may modify in place, and load the next
+files in a background thread (prefetch).  The nrPart*.dat table is converted
+once into a binary .npy file stored next to it.
+
+Instead of one .npy file per histogram set, the distHistoWriter optionally
+writes a consolidated output (consolidated=True): all histogram sets are
+stacked into a single .npy file of shape (n_sets, n_bins, n_columns) which
+grows in batches, and a JSON index file holds the header and the list of the
+frame numbers.  The distHistoReader reads such output memory-mapped.
 """
 
 import os
+import mmap
 import numpy as np
 import json
 import glob
@@ -20,6 +34,50 @@ from six.moves import range
 
 from cadishi import base
 from cadishi import util
+from ...lib import species
+from ...lib import prefetch as prefetch_lib
+
+
+def read_nr_part_table(filename, cache=True):
+    """Read a nrPart*.dat table and return the header list and the table.
+
+    In case cache is True, the table is stored in binary form next to the
+    text file (filename + '.npy') and read from there as long as the binary
+    file is newer than the text file.
+    """
+    with open(filename, 'r') as fp:
+        header_lst = fp.readline().split()
+        assert (header_lst[0] == '#')
+        cache_file = filename + '.npy'
+        if cache and os.path.exists(cache_file) and \
+           (os.path.getmtime(cache_file) >= os.path.getmtime(filename)):
+            table = np.load(cache_file)
+        else:
+            table = np.loadtxt(fp, ndmin=2)
+            if cache:
+                try:
+                    np.save(cache_file, table)
+                except (IOError, OSError):
+                    # e.g. read-only directory
+                    pass
+    return header_lst, table
+
+
+# fixed size of the header of the stacked .npy file, such that the header can
+# be rewritten in place when the file grows
+_STACK_HEADER_SIZE = 256
+
+
+def _npy_header(shape, dtype=np.float64):
+    """Return the header of a .npy file (format version 1.0) of the given
+    shape, padded to _STACK_HEADER_SIZE bytes."""
+    descr = np.lib.format.dtype_to_descr(np.dtype(dtype))
+    header = "{'descr': %s, 'fortran_order': False, 'shape': %s, }" % (repr(descr), repr(tuple(shape)))
+    prefix = np.lib.format.MAGIC_PREFIX + b'\x01\x00'
+    n_pad = _STACK_HEADER_SIZE - len(prefix) - 2 - len(header) - 1
+    assert (n_pad >= 0)
+    header = (header + ' ' * n_pad + '\n').encode('latin1')
+    return prefix + np.uint16(len(header)).tobytes() + header
 
 
 class distHistoReader(base.Reader):
@@ -32,11 +90,16 @@ class distHistoReader(base.Reader):
     def __init__(self, directory='histograms_output',
                  list_file='distHisto.list',
                  header_file='header.dat',
-                 first=None, last=None, step=1, verbose=False):
+                 first=None, last=None, step=1,
+                 mmap_mode=None, prefetch=0,
+                 index_file='distHisto.index.json', verbose=False):
         self.count = 0
         self.directory = directory
         self.list_file = list_file
+        self.index_file = index_file
         self.file_list = []
+        self.stack = None
+        self.stack_file = None
         self.header_file = header_file
         self.header = []
         self.nr_part_header = []
@@ -44,6 +107,15 @@ class distHistoReader(base.Reader):
         self.first = first
         self.last = last
         self.step = step
+        # the histograms are passed on as views of the mapped files and may be
+        # modified in place by downstream filters, hence copy-on-write mapping
+        # is used, which also leaves the input files untouched
+        if mmap_mode == 'r':
+            mmap_mode = 'c'
+        if mmap_mode not in [None, 'c']:
+            raise ValueError("mmap_mode must be None, 'c', or 'r' (mapped copy-on-write)")
+        self.mmap_mode = mmap_mode
+        self.prefetch = prefetch
         self.verb = verbose
         self.pipeline_log = []
         # ---
@@ -51,10 +123,18 @@ class distHistoReader(base.Reader):
         self._conflicts.extend(super(base.Reader, self)._conflicts)
         # --- check input configuration, create list of input files
         assert (os.path.isdir(self.directory))
-        filename = os.path.join(directory, list_file)
-        assert (os.path.exists(filename))
-        with open(filename) as fp:
-            _file_list = [os.path.join(directory, line.strip()) for line in fp]
+        index = None
+        if (index_file is not None) and os.path.exists(os.path.join(directory, index_file)):
+            # consolidated output of the distHistoWriter
+            with open(os.path.join(directory, index_file)) as fp:
+                index = json.load(fp)
+            self.stack_file = os.path.join(directory, index['stack_file'])
+            _file_list = [self.stack_file + '[' + str(number) + ']' for number in index['frames']]
+        else:
+            filename = os.path.join(directory, list_file)
+            assert (os.path.exists(filename))
+            with open(filename) as fp:
+                _file_list = [os.path.join(directory, line.strip()) for line in fp]
         # Remove elements from the file_list to handle first,last,step.
         # By convention (as is done in MD reader written by Juergen)
         # first and last are not list indices starting at 0 but rather
@@ -77,17 +157,27 @@ class distHistoReader(base.Reader):
             idx_selection = _step_list
         # --- apply the selection on the file list
         self.file_list = [_file_list[i] for i in idx_selection]
-        # --- check existence
-        for filename in self.file_list:
+        if index is not None:
+            # the histogram sets are memory-mapped views of the stacked file,
+            # copy-on-write by default to keep the file unmodified
+            if self.mmap_mode is None:
+                self.mmap_mode = 'c'
+            self.stack = np.load(self.stack_file, mmap_mode=self.mmap_mode)
+            assert (self.stack.shape[0] >= len(index['frames']))
+            self.stack_selection = idx_selection
+            self.header = index['header']
+        else:
+            # --- check existence
+            for filename in self.file_list:
+                assert (os.path.exists(filename))
+            # --- read species combinations from the header file
+            filename = os.path.join(directory, header_file)
             assert (os.path.exists(filename))
-        # --- read species combinations from the header file
-        filename = os.path.join(directory, header_file)
-        assert (os.path.exists(filename))
-        with open(filename, 'r') as fp:
-            header_raw = fp.readline()
-            header_lst = header_raw.split()
-            assert (header_lst[0] == '#')
-            self.header = header_lst
+            with open(filename, 'r') as fp:
+                header_raw = fp.readline()
+                header_lst = header_raw.split()
+                assert (header_lst[0] == '#')
+                self.header = header_lst
         # --- read preprocessor pipeline log information
         filename = os.path.join(directory, 'preprocessor_log.json')
         if os.path.exists(filename):
@@ -108,13 +198,7 @@ class distHistoReader(base.Reader):
         _nr_part_files = glob.glob(os.path.join(directory, 'nrPart*.dat'))
         if (len(_nr_part_files) == 1):
             filename = _nr_part_files[0]
-            _nr_part_table = None
-            with open(filename, 'r') as fp:
-                _header_raw = fp.readline()
-                _header_lst = _header_raw.split()
-                assert (_header_lst[0] == '#')
-                self.nr_part_header = _header_lst
-                _nr_part_table = np.loadtxt(fp)
+            self.nr_part_header, _nr_part_table = read_nr_part_table(filename)
             assert (_nr_part_table.shape[1] == len(self.nr_part_header))
             self.nr_part_table = _nr_part_table[idx_selection, :]
             assert (self.nr_part_table.shape[0] == len(self.file_list))
@@ -131,10 +215,26 @@ class distHistoReader(base.Reader):
         label = 'distHistoReader'
         param = {'directory': self.directory, 'list_file': self.list_file,
                  'header_file': self.header_file,
-                 'first': self.first, 'last': self.last, 'step': self.step}
+                 'first': self.first, 'last': self.last, 'step': self.step,
+                 'mmap_mode': self.mmap_mode, 'prefetch': self.prefetch,
+                 'index_file': self.index_file}
         meta[label] = param
         return meta
 
+    def get_frame_count(self):
+        """Return the number of histogram sets delivered by the reader."""
+        return len(self.file_list)
+
+    def load(self, filename):
+        """Load a histogram file, memory-mapped in case mmap_mode is set."""
+        histograms = np.load(filename, mmap_mode=self.mmap_mode)
+        if (self.mmap_mode is not None) and (self.prefetch > 0):
+            # ask the OS to read ahead the file pages in the background thread
+            _mmap = getattr(histograms, '_mmap', None)
+            if hasattr(_mmap, 'madvise') and hasattr(mmap, 'MADV_WILLNEED'):
+                _mmap.madvise(mmap.MADV_WILLNEED)
+        return histograms
+
     def __iter__(self):
         return self
 
@@ -142,21 +242,29 @@ class distHistoReader(base.Reader):
         """iterate through all the histogram sets and yield set by set"""
         if self.verb:
             print()
-        for i in range(len(self.file_list)):
+        if self.stack is not None:
+            if (self.prefetch > 0):
+                _mmap = getattr(self.stack, '_mmap', None)
+                if hasattr(_mmap, 'madvise') and hasattr(mmap, 'MADV_WILLNEED'):
+                    _mmap.madvise(mmap.MADV_WILLNEED)
+            loaded = (self.stack[k] for k in self.stack_selection)
+        else:
+            loaded = prefetch_lib.prefetch(self.file_list, self.load, self.prefetch)
+        for i, histograms in enumerate(loaded):
             hs = base.Container()
             # --- fill the hs.histograms dictionary
             filename = self.file_list[i]
-            histograms = np.load(filename)
             (_n_bins, n_rows) = histograms.shape
-            # the zeroth column of histograms contains the radial grid
-            radii = histograms[:, 0]
-            hs.put_data(base.loc_histograms + '/radii', radii)
             assert (n_rows == len(self.header))
-            # the following columns contain the distance histograms
-            for idx in range(1, n_rows):
-                key = self.header[idx]
-                val = histograms[:, idx]
-                hs.put_data(base.loc_histograms + '/' + key, val)
+            # the zeroth column of histograms contains the radial grid, the
+            # following columns contain the distance histograms, all of them
+            # are stored as (zero-copy) views of the loaded array
+            for idx in range(n_rows):
+                if (idx == 0):
+                    key = 'radii'
+                else:
+                    key = self.header[idx]
+                species.put_view(hs, base.loc_histograms + '/' + key, histograms[:, idx])
             # --- fill the hs.particles dictionary ---
             # The use of a numpy array to hold a single value may seem like
             # a bit of an overkill, but when averaging over several
@@ -180,10 +288,15 @@ class distHistoReader(base.Reader):
 
 class distHistoWriter(base.Writer):
     """
-    Writer for the original output format of histograms.py.
+    Writer for the original output format of histograms.py, or optionally
+    (consolidated=True) for a single stacked .npy file plus a JSON index,
+    written in batches of batch_size histogram sets.
     """
     _depends = []
     _conflicts = []
+    # container locations, see <lib/prune.py>
+    _consumes = [base.loc_histograms]
+    _produces = []
 
     def __init__(self,
                  source=None,
@@ -192,23 +305,40 @@ class distHistoWriter(base.Writer):
                  histo_file_prefix='distHisto',
                  header_file='header.dat',
                  write_txt=False,
+                 consolidated=False,
+                 batch_size=64,
                  verbose=False):
         self.count = 0
         self.src = source
-        if directory[-1] is not '/':
+        if directory[-1] != '/':
             directory += '/'
         self.directory = directory
         self.list_file = list_file
         self.histo_file_prefix = histo_file_prefix
         self.header_file = header_file
         self.write_txt = write_txt
+        self.consolidated = consolidated
+        self.batch_size = batch_size
         self.verb = verbose
+        self.stack_file = self.histo_file_prefix + '.stack.npy'
+        self.index_file = self.histo_file_prefix + '.index.json'
+        self._batch = []
+        self._numbers = []
+        self._fp_stack = None
         # create output directory, if necessary
         util.md(self.directory)
-        # create and truncate "file list"-file
-        filename = os.path.join(self.directory, self.list_file)
-        with open(filename, 'w') as _fp:
-            pass
+        if self.consolidated:
+            # remove a stale file list, the index is used instead
+            stale_file = os.path.join(self.directory, self.list_file)
+        else:
+            # create and truncate "file list"-file
+            filename = os.path.join(self.directory, self.list_file)
+            with open(filename, 'w') as _fp:
+                pass
+            # remove a stale index, which would take precedence in the reader
+            stale_file = os.path.join(self.directory, self.index_file)
+        if os.path.exists(stale_file):
+            os.remove(stale_file)
         # ---
         self._depends.extend(super(base.Writer, self)._depends)
         self._conflicts.extend(super(base.Writer, self)._conflicts)
@@ -222,10 +352,29 @@ class distHistoWriter(base.Writer):
         meta = {}
         label = 'distHistoWriter'
         param = {'directory': self.directory, 'list_file': self.list_file,
-                 'header_file': self.header_file}
+                 'header_file': self.header_file, 'consolidated': self.consolidated}
         meta[label] = param
         return meta
 
+    def flush(self, header_lst):
+        """Append the buffered histogram sets to the stacked file, update its
+        header and the index file."""
+        if (len(self._batch) > 0):
+            self._fp_stack.seek(0, os.SEEK_END)
+            self._fp_stack.write(np.ascontiguousarray(np.stack(self._batch)).tobytes())
+            del self._batch[:]
+        shape = (len(self._numbers),) + self._stack_shape
+        self._fp_stack.seek(0)
+        self._fp_stack.write(_npy_header(shape))
+        self._fp_stack.flush()
+        index = {'stack_file': self.stack_file,
+                 'header': header_lst,
+                 'frames': self._numbers}
+        filename = os.path.join(self.directory, self.index_file)
+        with open(filename + '.tmp', 'w') as fp:
+            json.dump(index, fp)
+        os.replace(filename + '.tmp', filename)
+
     def dump(self):
         """save histogram sets"""
         header_str = ''
@@ -244,6 +393,10 @@ class distHistoWriter(base.Writer):
                         fp.write(header_str + '\n')
                     nbin = len(obj.get_data(base.loc_histograms + '/radii'))
                     ncol = len(obj.get_keys(base.loc_histograms, skip_keys=['radii'])) + 1
+                    if self.consolidated:
+                        self._stack_shape = (nbin, ncol)
+                        self._fp_stack = open(os.path.join(self.directory, self.stack_file), 'wb')
+                        self._fp_stack.write(_npy_header((0,) + self._stack_shape))
                 # build a 2D numpy array containing the radii and the histograms
                 assert (nbin == len(obj.get_data(base.loc_histograms + '/radii')))
                 assert (ncol == len(obj.get_keys(base.loc_histograms, skip_keys=['radii'])) + 1)
@@ -253,6 +406,15 @@ class distHistoWriter(base.Writer):
                 for key in sorted(obj.get_keys(base.loc_histograms, skip_keys=['radii'])):
                     histo_array[:, idx] = obj.get_data(base.loc_histograms + '/' + key)
                     idx += 1
+                if self.consolidated:
+                    self._batch.append(histo_array)
+                    self._numbers.append(obj.i)
+                    if (len(self._batch) >= self.batch_size):
+                        self.flush(header_lst)
+                    if self.verb:
+                        print("distHistoWriter.dump() : " + str(obj.i))
+                    self.count += 1
+                    continue
                 # write histograms to numpy files
                 filenum = str(obj.i)
                 if self.write_txt:
@@ -270,3 +432,7 @@ class distHistoWriter(base.Writer):
                 if self.verb:
                     print("distHistoWriter.dump() : " + fullname)
                 self.count += 1
+        if self._fp_stack is not None:
+            self.flush(header_lst)
+            self._fp_stack.close()
+            self._fp_stack = None
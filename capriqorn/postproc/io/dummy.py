@@ -27,7 +27,8 @@ class DummyReader(base.Reader):
     _conflicts = []
 
     def __init__(self, n_histogram_sets=10, n_el=3, n_bins=1024,
-                 n_virtual=0, random=True, shell=False, verbose=False):
+                 n_virtual=0, random=True, shell=False, scalars=False, elements=None,
+                 verbose=False):
         self.count = 1
         self.n_histogram_sets = n_histogram_sets
         self.n_el = n_el
@@ -35,11 +36,25 @@ class DummyReader(base.Reader):
         self.n_virtual = n_virtual
         self.random = random
         self.shell = shell
+        self.scalars = scalars
+        self.elements = elements
         self.verb = verbose
+        self.shard_index = 0
+        self.n_shards = 1
         # ---
         self._depends.extend(super(base.Reader, self)._depends)
         self._conflicts.extend(super(base.Reader, self)._conflicts)
 
+    def shard(self, shard_index, n_shards):
+        """Restrict the reader to every n_shards-th histogram set, starting at shard_index."""
+        self.shard_index = shard_index
+        self.n_shards = n_shards
+        self.count = 1 + shard_index
+
+    def get_frame_count(self):
+        """Return the number of histogram sets delivered by the reader (shard)."""
+        return len(range(1 + self.shard_index, self.n_histogram_sets + 1, self.n_shards))
+
     def get_meta(self):
         """
         Return information on the present filter,
@@ -62,7 +77,10 @@ class DummyReader(base.Reader):
             radii = np.array([dr * (0.5 + x) for x in range(self.n_bins)])
             hs.put_data(base.loc_histograms + '/radii', radii)
             # --- fill histogram set with dummy data
-            spec_list = (list(string.ascii_uppercase))[:self.n_el]
+            if self.elements is not None:
+                spec_list = list(self.elements)
+            else:
+                spec_list = (list(string.ascii_uppercase))[:self.n_el]
             for i in range(1, self.n_virtual + 1):
                 x = 'X' + str(i)
                 spec_list.append(x)
@@ -76,12 +94,17 @@ class DummyReader(base.Reader):
                     else:
                         histo = np.ones(self.n_bins)
                     hs.put_data(base.loc_histograms + '/' + key, histo)
+            # --- optionally, add per-frame particle numbers and box volumes
+            if self.scalars:
+                for i, el in enumerate(spec_list):
+                    hs.put_data(base.loc_nr_particles + '/' + el, np.array([100 * (i + 1) + self.count]))
+                hs.put_data(base.loc_volumes, {'box': 1000.0 + self.count})
             # ---
             if self.verb:
                 print("DummyReader.next() :", self.count)
             hs.put_meta(self.get_meta())
             yield hs
-            self.count += 1
+            self.count += self.n_shards
             del hs
 
 
@@ -91,6 +114,9 @@ class DummyWriter(base.Writer):
     pipeline."""
     _depends = []
     _conflicts = []
+    # container locations, see <lib/prune.py>
+    _consumes = []
+    _produces = []
 
     def __init__(self, source, verbose=False):
         self.src = source
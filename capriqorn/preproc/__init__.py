@@ -11,3 +11,4 @@
 from .io import *
 from .filter import *
 from ..lib.parpipe import *
+from ..lib.prune import *
@@ -15,17 +15,22 @@ from __future__ import print_function
 
 
 import numpy as np
-import copy
 import cadishi.base as base
+from ...lib import species
 
 
 class Cuboid(base.Filter):
     """a filter that selects particles within an cuboidal volume"""
     _depends = []
     _conflicts = []
+    # container locations, see <lib/prune.py>
+    _consumes = [base.loc_coordinates]
+    _produces = [base.loc_coordinates]
+    # per-frame processing without side effects, see pipeutil.plan_pipeline()
+    _pure = True
 
-    def __init__(self, half_lengths=[1.e6, 1.e6, 1.e6], shell_width=-1, source=-1,
-                 verbose=False):
+    def __init__(self, half_lengths=[1.e6, 1.e6, 1.e6], shell_width=-1, chunk_size=None,
+                 source=-1, verbose=False):
         assert (len(half_lengths) == 3)
         assert ((half_lengths[0] > 0.0) and (half_lengths[1] > 0.0) and (half_lengths[2] > 0.0))
         self.half_lengths = np.array(half_lengths)
@@ -35,6 +40,7 @@ class Cuboid(base.Filter):
         self.r_max = 2.0 * np.sqrt((self.half_lengths ** 2).sum())
         self.volume = L.prod()
         self.shell_volume = self.volume - (L - 2 * shell_width).prod()
+        self.chunk_size = chunk_size
         # ---
         self.src = source
         self.verb = verbose
@@ -54,7 +60,8 @@ class Cuboid(base.Filter):
                  'shell_width': self.shell_width,
                  'volume': self.volume,
                  'shell_volume': self.shell_volume,
-                 'r_max': self.r_max}
+                 'r_max': self.r_max,
+                 'chunk_size': self.chunk_size}
         meta[label] = param
         return meta
 
@@ -118,6 +125,21 @@ class Cuboid(base.Filter):
         indices = self.selectBody(coords, (half_lengths[:] - sw))
         return indices
 
+    def classify(self, coords):
+        """
+        Return the region labels (see <lib/species.py>) classifying the
+        particles into the core and the shell region, or into the body in case
+        no shell width is given.
+        """
+        abs_coords = np.fabs(coords)
+        q_within_body = np.all(abs_coords < self.half_lengths[np.newaxis, :], axis=1)
+        if (self.shell_width > 0.0):
+            assert (min(self.half_lengths) > self.shell_width)
+            q_within_core = np.all(abs_coords < (self.half_lengths - self.shell_width)[np.newaxis, :], axis=1)
+            return species.region_labels(q_within_body, q_within_core)
+        else:
+            return species.region_labels(q_within_body)
+
     def __iter__(self):
         return self
 
@@ -125,32 +147,22 @@ class Cuboid(base.Filter):
         for frm_in in next(self.src):
             if frm_in is not None:
                 assert isinstance(frm_in, base.Container)
-                frm_out = copy.deepcopy(frm_in)
-                frm_out.del_data(base.loc_coordinates)
+                # --- all species are processed at once, see <lib/species.py>
+                (labels, coords, offsets) = species.get_blocks(frm_in)
+                frm_out = species.copy_container(frm_in, [base.loc_coordinates])
                 # ---
-                for spec_id in frm_in.get_keys(base.loc_coordinates, skip_keys='radii'):
-                    coord_in = frm_in.get_data(base.loc_coordinates + '/' + spec_id)
-                    if (self.shell_width > 0.0):
-                        # --- select core particles
-                        indices = self.selectCore(coord_in)
-                        coord_out = coord_in[indices]
-                        frm_out.put_data(base.loc_coordinates + '/' + spec_id,
-                                         coord_out)
-                        # --- select shell particles
-                        indices = self.selectShell(coord_in)
-                        coord_out = coord_in[indices]
-                        frm_out.put_data(base.loc_coordinates + '/' + spec_id + '.s',
-                                         coord_out)
-                    else:
-                        indices = self.selectBody(coord_in)
-                        coord_out = coord_in[indices]
-                        frm_out.put_data(base.loc_coordinates + '/' + spec_id,
-                                         coord_out)
+                regions = species.get_regions(self.shell_width)
+                selection = species.select_regions(coords, offsets, lambda chunk, k: self.classify(chunk),
+                                                   regions, self.chunk_size)
+                for (region, (coord_out, offsets_out)) in zip(regions, selection):
+                    species.put_blocks(frm_out, labels, coord_out, offsets_out,
+                                       suffix=species.REGION_SUFFIXES[region])
                 # ---
                 frm_out.i = frm_in.i
                 # ---
                 frm_out.put_data('log', frm_in.get_data('log'))
                 frm_out.put_meta(self.get_meta())
+                # ---
                 if self.verb:
                     print("Cuboid.next() :", frm_out.i)
             else:
@@ -25,6 +25,11 @@ class Dummy(base.Filter):
     """
     _depends = []
     _conflicts = []
+    # container locations, see <lib/prune.py>
+    _consumes = []
+    _produces = []
+    # per-frame processing without side effects, see pipeutil.plan_pipeline()
+    _pure = True
 
     def __init__(self, source=-1, verbose=False, sleep_seconds=0, raise_exception=False):
         self.src = source
@@ -17,17 +17,22 @@ from past.utils import old_div
 
 import math
 import numpy as np
-import copy
 import cadishi.base as base
+from ...lib import species
 
 
 class Ellipsoid(base.Filter):
     """a filter that selects particles within an ellipsoidal volume"""
     _depends = []
     _conflicts = []
+    # container locations, see <lib/prune.py>
+    _consumes = [base.loc_coordinates]
+    _produces = [base.loc_coordinates]
+    # per-frame processing without side effects, see pipeutil.plan_pipeline()
+    _pure = True
 
     def __init__(self, semi_principal_axes=[1.e6, 1.e6, 1.e6], shell_width=-1,
-                 source=-1, verbose=False):
+                 chunk_size=None, source=-1, verbose=False):
         assert (len(semi_principal_axes) == 3)
         self.semi_principal_axes = np.array(semi_principal_axes)  # semi-principal axes
         self.shell_width = shell_width
@@ -35,6 +40,7 @@ class Ellipsoid(base.Filter):
         self.r_max = 2. * np.max(self.semi_principal_axes)
         self.volume = 4. / 3. * math.pi * self.semi_principal_axes.prod()
         self.shell_volume = self.volume - 4. / 3. * math.pi * (self.semi_principal_axes - self.shell_width).prod()
+        self.chunk_size = chunk_size
         # ---
         self.src = source
         self.verb = verbose
@@ -54,7 +60,8 @@ class Ellipsoid(base.Filter):
                  'shell_width': self.shell_width,
                  'volume': self.volume,
                  'shell_volume': self.shell_volume,
-                 'r_max': self.r_max}
+                 'r_max': self.r_max,
+                 'chunk_size': self.chunk_size}
         meta[label] = param
         return meta
 
@@ -87,7 +94,8 @@ class Ellipsoid(base.Filter):
         sw = sw or self.shell_width
         assert (sw > 0.0)
         assert (min(semi_principal_axes) > sw)
-        coords_sq = coords ** 2
+        # squares are computed in double precision, also for float32 input
+        coords_sq = np.square(coords, dtype=np.float64)
         # select body
         semi_principal_axes_sq = semi_principal_axes ** 2
         q_within_body = (old_div(coords_sq, semi_principal_axes_sq[np.newaxis, :])).sum(axis=1) < 1.0
@@ -114,6 +122,24 @@ class Ellipsoid(base.Filter):
         indices = self.selectBody(coords, (semi_principal_axes[:] - sw))
         return indices
 
+    def classify(self, coords):
+        """
+        Return the region labels (see <lib/species.py>) classifying the
+        particles into the core and the shell region, or into the body in case
+        no shell width is given.
+        """
+        # squares are computed in double precision, also for float32 input
+        coords_sq = np.square(coords, dtype=np.float64)
+        semi_principal_axes_sq = self.semi_principal_axes ** 2
+        q_within_body = (old_div(coords_sq, semi_principal_axes_sq[np.newaxis, :])).sum(axis=1) < 1.0
+        if (self.shell_width > 0.0):
+            assert (min(self.semi_principal_axes) > self.shell_width)
+            semi_principal_axes_sq = (self.semi_principal_axes - self.shell_width) ** 2
+            q_within_core = (old_div(coords_sq, semi_principal_axes_sq[np.newaxis, :])).sum(axis=1) < 1.0
+            return species.region_labels(q_within_body, q_within_core)
+        else:
+            return species.region_labels(q_within_body)
+
     def __iter__(self):
         return self
 
@@ -121,27 +147,16 @@ class Ellipsoid(base.Filter):
         for frm_in in next(self.src):
             if frm_in is not None:
                 assert isinstance(frm_in, base.Container)
-                frm_out = copy.deepcopy(frm_in)
-                frm_out.del_data(base.loc_coordinates)
+                # --- all species are processed at once, see <lib/species.py>
+                (labels, coords, offsets) = species.get_blocks(frm_in)
+                frm_out = species.copy_container(frm_in, [base.loc_coordinates])
                 # ---
-                for spec_id in frm_in.get_keys(base.loc_coordinates, skip_keys='radii'):
-                    coord_in = frm_in.get_data(base.loc_coordinates + '/' + spec_id)
-                    if (self.shell_width > 0.0):
-                        # --- select core particles
-                        indices = self.selectCore(coord_in)
-                        coord_out = coord_in[indices]
-                        frm_out.put_data(base.loc_coordinates + '/' + spec_id,
-                                         coord_out)
-                        # --- select shell particles
-                        indices = self.selectShell(coord_in)
-                        coord_out = coord_in[indices]
-                        frm_out.put_data(base.loc_coordinates + '/' + spec_id + '.s',
-                                         coord_out)
-                    else:
-                        indices = self.selectBody(coord_in)
-                        coord_out = coord_in[indices]
-                        frm_out.put_data(base.loc_coordinates + '/' + spec_id,
-                                         coord_out)
+                regions = species.get_regions(self.shell_width)
+                selection = species.select_regions(coords, offsets, lambda chunk, k: self.classify(chunk),
+                                                   regions, self.chunk_size)
+                for (region, (coord_out, offsets_out)) in zip(regions, selection):
+                    species.put_blocks(frm_out, labels, coord_out, offsets_out,
+                                       suffix=species.REGION_SUFFIXES[region])
                 # ---
                 frm_out.i = frm_in.i
                 # ---
@@ -16,9 +16,9 @@ from __future__ import print_function
 
 import MDAnalysis as mda
 import numpy as np
-import copy
 from cadishi import base
 from ...lib import refstruct as librefstruct
+from ...lib import species
 
 
 class ReferenceStructure(base.Filter):
@@ -28,6 +28,11 @@ class ReferenceStructure(base.Filter):
     """
     _depends = []
     _conflicts = []
+    # container locations, see <lib/prune.py>
+    _consumes = [base.loc_coordinates]
+    _produces = [base.loc_coordinates]
+    # per-frame processing without side effects, see pipeutil.plan_pipeline()
+    _pure = True
 
     def __init__(self,
                  topology_file=None,  # reference structure PDB file
@@ -35,20 +40,30 @@ class ReferenceStructure(base.Filter):
                  distance=10,  # distance from reference structure
                  shell_width=-1,
                  algorithm="brute_force",
+                 chunk_size=None,
+                 shared_state=None,
                  source=-1,
                  verbose=False):
+        """
+        Parameters
+        ----------
+        shared_state : dict
+            State returned by get_shared_state(), built once by the master
+            process of a parallel pipeline, see pipeutil.share_state().
+        """
         self.topology_file = topology_file
         self.selection = selection
         self.distance = distance
         self.shell_width = shell_width
         self.algorithm = algorithm
+        self.chunk_size = chunk_size
         librefstruct.set_algorithm(algorithm)
         # ---
-        universe = mda.Universe(topology_file)
-        self.atoms = universe.atoms.select_atoms(selection)
+        if shared_state is None:
+            shared_state = self.get_shared_state(topology_file, selection)
+        self.atoms = shared_state['atoms']
         # --- calculate r_max from longest distance in reference structure
-        d_max = librefstruct.maxInnerDistance(self.atoms.positions)
-        self.r_max = d_max + 3. * self.distance
+        self.r_max = shared_state['d_max'] + 3. * self.distance
         # ---
         self.src = source
         self.verb = verbose
@@ -56,6 +71,14 @@ class ReferenceStructure(base.Filter):
         self._depends.extend(super(base.Filter, self)._depends)
         self._conflicts.extend(super(base.Filter, self)._conflicts)
 
+    @classmethod
+    def get_shared_state(cls, topology_file=None, selection='all', **kwargs):
+        """Return the selected atoms of the reference structure and their
+        longest inner distance, which do not change during the run."""
+        universe = mda.Universe(topology_file)
+        atoms = universe.atoms.select_atoms(selection)
+        return {'atoms': atoms, 'd_max': librefstruct.maxInnerDistance(atoms.positions)}
+
     def get_meta(self):
         """
         Return information on the present filter,
@@ -67,33 +90,36 @@ class ReferenceStructure(base.Filter):
                                        'algorithm': self.algorithm,
                                        'topology_file': self.topology_file,
                                        'selection': self.selection,
-                                       'distance': self.distance}}
+                                       'distance': self.distance,
+                                       'chunk_size': self.chunk_size}}
+
+    def classify(self, coords):
+        """Return the region labels (see <lib/species.py>) classifying the
+        particles into the core and the shell region, or into the body in case
+        no shell width is given.
+        """
+        if (self.shell_width > 0.0):
+            if (self.distance < self.shell_width):
+                raise RuntimeError("selection radius smaller then shell width")
+            # --- fused core/shell selection, single pass over the reference atoms
+            return librefstruct.get_classification(coords, self.atoms.positions,
+                                                   self.distance - self.shell_width,
+                                                   self.distance)
+        else:
+            q_body = librefstruct.get_selection(coords, self.atoms.positions, self.distance)
+            return species.region_labels(np.asarray(q_body, dtype=bool))
 
     def _process_frame(self, frm_in):
-        frm_out = copy.deepcopy(frm_in)
-        frm_out.del_data(base.loc_coordinates)
-        for spec_id in frm_in.get_keys(base.loc_coordinates):
-            coord_in = frm_in.get_data(base.loc_coordinates + '/' + spec_id)
-            if (self.shell_width > 0.0):
-                # --- select core particles
-                indices = librefstruct.selectCore(self.atoms.positions, coord_in,
-                                                  self.distance, self.shell_width)
-                coord_out = coord_in[indices]
-                frm_out.put_data(base.loc_coordinates + '/' + spec_id,
-                                 coord_out)
-                # --- select shell particles
-                indices = librefstruct.selectShell(self.atoms.positions, coord_in,
-                                                   self.distance, self.shell_width)
-                coord_out = coord_in[indices]
-                frm_out.put_data(base.loc_coordinates + '/' + spec_id + '.s',
-                                 coord_out)
-            else:
-                indices = librefstruct.selectBody(self.atoms.positions,
-                                                  coord_in,
-                                                  R=self.distance)
-                coord_out = coord_in[indices]
-                frm_out.put_data(base.loc_coordinates + '/' + spec_id,
-                                 coord_out)
+        # --- all species are processed at once, see <lib/species.py>;
+        # the coordinates keep their data type (float32 or float64)
+        (labels, coords, offsets) = species.get_blocks(frm_in)
+        frm_out = species.copy_container(frm_in, [base.loc_coordinates])
+        regions = species.get_regions(self.shell_width)
+        selection = species.select_regions(coords, offsets, lambda chunk, k: self.classify(chunk),
+                                           regions, self.chunk_size)
+        for (region, (coord_out, offsets_out)) in zip(regions, selection):
+            species.put_blocks(frm_out, labels, coord_out, offsets_out,
+                               suffix=species.REGION_SUFFIXES[region])
         frm_out.i = frm_in.i
         frm_out.put_data('log', frm_in.get_data('log'))
         frm_out.put_meta(self.get_meta())
@@ -125,6 +151,8 @@ class MultiReferenceStructure(ReferenceStructure):
     """
     _depends = []
     _conflicts = []
+    # r_max depends on the frames processed before
+    _pure = False
 
     def __init__(self,
                  topology_file=None,  # reference topology
@@ -134,8 +162,17 @@ class MultiReferenceStructure(ReferenceStructure):
                  r_max=-1,
                  shell_width=-1,
                  algorithm="brute_force",
+                 chunk_size=None,
+                 shared_state=None,
                  source=-1,
                  verbose=False):
+        """
+        Parameters
+        ----------
+        shared_state : dict
+            State returned by get_shared_state(), built once by the master
+            process of a parallel pipeline, see pipeutil.share_state().
+        """
         self.topology_file = topology_file
         self.trajectory_file = trajectory_file
         self.selection = selection
@@ -143,9 +180,16 @@ class MultiReferenceStructure(ReferenceStructure):
         self.shell_width = shell_width
         self.r_max = r_max
         self.algorithm = algorithm
+        self.chunk_size = chunk_size
         librefstruct.set_algorithm(algorithm)
         # ---
-        self.universe = mda.Universe(topology_file, trajectory_file)
+        # --- the parsed topology is shared, the trajectory is opened by each process
+        if shared_state is None:
+            shared_state = self.get_shared_state(topology_file)
+        if trajectory_file is None:
+            # the coordinates are read from the topology file
+            trajectory_file = topology_file
+        self.universe = mda.Universe(shared_state['topology'], trajectory_file)
         self.atoms = self.universe.atoms.select_atoms(selection)
         # ---
         self.src = source
@@ -154,6 +198,11 @@ class MultiReferenceStructure(ReferenceStructure):
         self._depends.extend(ReferenceStructure._depends)
         self._conflicts.extend(ReferenceStructure._conflicts)
 
+    @classmethod
+    def get_shared_state(cls, topology_file=None, **kwargs):
+        """Return the parsed reference topology."""
+        return {'topology': mda.Universe(topology_file)._topology}
+
     def get_meta(self):
         """
         Return information on the present filter,
@@ -166,7 +215,8 @@ class MultiReferenceStructure(ReferenceStructure):
                                             'topology_file': self.topology_file,
                                             'trajectory_file': self.trajectory_file,
                                             'selection': self.selection,
-                                            'distance': self.distance}}
+                                            'distance': self.distance,
+                                            'chunk_size': self.chunk_size}}
 
     def __iter__(self):
         return self
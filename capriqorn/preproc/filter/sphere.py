@@ -16,11 +16,10 @@ from __future__ import print_function
 from past.utils import old_div
 
 import math
-import copy
 import numpy as np
-from six.moves import range
 
 import cadishi.base as base
+from ...lib import species
 
 
 class Sphere(base.Filter):
@@ -28,12 +27,18 @@ class Sphere(base.Filter):
     from a generator returning base.Container with coordinate data."""
     _depends = []
     _conflicts = []
+    # container locations, see <lib/prune.py>
+    _consumes = [base.loc_coordinates]
+    _produces = [base.loc_coordinates, base.loc_len_histograms]
+    # per-frame processing without side effects, see pipeutil.plan_pipeline()
+    _pure = True
 
     def __init__(self,
                  radius=1.e6,
                  shell_width=-1,
                  do_len_histo=True,
                  len_histo_dr=0.01,
+                 chunk_size=None,
                  source=-1,
                  verbose=False):
         self.radius = radius
@@ -48,6 +53,7 @@ class Sphere(base.Filter):
         # ---
         self.do_len_histo = do_len_histo
         self.len_histo_dr = len_histo_dr
+        self.chunk_size = chunk_size
         self.src = source
         self.verb = verbose
         # ---
@@ -66,7 +72,8 @@ class Sphere(base.Filter):
                  'len_histo_dr': self.len_histo_dr,
                  'volume': self.volume,
                  'shell_volume': self.shell_volume,
-                 'r_max': self.r_max}
+                 'r_max': self.r_max,
+                 'chunk_size': self.chunk_size}
         meta[label] = param
         return meta
 
@@ -102,6 +109,25 @@ class Sphere(base.Filter):
         indices = self.selectBody(coords, R - sw)
         return indices
 
+    def classify(self, coords, len_histo=None):
+        """Return the region labels (see <lib/species.py>) classifying the
+        particles into the core and the shell region, or into the body in case
+        no shell width is given.  Optionally, the distance-from-center
+        histogram of the particles within the body is added to len_histo.
+        """
+        # squared distances are computed in double precision, also for float32 input
+        lengthsSqr = np.square(coords, dtype=np.float64).sum(axis=1)
+        q_body = lengthsSqr < self.radius ** 2
+        if len_histo is not None:
+            (histo, _edges) = np.histogram(np.sqrt(lengthsSqr[q_body]), bins=len_histo.shape[0],
+                                           range=(0.0, self.radius))
+            len_histo += histo
+        if (self.shell_width > 0.0):
+            q_core = lengthsSqr < (self.radius - self.shell_width) ** 2
+            return species.region_labels(q_body, q_core)
+        else:
+            return species.region_labels(q_body)
+
     def __iter__(self):
         return self
 
@@ -109,41 +135,26 @@ class Sphere(base.Filter):
         for frm_in in next(self.src):
             if frm_in is not None:
                 assert isinstance(frm_in, base.Container)
-                frm_out = copy.deepcopy(frm_in)
-                frm_out.del_data(base.loc_coordinates)
-                frm_out.del_data(base.loc_len_histograms)
+                # --- all species are processed at once, see <lib/species.py>
+                (labels, coords, offsets) = species.get_blocks(frm_in)
+                frm_out = species.copy_container(frm_in, [base.loc_coordinates, base.loc_len_histograms])
+                n_bins = int(round(old_div(self.radius, self.len_histo_dr)))
+                histos = np.zeros((len(labels), n_bins), dtype=np.int64)
+                if (self.shell_width > 0.0):
+                    assert (self.radius > self.shell_width)
+                regions = species.get_regions(self.shell_width)
+                selection = species.select_regions(
+                    coords, offsets, lambda chunk, k: self.classify(chunk, histos[k] if self.do_len_histo else None),
+                    regions, self.chunk_size)
+                for (region, (coord_out, offsets_out)) in zip(regions, selection):
+                    species.put_blocks(frm_out, labels, coord_out, offsets_out,
+                                       suffix=species.REGION_SUFFIXES[region])
                 if self.do_len_histo:
-                    n_bins = int(round(old_div(self.radius, self.len_histo_dr)))
-                    radii = np.zeros(n_bins)
-                    for i in range(n_bins):
-                        radii[i] = (0.5 + np.float64(i)) * self.len_histo_dr
+                    radii = (0.5 + np.arange(n_bins, dtype=np.float64)) * self.len_histo_dr
                     frm_out.put_data(base.loc_len_histograms + '/radii', radii)
-                for spec_id in frm_in.get_keys(base.loc_coordinates, skip_keys='radii'):
-                    coord_in = frm_in.get_data(base.loc_coordinates + '/' + spec_id)
-                    if (self.shell_width > 0.0):
-                        # --- select core particles
-                        indices = self.selectCore(coord_in)
-                        coord_out = coord_in[indices]
-                        frm_out.put_data(base.loc_coordinates + '/' + spec_id,
-                                         coord_out)
-                        # --- select shell particles
-                        indices = self.selectShell(coord_in)
-                        coord_out = coord_in[indices]
-                        frm_out.put_data(base.loc_coordinates + '/' + spec_id + '.s',
-                                         coord_out)
-                    else:
-                        indices = self.selectBody(coord_in)
-                        coord_out = coord_in[indices]
-                        frm_out.put_data(base.loc_coordinates + '/' + spec_id,
-                                         coord_out)
-                    if self.do_len_histo:
-                        indices = self.selectBody(coord_in)
-                        len_arr = np.sqrt((coord_in[indices] ** 2).sum(axis=1))
-                        (histo, _edges) = np.histogram(len_arr, bins=n_bins,
-                                                       range=(0.0, self.radius))
-                        histo_float64 = histo.astype(np.float64)
+                    for k, spec_id in enumerate(labels):
                         frm_out.put_data(base.loc_len_histograms + '/' + spec_id,
-                                         histo_float64)
+                                         histos[k].astype(np.float64))
                 frm_out.i = frm_in.i
                 frm_out.put_data('log', frm_in.get_data('log'))
                 frm_out.put_meta(self.get_meta())
@@ -21,6 +21,11 @@ class Step(base.Filter):
     """A filter that skips frames."""
     _depends = []
     _conflicts = []
+    # container locations, see <lib/prune.py>
+    _consumes = []
+    _produces = []
+    # frame selection, may be moved and folded into the reader by pipeutil.plan_pipeline()
+    _stride = True
 
     def __init__(self, step=1, source=-1, verbose=False):
         self.src = source
@@ -22,6 +22,7 @@ import numpy.random as ran
 
 import cadishi.base as base
 from ...lib import rotate as rot
+from ...lib import precision as libprecision
 
 # --- use fast Cython functions for time critical parts, if available
 try:
@@ -47,7 +48,7 @@ def _genIdealGas(N, L):
 if have_c_virtual_particles:
     _genLattice = c_virtual_particles.genLattice
 else:
-    def _genLattice(gridLength, latticeConstant, noise=False):
+    def _genLattice(gridLength, latticeConstant, noise=False, dtype=np.float64):
         """
         Generate a 3D lattice, optionally with random displacement.
         Serves as a helper function for the virtual particles method.
@@ -77,7 +78,7 @@ else:
                     counter += 1
         offset = ran.uniform(-latticeConstant / 2., latticeConstant / 2., 3)
         lattice[:] += offset
-        return lattice
+        return lattice.astype(dtype, copy=False)
 
 
 class VirtualParticles(base.Filter):
@@ -85,6 +86,9 @@ class VirtualParticles(base.Filter):
     in base.Container() instances."""
     _depends = []
     _conflicts = []
+    # container locations, see <lib/prune.py>
+    _consumes = [base.loc_coordinates]
+    _produces = [base.loc_coordinates]
 
     def __init__(self,
                  source=-1,
@@ -94,7 +98,16 @@ class VirtualParticles(base.Filter):
                  noise=False,
                  label='X',
                  random_seed=0,
+                 precision='double',
+                 rng_state=None,
                  verbose=False):
+        """
+        Parameters
+        ----------
+        rng_state : tuple
+            State of the numpy random number generator to continue from, as
+            returned by get_checkpoint(), see <lib/checkpoint.py>.
+        """
         self.src = source
         self.verb = verbose
         assert (method is not None)
@@ -120,6 +133,8 @@ class VirtualParticles(base.Filter):
         self.noise = noise
         self.label = label
         self.random_seed = random_seed
+        self.precision = precision
+        self.dtype = libprecision.get_dtype(precision)
         if (method == "lattice"):
             self.xD = xD
         self._depends.extend(super(base.Filter, self)._depends)
@@ -128,6 +143,8 @@ class VirtualParticles(base.Filter):
         # generator in order to achieve reproducibility.
         if (random_seed > 0):
             np.random.seed(random_seed)
+        if rng_state is not None:
+            np.random.set_state(rng_state)
 
     def get_meta(self):
         """
@@ -143,9 +160,14 @@ class VirtualParticles(base.Filter):
         param['noise'] = self.noise
         param['label'] = self.label
         param['random_seed'] = self.random_seed
+        param['precision'] = self.precision
         meta[label] = param
         return meta
 
+    def get_checkpoint(self):
+        """Return the parameters restoring the present state of the filter."""
+        return {'rng_state': np.random.get_state()}
+
     def __iter__(self):
         return self
 
@@ -159,10 +181,11 @@ class VirtualParticles(base.Filter):
                         print("VirtualParticles : adding 2x " + str(self.x_box_length ** 3) \
                             + " lattice particles")
                     for i in [1, 2]:
-                        coords = _genLattice(self.x_box_length, self.xD, noise=self.noise)
+                        coords = _genLattice(self.x_box_length, self.xD, noise=self.noise,
+                                             dtype=self.dtype)
                         frm.put_data(base.loc_coordinates + '/' + self.label + str(i), coords)
                 elif (self.method == "gas"):
-                    coords = _genIdealGas(self.xN, self.x_box_length)
+                    coords = _genIdealGas(self.xN, self.x_box_length).astype(self.dtype, copy=False)
                     frm.put_data(base.loc_coordinates + '/' + self.label, coords)
                 #
                 frm.put_meta(self.get_meta())
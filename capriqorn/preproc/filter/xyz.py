@@ -28,6 +28,9 @@ class XYZ(base.Filter):
     from a generator returning base.Container with coordinate data."""
     _depends = []
     _conflicts = []
+    # container locations, see <lib/prune.py>
+    _consumes = [base.loc_coordinates]
+    _produces = []
 
     def __init__(self, source=-1,
                  file_prefix='',
@@ -12,4 +12,7 @@ from cadishi.io.hdf5 import *
 from cadishi.io.ascii import *
 from cadishi.io.pickel import *
 from cadishi.io.md import *
+from ...lib.hdf5 import *
+from .md import *
 from .dummy import *
+from .crdbox import *
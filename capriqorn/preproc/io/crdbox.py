@@ -0,0 +1,384 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""Capriqorn-native reader for (gzipped) Amber CRD box trajectories.
+
+The coordinates of a CRD box file are stored as fixed-width text (10F8.3,
+i.e. ten fields of eight characters per line), each frame being followed by a
+line holding the three box lengths.  The reader decodes complete frames at once
+using NumPy and keeps a persistent sidecar index of the byte offsets of the
+frames such that `first`, `last`, and `step` can be served by seeking directly
+to the frames of interest.  For gzipped trajectories, seek access points into
+the compressed stream are stored in addition if the `indexed_gzip` package is
+available.
+"""
+from __future__ import print_function
+from __future__ import division
+
+
+from builtins import range
+import os
+import gzip
+import bz2
+import numpy as np
+
+from cadishi import base
+from ...lib import species
+from ...lib import precision as libprecision
+
+try:
+    import indexed_gzip
+    have_indexed_gzip = True
+except ImportError:
+    have_indexed_gzip = False
+
+import MDAnalysis as mda
+
+
+# width of a single coordinate field in characters
+FIELD_WIDTH = 8
+# number of coordinate fields per line
+FIELDS_PER_LINE = 10
+# position of the decimal point within a field (format F8.3)
+FIELD_DECIMAL_POS = 4
+# weights to convert the digits of a F8.3 field into an integer (unit 1e-3)
+FIELD_WEIGHTS = np.array([1000000, 100000, 10000, 1000, 0, 100, 10, 1], dtype=np.int64)
+# chunk size used to scan a trajectory when the frame offset index is built
+SCAN_BLOCK_SIZE = 16 * 1024 * 1024
+# version tag of the sidecar index file layout
+INDEX_VERSION = 1
+
+
+def decode_fixed_width(fields, out=None):
+    """Decode an (n, 8) uint8 array of F8.3 formatted text fields into n floats.
+
+    The fast path converts the digits to integers arithmetically.  In case the
+    fields do not follow the F8.3 layout, NumPy's string conversion is used as
+    a fallback.
+
+    Parameters
+    ----------
+    fields : numpy.ndarray
+        Array of shape (n, FIELD_WIDTH) and dtype uint8 containing the characters.
+    out : numpy.ndarray, optional
+        Preallocated float64 output array of length n.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array containing the decoded floating point numbers.
+    """
+    n = fields.shape[0]
+    if out is None:
+        out = np.empty(n, dtype=np.float64)
+    is_digit = (fields >= 48) & (fields <= 57)
+    is_other = (fields == 32) | (fields == 45) | (fields == 46)
+    if np.all(fields[:, FIELD_DECIMAL_POS] == 46) and np.all(is_digit | is_other):
+        digits = np.where(is_digit, fields - 48, 0).astype(np.int64)
+        np.divide(np.dot(digits, FIELD_WEIGHTS), 1000., out=out)
+        negative = np.any(fields == 45, axis=1)
+        np.negative(out, out=out, where=negative)
+    else:
+        text = np.ascontiguousarray(fields).view('S%d' % FIELD_WIDTH).reshape(n)
+        out[:] = text.astype(np.float64)
+    return out
+
+
+def open_trajectory(filename, gzip_index_file=None):
+    """Open a CRD box trajectory for binary reading, transparently handling
+    gzip and bzip2 compression.  If available, indexed_gzip is used to provide
+    fast random access into gzipped files.
+    """
+    if filename.endswith('.gz'):
+        if have_indexed_gzip:
+            if (gzip_index_file is not None) and os.path.isfile(gzip_index_file):
+                return indexed_gzip.IndexedGzipFile(filename, index_file=gzip_index_file)
+            else:
+                return indexed_gzip.IndexedGzipFile(filename)
+        else:
+            return gzip.open(filename, 'rb')
+    elif filename.endswith('.bz2'):
+        return bz2.BZ2File(filename, 'rb')
+    else:
+        return open(filename, 'rb')
+
+
+def scan_frame_offsets(fp, n_atoms):
+    """Scan a CRD box trajectory once and return the byte offsets of the frames
+    in the (uncompressed) data stream.
+
+    Parameters
+    ----------
+    fp : file object
+        Binary file object positioned at the beginning of the trajectory.
+    n_atoms : int
+        Number of atoms per frame.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of length n_frames+1, element i holds the offset of frame i
+        (0-based), the last element holds the end of the last complete frame.
+    """
+    # one title line, then the coordinate lines plus one box line per frame
+    n_lines = -(-3 * n_atoms // FIELDS_PER_LINE) + 1
+    boundaries = []
+    n_newlines = 0
+    pos = 0
+    while True:
+        block = fp.read(SCAN_BLOCK_SIZE)
+        if not block:
+            break
+        newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10)
+        # global newline indices j with j % n_lines == 0 terminate the title
+        # line or the box line of a frame, ie. the next byte starts a frame
+        j_first = (-n_newlines) % n_lines
+        boundaries.append(newlines[j_first::n_lines] + (pos + 1))
+        n_newlines += newlines.size
+        pos += len(block)
+    if boundaries:
+        offsets = np.concatenate(boundaries).astype(np.int64)
+    else:
+        offsets = np.zeros(0, dtype=np.int64)
+    if offsets.size < 2:
+        raise IOError("no complete frame found in CRD box trajectory")
+    return offsets
+
+
+class CRDBoxReader(base.Reader):
+    """Fast native reader for Amber CRD box trajectories (plain, gzip, bzip2).
+
+    The reader is a drop-in replacement for the MDReader in case of crdbox
+    trajectories.  The pdb file is used to obtain the atom names only.
+    """
+    _depends = []
+    _conflicts = []
+    # frame selection via first/last/step, see pipeutil.plan_pipeline()
+    _fold_stride = True
+
+    def __init__(self, pdb_file="protein.pdb", trajectory_file="protein.crdbox.gz", selection='all',
+                 alias_file="alias.dat", first=1, last=None, step=1, index_file=None,
+                 precision='double', verbose=False):
+        """Constructor of the CRDBoxReader.
+
+        Parameters
+        ----------
+        pdb_file : string
+            File name of PDB file.
+        trajectory_file : string
+            File name of the crdbox trajectory file, optionally compressed (.gz, .bz2).
+        alias_file : string
+            File name of alias file.
+        selection : string
+            species selection (MDAnalysis selection syntax)
+        first : optional[int]
+            Number of first frame to be read, default is 1.
+        last : optional[int]
+            Number of last frame to be read, default is None, ie. all available.
+        step : optional[int]
+            Step widh, i.e. skip step-1 frames
+        index_file : optional[string]
+            File name of the sidecar frame offset index.  Default is None,
+            i.e. the trajectory file name with the suffix '.idx.npz' appended.
+        precision : optional[string]
+            Floating point precision of the coordinates put into the frames,
+            'double' (default) or 'single', see <lib/precision.py>.
+        verbose : bool
+            Print information on what the reader is currently doing.  Default is False.
+        """
+        self.verb = verbose
+        self.first = first
+        self.last = last
+        self.step = step
+        self.initialized = False
+        self.pdb_file = pdb_file
+        self.trajectory_file = trajectory_file
+        self.alias_file = alias_file
+        self.selection = selection
+        if index_file is None:
+            index_file = trajectory_file + '.idx.npz'
+        self.index_file = index_file
+        self.precision = precision
+        self.dtype = libprecision.get_dtype(precision)
+        self.shard_index = 0
+        self.n_shards = 1
+        # ---
+        self._depends.extend(super(base.Reader, self)._depends)
+        self._conflicts.extend(super(base.Reader, self)._conflicts)
+
+    def _gzip_index_file(self):
+        if self.trajectory_file.endswith('.gz') and have_indexed_gzip:
+            return self.index_file + '.gzidx'
+        else:
+            return None
+
+    def _load_index(self):
+        """Load the sidecar index, return None if it is missing or outdated."""
+        if not os.path.isfile(self.index_file):
+            return None
+        stat = os.stat(self.trajectory_file)
+        try:
+            with np.load(self.index_file) as idx:
+                if (int(idx['version']) != INDEX_VERSION) or \
+                   (int(idx['n_atoms']) != self.n_atoms_total) or \
+                   (int(idx['trajectory_size']) != stat.st_size) or \
+                   (float(idx['trajectory_mtime']) != stat.st_mtime):
+                    return None
+                offsets = idx['offsets']
+        except Exception:
+            return None
+        gzidx = self._gzip_index_file()
+        if (gzidx is not None) and (not os.path.isfile(gzidx)):
+            return None
+        return offsets
+
+    def _build_index(self):
+        """Scan the trajectory once and save the frame offsets (and the gzip
+        access points, if possible) to the sidecar index file(s)."""
+        if self.verb:
+            print("CRDBoxReader: building frame offset index for " + self.trajectory_file)
+        gzidx = self._gzip_index_file()
+        fp = open_trajectory(self.trajectory_file)
+        try:
+            offsets = scan_frame_offsets(fp, self.n_atoms_total)
+            if gzidx is not None:
+                fp.build_full_index()
+                fp.export_index(gzidx)
+        finally:
+            fp.close()
+        stat = os.stat(self.trajectory_file)
+        tmp_file = self.index_file + '.tmp'
+        try:
+            with open(tmp_file, 'wb') as fp:
+                np.savez(fp, version=INDEX_VERSION, n_atoms=self.n_atoms_total, offsets=offsets,
+                         trajectory_size=stat.st_size, trajectory_mtime=stat.st_mtime)
+            os.rename(tmp_file, self.index_file)
+        except (IOError, OSError):
+            print(" Note: CRDBoxReader could not save the frame offset index to " + self.index_file)
+        return offsets
+
+    def init(self):
+        """Initialization routine that does actually open files to read information."""
+        universe = mda.Universe(self.pdb_file)
+        self.n_atoms_total = universe.atoms.n_atoms
+        atoms = universe.select_atoms(self.selection)
+        self.nrPart = atoms.n_atoms
+        # species partition, relative to the full set of atoms in the trajectory
+        self.partition = species.SpeciesPartition.from_alias(atoms.names,
+                                                             species.read_alias_file(self.alias_file),
+                                                             atoms.indices)
+        self.elements = self.partition.elements
+        self.nEl = len(self.elements)
+        # --- frame offset index
+        self.offsets = self._load_index()
+        if self.offsets is None:
+            self.offsets = self._build_index()
+        self.n_frames = self.offsets.size - 1
+        # ---
+        if (self.first is None):
+            self.first = 1
+        if (self.first > self.n_frames):
+            raise IndexError("First frame index exceeds the maximum number of frames.")
+        if self.last is None:
+            self.last = self.n_frames
+        else:
+            if (self.first > self.last):
+                raise IndexError("First frame index exceeds the last frame index.")
+            self.last = min(self.last, self.n_frames)
+        # --- preallocated buffers, reused for each frame
+        self._n_fields = 3 * self.n_atoms_total + 3
+        self._frame_bytes = bytearray(int(np.max(np.diff(self.offsets))))
+        self._values = np.empty(self._n_fields, dtype=np.float64)
+        self._fp = open_trajectory(self.trajectory_file, self._gzip_index_file())
+        self.initialized = True
+
+    def close(self):
+        if self.initialized:
+            self._fp.close()
+            self.initialized = False
+
+    def shard(self, shard_index, n_shards):
+        """Restrict the reader to every n_shards-th selected frame, starting at
+        shard_index.  Frame numbers are kept identical to the ones of an
+        unsharded reader."""
+        self.shard_index = shard_index
+        self.n_shards = n_shards
+
+    def get_frame_count(self):
+        """Return the number of frames delivered by the reader (shard)."""
+        if not self.initialized:
+            self.init()
+        start = self.first + self.shard_index * self.step
+        return len(range(start, self.last + 1, self.step * self.n_shards))
+
+    def get_meta(self):
+        """Return information on the reader, ready to be added to a frame
+        object's list of pipeline meta information.
+        """
+        meta = {}
+        label = 'CRDBoxReader'
+        param = {'pdb_file': self.pdb_file, 'trajectory_file': self.trajectory_file,
+                 'alias_file': self.alias_file, 'selection': self.selection,
+                 'first': self.first, 'last': self.last, 'step': self.step,
+                 'precision': self.precision}
+        meta[label] = param
+        return meta
+
+    def read_frame(self, i):
+        """Read and decode frame i (1-based numbering), return the coordinates
+        of all atoms as an (n_atoms, 3) array and the box lengths.  Both arrays
+        are views into buffers that are reused by subsequent calls.
+        """
+        if not self.initialized:
+            self.init()
+        start = self.offsets[i - 1]
+        n_bytes = self.offsets[i] - start
+        if self._fp.tell() != start:
+            self._fp.seek(start)
+        view = memoryview(self._frame_bytes)[:n_bytes]
+        if self._fp.readinto(view) != n_bytes:
+            raise IOError("unexpected end of CRD box trajectory at frame {}".format(i))
+        chars = np.frombuffer(self._frame_bytes, dtype=np.uint8, count=n_bytes)
+        chars = chars[(chars != 10) & (chars != 13)]
+        if chars.size != self._n_fields * FIELD_WIDTH:
+            raise IOError("malformed frame {} in CRD box trajectory".format(i))
+        decode_fixed_width(chars.reshape(self._n_fields, FIELD_WIDTH), out=self._values)
+        coords = self._values[:-3].reshape(self.n_atoms_total, 3)
+        box = self._values[-3:]
+        return coords, box
+
+    def get_frame(self, i):
+        """Return frame i (1-based numbering) as a Container."""
+        coords, box = self.read_frame(i)
+        frm = base.Container()
+        self.partition.put(frm, coords, dtype=self.dtype)
+        dimensions = np.array([box[0], box[1], box[2], 90., 90., 90.], dtype=np.float32)
+        frm.put_data(base.loc_dimensions, dimensions)
+        frm.i = i
+        frm.put_meta(self.get_meta())
+        return frm
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """Generator that iterates through the selected frames and yields
+        frame by frame.
+        """
+        if not self.initialized:
+            self.init()
+        start = self.first + self.shard_index * self.step
+        for i in range(start, self.last + 1, self.step * self.n_shards):
+            frm = self.get_frame(i)
+            if self.verb:
+                print("CRDBoxReader.next() : {}".format(frm.i))
+            yield frm
+        self.close()
@@ -28,10 +28,22 @@ class DummyReader(base.Reader):
     _depends = []
     _conflicts = []
 
-    def __init__(self, n_frames=3, n_elems=3, n_atoms=1024, verbose=False):
+    def __init__(self, n_frames=3, n_elems=3, n_atoms=1024, box_length=None,
+                 table=True, verbose=False):
+        """
+        Parameters
+        ----------
+        box_length : float
+            Optional edge length of a cubic box centered at the origin the
+            coordinates are distributed in, default is the unit cube [0,1).
+        table : bool
+            Add a large (n_atoms x n_atoms) table to each frame.
+        """
         self.n_frames = n_frames
         self.n_elems = n_elems
         self.n_atoms = n_atoms
+        self.box_length = box_length
+        self.table = table
         self.verb = verbose
         self.frms = []
         # ---
@@ -43,10 +55,13 @@ class DummyReader(base.Reader):
             for j in range(n_elems):
                 s_name = "El" + str(i) + str(j)
                 s_coor = np.random.rand(n_atoms, 3)
+                if box_length is not None:
+                    s_coor = box_length * (s_coor - 0.5)
                 frm.put_data(base.loc_coordinates + '/' + s_name, s_coor)
-            s_name = 'my/huge/table/in/some/subdirectory/data'
-            s_table = np.random.rand(n_atoms, n_atoms)
-            frm.put_data(s_name, s_table)
+            if table:
+                s_name = 'my/huge/table/in/some/subdirectory/data'
+                s_table = np.random.rand(n_atoms, n_atoms)
+                frm.put_data(s_name, s_table)
             s_name = 'integer'
             frm.put_data(s_name, 1)
             s_name = 'string'
@@ -63,6 +78,14 @@ class DummyReader(base.Reader):
             frm.put_data(s_name, ['Hello', 1])
             self.frms.append(copy.deepcopy(frm))
 
+    def shard(self, shard_index, n_shards):
+        """Restrict the reader to every n_shards-th frame, starting at shard_index."""
+        self.frms = self.frms[shard_index::n_shards]
+
+    def get_frame_count(self):
+        """Return the number of frames delivered by the reader (shard)."""
+        return len(self.frms)
+
     def get_meta(self):
         """ Return information on the present filter, ready to be added to a
         frame object's list of pipeline meta information. """
@@ -88,6 +111,9 @@ class DummyWriter(base.Writer):
     """
     _depends = []
     _conflicts = []
+    # container locations, see <lib/prune.py>
+    _consumes = []
+    _produces = []
 
     def __init__(self, source, verbose=False):
         self.src = source
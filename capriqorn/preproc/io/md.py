@@ -0,0 +1,106 @@
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""Capriqorn MDAnalysis-based reader, extends the Cadishi MDReader by
+frame-range seeking and sharded reading.
+"""
+from __future__ import print_function
+
+
+import copy
+from cadishi import base
+from cadishi.io import md as cadishi_md
+from ...lib import species
+from ...lib import precision as libprecision
+
+
+class MDReader(cadishi_md.MDReader):
+    """Trajectory reader, built upon MDAnalysis."""
+    _depends = []
+    _conflicts = []
+    # frame selection via first/last/step, see pipeutil.plan_pipeline()
+    _fold_stride = True
+
+    def __init__(self, pdb_file="protein.pdb", trajectory_file="protein.xtc", selection='all',
+                 alias_file="alias.dat", first=1, last=None, step=1, precision='double',
+                 verbose=False):
+        super(MDReader, self).__init__(pdb_file=pdb_file, trajectory_file=trajectory_file,
+                                       selection=selection, alias_file=alias_file,
+                                       first=first, last=last, step=step, verbose=verbose)
+        self.precision = precision
+        self.dtype = libprecision.get_dtype(precision)
+        self.shard_index = 0
+        self.n_shards = 1
+
+    def init(self):
+        """Initialization routine that does actually open files to read information.
+        The Cadishi implementation is used, except that the trajectory is not
+        forwarded frame by frame to the first frame (the trajectory is sliced
+        in __next__), and that the species partition table is set up once.
+        """
+        first = self.first if (self.first is not None) else 1
+        self.first = 1
+        super(MDReader, self).init()
+        self.first = first
+        # check the value of `first` as done by the Cadishi implementation
+        if (self.first > self.universe.trajectory.n_frames):
+            raise IndexError("First frame index exceeds the maximum number of frames.")
+        if (self.first > self.last):
+            raise IndexError("First frame index exceeds the last frame index.")
+        # species partition, relative to the full set of atoms in the universe
+        self.partition = species.SpeciesPartition.from_alias(self.atoms.names,
+                                                             species.read_alias_file(self.alias_file),
+                                                             self.atoms.indices)
+        self.elements = self.partition.elements
+        self.nEl = len(self.elements)
+
+    def shard(self, shard_index, n_shards):
+        """Restrict the reader to every n_shards-th selected frame, starting at
+        shard_index.  Frame numbers are kept identical to the ones of an
+        unsharded reader."""
+        self.shard_index = shard_index
+        self.n_shards = n_shards
+
+    def get_frame_count(self):
+        """Return the number of frames delivered by the reader (shard)."""
+        if not self.initialized:
+            self.init()
+        start = self.first - 1 + self.shard_index * self.step
+        return len(range(start, self.last, self.step * self.n_shards))
+
+    def get_meta(self):
+        """Return information on the reader, ready to be added to a frame
+        object's list of pipeline meta information.
+        """
+        meta = super(MDReader, self).get_meta()
+        meta['MDReader']['precision'] = self.precision
+        return meta
+
+    def __next__(self):
+        """Generator that iterates through the selected frames and yields
+        frame by frame.  The trajectory is sliced, i.e. MDAnalysis seeks
+        directly to the frames of interest.
+        """
+        if not self.initialized:
+            self.init()
+        start = self.first - 1 + self.shard_index * self.step
+        stride = self.step * self.n_shards
+        for ts in self.universe.trajectory[start:self.last:stride]:
+            frm = base.Container()
+            # MDAnalysis provides single precision coordinates, which are
+            # type-converted to 64 bit floats unless single precision is requested
+            self.partition.put(frm, ts.positions, dtype=self.dtype)
+            frm.put_data(base.loc_dimensions, copy.deepcopy(ts.dimensions))
+            frm.i = ts.frame + 1  # numbering relative to the original dataset
+            frm.put_meta(self.get_meta())
+            if self.verb:
+                print("MDReader.next() : {}".format(frm.i))
+            yield frm
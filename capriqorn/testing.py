@@ -107,6 +107,30 @@ class KeepLastFrame(base.Filter):
         self.last_frame = copy.deepcopy(frm)
 
 
+class FrameSource(base.Reader):
+    """Minimal pipeline source yielding a given list of frames."""
+
+    def __init__(self, frames):
+        self.frames = frames
+
+    def get_meta(self):
+        """Return information on the present filter, ready to be added to a
+        frame object's list of pipeline meta information.
+        """
+        meta = {}
+        label = 'FrameSource'
+        param = {}
+        meta[label] = param
+        return meta
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        for frm in self.frames:
+            yield frm
+
+
 # --- legacy code below ---
 
 
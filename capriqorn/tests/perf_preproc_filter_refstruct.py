@@ -12,7 +12,7 @@
 
 from __future__ import print_function
 from builtins import str
-import time
+from timeit import default_timer as timer
 import numpy as np
 from capriqorn.lib import refstruct
 from capriqorn.kernel import c_refstruct
@@ -27,24 +27,24 @@ R = 0.75
 print(" Measuring queryDistance() performance ...")
 print(" n_xyz=" + str(n_xyz) + ", n_ref=" + str(n_ref))
 
-t0 = time.clock()
+t0 = timer()
 q_old = refstruct.queryDistance_legacy(xyz, ref, R)
-dt = time.clock() - t0
+dt = timer() - t0
 print(" * queryDistance_legacy: ", dt)
 
-t0 = time.clock()
+t0 = timer()
 q_new = refstruct.queryDistance_opt(xyz, ref, R)
-dt = time.clock() - t0
+dt = timer() - t0
 print(" * queryDistance_opt:    ", dt)
 
-t0 = time.clock()
+t0 = timer()
 q_acc = c_refstruct.queryDistance(xyz, ref, R)
-dt = time.clock() - t0
+dt = timer() - t0
 print(" * queryDistance_cython: ", dt)
 
-t0 = time.clock()
+t0 = timer()
 c_refstruct.queryDistance(xyz, ref, R)
-dt = time.clock() - t0
+dt = timer() - t0
 print(" * queryDistance:        ", dt)
 
 print(" Comparing results ...")
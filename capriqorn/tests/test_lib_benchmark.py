@@ -0,0 +1,66 @@
+#!/usr/bin/env python2.7
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""A set of unit tests of the Capriqorn benchmark library.
+"""
+
+
+import os
+import cadishi.util as util
+from capriqorn.lib import benchmark
+
+
+do_cleanup = True
+tiny = {'n_frames': 2, 'n_atoms': 2000, 'n_ref': 100, 'n_bins': 500, 'n_workers': [2], 'repeat': 2}
+
+
+def test_select():
+    names = benchmark.get_benchmarks(tiny).keys()
+    assert benchmark.select(names, None) == list(names)
+    assert benchmark.select(names, ['postproc.*']) == \
+        ['postproc.Average', 'postproc.Solvent', 'postproc.DeltaH', 'postproc.PDDF']
+    assert benchmark.select(names, ['*Sphere', 'pipeline.*']) == ['preproc.Sphere', 'pipeline.n_workers=2']
+
+
+def test_run():
+    # the PDDF filter takes too long for the test suite
+    names = [name for name in benchmark.get_benchmarks(tiny).keys() if (name != 'postproc.PDDF')]
+    cwd = os.getcwd()
+    os.chdir(util.scratch_dir())
+    try:
+        result = benchmark.run(tiny, names)
+        file_name = 'bench.json'
+        benchmark.save(result, file_name)
+        baseline = benchmark.load(file_name)
+    finally:
+        os.chdir(cwd)
+    assert list(result['results'].keys()) == names
+    for entry in result['results'].values():
+        assert len(entry['times']) == 2
+        assert entry['best'] == min(entry['times'])
+    assert '_cache' not in baseline['config']
+    rows = benchmark.compare(result, baseline)
+    assert all([row[-1] == 'ok' for row in rows])
+
+
+def test_compare():
+    baseline = {'results': {'a': {'best': 1.0}, 'b': {'best': 1.0}, 'c': {'best': 1.0}, 'd': {'best': 1.0}}}
+    result = {'results': {'a': {'best': 1.05}, 'b': {'best': 1.5}, 'c': {'best': 0.5}, 'e': {'best': 1.0}}}
+    rows = benchmark.compare(result, baseline, threshold=0.1)
+    status = dict([(row[0], row[-1]) for row in rows])
+    assert status == {'a': 'ok', 'b': 'regression', 'c': 'improvement', 'd': 'missing', 'e': 'new'}
+    benchmark.print_comparison(rows)
+
+
+if do_cleanup:
+    def test_final_cleanup():
+        util.rmrf(util.scratch_dir())
@@ -0,0 +1,57 @@
+#!/usr/bin/env python2.7
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""A set of unit tests of the Capriqorn block averaging library.
+"""
+
+
+import numpy as np
+import cadishi.base as base
+from capriqorn.lib import blocking
+import pytest
+
+
+def test_running_variance():
+    np.random.seed(7)
+    samples = np.random.rand(50, 4) * 1.e3 + 1.e6
+    running = blocking.RunningVariance()
+    for x in samples:
+        running.add({'radii': np.arange(4), 'A,A': x})
+    assert sorted(running.mean.keys()) == ['A,A']
+    assert np.allclose(running.mean['A,A'], samples.mean(axis=0))
+    assert np.allclose(running.variance()['A,A'], samples.var(axis=0, ddof=1))
+    assert np.allclose(running.stderr()['A,A'], samples.std(axis=0, ddof=1) / np.sqrt(50))
+
+
+def test_get_block_sizes():
+    assert blocking.get_block_sizes(None) == []
+    assert blocking.get_block_sizes(4) == [4]
+    assert blocking.get_block_sizes([10, 2, 10]) == [2, 10]
+    with pytest.raises(ValueError):
+        blocking.get_block_sizes([0])
+
+
+def test_get_replica():
+    frm = base.Container(number=3)
+    frm.put_data(base.loc_histograms + '/A,A', np.ones(4))
+    frm.put_data(base.loc_intensity + '/dI', np.ones((4, 2)))
+    frm.put_data(blocking.loc_error_blocks, {'0': {base.loc_histograms: {'A,A': np.zeros(4)}}})
+    frm.put_meta({'Dummy': {}})
+    block = blocking.get_error_blocks(frm)[0]
+    replica = blocking.get_replica(frm, block, [base.loc_intensity])
+    assert replica.i == 3
+    assert np.all(replica.get_data(base.loc_histograms + '/A,A') == 0.0)
+    assert not replica.contains_key(blocking.loc_error_blocks)
+    replica.put_data(base.loc_intensity + '/dI', np.zeros((4, 2)))
+    replica.put_meta({'Other': {}})
+    assert np.all(frm.get_data(base.loc_intensity + '/dI') == 1.0)
+    assert len(frm.get_meta()) == 1
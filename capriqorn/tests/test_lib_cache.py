@@ -0,0 +1,130 @@
+#!/usr/bin/env python2.7
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""A set of unit tests of the Capriqorn stage cache.
+"""
+
+
+import os
+import glob
+import shutil
+import numpy as np
+import cadishi.base as base
+import cadishi.util as util
+from capriqorn.postproc import io as postproc_io
+from capriqorn.lib import pipeutil
+from capriqorn.lib import cache
+from capriqorn.testing import FrameSource, get_test_data_file_path
+
+
+do_cleanup = True
+out_directory = util.scratch_dir()
+input_file = out_directory + "cache_input.h5"
+cache_directory = out_directory + "stage_cache"
+
+
+def pipeline_meta(output_file, n_dummy=1):
+    return [{'H5Reader': {'file': input_file}},
+            {'Average': {'n_avg': 2}}] + \
+        [{'Dummy': {}}] * n_dummy + \
+        [{'H5Writer': {'file': output_file}}]
+
+
+def instantiate(meta):
+    pipeline = pipeutil.instantiate_pipeline(meta, "capriqorn.postproc")
+    return cache.apply(pipeline, cache_directory)
+
+
+def read_histograms(file_name):
+    frames = list(next(postproc_io.H5Reader(file=file_name)))
+    return [frm.get_data(base.loc_histograms) for frm in frames]
+
+
+def test_setup():
+    frames = list(next(postproc_io.DummyReader(n_histogram_sets=6, n_bins=32)))
+    postproc_io.H5Writer(source=FrameSource(frames), file=input_file).dump()
+
+
+def test_stage_cache():
+    # --- first run, all stages are computed and stored
+    (pipeline, n_cached) = instantiate(pipeline_meta(out_directory + "cache_1.h5"))
+    assert n_cached == 0
+    pipeline[-1].dump()
+    assert len(glob.glob(os.path.join(cache_directory, '*', cache.entry_file))) == 2
+    # --- second run, the Average and Dummy stages are served from the cache
+    (pipeline, n_cached) = instantiate(pipeline_meta(out_directory + "cache_2.h5"))
+    assert n_cached == 3
+    assert isinstance(pipeline[0], cache.CacheReader)
+    pipeline[-1].dump()
+    # --- an additional stage, the prefix is served from the cache
+    (pipeline, n_cached) = instantiate(pipeline_meta(out_directory + "cache_3.h5", n_dummy=2))
+    assert n_cached == 3
+    pipeline[-1].dump()
+    reference = read_histograms(out_directory + "cache_1.h5")
+    assert len(reference) == 3
+    for file_name in ["cache_2.h5", "cache_3.h5"]:
+        histograms = read_histograms(out_directory + file_name)
+        assert len(histograms) == len(reference)
+        for (x, y) in zip(histograms, reference):
+            for key in y:
+                assert np.allclose(x[key], y[key])
+    # --- changed parameters invalidate the stage and the downstream stages
+    meta = pipeline_meta(out_directory + "cache_4.h5")
+    meta[1]['Average']['n_avg'] = 3
+    (pipeline, n_cached) = instantiate(meta)
+    assert n_cached == 0
+
+
+def test_stage_cache_input_changed():
+    frames = list(next(postproc_io.DummyReader(n_histogram_sets=4, n_bins=32)))
+    postproc_io.H5Writer(source=FrameSource(frames), file=input_file).dump()
+    (pipeline, n_cached) = instantiate(pipeline_meta(out_directory + "cache_5.h5"))
+    assert n_cached == 0
+
+
+def test_stage_keys_filter_files():
+    # the data files and the debug flag of downstream filters are part of the keys
+    form_factor_file = out_directory + "atomsf.dat"
+    shutil.copy(get_test_data_file_path('atomsf.dat'), form_factor_file)
+
+    def get_keys(debug=False):
+        meta = [{'H5Reader': {'file': input_file}},
+                {'PDDF': {'form_factor_file': form_factor_file, 'debug': debug}},
+                {'H5Writer': {'file': out_directory + "cache_keys.h5"}}]
+        # the key of the writer is not used
+        return cache.get_stage_keys(pipeutil.instantiate_pipeline(meta, "capriqorn.postproc"))[:-1]
+
+    keys = get_keys()
+    assert get_keys() == keys
+    assert get_keys(debug=True)[1] != keys[1]
+    stat = os.stat(form_factor_file)
+    os.utime(form_factor_file, (stat.st_atime, stat.st_mtime + 10.))
+    modified_keys = get_keys()
+    assert modified_keys[0] == keys[0]
+    assert modified_keys[1] != keys[1]
+
+
+def test_evict():
+    assert cache.evict(cache_directory) > 0
+    assert cache.evict(cache_directory, size=0.) == 0
+    assert glob.glob(os.path.join(cache_directory, '*')) == []
+
+
+def test_run_pipeline():
+    meta = pipeline_meta(out_directory + "cache_6.h5")
+    pipeutil.run_pipeline(meta, "capriqorn.postproc", cache={'directory': cache_directory, 'size': 1.})
+    assert len(glob.glob(os.path.join(cache_directory, '*', cache.entry_file))) == 2
+
+
+if do_cleanup:
+    def test_final_cleanup():
+        util.rmrf(out_directory)
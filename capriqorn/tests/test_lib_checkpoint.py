@@ -0,0 +1,211 @@
+#!/usr/bin/env python2.7
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""A set of unit tests of the Capriqorn checkpoint and resume functionality.
+"""
+
+
+import os
+import pytest
+import numpy as np
+import cadishi.base as base
+import cadishi.util as util
+from capriqorn.postproc import io as postproc_io
+from capriqorn.preproc import io as preproc_io
+from capriqorn.preproc import filter as preproc_filter
+from capriqorn.lib import pipeutil
+from capriqorn.lib import checkpoint
+from capriqorn.lib import profiling
+from capriqorn.testing import FrameSource
+
+
+do_cleanup = True
+out_directory = util.scratch_dir()
+input_file = out_directory + "checkpoint_input.h5"
+module = "capriqorn.postproc"
+
+
+class InterruptedSource(object):
+    """Source passing on n_frames frames and failing afterwards."""
+
+    def __init__(self, source, n_frames):
+        self.src = source
+        self.n_frames = n_frames
+
+    def __next__(self):
+        for (count, frm) in enumerate(next(self.src)):
+            if (count == self.n_frames):
+                raise RuntimeError("interrupted")
+            yield frm
+
+    next = __next__
+
+
+def pipeline_meta(output_file, average=False):
+    meta = [{'H5Reader': {'file': input_file}}]
+    if average:
+        meta.append({'Average': {'n_avg': 'all'}})
+    else:
+        meta.append({'Dummy': {}})
+    meta.append({'H5Writer': {'file': output_file}})
+    return meta
+
+
+def run_interrupted(meta, position, n_frames):
+    pipeline = pipeutil.instantiate_pipeline(meta, module)
+    pipeline[position].src = InterruptedSource(pipeline[position].src, n_frames)
+    with pytest.raises(RuntimeError):
+        pipeline[-1].dump()
+    pipeline[-1].close_file_safely()
+
+
+def read_frames(file_name):
+    return list(next(postproc_io.H5Reader(file=file_name)))
+
+
+def compare(file_name, reference_name):
+    frames = read_frames(file_name)
+    reference = read_frames(reference_name)
+    assert len(frames) == len(reference)
+    for (frm, ref) in zip(frames, reference):
+        x = frm.get_data(base.loc_histograms)
+        y = ref.get_data(base.loc_histograms)
+        for key in y:
+            assert np.allclose(x[key], y[key])
+
+
+def test_setup():
+    frames = list(next(postproc_io.DummyReader(n_histogram_sets=7, n_bins=32)))
+    postproc_io.H5Writer(source=FrameSource(frames), file=input_file).dump()
+
+
+def test_resume_writer():
+    reference_file = out_directory + "reference.h5"
+    pipeutil.run_pipeline(pipeline_meta(reference_file), module)
+    # --- interrupted run, the last checkpoint is written after 4 frames
+    output_file = out_directory + "resumed.h5"
+    meta = pipeline_meta(output_file)
+    checkpoint.setup(meta, module, interval=2)
+    run_interrupted(meta, -1, 5)
+    cp = checkpoint.read(checkpoint.get_checkpoint_file(output_file))
+    assert cp['frame'] == 4
+    assert cp['source'] == 'H5Writer'
+    assert len(read_frames(output_file)) == 5
+    # --- resumed run, frame 5 is removed and processed again
+    meta = pipeline_meta(output_file)
+    checkpoint.setup(meta, module, resume=True)
+    assert meta[0]['H5Reader']['first'] == 5
+    assert meta[-1]['H5Writer']['mode'] == 'a'
+    pipeutil.run_pipeline(meta, module)
+    assert not os.path.exists(checkpoint.get_checkpoint_file(output_file))
+    compare(output_file, reference_file)
+
+
+def test_resume_average():
+    reference_file = out_directory + "reference_average.h5"
+    pipeutil.run_pipeline(pipeline_meta(reference_file, average=True), module)
+    output_file = out_directory + "resumed_average.h5"
+    meta = pipeline_meta(output_file, average=True)
+    checkpoint.setup(meta, module, interval=3)
+    run_interrupted(meta, 1, 4)
+    cp = checkpoint.read(checkpoint.get_checkpoint_file(output_file))
+    assert cp['frame'] == 3
+    assert cp['source'] == 'Average'
+    meta = pipeline_meta(output_file, average=True)
+    checkpoint.setup(meta, module, resume=True)
+    assert meta[0]['H5Reader']['first'] == 4
+    assert 'append_state' in meta[1]['Average']
+    pipeutil.run_pipeline(meta, module)
+    compare(output_file, reference_file)
+
+
+def test_checkpoint_parallel_average():
+    # the partial sums of Average in a parallel region are merged at the end only
+    meta = pipeline_meta(out_directory + "parallel.h5", average=True)
+    meta.insert(1, {'ParallelFork': {'n_workers': 2}})
+    meta.insert(3, {'ParallelJoin': {}})
+    with pytest.raises(RuntimeError):
+        checkpoint.setup(meta, module, interval=2)
+    meta[1]['ParallelFork']['active'] = False
+    checkpoint.setup(meta, module, interval=2)
+    assert meta[2]['Average']['checkpoint'] == 2
+
+
+def test_checkpoint_parallel_virtual_particles():
+    # the random number generator state of VirtualParticles lives on the workers
+    meta = [{'DummyReader': {}},
+            {'ParallelFork': {'n_workers': 2}},
+            {'VirtualParticles': {'method': 'gas'}},
+            {'ParallelJoin': {}},
+            {'H5Writer': {'file': out_directory + "parallel_vp.h5"}}]
+    with pytest.raises(RuntimeError):
+        checkpoint.setup(meta, "capriqorn.preproc", interval=2)
+    meta[1]['ParallelFork']['active'] = False
+    checkpoint.setup(meta, "capriqorn.preproc", interval=2)
+    assert meta[4]['H5Writer']['checkpoint'] == 2
+
+
+def test_resume_without_checkpoint():
+    meta = pipeline_meta(out_directory + "new.h5")
+    assert checkpoint.setup_resume(meta, module) is None
+    assert 'first' not in meta[0]['H5Reader']
+
+
+def test_resume_step():
+    # the Step filter cannot be folded into the reader behind VirtualParticles
+    output_file = out_directory + "preproc.h5"
+    meta = [{'CRDBoxReader': {'pdb_file': 'protein.pdb', 'crdbox_file': 'protein.crdbox'}},
+            {'VirtualParticles': {'method': 'gas'}},
+            {'Step': {'step': 2}},
+            {'H5Writer': {'file': output_file}}]
+    checkpoint.write(checkpoint.get_checkpoint_file(output_file),
+                     {'frame': 2, 'interval': 2, 'source': 'H5Writer', 'parameters': {},
+                      'reader': ('CRDBoxReader', {'first': 1, 'step': 1})})
+    with pytest.raises(RuntimeError):
+        checkpoint.setup_resume(meta, "capriqorn.preproc")
+    del meta[1]
+    checkpoint.setup_resume(meta, "capriqorn.preproc")
+    assert meta[0]['CRDBoxReader']['first'] == 3
+
+
+def test_virtual_particles_rng_state():
+    vp = preproc_filter.VirtualParticles(method='gas', x_box_length=10.0, random_seed=7)
+    state = vp.get_checkpoint()
+    x = np.random.uniform(size=8)
+    vp = preproc_filter.VirtualParticles(method='gas', x_box_length=10.0, random_seed=7, **state)
+    y = np.random.uniform(size=8)
+    assert np.all(x == y)
+
+
+def test_collect_states_instrumented():
+    # the stand-ins of the instrumentation do not change the labels of the states
+    reader = preproc_io.DummyReader(n_frames=2, n_atoms=8)
+    vp = preproc_filter.VirtualParticles(source=reader, method='gas', x_box_length=10.0, random_seed=7)
+    writer = preproc_io.DummyWriter(source=vp)
+    profiling.instrument([reader, vp, writer])
+    assert list(checkpoint.collect_states(writer)) == ['VirtualParticles']
+
+
+def test_resume_unknown_state():
+    output_file = out_directory + "unknown_state.h5"
+    checkpoint.write(checkpoint.get_checkpoint_file(output_file),
+                     {'frame': 2, 'interval': 2, 'source': 'H5Writer',
+                      'parameters': {'VirtualParticles': {'rng_state': None}},
+                      'reader': ('H5Reader', {'first': 1, 'step': 1})})
+    meta = pipeline_meta(output_file)
+    with pytest.raises(RuntimeError):
+        checkpoint.setup_resume(meta, module)
+
+
+if do_cleanup:
+    def test_final_cleanup():
+        util.rmrf(out_directory)
@@ -0,0 +1,428 @@
+#!/usr/bin/env python2.7
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""A set of unit tests of the Capriqorn (parallel) pipeline code.
+"""
+
+
+import os
+import copy
+import json
+import multiprocessing as mp
+import numpy as np
+import cadishi.util as util
+import capriqorn.preproc.io as preproc_io
+import capriqorn.preproc.filter as preproc_filter
+from capriqorn.lib import pipeutil
+from capriqorn.lib import parpipe
+from capriqorn.lib import profiling
+from capriqorn.lib import memory
+from capriqorn.lib import progress
+from capriqorn.testing import data
+import pytest
+
+
+do_cleanup = True
+h5name = util.scratch_dir() + "test_lib_pipeutil.h5"
+
+
+def sharded_pipeline_meta(n_frames=10, n_workers=3):
+    return [{'DummyReader': {'n_frames': n_frames, 'n_atoms': 16}},
+            {'ParallelFork': {'n_workers': n_workers, 'sharding': True}},
+            {'Dummy': {}},
+            {'ParallelJoin': {}},
+            {'H5Writer': {'file': h5name}}]
+
+
+# --- tests below ---
+
+
+def test_parallel_pipeline(data):
+    pipeline_meta = util.load_parameter_file(data["test_preprocessor_parallel_success.yaml"])
+    cwd = os.getcwd()
+    os.chdir(util.scratch_dir())
+    try:
+        pipeutil.run_pipeline(pipeline_meta, "capriqorn.preproc")
+    finally:
+        os.chdir(cwd)
+
+
+def test_sharded_pipeline_segments():
+    pipeline_meta = sharded_pipeline_meta()
+    (n_parallel, n_workers_per_segment) = pipeutil.get_parallel_configuration(pipeline_meta)
+    assert n_parallel == 1
+    assert n_workers_per_segment == [3, 1]
+    meta_segments = pipeutil.get_pipeline_meta_segments(pipeline_meta)
+    assert len(meta_segments) == 2
+    assert [list(x.keys())[0] for x in meta_segments[0]] == \
+        ['DummyReader', 'ParallelFork', 'Dummy', 'ParallelJoin']
+    segment = pipeutil.get_shard_segment(meta_segments[0], 2)
+    assert segment[1]['ParallelFork']['shard_index'] == 2
+    assert 'shard_index' not in meta_segments[0][1]['ParallelFork']
+
+
+def test_sharded_pipeline_invalid():
+    pipeline_meta = sharded_pipeline_meta()
+    pipeline_meta.insert(1, {'Dummy': {}})
+    with pytest.raises(RuntimeError):
+        pipeutil.get_parallel_configuration(pipeline_meta)
+
+
+def test_parallel_average_placement():
+    pipeline_meta = [{'H5Reader': {}},
+                     {'ParallelFork': {'n_workers': 2}},
+                     {'Average': {'n_avg': 2}},
+                     {'Dummy': {'active': False}},
+                     {'ParallelJoin': {}},
+                     {'H5Writer': {}}]
+    assert pipeutil.get_parallel_configuration(copy.deepcopy(pipeline_meta)) == (1, [1, 2, 1])
+    pipeline_meta[3]['Dummy']['active'] = True
+    with pytest.raises(RuntimeError):
+        pipeutil.get_parallel_configuration(copy.deepcopy(pipeline_meta))
+    # the error estimates are not supported in parallel regions
+    del pipeline_meta[3]
+    pipeline_meta[2]['Average']['error_block_sizes'] = [1, 2]
+    with pytest.raises(RuntimeError):
+        pipeutil.get_parallel_configuration(pipeline_meta)
+
+
+def test_sharded_join_order():
+    n_frames = 10
+    n_workers = 3
+    queue = mp.Queue(parpipe.QUEUE_MAXSIZE)
+    # run the worker side of the parallel region sequentially, the shards
+    # arrive at the join one after the other
+    for shard_index in range(n_workers):
+        reader = preproc_io.DummyReader(n_frames=n_frames, n_atoms=16)
+        fork = parpipe.ParallelFork(source=reader, side=parpipe.SIDE_DOWNSTREAM,
+                                    n_workers=n_workers, sharding=True, shard_index=shard_index)
+        join = parpipe.ParallelJoin(source=fork, queue=queue, side=parpipe.SIDE_UPSTREAM)
+        join.dump()
+    join = parpipe.ParallelJoin(queue=queue, side=parpipe.SIDE_DOWNSTREAM, n_workers=n_workers)
+    frames = [frm.i for frm in next(join) if frm is not None]
+    assert frames == list(range(n_frames))
+
+
+def test_sharded_pipeline():
+    cwd = os.getcwd()
+    os.chdir(util.scratch_dir())
+    try:
+        pipeutil.run_pipeline(sharded_pipeline_meta(), "capriqorn.preproc")
+    finally:
+        os.chdir(cwd)
+    reader = preproc_io.H5Reader(h5name)
+    assert sorted(int(frame_idx) for (_, frame_idx) in reader.frame_pool) == list(range(10))
+
+
+def test_H5Reader_shard():
+    reader = preproc_io.H5Reader(h5name, first=2, step=2)
+    frames = [frm.i for frm in next(reader)]
+    shards = []
+    for shard_index in range(3):
+        reader = preproc_io.H5Reader(h5name, first=2, step=2)
+        reader.shard(shard_index, 3)
+        shards.extend([frm.i for frm in next(reader)])
+    assert sorted(shards) == frames
+
+
+def test_pipeline_settings():
+    pipeline_meta = [{'Pipeline': {'precision': 'single'}},
+                     {'DummyReader': {'n_frames': 2}},
+                     {'VirtualParticles': {'method': 'gas'}},
+                     {'Sphere': {}},
+                     {'DummyWriter': {}}]
+    (element_meta, settings) = pipeutil.get_pipeline_settings(pipeline_meta)
+    assert settings['precision'] == 'single'
+    assert [list(x.keys())[0] for x in element_meta] == ['DummyReader', 'VirtualParticles', 'Sphere', 'DummyWriter']
+    pipeutil.apply_pipeline_settings(element_meta, "capriqorn.preproc", settings)
+    assert element_meta[1]['VirtualParticles']['precision'] == 'single'
+    assert 'precision' not in element_meta[0]['DummyReader']
+    assert 'precision' not in element_meta[2]['Sphere']
+    # explicit parameters take precedence
+    element_meta[1]['VirtualParticles']['precision'] = 'double'
+    pipeutil.apply_pipeline_settings(element_meta, "capriqorn.preproc", settings)
+    assert element_meta[1]['VirtualParticles']['precision'] == 'double'
+    # defaults
+    (_, settings) = pipeutil.get_pipeline_settings(element_meta)
+    assert settings == pipeutil.PIPELINE_SETTINGS
+
+
+def test_pipeline_settings_invalid():
+    with pytest.raises(ValueError):
+        pipeutil.get_pipeline_settings([{'Pipeline': {'no_such_setting': 1}}])
+
+
+def test_plan_pipeline():
+    pipeline_meta = [{'CRDBoxReader': {'first': 2, 'step': 3}},
+                     {'Dummy': {}},
+                     {'Sphere': {'radius': 10.0}},
+                     {'Step': {'step': 2}},
+                     {'Cuboid': {'active': False}},
+                     {'Step': {'step': 1}},
+                     {'VirtualParticles': {}},
+                     {'Step': {'step': 5}},
+                     {'H5Writer': {}}]
+    (plan, notes) = pipeutil.plan_pipeline(pipeline_meta, "capriqorn.preproc")
+    assert [list(x.keys())[0] for x in plan] == ['CRDBoxReader', 'Dummy', 'Sphere', 'VirtualParticles',
+                                                 'Step', 'H5Writer']
+    assert plan[0]['CRDBoxReader'] == {'first': 2, 'step': 6}
+    assert plan[4]['Step'] == {'step': 5}
+    assert len(notes) == 4
+    # the specification is not modified
+    assert pipeline_meta[0]['CRDBoxReader']['step'] == 3
+    pipeutil.print_plan(plan, notes)
+
+
+def test_plan_pipeline_parallel():
+    pipeline_meta = [{'DummyReader': {}},
+                     {'ParallelFork': {'n_workers': 2}},
+                     {'Sphere': {}},
+                     {'Step': {'step': 2}},
+                     {'ParallelJoin': {}},
+                     {'H5Writer': {}}]
+    (plan, notes) = pipeutil.plan_pipeline(pipeline_meta, "capriqorn.preproc")
+    # Step is not moved across ParallelFork, nor folded into a reader lacking _fold_stride
+    assert [list(x.keys())[0] for x in plan] == ['DummyReader', 'ParallelFork', 'Step', 'Sphere',
+                                                 'ParallelJoin', 'H5Writer']
+    pipeline_meta = [{'DummyReader': {}}, {'Step': {'step': 2}}, {'H5Writer': {}}]
+    (plan, notes) = pipeutil.plan_pipeline(pipeline_meta, "capriqorn.preproc")
+    assert plan == pipeline_meta
+    assert notes == []
+
+
+def test_plan_pipeline_run():
+    pipeline_meta = [{'DummyReader': {'n_frames': 6, 'n_atoms': 16}},
+                     {'Dummy': {}},
+                     {'Step': {'step': 2}},
+                     {'H5Writer': {'file': h5name}}]
+    cwd = os.getcwd()
+    os.chdir(util.scratch_dir())
+    try:
+        pipeutil.run_pipeline(pipeline_meta, "capriqorn.preproc", profile=True)
+        with open(os.path.join(profiling.profile_directory, profiling.summary_file)) as fp:
+            summary = json.load(fp)
+    finally:
+        os.chdir(cwd)
+    # the Dummy filter only processes the frames kept by Step
+    assert summary['filters']['Dummy']['n_items'] == 3
+    reader = preproc_io.H5Reader(h5name)
+    assert len(reader.frame_pool) == 3
+
+
+def test_prune_pipeline():
+    pipeline_meta = [{'DummyReader': {}},
+                     {'ParallelFork': {'n_workers': 2, 'sharding': True}},
+                     {'Sphere': {}},
+                     {'XYZ': {}},
+                     {'ParallelJoin': {}},
+                     {'DummyWriter': {}}]
+    (plan, notes) = pipeutil.prune_pipeline(pipeline_meta, "capriqorn.preproc")
+    # no pruning between the reader and the sharded fork, the length
+    # histograms produced by Sphere are dropped right away
+    assert [list(x.keys())[0] for x in plan] == ['DummyReader', 'ParallelFork', 'Prune', 'Sphere', 'Prune',
+                                                 'XYZ', 'Prune', 'ParallelJoin', 'DummyWriter']
+    assert plan[2]['Prune']['keep'] == ['coordinates']
+    assert plan[4]['Prune']['keep'] == ['coordinates']
+    assert plan[6]['Prune']['keep'] == []
+    assert len(notes) == 3
+    # ParallelJoin does not produce any locations, no Prune follows it
+    (plan, notes) = pipeutil.prune_pipeline(pipeline_meta[:2] + pipeline_meta[3:], "capriqorn.preproc")
+    assert [list(x.keys())[0] for x in plan] == ['DummyReader', 'ParallelFork', 'Prune', 'XYZ', 'Prune',
+                                                 'ParallelJoin', 'DummyWriter']
+    # filters with undeclared locations consume everything
+    pipeline_meta = [{'DummyReader': {}}, {'Dummy': {}}, {'H5Writer': {}}]
+    (plan, notes) = pipeutil.prune_pipeline(pipeline_meta, "capriqorn.preproc")
+    assert plan == pipeline_meta
+
+
+def test_prune_postprocessor():
+    template = os.path.join(os.path.dirname(pipeutil.__file__), '..', 'data', 'postprocessor_template.yaml')
+    pipeline_meta = util.load_parameter_file(template)
+    pipeline_meta[-1]['H5Writer']['fields'] = ['intensity', 'pddf']
+    (plan, notes) = pipeutil.plan_pipeline(pipeline_meta, "capriqorn.postproc")
+    labels = [list(x.keys())[0] for x in plan]
+    # the shell histograms are not needed beyond Solvent, the histograms and
+    # length histograms are not needed beyond DeltaH
+    k = labels.index('DeltaH')
+    assert labels[k - 1] == 'Prune'
+    assert 'shell_Hxx' not in plan[k - 1]['Prune']['keep']
+    assert 'histograms' in plan[k - 1]['Prune']['keep']
+    assert labels[k + 1] == 'Prune'
+    assert plan[k + 1]['Prune']['keep'] == ['error_blocks', 'intensity', 'pddf', 'solvent_matching']
+    # Average has to precede ParallelJoin directly
+    assert labels[labels.index('Average') + 1] == 'ParallelJoin'
+
+
+@pytest.mark.parametrize('sharding', [False, True])
+def test_prune_run(sharding):
+    pipeline_meta = sharded_pipeline_meta(n_frames=4, n_workers=2)
+    pipeline_meta[1]['ParallelFork']['sharding'] = sharding
+    pipeline_meta[-1]['H5Writer']['fields'] = ['coordinates']
+    cwd = os.getcwd()
+    os.chdir(util.scratch_dir())
+    try:
+        pipeutil.run_pipeline(pipeline_meta, "capriqorn.preproc", profile=True)
+        with open(os.path.join(profiling.profile_directory, profiling.summary_file)) as fp:
+            summary = json.load(fp)
+    finally:
+        os.chdir(cwd)
+    # 3 species of 16 particles, the table is dropped before it reaches Dummy
+    assert summary['filters']['Dummy']['bytes_in'] == 4 * 3 * 16 * 3 * 8
+    reader = preproc_io.H5Reader(h5name)
+    frames = [frm for frm in next(reader)]
+    assert len(frames) == 4
+    for frm in frames:
+        assert sorted(frm.data.keys()) == ['coordinates', 'log']
+
+
+@pytest.mark.parametrize('sharding', [None, False, True])
+def test_profile(sharding):
+    pipeline_meta = sharded_pipeline_meta(n_frames=6, n_workers=2)
+    if sharding is None:
+        # sequential pipeline
+        del pipeline_meta[3]
+        del pipeline_meta[1]
+    else:
+        pipeline_meta[1]['ParallelFork']['sharding'] = sharding
+    cwd = os.getcwd()
+    os.chdir(util.scratch_dir())
+    try:
+        pipeutil.run_pipeline(pipeline_meta, "capriqorn.preproc", profile=True)
+        with open(os.path.join(profiling.profile_directory, profiling.summary_file)) as fp:
+            summary = json.load(fp)
+        with open(os.path.join(profiling.profile_directory, profiling.trace_file)) as fp:
+            trace = json.load(fp)
+    finally:
+        os.chdir(cwd)
+    filters = summary['filters']
+    assert filters['DummyReader']['n_items'] == 6
+    assert filters['Dummy']['n_items'] == 6
+    assert filters['H5Writer']['n_items'] == 6
+    assert filters['Dummy']['bytes_in'] > 0
+    assert filters['Dummy']['bytes_in'] == filters['DummyReader']['bytes_out']
+    for total in filters.values():
+        assert total['wall'] >= 0.0
+    frames = sorted([event['args']['frame'] for event in trace['traceEvents']
+                     if (event['name'] == 'Dummy') and ('frame' in event['args'])])
+    assert frames == list(range(6))
+    pids = set([event['pid'] for event in trace['traceEvents']])
+    if sharding is None:
+        assert len(pids) == 1
+    else:
+        assert 'ParallelJoin' in filters
+        assert len(pids) == 3 if sharding else 4
+
+
+@pytest.mark.parametrize('parallel, trace_malloc', [(False, True), (True, False)])
+def test_memory(parallel, trace_malloc):
+    pipeline_meta = sharded_pipeline_meta(n_frames=4, n_workers=2)
+    if not parallel:
+        del pipeline_meta[3]
+        del pipeline_meta[1]
+    cwd = os.getcwd()
+    os.chdir(util.scratch_dir())
+    try:
+        # a budget of 1 MB is exceeded by any process, profiling may be combined
+        pipeutil.run_pipeline(pipeline_meta, "capriqorn.preproc", profile=True,
+                              memory={'budget': 1.0, 'tracemalloc': trace_malloc})
+        with open(os.path.join(profiling.profile_directory, memory.summary_file)) as fp:
+            summary = json.load(fp)
+        with open(os.path.join(profiling.profile_directory, profiling.summary_file)) as fp:
+            profile = json.load(fp)
+    finally:
+        os.chdir(cwd)
+    # sharded reading: two workers and the master
+    n_processes = 3 if parallel else 1
+    assert len(summary['processes']) == n_processes
+    assert len(summary['budget_exceeded']) == n_processes
+    for process in summary['processes']:
+        assert process['peak_rss'] > 0
+        assert (len(process['top_allocations']) > 0) == trace_malloc
+    filters = summary['filters']
+    assert filters['DummyReader']['n_items'] == 4
+    # 3 species of 16 particles, and a table of 16x16 double values
+    assert filters['DummyReader']['payload_max'] >= (3 * 16 * 3 + 16 * 16) * 8
+    assert filters['Dummy']['payload_max'] == filters['DummyReader']['payload_max']
+    assert profile['filters']['Dummy']['n_items'] == 4
+
+
+
+@pytest.mark.parametrize('sharding', [None, False, True])
+def test_progress(sharding):
+    pipeline_meta = sharded_pipeline_meta(n_frames=5, n_workers=2)
+    if sharding is None:
+        del pipeline_meta[3]
+        del pipeline_meta[1]
+    else:
+        pipeline_meta[1]['ParallelFork']['sharding'] = sharding
+    cwd = os.getcwd()
+    os.chdir(util.scratch_dir())
+    try:
+        pipeutil.run_pipeline(pipeline_meta, "capriqorn.preproc", progress={'interval': 0.01, 'show': True})
+        with open(os.path.join(profiling.profile_directory, progress.status_file)) as fp:
+            status = json.load(fp)
+    finally:
+        os.chdir(cwd)
+    assert status['state'] == 'done'
+    assert status['frames_total'] == 5
+    assert status['frames_read'] == 5
+    assert status['eta'] == 0.0
+    assert status['throughput'] > 0.0
+    roles = [worker['role'] for worker in status['workers'].values()]
+    if sharding is None:
+        assert status['frames_joined'] is None
+        assert roles == ['reader']
+        assert status['queues'] == {}
+    else:
+        assert status['frames_joined'] == 5
+        assert sorted(roles) == (['join', 'reader', 'reader'] if sharding else ['join', 'reader', 'worker', 'worker'])
+        assert len(status['queues']) == (1 if sharding else 2)
+        assert all([depth in (0, None) for depth in status['queues'].values()])
+        worker_frames = [worker['frames'] for worker in status['workers'].values() if worker['role'] != 'join']
+        assert sum(worker_frames) == (5 if sharding else 10)
+
+
+def test_share_state(data):
+    pipeline_meta = [{'DummyReader': {'n_frames': 4, 'n_atoms': 16}},
+                     {'ParallelFork': {'n_workers': 2}},
+                     {'ReferenceStructure': {'topology_file': data['protein.pdb.gz'], 'selection': 'name CA'}},
+                     {'ParallelJoin': {}},
+                     {'H5Writer': {'file': h5name}}]
+    meta_segments = pipeutil.get_pipeline_meta_segments(pipeline_meta)
+    assert pipeutil.share_state(meta_segments[1:2], "capriqorn.preproc") == 1
+    parameters = meta_segments[1][1]['ReferenceStructure']
+    assert sorted(parameters['shared_state'].keys()) == ['atoms', 'd_max']
+    reference = preproc_filter.ReferenceStructure(topology_file=data['protein.pdb.gz'], selection='name CA')
+    shared = preproc_filter.ReferenceStructure(**parameters)
+    assert shared.r_max == reference.r_max
+    # run the pipeline with and without building the state before forking
+    results = []
+    for share in [True, False]:
+        cwd = os.getcwd()
+        os.chdir(util.scratch_dir())
+        try:
+            pipeutil.run_pipeline(copy.deepcopy(pipeline_meta) + [{'Pipeline': {'share_state': share}}],
+                                  "capriqorn.preproc")
+        finally:
+            os.chdir(cwd)
+        frames = [frm for frm in next(preproc_io.H5Reader(h5name))]
+        assert len(frames) == 4
+        results.append(frames)
+    for (x, y) in zip(results[0], results[1]):
+        assert sorted(x.data['coordinates'].keys()) == sorted(y.data['coordinates'].keys())
+        for key in y.data['coordinates']:
+            assert np.array_equal(x.data['coordinates'][key], y.data['coordinates'][key])
+
+
+if do_cleanup:
+    def test_final_cleanup():
+        util.rmrf(util.scratch_dir())
@@ -0,0 +1,50 @@
+#!/usr/bin/env python2.7
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""A set of unit tests of the Capriqorn prefetching library.
+"""
+
+
+from capriqorn.lib import prefetch
+import pytest
+
+
+@pytest.mark.parametrize('depth', [0, 1, 4])
+def test_prefetch(depth):
+    assert list(prefetch.prefetch(range(20), lambda x: x * x, depth)) == [x * x for x in range(20)]
+
+
+def test_prefetch_failure():
+    def load(x):
+        if (x == 3):
+            raise ValueError("cannot load 3")
+        return x
+
+    items = []
+    with pytest.raises(ValueError):
+        for x in prefetch.prefetch(range(10), load, 2):
+            items.append(x)
+    assert items == [0, 1, 2]
+
+
+def test_prefetch_close():
+    loaded = []
+
+    def load(x):
+        loaded.append(x)
+        return x
+
+    generator = prefetch.prefetch(range(1000), load, 2)
+    assert next(generator) == 0
+    generator.close()
+    # the background thread stops after at most depth + 2 further items
+    assert len(loaded) <= 5
@@ -0,0 +1,68 @@
+#!/usr/bin/env python2.7
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""A set of unit tests of the Capriqorn RDF library, comparing the vectorized
+routines against the element-wise reference implementations.
+"""
+
+
+import numpy as np
+from capriqorn.lib import rdf
+from capriqorn.testing import data
+import pytest
+
+
+fit_fraction = 0.3
+
+
+@pytest.fixture
+def g_table(data):
+    return np.loadtxt(data["rdf.extended.dat"])[:2000]
+
+
+def test_getRDFCumuFast(g_table):
+    assert np.array_equal(rdf.getRDFCumuFast(g_table, 0.01), rdf.getRDFCumu(g_table, 0.01))
+
+
+def test_getPlateauValueFast(g_table):
+    histoCumu = rdf.getRDFCumu(g_table, 0.01)
+    index = rdf.getStartingBin(g_table, fit_fraction)
+    assert np.allclose(rdf.getPlateauValueFast(histoCumu, index),
+                       rdf.getPlateauValue(histoCumu, index), rtol=1.e-10, atol=1.e-12)
+
+
+@pytest.mark.parametrize('noise_fraction', [0.01, 0.5, 1.0])
+def test_taperNoiseFast(g_table, noise_fraction):
+    histoCumu = rdf.getRDFCumu(g_table, 0.01)
+    index = rdf.getStartingBin(g_table, fit_fraction)
+    ginfty = rdf.getPlateauValue(histoCumu, index)
+    assert np.allclose(rdf.taperNoiseFast(g_table, index, ginfty, noise_fraction),
+                       rdf.taperNoise(g_table, index, ginfty, noise_fraction), rtol=1.e-12, atol=1.e-15)
+
+
+def test_setGinftyFast(g_table):
+    ginfty = list(np.arange(g_table.shape[1] - 1))
+    assert np.array_equal(rdf.setGinftyFast(g_table.copy(), ginfty), rdf.setGinfty(g_table.copy(), ginfty))
+
+
+def test_smooth(g_table):
+    histoCumu = rdf.getRDFCumu(g_table, 0.01)
+    index = rdf.getStartingBin(g_table, fit_fraction)
+    ginfty = rdf.getPlateauValue(histoCumu, index)
+    expected = rdf.setGinfty(rdf.taperNoise(g_table, index, ginfty, 0.01), ginfty)
+    assert np.allclose(rdf.smooth(g_table, 0.01, fit_fraction, 0.01), expected, rtol=1.e-10, atol=1.e-12)
+
+
+def test_PShFast():
+    radii = np.arange(8000) * 0.01
+    pShell = np.array([rdf.PSh(32., 35., r) for r in radii])
+    assert np.allclose(rdf.PShFast(32., 35., radii), pShell, rtol=1.e-12, atol=1.e-15)
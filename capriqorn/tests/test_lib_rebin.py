@@ -0,0 +1,76 @@
+#!/usr/bin/env python2.7
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""A set of unit tests of the Capriqorn histogram rebinning library.
+"""
+
+
+import numpy as np
+from capriqorn.lib import rebin
+import pytest
+
+
+@pytest.mark.parametrize('n_bins', [60, 64])
+def test_coarsen(n_bins):
+    np.random.seed(1)
+    table = np.random.rand(n_bins, 3)
+    n = 6
+    expected = [table[i:i + n].sum(axis=0) for i in range(0, n_bins, n)]
+    assert np.allclose(rebin.coarsen(table, n), np.array(expected))
+    assert rebin.coarsen(table, n, remainder=False).shape == (n_bins // n, 3)
+    radii = (np.arange(n_bins) + 0.5) * 0.1
+    expected = [radii[i:i + n].mean() for i in range(0, n_bins, n)]
+    assert np.allclose(rebin.coarsen_mean(radii, n), np.array(expected))
+
+
+def test_rebin():
+    np.random.seed(2)
+    counts = np.random.rand(40, 2)
+    edges = np.arange(41) * 0.25
+    # identical edges
+    assert np.allclose(rebin.rebin(counts, edges, edges), counts)
+    # merging bins is exact
+    assert np.allclose(rebin.rebin(counts, edges, edges[::4]), rebin.coarsen(counts, 4))
+    # arbitrary edges covering the range preserve the total count
+    edges_out = np.linspace(0., 10., 17)
+    assert np.allclose(rebin.rebin(counts, edges, edges_out).sum(axis=0), counts.sum(axis=0))
+    # half of the first bin
+    assert np.allclose(rebin.rebin(counts, edges, [0., 0.125])[0], 0.5 * counts[0])
+
+
+def test_regrid():
+    centers = (np.arange(100) + 0.5) * 0.01
+    edges = rebin.edges_from_centers(centers)
+    assert np.allclose(edges, np.arange(101) * 0.01)
+    density = np.column_stack((np.ones(100), centers))
+    edges_out = np.arange(0., 1.0001, 0.04)
+    out = rebin.regrid(density, edges, edges_out)
+    assert np.allclose(out[:, 0], 1.0)
+    # linear function: the bin average is the value at the center
+    assert np.allclose(out[:, 1], 0.5 * (edges_out[1:] + edges_out[:-1]))
+
+
+def test_regrid_rdf_table():
+    dr = 0.01
+    g_radii = (np.arange(100) + 0.5) * dr
+    g_table = np.column_stack((g_radii, np.random.rand(100), np.random.rand(100)))
+    radii = (np.arange(80) + 0.5) * 2. * dr
+    table = rebin.regrid_rdf_table(g_table, radii, 2. * dr)
+    # the first row holding the densities is kept, the table covers radii up to 0.99
+    assert np.allclose(table[0, 1:], g_table[0, 1:])
+    assert table.shape == (50, 3)
+    assert np.allclose(table[:, 0], radii[:50])
+    # bin [0.02, 0.04) averages the rdf bins at 0.025 and 0.035
+    assert np.allclose(table[1, 1:], 0.5 * (g_table[2, 1:] + g_table[3, 1:]))
+    g_dict = {'radii': g_radii, 'A,A': g_table[:, 1], 'A,B': g_table[:, 2]}
+    g_dict = rebin.regrid_rdf_dict(g_dict, radii, 2. * dr)
+    assert np.allclose(g_dict['A,B'], table[:, 2])
@@ -0,0 +1,142 @@
+#!/usr/bin/env python2.7
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""A set of unit tests of the Capriqorn geometry selection library.
+"""
+
+
+import copy
+import numpy as np
+import cadishi.base as base
+from cadishi import dict_util
+from capriqorn.lib import selection
+from capriqorn.postproc.filter.strip_virtual_particles import blacklist
+import pytest
+
+
+def get_frame(species, n_bins=16):
+    """Return a container with random histograms and particle numbers of the
+    species, including the shell species."""
+    np.random.seed(3)
+    labels = sorted(species + [x + '.s' for x in species])
+    frm = base.Container(number=5)
+    frm.put_data(base.loc_histograms + '/radii', np.arange(n_bins) * 0.1)
+    for i, a in enumerate(labels):
+        for b in labels[i:]:
+            if (a + ',' + b) in blacklist:
+                continue
+            frm.put_data(base.loc_histograms + '/' + a + ',' + b, np.random.rand(n_bins))
+    for a in labels:
+        frm.put_data(base.loc_nr_particles + '/' + a, np.random.rand(1))
+    frm.put_data(base.loc_nr_particles + '/frame', np.array([5]))
+    frm.put_meta({'Sphere': {'shell_width': 3.0}})
+    return frm
+
+
+def reference_selection(frm, region):
+    """Straightforward per-key implementation of the selection of region."""
+    def strip(key):
+        return ','.join([x[:-2] if x.endswith('.s') else x for x in key.split(',')])
+
+    def merge(values, pairs):
+        keys = [key for key in values if key not in selection.passthrough_keys]
+        elements = set(','.join(keys).split(','))
+        out = {key: values[key] for key in values if key in selection.passthrough_keys}
+        for key in keys:
+            if ('X1' in elements) and ('X2' in elements):
+                key_new = key.replace('X1', 'X').replace('X2', 'X')
+            else:
+                key_new = key
+            out[key_new] = out.get(key_new, 0.0) + values[key]
+        return out
+
+    histograms = frm.get_data(base.loc_histograms)
+    nr_particles = frm.get_data(base.loc_nr_particles)
+    n_shell = {selection.CORE: [0], selection.SHELL: [2], selection.CROSS: [1]}
+    if (region == selection.FULL):
+        hist = {}
+        for sub_region in [selection.CORE, selection.SHELL, selection.CROSS]:
+            hist_sub, _ = reference_selection(frm, sub_region)
+            for (key, val) in hist_sub.items():
+                if (key == 'radii'):
+                    hist[key] = val
+                else:
+                    hist[strip(key)] = hist.get(strip(key), 0.0) + val
+        nr_core = reference_selection(frm, selection.CORE)[1]
+        nr = copy.deepcopy(nr_core)
+        dict_util.sum_values(nr, reference_selection(frm, selection.SHELL)[1])
+        return hist, nr
+    hist = {'radii': histograms['radii']}
+    for key in histograms:
+        if (key != 'radii') and (key.count('.s') in n_shell[region]):
+            hist[strip(key) if (region == selection.SHELL) else key] = histograms[key]
+    hist = merge(hist, True)
+    nr = {}
+    if (region == selection.CORE):
+        nr = {key: val for (key, val) in nr_particles.items() if not key.endswith('.s')}
+    elif (region == selection.SHELL):
+        nr = {strip(key): val for (key, val) in nr_particles.items() if key.endswith('.s')}
+        nr['frame'] = nr_particles['frame']
+    nr = merge(nr, False)
+    return hist, nr
+
+
+@pytest.mark.parametrize('species', [['C', 'O'], ['C', 'X1', 'X2']])
+@pytest.mark.parametrize('region', ['core', 'shell', 'cross', 'full'])
+def test_selection(species, region):
+    frm = get_frame(species)
+    hist_ref, nr_ref = reference_selection(frm, region)
+    for _ in range(2):
+        # the second call uses the cached plan
+        frm_out = getattr(selection, 'get_' + region)(frm)
+        assert frm_out.i == frm.i
+        assert frm_out.get_meta()[-1] == {'get_' + region: True}
+        hist = frm_out.get_data(base.loc_histograms)
+        assert sorted(hist.keys()) == sorted(hist_ref.keys())
+        for key in hist_ref:
+            assert np.allclose(hist[key], hist_ref[key])
+        if (region == 'cross'):
+            assert not frm_out.contains_key(base.loc_nr_particles)
+        else:
+            nr = frm_out.get_data(base.loc_nr_particles)
+            assert sorted(nr.keys()) == sorted(nr_ref.keys())
+            for key in nr_ref:
+                assert np.allclose(nr[key], nr_ref[key])
+    # the input frame is not modified
+    assert np.allclose(frm.get_data(base.loc_histograms + '/C,C'), get_frame(species).get_data(base.loc_histograms + '/C,C'))
+
+
+def test_get_full_no_shell():
+    frm = get_frame(['C', 'O'])
+    frm.put_meta({'Sphere': {'shell_width': -1.0}})
+    assert selection.get_full(frm) is frm
+
+
+def test_merge_virtual_particles():
+    frm = base.Container()
+    frm.put_data(base.loc_histograms + '/radii', np.arange(4) * 0.1)
+    for key in ['C,C', 'C,X1', 'C,X2', 'X1,X2']:
+        frm.put_data(base.loc_histograms + '/' + key, np.ones(4))
+    for key in ['C', 'X1', 'X2']:
+        frm.put_data(base.loc_nr_particles + '/' + key, np.ones(1))
+        frm.put_data(base.loc_len_histograms + '/' + key, np.ones(4))
+    selection.merge_virtual_particles(frm)
+    assert sorted(frm.get_keys(base.loc_histograms)) == ['C,C', 'C,X', 'X,X', 'radii']
+    assert np.all(frm.get_data(base.loc_histograms + '/C,X') == 2.0)
+    assert np.all(frm.get_data(base.loc_histograms + '/X,X') == 1.0)
+    assert sorted(frm.get_keys(base.loc_nr_particles)) == ['C', 'X']
+    assert np.all(frm.get_data(base.loc_nr_particles + '/X') == 2.0)
+    assert np.all(frm.get_data(base.loc_len_histograms + '/X') == 2.0)
+    # the species pairs X1,X1 and X2,X2 are rejected
+    frm.put_data(base.loc_histograms + '/X1,X1', np.ones(4))
+    with pytest.raises(AssertionError):
+        selection.merge_virtual_particles(frm)
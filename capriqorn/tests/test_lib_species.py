@@ -0,0 +1,113 @@
+#!/usr/bin/env python2.7
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""A set of unit tests of the Capriqorn species partition library.
+"""
+
+
+import numpy as np
+import cadishi.base as base
+from capriqorn.lib import species
+
+
+element_list = ['O', 'H', 'H', 'C', 'O', 'H', 'N', 'H', 'C']
+
+
+def test_partition_split():
+    partition = species.SpeciesPartition(element_list)
+    assert partition.elements == ['C', 'H', 'N', 'O']
+    assert partition.n_atoms == len(element_list)
+    coords = np.random.rand(len(element_list), 3).astype(np.float32)
+    frm = base.Container()
+    buf = partition.put(frm, coords, dtype=np.float64)
+    assert buf.dtype == np.float64
+    for el in partition.elements:
+        arr = frm.get_data(base.loc_coordinates + '/' + el)
+        expected = coords[[i for i, x in enumerate(element_list) if x == el]]
+        assert np.array_equal(arr, expected.astype(np.float64))
+        assert arr.base is buf
+
+
+def test_partition_atom_indices():
+    atom_indices = np.array([1, 3, 4, 8])
+    partition = species.SpeciesPartition([element_list[i] for i in atom_indices], atom_indices)
+    coords = np.random.rand(len(element_list), 3)
+    frm = base.Container()
+    partition.put(frm, coords)
+    assert np.array_equal(frm.get_data(base.loc_coordinates + '/C'), coords[[3, 8]])
+    assert np.array_equal(frm.get_data(base.loc_coordinates + '/H'), coords[[1]])
+    assert np.array_equal(frm.get_data(base.loc_coordinates + '/O'), coords[[4]])
+
+
+def test_get_blocks():
+    partition = species.SpeciesPartition(element_list)
+    coords = np.random.rand(len(element_list), 3)
+    frm = base.Container()
+    buf = partition.put(frm, coords)
+    (labels, buf_out, offsets) = species.get_blocks(frm)
+    assert labels == partition.elements
+    assert buf_out is buf
+    assert np.array_equal(offsets, partition.offsets)
+    # separate arrays are concatenated
+    frm.put_data(base.loc_coordinates + '/H', np.random.rand(4, 3))
+    (labels, buf_out, offsets) = species.get_blocks(frm)
+    assert buf_out is not buf
+    for k, label in enumerate(labels):
+        assert np.array_equal(buf_out[offsets[k]:offsets[k + 1]],
+                              frm.get_data(base.loc_coordinates + '/' + label))
+
+
+def test_compress_blocks():
+    partition = species.SpeciesPartition(element_list)
+    coords = np.random.rand(len(element_list), 3)
+    buf = partition.split(coords)
+    mask = buf[:, 0] < 0.5
+    (buf_out, offsets_out) = species.compress_blocks(buf, partition.offsets, mask)
+    for k in range(len(partition.elements)):
+        block = buf[partition.offsets[k]:partition.offsets[k + 1]]
+        block_mask = mask[partition.offsets[k]:partition.offsets[k + 1]]
+        assert np.array_equal(buf_out[offsets_out[k]:offsets_out[k + 1]], block[block_mask])
+
+
+def test_iter_chunks():
+    offsets = np.array([0, 5, 5, 12])
+    assert list(species.iter_chunks(offsets)) == [(0, 0, 5), (2, 5, 12)]
+    assert list(species.iter_chunks(offsets, 4)) == [(0, 0, 4), (0, 4, 5), (2, 5, 9), (2, 9, 12)]
+
+
+def test_select_regions():
+    buf = np.random.rand(1000, 3) - 0.5
+    offsets = np.array([0, 100, 100, 650, 1000])
+
+    def classify(chunk, k):
+        lengths = np.sqrt((chunk ** 2).sum(axis=1))
+        return species.region_labels(lengths < 0.5, lengths < 0.3)
+
+    regions = [species.REGION_CORE, species.REGION_SHELL]
+    labels = classify(buf, None)
+    reference = [species.compress_blocks(buf, offsets, labels == region) for region in regions]
+    for chunk_size in [None, 1, 64, 5000]:
+        selection = species.select_regions(buf, offsets, classify, regions, chunk_size)
+        for (buf_out, offsets_out), (buf_ref, offsets_ref) in zip(selection, reference):
+            assert np.array_equal(buf_out, buf_ref)
+            assert np.array_equal(offsets_out, offsets_ref)
+
+
+def test_copy_container():
+    frm = base.Container()
+    frm.put_data(base.loc_coordinates + '/C', np.zeros((2, 3)))
+    frm.put_data('table', np.ones(4))
+    frm_out = species.copy_container(frm, [base.loc_coordinates])
+    assert not frm_out.contains_key(base.loc_coordinates)
+    assert frm.contains_key(base.loc_coordinates)
+    assert np.array_equal(frm_out.get_data('table'), np.ones(4))
+    assert frm_out.get_data('table') is not frm.get_data('table')
@@ -0,0 +1,175 @@
+#!/usr/bin/env python2.7
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""A set of unit tests of the supervision of parallel pipelines.
+
+The pipelines are built from the present module, which provides the
+preprocessor pipeline elements and a filter failing on selected frames.
+"""
+
+
+import os
+import json
+import time
+import pytest
+import h5py
+import cadishi.base as base
+import cadishi.util as util
+from capriqorn.preproc import *
+from capriqorn.lib import pipeutil
+from capriqorn.lib import supervisor
+
+
+do_cleanup = True
+out_directory = util.scratch_dir()
+pipeline_module = "capriqorn.tests.test_lib_supervisor"
+
+
+class FlakyFilter(base.Filter):
+    """Filter failing (or hanging) on the given frames, only the first time
+    in case of the transient frames, recorded by marker files."""
+    _depends = []
+    _conflicts = []
+
+    def __init__(self, fail=[], transient=[], hang=[], source=-1, verbose=False):
+        self.src = source
+        self.fail = fail
+        self.transient = transient
+        self.hang = hang
+        self.verb = verbose
+
+    def get_meta(self):
+        meta = {}
+        label = 'FlakyFilter'
+        param = {}
+        meta[label] = param
+        return meta
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        for frm in next(self.src):
+            if frm is not None:
+                marker = os.path.join(out_directory, 'flaky_' + str(frm.i))
+                if (frm.i in self.transient) or (frm.i in self.hang):
+                    if not os.path.exists(marker):
+                        open(marker, 'w').close()
+                        if frm.i in self.hang:
+                            # bounded, the supervisor terminates the worker long before
+                            time.sleep(30.)
+                        raise RuntimeError("transient failure")
+                if frm.i in self.fail:
+                    raise RuntimeError("permanent failure")
+            yield frm
+
+    next = __next__
+
+
+class SlowFilter(base.Filter):
+    """Filter sleeping on each frame, used to slow down the master process."""
+    _depends = []
+    _conflicts = []
+
+    def __init__(self, delay=0.05, source=-1, verbose=False):
+        self.src = source
+        self.delay = delay
+        self.verb = verbose
+
+    def get_meta(self):
+        meta = {}
+        label = 'SlowFilter'
+        param = {'delay': self.delay}
+        meta[label] = param
+        return meta
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        for frm in next(self.src):
+            if frm is not None:
+                time.sleep(self.delay)
+            yield frm
+
+    next = __next__
+
+
+def pipeline_meta(output_file, flaky):
+    return [{'DummyReader': {'n_frames': 8, 'n_atoms': 16}},
+            {'ParallelFork': {'n_workers': 2}},
+            {'FlakyFilter': flaky},
+            {'ParallelJoin': {}},
+            {'H5Writer': {'file': output_file}}]
+
+
+def run(meta, supervise):
+    cwd = os.getcwd()
+    # the scratch directory may have been removed by the cleanup of a previous test module
+    util.md(out_directory)
+    os.chdir(out_directory)
+    try:
+        pipeutil.run_pipeline(meta, pipeline_module, supervise=supervise)
+    finally:
+        os.chdir(cwd)
+
+
+def get_frame_numbers(file_name):
+    with h5py.File(file_name, 'r') as fp:
+        return sorted([int(key) for key in fp.keys()])
+
+
+def test_supervisor_recovery():
+    output_file = out_directory + "supervised.h5"
+    meta = pipeline_meta(output_file, {'transient': [3], 'hang': [6]})
+    run(meta, {'retries': 2, 'timeout': 2.})
+    assert get_frame_numbers(output_file) == list(range(8))
+    assert not os.path.exists(os.path.join(out_directory, 'pipeline_log', supervisor.quarantine_file))
+
+
+def test_supervisor_quarantine():
+    output_file = out_directory + "quarantine.h5"
+    meta = pipeline_meta(output_file, {'fail': [4]})
+    run(meta, {'retries': 1, 'timeout': 60.})
+    assert get_frame_numbers(output_file) == [0, 1, 2, 3, 5, 6, 7]
+    with open(os.path.join(out_directory, 'pipeline_log', supervisor.quarantine_file)) as fp:
+        quarantine = json.load(fp)
+    assert quarantine['frames'] == [4]
+
+
+def test_supervisor_slow_master(capsys):
+    # the workers are blocked on the full queue of the ParallelJoin filter
+    # for longer than the timeout, which must not be considered a hang
+    output_file = out_directory + "slow_master.h5"
+    meta = [{'DummyReader': {'n_frames': 80, 'n_atoms': 16}},
+            {'ParallelFork': {'n_workers': 2}},
+            {'FlakyFilter': {}},
+            {'ParallelJoin': {}},
+            {'SlowFilter': {'delay': 0.1}},
+            {'H5Writer': {'file': output_file}}]
+    run(meta, {'retries': 1, 'timeout': 1.})
+    assert get_frame_numbers(output_file) == list(range(80))
+    assert "hung" not in capsys.readouterr().out
+
+
+def test_supervisor_configuration():
+    meta = [{'DummyReader': {}},
+            {'ParallelFork': {'n_workers': 2, 'sharding': True}},
+            {'ParallelJoin': {}},
+            {'DummyWriter': {}}]
+    with pytest.raises(RuntimeError):
+        pipeutil.run_pipeline(meta, pipeline_module, supervise={})
+
+
+if do_cleanup:
+    def test_final_cleanup():
+        util.rmrf(out_directory)
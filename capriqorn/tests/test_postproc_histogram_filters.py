@@ -16,13 +16,18 @@
 import sys
 import os
 import glob
+import copy
+import multiprocessing as mp
 import numpy as np
+import pytest
 
 import cadishi.base as base
 import cadishi.util as util
 from capriqorn.postproc import io as postproc_io
 from capriqorn.postproc import filter as postproc_filter
-from capriqorn.testing import FrameCounter, KeepLastFrame
+from capriqorn.lib import parpipe
+from capriqorn.lib import rdf
+from capriqorn.testing import FrameCounter, KeepLastFrame, FrameSource, data
 
 
 def test_dummy_filter():
@@ -93,3 +98,210 @@ def test_average_filter_remainder():
     for key in keys:
         histo = frm.get_data(base.loc_histograms + '/' + key)
         assert(np.sum(histo, dtype=np.int) == n_bins)
+
+
+def test_growing_array():
+    arr = postproc_filter.GrowingArray(capacity=2)
+    expected = []
+    for i in range(100):
+        arr.append(np.array([i]))
+        expected.append(i)
+    arr.append(np.array([0.5, 1.5]))
+    expected.extend([0.5, 1.5])
+    assert arr.get().dtype == np.float64
+    assert np.array_equal(arr.get(), np.array(expected))
+
+
+def test_average_filter_scalars():
+    n_tot = 25
+    n_avg = 10
+    reader = postproc_io.DummyReader(n_histogram_sets=n_tot, n_bins=64, scalars=True)
+    frames = list(next(reader))
+    average = postproc_filter.Average(source=FrameSource(frames), n_avg=n_avg)
+    frames_avg = list(next(average))
+    assert len(frames_avg) == 3
+    for j, frm in enumerate(frames_avg):
+        block = frames[j * n_avg:(j + 1) * n_avg]
+        for key in frm.get_keys(base.loc_histograms, skip_keys='radii'):
+            expected = np.mean([x.get_data(base.loc_histograms + '/' + key) for x in block], axis=0)
+            assert np.allclose(frm.get_data(base.loc_histograms + '/' + key), expected)
+        for key in frm.get_keys(base.loc_nr_particles):
+            expected = np.concatenate([x.get_data(base.loc_nr_particles + '/' + key) for x in block])
+            assert np.array_equal(frm.get_data(base.loc_nr_particles + '/' + key), expected)
+        expected = np.array([x.get_data(base.loc_volumes + '/box') for x in block])
+        assert np.array_equal(frm.get_data(base.loc_volumes + '/box'), expected)
+    # the input frames are not modified
+    assert np.array_equal(frames[0].get_data(base.loc_nr_particles + '/A'), np.array([101]))
+
+
+@pytest.mark.parametrize('n_avg', [4, 'all'])
+def test_average_filter_parallel(n_avg):
+    n_tot = 22
+    n_workers = 3
+    reader = postproc_io.DummyReader(n_histogram_sets=n_tot, n_bins=64, shell=True, scalars=True)
+    frames = list(next(reader))
+    frames_seq = list(next(postproc_filter.Average(source=FrameSource(copy.deepcopy(frames)), n_avg=n_avg)))
+    # run the workers of the parallel region sequentially, each one averaging
+    # every n_workers-th frame, numbered as done by the ParallelFork filter
+    queue = mp.Queue()
+    for shard_index in range(n_workers):
+        shard = []
+        for number in range(shard_index, n_tot, n_workers):
+            frm = copy.deepcopy(frames[number])
+            frm.put_data(base.loc_parallel + '/number', number)
+            shard.append(frm)
+        shard.append(None)
+        average = postproc_filter.Average(source=FrameSource(shard), n_avg=n_avg)
+        join = parpipe.ParallelJoin(source=average, queue=queue, side=parpipe.SIDE_UPSTREAM)
+        join.dump()
+    join = parpipe.ParallelJoin(queue=queue, side=parpipe.SIDE_DOWNSTREAM, n_workers=n_workers)
+    frames_par = [frm for frm in next(join) if frm is not None]
+    assert len(frames_par) == len(frames_seq)
+    for frm_par, frm_seq in zip(frames_par, frames_seq):
+        assert frm_par.i == frm_seq.i
+        assert frm_par.query_meta('Average') == frm_seq.query_meta('Average')
+        for location in [base.loc_histograms, base.loc_nr_particles, base.loc_volumes]:
+            assert frm_par.get_keys(location) == frm_seq.get_keys(location)
+            for key in frm_seq.get_keys(location):
+                assert np.allclose(frm_par.get_data(location + '/' + key),
+                                   frm_seq.get_data(location + '/' + key))
+
+
+def test_average_filter_errors():
+    n_tot = 25
+    n_avg = 12
+    block_sizes = [1, 3]
+    reader = postproc_io.DummyReader(n_histogram_sets=n_tot, n_bins=64, scalars=True)
+    frames = list(next(reader))
+    average = postproc_filter.Average(source=FrameSource(frames), n_avg=n_avg, error_block_sizes=block_sizes)
+    frames_avg = list(next(average))
+    assert len(frames_avg) == 3
+    assert frames_avg[0].query_meta('Average/error_block_sizes') == block_sizes
+    for j, frm in enumerate(frames_avg):
+        chunk = frames[j * n_avg:(j + 1) * n_avg]
+        for b in block_sizes:
+            n_blocks = len(chunk) // b
+            location = 'histograms_stderr/' + str(b)
+            if (n_blocks == 0):
+                assert not frm.contains_key(location)
+                continue
+            for key in frm.get_keys(location, skip_keys='radii'):
+                histos = np.array([x.get_data(base.loc_histograms + '/' + key) for x in chunk[:n_blocks * b]])
+                block_means = histos.reshape(n_blocks, b, -1).mean(axis=1)
+                expected = block_means.std(axis=0, ddof=1) / np.sqrt(n_blocks)
+                assert np.allclose(frm.get_data(location + '/' + key), expected, equal_nan=True)
+        # the block means of the smallest block size are kept for downstream filters
+        blocks = frm.get_data('error_blocks')
+        assert len(blocks) == len(chunk)
+        for k, x in enumerate(chunk):
+            for key in x.get_keys(base.loc_histograms, skip_keys='radii'):
+                assert np.allclose(blocks[str(k)][base.loc_histograms][key],
+                                   x.get_data(base.loc_histograms + '/' + key))
+    # a single frame gives no error estimate
+    assert np.all(np.isnan(frames_avg[2].get_data('histograms_stderr/1/A,A')))
+
+
+def test_average_filter_errors_parallel():
+    frm = next(next(postproc_io.DummyReader(n_histogram_sets=1, n_bins=8)))
+    frm.put_data(base.loc_parallel + '/number', 0)
+    average = postproc_filter.Average(source=FrameSource([frm]), n_avg=1, error_block_sizes=2)
+    with pytest.raises(RuntimeError):
+        list(next(average))
+
+
+def solvent_frame(number, virtual_particles, dr=0.01):
+    """Return a synthetic shell histogram set matching the species of rdf.extended.dat."""
+    np.random.seed(number)
+    n_bins = int(round(100. / dr))
+    frm = base.Container(number=number)
+    frm.put_data(base.loc_histograms + '/radii', (np.arange(n_bins) + 0.5) * dr)
+    elements = ['Cl-1', 'H', 'Na+1', 'O']
+    if virtual_particles:
+        elements.append('X')
+    for i, a in enumerate(elements):
+        for b in elements[i:]:
+            frm.put_data(base.loc_histograms + '/' + a + '.s,' + b + '.s', np.random.rand(n_bins))
+        frm.put_data(base.loc_nr_particles + '/' + a + '.s', np.random.rand(1) + 10.)
+    frm.put_meta({'histograms': {'histogram': {'dr': dr}}})
+    frm.put_meta({'Sphere': {'radius': 35., 'shell_width': 3., 'shell_volume': rdf.VShell(32., 35.)}})
+    if virtual_particles:
+        frm.put_meta({'VirtualParticles': {'method': 'lattice', 'x_density': 0.1}})
+    return frm
+
+
+@pytest.mark.parametrize('virtual_particles', [False, True])
+def test_solvent_filter_cache(data, monkeypatch, virtual_particles):
+    calls = []
+    smooth = rdf.smooth
+
+    def counting_smooth(*args, **kwargs):
+        calls.append(1)
+        return smooth(*args, **kwargs)
+
+    monkeypatch.setattr(rdf, 'smooth', counting_smooth)
+    frames = [solvent_frame(i, virtual_particles) for i in range(3)]
+    solvent = postproc_filter.Solvent(source=FrameSource(copy.deepcopy(frames)),
+                                      g_ascii_file=data["rdf.extended.dat"], g_noise_fraction=0.01)
+    frames_out = list(next(solvent))
+    # the reference g-functions are prepared once
+    assert len(calls) == 1
+    # the cached tables give the same result as a fresh filter
+    for frm, frm_ref in zip(frames_out, frames):
+        solvent = postproc_filter.Solvent(source=FrameSource([frm_ref]),
+                                          g_ascii_file=data["rdf.extended.dat"], g_noise_fraction=0.01)
+        frm_ref = next(next(solvent))
+        assert frm.get_data(base.loc_solv_match + '/scale_factor') == \
+            frm_ref.get_data(base.loc_solv_match + '/scale_factor')
+        g_scaled = frm.get_data(base.loc_solv_match + '/g_scaled')
+        for (key, val) in frm_ref.get_data(base.loc_solv_match + '/g_scaled').items():
+            assert np.array_equal(g_scaled[key], val)
+    assert len(calls) == 4
+
+
+def test_solvent_filter_rebin(data):
+    """The rdfs are mapped onto the bins of histograms of a different bin size."""
+    dr = 0.02
+    frm = solvent_frame(0, False, dr)
+    solvent = postproc_filter.Solvent(source=FrameSource([frm]), g_ascii_file=data["rdf.extended.dat"],
+                                      g_noise_fraction=0.01, debug=True)
+    frm = next(next(solvent))
+    g_scaled = frm.get_data(base.loc_solv_match + '/g_scaled')
+    assert np.allclose(g_scaled['radii'], frm.get_data(base.loc_histograms + '/radii'))
+    g_table = frm.get_data(base.loc_solv_match + '/g_table_0_smooth')
+    scale_factor = frm.get_data(base.loc_solv_match + '/scale_factor')
+    # the bins of width 2*dr average pairs of rdf bins
+    expected = 0.5 * (g_table[2:-1:2, 1] + g_table[3::2, 1])
+    assert np.allclose(g_scaled['Cl-1,Cl-1'][1:] / scale_factor, expected)
+
+
+def test_rdf_filter():
+    n_bins = 64
+    dr = 0.1
+    frm = base.Container(number=1)
+    radii = (np.arange(n_bins) + 0.5) * dr
+    frm.put_data(base.loc_histograms + '/radii', radii)
+    np.random.seed(5)
+    for key in ['A,A', 'A,B', 'B,B', 'A,C', 'B,C', 'C,C']:
+        frm.put_data(base.loc_histograms + '/' + key, np.random.rand(n_bins))
+    box_volumes = np.array([1000., 1100., 1050.])
+    frm.put_data(base.loc_volumes + '/box', box_volumes)
+    nr_particles = {'A': np.array([10., 12., 11.]), 'B': np.array([5., 5., 5.]), 'C': np.zeros(3)}
+    for key in nr_particles:
+        frm.put_data(base.loc_nr_particles + '/' + key, nr_particles[key])
+    frm.put_meta({'histograms': {'histogram': {'dr': dr}}})
+    rdf_filter = postproc_filter.RDF(source=FrameSource([frm]))
+    frm = next(next(rdf_filter))
+    rdfs = frm.get_data(base.loc_rdf)
+    # pairs involving species C (no particles) are skipped
+    assert sorted(rdfs.keys()) == ['A,A', 'A,B', 'B,B', 'radii']
+    vol_inv = np.mean(np.reciprocal(box_volumes))
+    for key in ['A,A', 'A,B', 'B,B']:
+        species_1, species_2 = key.split(',')
+        nr_1 = nr_particles[species_1].mean()
+        nr_2 = nr_particles[species_2].mean()
+        fac = 1.0 if (species_1 == species_2) else 2.0
+        expected = np.array([2. * h / (fac * nr_1 * nr_2 * 4.0 * np.pi * dr * vol_inv * r * r)
+                             for (h, r) in zip(frm.get_data(base.loc_histograms + '/' + key), radii)])
+        if (species_1 == species_2):
+            expected[0] = nr_1 * vol_inv
+        assert np.allclose(rdfs[key], expected, rtol=1.e-12)
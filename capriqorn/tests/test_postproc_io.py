@@ -17,9 +17,15 @@
 import sys
 import os
 import glob
+import numpy as np
+import pytest
+import cadishi.base as base
 import cadishi.util as util
 from capriqorn.postproc import io as postproc_io
 from capriqorn.postproc import filter as postproc_filter
+from capriqorn.lib import pipeutil
+from capriqorn.lib import incremental
+from capriqorn.testing import FrameSource
 
 
 do_cleanup = True
@@ -67,6 +73,73 @@ def test_distHistoReader_first_last_step():
     writer.dump()
 
 
+@pytest.mark.parametrize('mmap_mode, prefetch', [(None, 2), ('r', 0), ('c', 3)])
+def test_distHistoReader_mmap_prefetch(mmap_mode, prefetch):
+    directory = out_directory + 'legacy/'
+    reader = postproc_io.DummyReader(n_histogram_sets=7, n_bins=64)
+    writer = postproc_io.distHistoWriter(source=reader, directory=directory)
+    writer.dump()
+    nr_part_file = directory + 'nrPart.dat'
+    nr_part = np.column_stack((np.arange(7) + 1, np.arange(14).reshape(7, 2) + 100))
+    util.savetxtHeader(nr_part_file, '# A B', nr_part)
+    frames_ref = list(next(postproc_io.distHistoReader(directory=directory)))
+    # the particle number table is cached in binary form
+    assert os.path.isfile(nr_part_file + '.npy')
+    frames = list(next(postproc_io.distHistoReader(directory=directory, mmap_mode=mmap_mode,
+                                                   prefetch=prefetch)))
+    assert len(frames) == len(frames_ref) == 7
+    for (j, (frm, frm_ref)) in enumerate(zip(frames, frames_ref)):
+        assert frm.i == frm_ref.i
+        assert sorted(frm.get_keys(base.loc_histograms)) == sorted(frm_ref.get_keys(base.loc_histograms))
+        for key in frm_ref.get_keys(base.loc_histograms):
+            assert np.array_equal(frm.get_data(base.loc_histograms + '/' + key),
+                                  frm_ref.get_data(base.loc_histograms + '/' + key))
+        assert frm.get_data(base.loc_nr_particles + '/B')[0] == nr_part[j, 2]
+    # an early stop of the pipeline terminates the prefetching
+    reader = postproc_io.distHistoReader(directory=directory, mmap_mode=mmap_mode, prefetch=prefetch)
+    # the files are always mapped copy-on-write
+    assert reader.mmap_mode in [None, 'c']
+    generator = next(reader)
+    next(generator)
+    generator.close()
+
+
+def test_distHistoReader_mmap_mode_invalid():
+    # 'r+' would let in-place filters modify the input files
+    with pytest.raises(ValueError):
+        postproc_io.distHistoReader(directory=out_directory + 'legacy/', mmap_mode='r+')
+
+
+@pytest.mark.parametrize('first, last, step, prefetch', [(None, None, 1, 0), (2, 9, 3, 2)])
+def test_distHistoWriter_consolidated(first, last, step, prefetch):
+    directory = out_directory + 'consolidated/'
+    frames_ref = list(next(postproc_io.DummyReader(n_histogram_sets=10, n_bins=64)))
+    # batch_size smaller than the number of frames, the stacked file grows
+    writer = postproc_io.distHistoWriter(source=FrameSource(frames_ref), directory=directory,
+                                         consolidated=True, batch_size=4)
+    writer.dump()
+    assert not os.path.exists(directory + 'distHisto.list')
+    stack = np.load(directory + 'distHisto.stack.npy')
+    assert stack.shape[0] == 10
+    frames_ref = frames_ref[(first or 1) - 1:last][::step]
+    reader = postproc_io.distHistoReader(directory=directory, first=first, last=last,
+                                         step=step, prefetch=prefetch)
+    assert isinstance(reader.stack, np.memmap)
+    frames = list(next(reader))
+    assert len(frames) == len(frames_ref)
+    for (frm, frm_ref) in zip(frames, frames_ref):
+        assert sorted(frm.get_keys(base.loc_histograms)) == sorted(frm_ref.get_keys(base.loc_histograms))
+        for key in frm_ref.get_keys(base.loc_histograms):
+            assert np.array_equal(frm.get_data(base.loc_histograms + '/' + key),
+                                  frm_ref.get_data(base.loc_histograms + '/' + key))
+    # the legacy output written into the same directory replaces the index
+    reader = postproc_io.DummyReader(n_histogram_sets=3, n_bins=64)
+    writer = postproc_io.distHistoWriter(source=reader, directory=directory)
+    writer.dump()
+    assert not os.path.exists(directory + 'distHisto.index.json')
+    assert len(list(next(postproc_io.distHistoReader(directory=directory)))) == 3
+
+
 def test_H5Writer():
     reader = postproc_io.DummyReader()
     writer = postproc_io.H5Writer(source=reader, file=h5name, verbose=False)
@@ -85,6 +158,44 @@ def test_H5Reader_H5Writer():
     writer.dump()
 
 
+def append_pipeline_meta(input_file, output_file):
+    return [{'H5Reader': {'file': input_file}},
+            {'Average': {'n_avg': 'all'}},
+            {'H5Writer': {'file': output_file}}]
+
+
+def test_append():
+    input_file = out_directory + "append_input.h5"
+    output_file = out_directory + "append_output.h5"
+    output_file_full = out_directory + "append_output_full.h5"
+    frames = list(next(postproc_io.DummyReader(n_histogram_sets=10, n_bins=32, scalars=True)))
+    # --- process the first 6 frames
+    postproc_io.H5Writer(source=FrameSource(frames[:6]), file=input_file).dump()
+    pipeutil.run_pipeline(append_pipeline_meta(input_file, output_file), "capriqorn.postproc")
+    # --- nothing new to append
+    assert not incremental.setup_append(append_pipeline_meta(input_file, output_file))
+    # --- extend the input, append the new frames to the previous result
+    postproc_io.H5Writer(source=FrameSource(frames[6:]), file=input_file, mode='a').dump()
+    pipeline_meta = append_pipeline_meta(input_file, output_file)
+    assert incremental.setup_append(pipeline_meta)
+    assert pipeline_meta[0]['H5Reader']['first'] == 7
+    pipeutil.run_pipeline(pipeline_meta, "capriqorn.postproc")
+    # --- reference: process all frames at once
+    pipeutil.run_pipeline(append_pipeline_meta(input_file, output_file_full), "capriqorn.postproc")
+    reader = postproc_io.H5Reader(file=output_file)
+    reader_full = postproc_io.H5Reader(file=output_file_full)
+    assert reader.frame_pool == reader_full.frame_pool == [(0, '10')]
+    frm = next(next(reader))
+    frm_full = next(next(reader_full))
+    assert frm.query_meta('Average/n_avg') == 10
+    for location in [base.loc_histograms, base.loc_nr_particles, base.loc_volumes]:
+        for key in frm_full.get_keys(location):
+            assert np.allclose(frm.get_data(location + '/' + key), frm_full.get_data(location + '/' + key))
+    assert frm.get_data(incremental.loc_average_state + '/n_frames')[0] == 10
+    assert frm.get_data(incremental.loc_average_state + '/n_appended')[0] == 4
+    assert not os.path.exists(output_file + '.part')
+
+
 if do_cleanup:
     def test_final_cleanup():
         util.rmrf(out_directory)
@@ -12,7 +12,12 @@
 import numpy as np
 import pytest
 from numpy.testing import assert_array_equal
+import MDAnalysis as mda
+import cadishi.base as base
 from capriqorn.lib import refstruct
+from capriqorn.lib import species
+import capriqorn.preproc.filter as preproc_filter
+from capriqorn.testing import data, FrameSource
 
 
 @pytest.fixture
@@ -74,6 +79,62 @@ def test_maxInnerDistance(circle):
     assert np.isclose(max_dist, refstruct.maxInnerDistance(circle), atol=1.e-15)
 
 
+@pytest.fixture
+def random_coordinates():
+    np.random.seed(1)
+    xyz = np.random.uniform(-15., 15., (4096, 3))
+    ref = np.random.uniform(-5., 5., (64, 3))
+    return xyz, ref
+
+
+def test_queryDistance_single_precision(random_coordinates):
+    xyz, ref = random_coordinates
+    xyz = xyz.astype(np.float32)
+    ref = ref.astype(np.float32)
+    query = refstruct.queryDistance(xyz, ref, 4.)
+    assert np.any(query) and not np.all(query)
+    assert_array_equal(query, refstruct.queryDistance(xyz.astype(np.float64), ref.astype(np.float64), 4.))
+    # mixed input is handled in double precision
+    assert_array_equal(query, refstruct.queryDistance(xyz, ref.astype(np.float64), 4.))
+
+
+@pytest.mark.parametrize('dtype', (np.float32, np.float64))
+def test_classifyDistance(random_coordinates, dtype):
+    xyz, ref = random_coordinates
+    xyz = xyz.astype(dtype)
+    ref = ref.astype(dtype)
+    labels = refstruct.classifyDistance(xyz, ref, 2., 4.)
+    assert labels.dtype == np.uint8
+    assert_array_equal(np.where(labels == 2), refstruct.selectCore(ref, xyz, 4., 2.))
+    assert_array_equal(np.where(labels == 1), refstruct.selectShell(ref, xyz, 4., 2.))
+    assert_array_equal(labels > 0, refstruct.queryDistance(xyz, ref, 4.))
+
+
+@pytest.mark.parametrize('shell_width', (-1, 3.))
+def test_ReferenceStructure_chunked(data, shell_width):
+    positions = mda.Universe(data["protein.pdb.gz"]).atoms.positions.astype(np.float64)
+    np.random.seed(3)
+    frm = base.Container()
+    frm.i = 1
+    partition = species.SpeciesPartition(['A', 'B', 'C'] * 200)
+    partition.put(frm, positions[:600] + np.random.normal(0., 8., (600, 3)))
+    frames = {}
+    for chunk_size in (None, 50):
+        filtre = preproc_filter.ReferenceStructure(source=FrameSource([frm]), topology_file=data["protein.pdb.gz"],
+                                                   selection='name CA', distance=6., shell_width=shell_width,
+                                                   chunk_size=chunk_size)
+        frames[chunk_size] = list(next(filtre))[0]
+    keys = frames[None].get_keys(base.loc_coordinates)
+    assert keys == frames[50].get_keys(base.loc_coordinates)
+    assert len(keys) == (6 if shell_width > 0 else 3)
+    ref = filtre.atoms.positions
+    for key in keys:
+        coord = frames[None].get_data(base.loc_coordinates + '/' + key)
+        assert np.array_equal(coord, frames[50].get_data(base.loc_coordinates + '/' + key))
+        assert len(coord) > 0
+        assert np.all(refstruct.queryDistance(coord, ref, 6.))
+
+
 # def test_queryDistance_naive(circle, half_circle):
 #     obj = half_circle
 # #     obj = np.asarray([[1, 1, 1]])
@@ -17,10 +17,13 @@
 import sys
 import os
 import glob
+import numpy as np
+import pytest
+import cadishi.base as base
 import cadishi.util as util
 import capriqorn.preproc.io as preproc_io
 import capriqorn.preproc.filter as preproc_filter
-from capriqorn.testing import reader
+from capriqorn.testing import reader, FrameSource
 
 # output to HDF5, the default ("False") is to output to ASCII files
 use_hdf5 = True
@@ -97,6 +100,80 @@ def test_cuboid_filter_coreshell(reader):
     writer.dump()
 
 
+@pytest.mark.parametrize('filter_class, kwargs', [
+    (preproc_filter.Sphere, {'radius': 0.8}),
+    (preproc_filter.Sphere, {'radius': 0.8, 'shell_width': 0.2}),
+    (preproc_filter.Ellipsoid, {'semi_principal_axes': [0.6, 0.8, 0.9]}),
+    (preproc_filter.Ellipsoid, {'semi_principal_axes': [0.6, 0.8, 0.9], 'shell_width': 0.2}),
+    (preproc_filter.Cuboid, {'half_lengths': [0.5, 0.6, 0.7]}),
+    (preproc_filter.Cuboid, {'half_lengths': [0.5, 0.6, 0.7], 'shell_width': 0.2})])
+@pytest.mark.parametrize('chunk_size', [None, 100])
+def test_geometry_filter_selection(filter_class, kwargs, chunk_size):
+    """Compare the per-frame selection of all species at once against the
+    per-species select* methods."""
+    reader = preproc_io.DummyReader(n_frames=2, n_elems=4, n_atoms=2048)
+    frames_in = {frm.i: frm for frm in next(reader)}
+    filtre = filter_class(source=reader, chunk_size=chunk_size, **kwargs)
+    for frm in next(filtre):
+        frm_in = frames_in[frm.i]
+        for spec_id in frm_in.get_keys(base.loc_coordinates):
+            coord_in = frm_in.get_data(base.loc_coordinates + '/' + spec_id)
+            if 'shell_width' in kwargs:
+                expected = [('', filtre.selectCore(coord_in)), ('.s', filtre.selectShell(coord_in))]
+            else:
+                expected = [('', filtre.selectBody(coord_in))]
+            for suffix, indices in expected:
+                coord_out = frm.get_data(base.loc_coordinates + '/' + spec_id + suffix)
+                assert np.array_equal(coord_out, coord_in[indices])
+
+
+def test_sphere_filter_len_histo_chunked():
+    frames = list(next(preproc_io.DummyReader(n_frames=2, n_elems=4, n_atoms=2048)))
+    histos = {}
+    for chunk_size in [None, 100]:
+        filtre = preproc_filter.Sphere(source=FrameSource(frames), radius=0.8, shell_width=0.2,
+                                       len_histo_dr=0.05, chunk_size=chunk_size)
+        histos[chunk_size] = [frm.get_data(base.loc_len_histograms) for frm in next(filtre)]
+    for histo, histo_chunked in zip(histos[None], histos[100]):
+        assert sorted(histo.keys()) == sorted(histo_chunked.keys())
+        for key in histo:
+            assert np.array_equal(histo[key], histo_chunked[key])
+
+
+def converted_frames(frames, dtype):
+    frames_out = []
+    for frm in frames:
+        frm_out = base.Container()
+        for spec_id in frm.get_keys(base.loc_coordinates):
+            location = base.loc_coordinates + '/' + spec_id
+            frm_out.put_data(location, frm.get_data(location).astype(dtype))
+        frm_out.i = frm.i
+        frm_out.put_data('log', frm.get_data('log'))
+        frames_out.append(frm_out)
+    return frames_out
+
+
+@pytest.mark.parametrize('filter_class, kwargs', [
+    (preproc_filter.Sphere, {'radius': 0.8, 'shell_width': 0.2}),
+    (preproc_filter.Ellipsoid, {'semi_principal_axes': [0.6, 0.8, 0.9], 'shell_width': 0.2}),
+    (preproc_filter.Cuboid, {'half_lengths': [0.5, 0.6, 0.7], 'shell_width': 0.2})])
+def test_geometry_filter_single_precision(filter_class, kwargs):
+    """The geometry filters keep float32 coordinates and select the same
+    particles as from the coordinates converted to float64."""
+    frames = list(next(preproc_io.DummyReader(n_frames=2, n_elems=4, n_atoms=2048)))
+    frames_sp = converted_frames(frames, np.float32)
+    frames_dp = converted_frames(frames_sp, np.float64)
+    filtered_sp = list(next(filter_class(source=FrameSource(frames_sp), **kwargs)))
+    filtered_dp = list(next(filter_class(source=FrameSource(frames_dp), **kwargs)))
+    for frm_sp, frm_dp in zip(filtered_sp, filtered_dp):
+        assert frm_sp.get_keys(base.loc_coordinates) == frm_dp.get_keys(base.loc_coordinates)
+        for spec_id in frm_dp.get_keys(base.loc_coordinates):
+            coord_sp = frm_sp.get_data(base.loc_coordinates + '/' + spec_id)
+            assert coord_sp.dtype == np.float32
+            assert np.array_equal(coord_sp.astype(np.float64),
+                                  frm_dp.get_data(base.loc_coordinates + '/' + spec_id))
+
+
 # --- end of unit test routines
 if do_clean:
     def test_final_cleanup():
@@ -0,0 +1,191 @@
+#!/usr/bin/env python2.7
+# -*- Mode: python; tab-width: 4; indent-tabs-mode:nil; coding: utf-8 -*-
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4 fileencoding=utf-8
+#
+# Capriqorn --- CAlculation of P(R) and I(Q) Of macRomolcules in solutioN
+#
+# Copyright (c) Juergen Koefinger, Klaus Reuter, and contributors.
+# See the file AUTHORS.rst for the full list of contributors.
+#
+# Released under the GNU Public Licence, v2 or any higher version, see the file LICENSE.txt.
+
+
+"""A set of unit tests of the Capriqorn native CRD box trajectory reader.
+"""
+
+
+import os
+import gzip
+import numpy as np
+import cadishi.base as base
+import cadishi.util as util
+import capriqorn.preproc.io as preproc_io
+from capriqorn.preproc.io import crdbox
+from capriqorn.testing import data, FrameCounter
+import pytest
+import MDAnalysis as mda
+
+do_cleanup = True
+n_frames = 8
+crd_name = util.scratch_dir() + "test_preproc_io_crdbox.crdbox"
+crd_gz_name = crd_name + ".gz"
+
+
+def write_crdbox(filename, coords, boxes):
+    """Write coordinates of shape (n_frames, n_atoms, 3) in CRD box format."""
+    lines = ["synthetic trajectory\n"]
+    for xyz, box in zip(coords, boxes):
+        fields = ["%8.3f" % x for x in xyz.flatten()]
+        for i in range(0, len(fields), 10):
+            lines.append("".join(fields[i:i + 10]) + "\n")
+        lines.append("".join(["%8.3f" % x for x in box]) + "\n")
+    text = "".join(lines).encode()
+    util.md(filename)
+    if filename.endswith('.gz'):
+        with gzip.open(filename, 'wb') as fp:
+            fp.write(text)
+    else:
+        with open(filename, 'wb') as fp:
+            fp.write(text)
+
+
+def reference_coordinates(n_atoms):
+    np.random.seed(42)
+    coords = np.round(np.random.uniform(-99., 99., (n_frames, n_atoms, 3)), 3)
+    boxes = np.round(np.random.uniform(80., 120., (n_frames, 3)), 3)
+    return coords, boxes
+
+
+# --- tests below ---
+
+
+def test_decode_fixed_width():
+    values = np.array([0., -0.001, 1.5, -12.345, 999.999, -999.999, 0.5])
+    text = "".join(["%8.3f" % x for x in values]).encode()
+    fields = np.frombuffer(text, dtype=np.uint8).reshape(-1, 8)
+    assert np.array_equal(crdbox.decode_fixed_width(fields), values)
+    # fields not following the F8.3 layout are handled by the fallback path
+    text = "".join(["%8.2f" % x for x in values]).encode()
+    fields = np.frombuffer(text, dtype=np.uint8).reshape(-1, 8)
+    assert np.allclose(crdbox.decode_fixed_width(fields), values, atol=0.005)
+
+
+@pytest.mark.parametrize('filename', [crd_name, crd_gz_name])
+def test_CRDBoxReader(data, filename):
+    n_atoms = mda.Universe(data["protein.pdb.gz"]).atoms.n_atoms
+    coords, boxes = reference_coordinates(n_atoms)
+    write_crdbox(filename, coords, boxes)
+    for index_file in [filename + '.idx.npz', filename + '.idx.npz.gzidx']:
+        if os.path.isfile(index_file):
+            os.remove(index_file)
+    reader = preproc_io.CRDBoxReader(pdb_file=data["protein.pdb.gz"],
+                                     trajectory_file=filename,
+                                     alias_file=data["alias.dat"])
+    counter = 0
+    for frm in next(reader):
+        xyz = coords[frm.i - 1]
+        n_read = 0
+        partition = reader.partition
+        for k, el in enumerate(partition.elements):
+            idx = partition.permutation[partition.offsets[k]:partition.offsets[k + 1]]
+            species_coord = frm.get_data(base.loc_coordinates + '/' + el)
+            assert np.allclose(species_coord, xyz[idx])
+            n_read += species_coord.shape[0]
+        assert n_read == n_atoms
+        assert np.allclose(frm.get_data(base.loc_dimensions)[:3], boxes[frm.i - 1])
+        counter += 1
+    assert counter == n_frames
+    assert os.path.isfile(filename + '.idx.npz')
+
+
+def test_CRDBoxReader_MDReader(data):
+    """Compare the native reader against the MDAnalysis-based reader."""
+    kwargs = {'pdb_file': data["protein.pdb.gz"], 'trajectory_file': crd_gz_name,
+              'alias_file': data["alias.dat"], 'first': 2, 'last': 7, 'step': 2}
+    frames_crd = list(next(preproc_io.CRDBoxReader(**kwargs)))
+    frames_md = list(next(preproc_io.MDReader(**kwargs)))
+    assert len(frames_crd) == len(frames_md) == 3
+    for frm_crd, frm_md in zip(frames_crd, frames_md):
+        assert frm_crd.i == frm_md.i
+        assert frm_crd.get_keys(base.loc_coordinates) == frm_md.get_keys(base.loc_coordinates)
+        for el in frm_md.get_keys(base.loc_coordinates):
+            assert np.allclose(frm_crd.get_data(base.loc_coordinates + '/' + el),
+                               frm_md.get_data(base.loc_coordinates + '/' + el), atol=1.e-3)
+        assert np.allclose(frm_crd.get_data(base.loc_dimensions),
+                           frm_md.get_data(base.loc_dimensions), atol=1.e-3)
+
+
+@pytest.mark.parametrize('first, last, step', [[3, 6, 2],
+                                               [1, 8, 3],
+                                               [None, 3, 2],
+                                               [3, None, 2],
+                                               [None, None, 1]])
+def test_CRDBoxReader_first_last_step(data, first, last, step):
+    reader = preproc_io.CRDBoxReader(pdb_file=data["protein.pdb.gz"],
+                                     trajectory_file=crd_gz_name,
+                                     alias_file=data["alias.dat"],
+                                     first=first, last=last, step=step)
+    counter = FrameCounter(source=reader)
+    writer = preproc_io.DummyWriter(source=counter)
+    writer.dump()
+
+    if first is None:
+        first = 1
+    if last is None:
+        last = n_frames
+
+    frame_indices_expected = np.arange(first, last + 1, step)
+    assert counter.count == len(frame_indices_expected)
+    assert np.allclose(np.array(counter.frames), frame_indices_expected)
+
+
+@pytest.mark.parametrize('reader_class', [preproc_io.CRDBoxReader, preproc_io.MDReader])
+def test_reader_shard(data, reader_class):
+    kwargs = {'pdb_file': data["protein.pdb.gz"], 'trajectory_file': crd_gz_name,
+              'alias_file': data["alias.dat"], 'first': 2, 'step': 2}
+    frames = [frm.i for frm in next(reader_class(**kwargs))]
+    shards = []
+    for shard_index in range(3):
+        reader = reader_class(**kwargs)
+        reader.shard(shard_index, 3)
+        shards.append([frm.i for frm in next(reader)])
+    assert shards[0] == frames[0::3]
+    assert sorted(sum(shards, [])) == frames
+
+
+@pytest.mark.parametrize('reader_class', [preproc_io.CRDBoxReader, preproc_io.MDReader])
+def test_reader_single_precision(data, reader_class):
+    kwargs = {'pdb_file': data["protein.pdb.gz"], 'trajectory_file': crd_gz_name,
+              'alias_file': data["alias.dat"], 'last': 3}
+    frames_dp = list(next(reader_class(**kwargs)))
+    frames_sp = list(next(reader_class(precision='single', **kwargs)))
+    assert len(frames_sp) == len(frames_dp) == 3
+    for frm_sp, frm_dp in zip(frames_sp, frames_dp):
+        assert frm_sp.get_keys(base.loc_coordinates) == frm_dp.get_keys(base.loc_coordinates)
+        for el in frm_dp.get_keys(base.loc_coordinates):
+            coord_sp = frm_sp.get_data(base.loc_coordinates + '/' + el)
+            assert coord_sp.dtype == np.float32
+            assert np.array_equal(coord_sp, frm_dp.get_data(base.loc_coordinates + '/' + el).astype(np.float32))
+
+
+def test_CRDBoxReader_stale_index(data):
+    reader = preproc_io.CRDBoxReader(pdb_file=data["protein.pdb.gz"],
+                                     trajectory_file=crd_name,
+                                     alias_file=data["alias.dat"])
+    reader.init()
+    assert reader.n_frames == n_frames
+    coords, boxes = reference_coordinates(reader.n_atoms_total)
+    # shorten the trajectory, the index must be rebuilt
+    write_crdbox(crd_name, coords[:3], boxes[:3])
+    os.utime(crd_name, (0, 0))
+    reader = preproc_io.CRDBoxReader(pdb_file=data["protein.pdb.gz"],
+                                     trajectory_file=crd_name,
+                                     alias_file=data["alias.dat"])
+    frames = list(next(reader))
+    assert len(frames) == 3
+    assert reader.n_frames == 3
+
+
+if do_cleanup:
+    def test_final_cleanup():
+        util.rmrf(util.scratch_dir())
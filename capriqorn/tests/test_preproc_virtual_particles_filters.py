@@ -17,6 +17,9 @@
 import sys
 import os
 import glob
+import numpy as np
+import pytest
+import cadishi.base as base
 import cadishi.util as util
 import capriqorn.preproc.io as preproc_io
 import capriqorn.preproc.filter as preproc_filter
@@ -57,6 +60,24 @@ def test_virtual_particles_basic(reader):
     writer.dump()
 
 
+@pytest.mark.parametrize('method', ['lattice', 'gas'])
+def test_virtual_particles_single_precision(method):
+    coords = {}
+    for precision in ['double', 'single']:
+        reader = preproc_io.DummyReader(n_frames=1)
+        filtre = preproc_filter.VirtualParticles(source=reader, method=method, x_box_length=20.0,
+                                                 x_density=0.1, noise=True, random_seed=7,
+                                                 precision=precision)
+        for frm in next(filtre):
+            coords[precision] = [frm.get_data(base.loc_coordinates + '/' + key)
+                                 for key in frm.get_keys(base.loc_coordinates) if key.startswith('X')]
+    assert len(coords['single']) == len(coords['double']) > 0
+    for coord_sp, coord_dp in zip(coords['single'], coords['double']):
+        assert coord_sp.dtype == np.float32
+        assert coord_dp.dtype == np.float64
+        assert np.array_equal(coord_sp, coord_dp.astype(np.float32))
+
+
 # --- end of unit test routines
 if do_clean:
     def test_final_cleanup():